@@ -0,0 +1,272 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import Queue
+import random
+import resource
+import shutil
+import time
+import numpy as np
+import database
+import synthetic
+import table_reader
+import validation
+
+# metrics of a benchmark result where a higher value is better, all the others are better lower.
+HIGHER_IS_BETTER = ('rows_per_sec',)
+# relative change of a metric from its baseline that counts as a regression.
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_NUM_OF_QUERIES = 200
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _latency_ms(function, num_of_queries):
+    """
+    :return: median milliseconds of num_of_queries calls of function, after one warm up call.
+    """
+    function(0)
+    latencies = []
+    for i in range(num_of_queries):
+        start = time.time()
+        function(i)
+        latencies.append((time.time() - start) * 1000)
+    return sorted(latencies)[len(latencies) // 2]
+
+
+def ingest(mimic3_dir, work_dir, num_workers=None):
+    """
+    reads all the tables of mimic3_dir into a database.
+    """
+    db = database.ICUDatabase(mimic3_dir)
+    start = time.time()
+    db.ingest(num_workers=num_workers)
+    seconds = time.time() - start
+    num_of_rows = sum(progress.num_of_rows for progress in db.metrics.reads)
+    return {'seconds': seconds, 'rows_per_sec': num_of_rows / seconds, 'events': len(db.event_store)}
+
+
+def ingest_parallel(mimic3_dir, work_dir):
+    """
+    reads the events tables on all the cores. peak_rss_mb is the memory of the main process only.
+    """
+    return ingest(mimic3_dir, work_dir, multiprocessing.cpu_count())
+
+
+def ingest_pipeline(mimic3_dir, work_dir):
+    """
+    reads all the tables of mimic3_dir as a pipeline of overlapping stages, on all the cores.
+    """
+    db = database.ICUDatabase(mimic3_dir)
+    report = db.ingest_pipeline()
+    num_of_rows = sum(progress.num_of_rows for progress in db.metrics.reads)
+    return {'seconds': report.wall_seconds, 'rows_per_sec': num_of_rows / report.wall_seconds,
+            'events': len(db.event_store)}
+
+
+def snapshot_save(mimic3_dir, work_dir):
+    """
+    writes the snapshot the other snapshot benchmarks read, the ingest before it is not timed.
+    """
+    db = database.ICUDatabase(mimic3_dir)
+    db.ingest()
+    start = time.time()
+    db.save_snapshot(os.path.join(work_dir, 'snapshot'), overwrite=True)
+    return {'seconds': time.time() - start}
+
+
+def snapshot_load(mimic3_dir, work_dir):
+    start = time.time()
+    db = database.ICUDatabase.load_snapshot(os.path.join(work_dir, 'snapshot'))
+    return {'seconds': time.time() - start, 'events': len(db.event_store)}
+
+
+def snapshot_open(mimic3_dir, work_dir):
+    start = time.time()
+    db = database.ICUDatabase.open_snapshot(os.path.join(work_dir, 'snapshot'))
+    return {'seconds': time.time() - start, 'events': len(db.event_store)}
+
+
+def cohort_query(mimic3_dir, work_dir, num_of_queries=DEFAULT_NUM_OF_QUERIES):
+    """
+    latency of cohort queries over an opened snapshot, the index is built before the queries are timed.
+    """
+    db = database.ICUDatabase.open_snapshot(os.path.join(work_dir, 'snapshot'))
+    care_units = synthetic.CARE_UNITS
+    start = time.time()
+    db.index
+    index_seconds = time.time() - start
+    latency = _latency_ms(lambda i: db.cohort().care_unit(care_units[i % len(care_units)])
+                          .with_item(211, min_count=10).stay_ids(), num_of_queries)
+    return {'index_seconds': index_seconds, 'latency_ms': latency}
+
+
+def stay_series(mimic3_dir, work_dir, num_of_queries=DEFAULT_NUM_OF_QUERIES):
+    """
+    latency of reading the time series of one item of a random icu stay of an opened snapshot.
+    """
+    db = database.ICUDatabase.open_snapshot(os.path.join(work_dir, 'snapshot'))
+    icu_stay_ids = sorted(db.icu_stays.keys())
+    chosen = random.Random(0).sample(icu_stay_ids, min(len(icu_stay_ids), num_of_queries))
+    return {'latency_ms': _latency_ms(lambda i: db.icu_stays[chosen[i % len(chosen)]].series(211), num_of_queries)}
+
+
+def validate(mimic3_dir, work_dir):
+    """
+    seconds to check a CHARTEVENTS sized input with the ADMISSIONS rules at every validation level. the ADMISSIONS
+    rows are repeated into chunks of the reader's size, as many rows as CHARTEVENTS.csv has.
+    """
+    with table_reader.TableReader(table_reader.table_path(mimic3_dir, 'ADMISSIONS')) as reader:
+        admissions = next(iter(reader))
+    num_of_rows = json.load(open(os.path.join(mimic3_dir, 'dataset.json')))['num_of_events']
+    chunk_size = min(num_of_rows, table_reader.DEFAULT_CHUNK_SIZE)
+    positions = np.arange(chunk_size) % len(admissions)
+    columns = dict((name, values[positions]) for name, values in admissions.columns.items())
+    chunks = [table_reader.Chunk(columns, first, chunk_size, 0) for first in range(0, num_of_rows, chunk_size)]
+    metrics = {}
+    for level in validation.LEVELS:
+        validator = validation.Validator(level)
+        start = time.time()
+        for chunk in chunks:
+            validator.check('ADMISSIONS', chunk)
+        metrics['%s_seconds' % level] = time.time() - start
+    return metrics
+
+
+# name -> function(mimic3_dir, work_dir) that returns a dict of metrics, in the order they run.
+BENCHMARKS = (('ingest', ingest), ('ingest_parallel', ingest_parallel), ('ingest_pipeline', ingest_pipeline),
+              ('snapshot_save', snapshot_save), ('snapshot_load', snapshot_load), ('snapshot_open', snapshot_open),
+              ('cohort_query', cohort_query), ('stay_series', stay_series), ('validate', validate))
+
+
+def _run_benchmark(benchmark, mimic3_dir, work_dir, results):
+    metrics = benchmark(mimic3_dir, work_dir)
+    metrics['peak_rss_mb'] = _peak_rss_mb()
+    results.put(metrics)
+
+
+def run_benchmark(benchmark, mimic3_dir, work_dir):
+    """
+    runs a benchmark in a new process, so its peak memory is measured on its own.
+    :return: dict metric -> value
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_benchmark, args=(benchmark, mimic3_dir, work_dir, results))
+    process.start()
+    while True:
+        try:
+            metrics = results.get(timeout=1.0)
+            break
+        except Queue.Empty:
+            if not process.is_alive():
+                logging.error("benchmark %s failed", benchmark.__name__)
+                raise RuntimeError("benchmark %s failed" % benchmark.__name__)
+    process.join()
+    return metrics
+
+
+def run(work_dir, num_of_events=synthetic.DEFAULT_NUM_OF_EVENTS, seed=0, names=None):
+    """
+    generates a synthetic dataset in work_dir (unless it was already generated there with the same size and seed) and
+    runs the benchmarks on it.
+    :param work_dir: directory of the dataset and of the snapshot the benchmarks write.
+    :param num_of_events: number of chart events of the dataset.
+    :param seed: seed of the dataset.
+    :param names: names of the BENCHMARKS to run, all by default.
+    :return: dict with the dataset parameters under 'dataset' and dict benchmark name -> metrics under 'results'.
+    """
+    mimic3_dir = os.path.join(work_dir, 'csv')
+    dataset = {'num_of_events': num_of_events, 'seed': seed}
+    dataset_file = os.path.join(mimic3_dir, 'dataset.json')
+    if not os.path.exists(dataset_file) or json.load(open(dataset_file)) != dataset:
+        if os.path.isdir(mimic3_dir):
+            shutil.rmtree(mimic3_dir)
+        logging.info("Generating a synthetic dataset of %d events in %s", num_of_events, mimic3_dir)
+        synthetic.generate(mimic3_dir, num_of_events, seed=seed)
+        with open(dataset_file, 'w') as dataset_json:
+            json.dump(dataset, dataset_json)
+
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        logging.info("Running benchmark %s", name)
+        results[name] = run_benchmark(benchmark, mimic3_dir, work_dir)
+    return {'dataset': dataset, 'results': results}
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    compares the results of a run with a baseline run. only the metrics that both runs measured are compared. a
+    different number of events is always reported, it means the ingest changed its results.
+    :param report: dict returned by run.
+    :param baseline: dict returned by run, usually loaded from a json file.
+    :param tolerance: relative change that counts as a regression.
+    :return: list of (benchmark name, metric, baseline value, value) of the metrics that regressed.
+    """
+    if report['dataset'] != baseline['dataset']:
+        logging.warning("The baseline was measured on another dataset %s", baseline['dataset'])
+    regressions = []
+    for name, metrics in sorted(report['results'].items()):
+        for metric, value in sorted(metrics.items()):
+            base = baseline['results'].get(name, {}).get(metric)
+            if base is None:
+                continue
+            if metric == 'events':
+                if value != base:
+                    regressions.append((name, metric, base, value))
+                continue
+            if base == 0:
+                continue
+            change = (value - base) / float(base)
+            if (metric in HIGHER_IS_BETTER and change < -tolerance) or \
+                    (metric not in HIGHER_IS_BETTER and change > tolerance):
+                regressions.append((name, metric, base, value))
+    return regressions
+
+
+def format_report(report, baseline=None):
+    """
+    :return: a line per metric of the report, with its change from the baseline when given.
+    """
+    lines = []
+    for name, metrics in sorted(report['results'].items()):
+        for metric, value in sorted(metrics.items()):
+            line = '%-16s %-14s %14.3f' % (name, metric, value)
+            base = (baseline or {}).get('results', {}).get(name, {}).get(metric)
+            if base:
+                line += ' %+8.1f%%' % (100.0 * (value - base) / base)
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="benchmarks the ICUDatabase on a synthetic MIMIC-III dataset")
+    parser.add_argument('work_dir', help="directory of the generated dataset and snapshot")
+    parser.add_argument('--events', type=int, default=synthetic.DEFAULT_NUM_OF_EVENTS,
+                        help="number of chart events of the dataset")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', choices=[name for name, benchmark in BENCHMARKS],
+                        help="benchmarks to run, all by default")
+    parser.add_argument('--baseline', help="json file of a previous run to compare with")
+    parser.add_argument('--save-baseline', help="json file to save the results of this run to")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    report = run(args.work_dir, args.events, args.seed, args.only)
+    baseline = json.load(open(args.baseline)) if args.baseline else None
+    print format_report(report, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance)
+        for name, metric, base, value in regressions:
+            print "REGRESSION %s %s: %.3f -> %.3f" % (name, metric, base, value)
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import sys
+# the parser only imports constants, not the database modules (and numpy), so --help starts right away. the commands
+# import the modules they use.
+import constants
+
+
+def _concept_map(path):
+    """
+    :param path: 'default', or a json file with the 'concepts', 'units' and 'item_units' of a d_items.ConceptMap.
+    :return: d_items.ConceptMap, None without a path.
+    """
+    import d_items
+    if path is None:
+        return None
+    if path == 'default':
+        return d_items.ConceptMap.default()
+    with open(path) as config_file:
+        return d_items.ConceptMap.from_dict(json.load(config_file))
+
+
+def _ingest(args):
+    """
+    reads the tables of args.data_dir into a new database.
+    :return: (ICUDatabase, profiling.Profiler of the ingest or pipeline.PipelineReport with --pipeline)
+    """
+    import database
+    db = database.ICUDatabase(args.data_dir, args.validation, args.bad_rows, _concept_map(args.concept_map))
+    if args.pipeline:
+        if args.profile or args.profile_dir or args.external_dir:
+            logging.error("--pipeline can't be combined with --profile, --profile-dir or --external-dir")
+            raise ValueError("--pipeline can't be combined with --profile, --profile-dir or --external-dir")
+        return db, db.ingest_pipeline(args.tables, args.workers, compare=args.compare)
+    profiler = db.ingest(args.tables, args.workers, args.profile, args.profile_dir, args.external_dir,
+                         args.memory_budget * 1024 ** 2)
+    return db, profiler
+
+
+def _print_database(db):
+    print "patients: %d" % db.num_of_patients
+    print "admissions: %d" % db.total_number_of_hospital_visits
+    print "icu stays: %d" % len(db.icu_stays)
+    print "events: %d" % len(db.event_store)
+
+
+def ingest_command(args):
+    db, profiler = _ingest(args)
+    _print_database(db)
+    for table_name, anomalies in sorted(db.metrics.report().items()):
+        for anomaly, count in sorted(anomalies.items()):
+            print "%s %s: %d" % (table_name, anomaly, count)
+    if args.profile or args.profile_dir or args.pipeline:
+        print profiler.format_report()
+    if args.snapshot:
+        db.save_snapshot(args.snapshot, args.overwrite)
+
+
+def snapshot_save_command(args):
+    db, profiler = _ingest(args)
+    db.save_snapshot(args.snapshot, args.overwrite)
+    _print_database(db)
+
+
+def snapshot_load_command(args):
+    import database
+    _print_database(database.ICUDatabase.load_snapshot(args.snapshot))
+
+
+def snapshot_update_command(args):
+    import database
+    db = database.ICUDatabase.load_snapshot(args.snapshot).update(args.snapshot)
+    _print_database(db)
+
+
+def stats_command(args):
+    """
+    prints the sizes of a snapshot, its events per source table and its most common items. the snapshot is opened
+    without building the object graph.
+    """
+    import numpy as np
+    import database
+    import event
+    import utils
+    db = database.ICUDatabase.open_snapshot(args.snapshot)
+    _print_database(db)
+    store = db.event_store
+    if len(store) == 0:
+        return
+    sources = {event.CHART_EVENT: 'CHARTEVENTS', event.LAB_EVENT: 'LABEVENTS', event.OUTPUT_EVENT: 'OUTPUTEVENTS'}
+    for source, count in enumerate(np.bincount(store.source)):
+        if count:
+            print "%s events: %d" % (sources.get(source, source), count)
+    timed = store.chart_time[store.chart_time != utils.MISSING_TIME]
+    if len(timed):
+        print "first event: %s" % utils.epoch_to_date_time_object(int(timed.min()))
+        print "last event: %s" % utils.epoch_to_date_time_object(int(timed.max()))
+    item_ids, counts = np.unique(store.item_id, return_counts=True)
+    print "distinct items: %d" % len(item_ids)
+    for position in np.argsort(-counts, kind='mergesort')[:args.top]:
+        print "item %d: %d events" % (item_ids[position], counts[position])
+
+
+def _cohort(db, args):
+    """
+    :return: sorted ICUSTAY_IDs of the stays of db that pass the cohort filters of args.
+    """
+    query = db.cohort()
+    if args.care_unit:
+        query = query.care_unit(*args.care_unit)
+    if args.admission_type:
+        query = query.admission_type(*args.admission_type)
+    for item_id in args.with_item or ():
+        query = query.with_item(item_id)
+    return query.stay_ids()
+
+
+def export_command(args):
+    """
+    writes the binned features of a cohort of a snapshot to a npz file (values, mask, icu_stay_ids, feature_names),
+    or to a parquet file with a row per stay and bin when pyarrow is installed.
+    """
+    import numpy as np
+    import database
+    import export
+    import features
+    db = database.ICUDatabase.open_snapshot(args.snapshot)
+    builder = features.FeatureBuilder(args.items, args.bin_width, args.horizon, args.aggregations)
+    icu_stay_ids = _cohort(db, args)
+    matrix = builder.build(db.event_store, icu_stay_ids, export.stay_in_times(db, icu_stay_ids))
+
+    if args.format == 'npz':
+        np.savez_compressed(args.output, values=matrix.values, mask=matrix.mask, icu_stay_ids=matrix.icu_stay_ids,
+                            feature_names=np.array(matrix.feature_names))
+    else:
+        export.write_parquet(args.output, export.feature_rows(matrix))
+    print "exported %d icu stays with %d features to %s" % (len(matrix.icu_stay_ids), builder.n_features,
+                                                              args.output)
+
+
+def dump_command(args):
+    """
+    streams tables of a cohort of a snapshot to a directory per table of parquet files, or npz shards without
+    pyarrow, a batch of icu stays per file.
+    """
+    import database
+    import export
+    import features
+    db = database.ICUDatabase.open_snapshot(args.snapshot)
+    builder = None
+    if 'features' in args.tables:
+        if not args.items:
+            logging.error("the features table needs --items")
+            raise ValueError("the features table needs --items")
+        builder = features.FeatureBuilder(args.items, args.bin_width, args.horizon, args.aggregations)
+    columns = {}
+    for table_name, names in (('patients', args.patient_columns), ('admissions', args.admission_columns),
+                              ('icu_stays', args.icu_stay_columns), ('events', args.event_columns)):
+        if names:
+            columns[table_name] = names
+    exporter = export.Exporter(db, args.output_dir, args.format, args.batch_size)
+    written = exporter.export(args.tables, _cohort(db, args), columns, builder)
+    for table_name in args.tables:
+        print "%s: %d files" % (table_name, len(written[table_name]))
+
+
+def _add_cohort_arguments(parser):
+    parser.add_argument('--care-unit', nargs='+', help="keep stays of these FIRST_CAREUNITs")
+    parser.add_argument('--admission-type', nargs='+', help="keep stays of admissions of these types")
+    parser.add_argument('--with-item', nargs='+', type=int, help="keep stays that recorded all of these ITEMIDs")
+
+
+def _add_feature_arguments(parser):
+    parser.add_argument('--bin-width', type=int, default=3600, help="seconds of a feature bin")
+    parser.add_argument('--horizon', type=int, default=48 * 3600, help="seconds from INTIME to featurize")
+    parser.add_argument('--aggregations', nargs='+', default=['mean'],
+                        choices=constants.AGGREGATIONS)
+
+
+def _add_ingest_arguments(parser):
+    parser.add_argument('data_dir', help="directory of the mimic csv (or csv.gz) files")
+    parser.add_argument('--tables', nargs='+', choices=constants.TABLE_ORDER, default=constants.TABLE_ORDER,
+                        help="tables to read, all by default")
+    parser.add_argument('--workers', type=int, help="read the events tables on this many processes")
+    parser.add_argument('--validation', choices=constants.VALIDATION_LEVELS, default=constants.STRICT,
+                        help="validation level")
+    parser.add_argument('--bad-rows', help="json lines file to write a sample of the bad rows to")
+    parser.add_argument('--profile', action='store_true', help="print the stage timing report")
+    parser.add_argument('--profile-dir', help="directory to write a cProfile pstats file per table to")
+    parser.add_argument('--external-dir', help="read the events tables out of core, spilling them to this directory")
+    parser.add_argument('--memory-budget', type=int, default=constants.DEFAULT_MEMORY_BUDGET // 1024 ** 2,
+                        help="MB the out of core ingest may use to sort a partition")
+    parser.add_argument('--concept-map', help="merge equivalent ITEMIDs and convert units while reading the events, "
+                                              "'default' or a json file with concepts, units and item_units")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="read the tables as overlapping stages and print their timing report")
+    parser.add_argument('--compare', action='store_true',
+                        help="with --pipeline, also time a sequential ingest as the baseline of the report")
+
+
+def make_parser():
+    """
+    :return: argparse.ArgumentParser of all the commands.
+    """
+    parser = argparse.ArgumentParser(prog='mimic3', description="MIMIC-III ICU database tools")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log progress")
+    commands = parser.add_subparsers(title='commands')
+
+    ingest = commands.add_parser('ingest', help="read mimic csv files and report what was read")
+    _add_ingest_arguments(ingest)
+    ingest.add_argument('--snapshot', help="save the database to this snapshot directory")
+    ingest.add_argument('--overwrite', action='store_true', help="replace an existing snapshot")
+    ingest.set_defaults(command=ingest_command)
+
+    snapshot = commands.add_parser('snapshot', help="save, load or update snapshots")
+    snapshot_commands = snapshot.add_subparsers(title='snapshot commands')
+    save = snapshot_commands.add_parser('save', help="read mimic csv files and save them as a snapshot")
+    _add_ingest_arguments(save)
+    save.add_argument('snapshot', help="snapshot directory")
+    save.add_argument('--overwrite', action='store_true', help="replace an existing snapshot")
+    save.set_defaults(command=snapshot_save_command)
+    load = snapshot_commands.add_parser('load', help="load a snapshot and print its sizes")
+    load.add_argument('snapshot', help="snapshot directory")
+    load.set_defaults(command=snapshot_load_command)
+    update = snapshot_commands.add_parser('update', help="ingest the rows appended to the csv files of a snapshot")
+    update.add_argument('snapshot', help="snapshot directory")
+    update.set_defaults(command=snapshot_update_command)
+
+    stats = commands.add_parser('stats', help="print statistics of a snapshot")
+    stats.add_argument('snapshot', help="snapshot directory")
+    stats.add_argument('--top', type=int, default=10, help="number of most common items to print")
+    stats.set_defaults(command=stats_command)
+
+    export = commands.add_parser('export', help="export the features of a cohort of a snapshot")
+    export.add_argument('snapshot', help="snapshot directory")
+    export.add_argument('output', help="file to write")
+    export.add_argument('--items', nargs='+', type=int, required=True, help="ITEMIDs of the features")
+    export.add_argument('--format', choices=constants.EXPORT_FORMATS, default='npz')
+    _add_cohort_arguments(export)
+    _add_feature_arguments(export)
+    export.set_defaults(command=export_command)
+
+    dump = commands.add_parser('dump', help="stream tables of a cohort of a snapshot to parquet files or npz shards")
+    dump.add_argument('snapshot', help="snapshot directory")
+    dump.add_argument('output_dir', help="directory to write a directory per table to")
+    dump.add_argument('--tables', nargs='+', choices=constants.EXPORT_TABLES, default=constants.EXPORT_TABLES[:4])
+    dump.add_argument('--format', choices=constants.EXPORT_FORMATS,
+                      help="parquet when pyarrow is installed, npz otherwise")
+    dump.add_argument('--batch-size', type=int, default=256, help="icu stays per file")
+    dump.add_argument('--patient-columns', nargs='+', help="columns of the patients table, all by default")
+    dump.add_argument('--admission-columns', nargs='+', help="columns of the admissions table, all by default")
+    dump.add_argument('--icu-stay-columns', nargs='+', help="columns of the icu stays table, all by default")
+    dump.add_argument('--event-columns', nargs='+', help="columns of the events table, all by default")
+    dump.add_argument('--items', nargs='+', type=int, help="ITEMIDs of the features table")
+    _add_cohort_arguments(dump)
+    _add_feature_arguments(dump)
+    dump.set_defaults(command=dump_command)
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.INFO if args.verbose else logging.WARNING)
+    args.command(args)
+
+
+if __name__ == "__main__":
+    main()
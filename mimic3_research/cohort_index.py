@@ -0,0 +1,242 @@
+import logging
+import numbers
+import numpy as np
+import utils
+
+
+class CategoryIndex(object):
+    """
+    Index of a categorical column, value -> sorted ids of the rows that have it.
+    """
+    def __init__(self, values, ids):
+        """
+        :param values: array of the column values.
+        :param ids: array of the id of every row.
+        """
+        values = np.asarray(values)
+        ids = np.asarray(ids, dtype=np.int64)
+        self._ids = {}
+        if len(values) == 0:
+            return
+        categories, inverse = np.unique(values, return_inverse=True)
+        order = np.lexsort((ids, inverse))
+        starts = np.searchsorted(inverse[order], np.arange(len(categories)))
+        stops = np.append(starts[1:], len(order))
+        for category, start, stop in zip(categories.tolist(), starts, stops):
+            self._ids[category] = ids[order[start:stop]]
+
+    def categories(self):
+        return sorted(self._ids)
+
+    def lookup(self, *values):
+        """
+        :param values: one or more values of the column.
+        :return: sorted unique ids of the rows that have any of the values.
+        """
+        found = [self._ids[value] for value in values if value in self._ids]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found)) if len(found) > 1 else found[0]
+
+
+class ItemIndex(object):
+    """
+    Index of ITEMID -> icu stays that recorded the item, with the number of events and the first and last time of the
+    item in every stay. events without CHARTTIME are not indexed.
+    """
+    def __init__(self, store):
+        """
+        :param store: event_store.EventStore
+        """
+        timed = np.flatnonzero(store.chart_time != utils.MISSING_TIME)
+        item_id = store.item_id[timed]
+        icu_stay_id = store.icu_stay_id[timed]
+        chart_time = store.chart_time[timed]
+        # lexsort is stable and the store is sorted by time inside a stay, so every (item, stay) group stays sorted
+        # by time.
+        order = np.lexsort((icu_stay_id, item_id))
+        item_id, icu_stay_id, chart_time = item_id[order], icu_stay_id[order], chart_time[order]
+        if len(order):
+            starts = np.flatnonzero(np.append(True, (item_id[1:] != item_id[:-1]) |
+                                              (icu_stay_id[1:] != icu_stay_id[:-1])))
+            stops = np.append(starts[1:], len(order)).astype(np.int64)
+        else:
+            starts = stops = np.empty(0, dtype=np.int64)
+
+        self.item_ids = item_id[starts]
+        self.icu_stay_ids = icu_stay_id[starts]
+        self.counts = stops - starts
+        self.first_times = chart_time[starts]
+        self.last_times = chart_time[stops - 1]
+
+    def _range(self, item_id):
+        return (np.searchsorted(self.item_ids, item_id, side='left'),
+                np.searchsorted(self.item_ids, item_id, side='right'))
+
+    def stays(self, item_id, min_count=1, min_duration=0):
+        """
+        :param item_id: ITEMID
+        :param min_count: minimal number of events of the item in the stay.
+        :param min_duration: minimal seconds between the first and last event of the item in the stay.
+        :return: sorted ids of the icu stays that recorded the item.
+        """
+        start, stop = self._range(item_id)
+        keep = ((self.counts[start:stop] >= min_count) &
+                (self.last_times[start:stop] - self.first_times[start:stop] >= min_duration))
+        return self.icu_stay_ids[start:stop][keep]
+
+    def counts_of(self, item_id):
+        """
+        :return: dict icu_stay_id -> number of events of the item in the stay.
+        """
+        start, stop = self._range(item_id)
+        return dict(zip(self.icu_stay_ids[start:stop].tolist(), self.counts[start:stop].tolist()))
+
+
+class TimeIndex(object):
+    """
+    Interval index of the [INTIME, OUTTIME] of the icu stays, sorted by INTIME. stays without INTIME are not indexed,
+    stays without OUTTIME are treated as still open.
+    """
+    def __init__(self, icu_stay_ids, in_times, out_times):
+        known = np.asarray(in_times) != utils.MISSING_TIME
+        order = np.argsort(np.asarray(in_times)[known], kind='mergesort')
+        self.icu_stay_ids = np.asarray(icu_stay_ids, dtype=np.int64)[known][order]
+        self.in_times = np.asarray(in_times, dtype=np.int64)[known][order]
+        out_times = np.asarray(out_times, dtype=np.int64)[known][order]
+        self.out_times = np.where(out_times == utils.MISSING_TIME, np.iinfo(np.int64).max, out_times)
+
+    def overlapping(self, start, end):
+        """
+        :param start: seconds since epoch.
+        :param end: seconds since epoch.
+        :return: sorted ids of the stays that were open at any time in [start, end].
+        """
+        opened = np.searchsorted(self.in_times, end, side='right')
+        return np.sort(self.icu_stay_ids[:opened][self.out_times[:opened] >= start])
+
+
+class CohortIndex(object):
+    """
+    Secondary indexes over the icu stays and admissions of a database, used to select cohorts without walking the
+    patients object graph or the time series of every stay.
+
+        Attributes:
+            - items: ItemIndex of the event store.
+            - care_units: CategoryIndex FIRST_CAREUNIT -> ICUSTAY_ID.
+            - db_sources: CategoryIndex DBSOURCE -> ICUSTAY_ID.
+            - admission_types: CategoryIndex ADMISSION_TYPE -> HADM_ID.
+            - insurances: CategoryIndex INSURANCE -> HADM_ID.
+            - times: TimeIndex of the INTIME / OUTTIME of the stays.
+    """
+    def __init__(self, tables, store):
+        """
+        :param tables: dict table name -> dict csv column -> numpy array, as snapshot.Snapshot.tables.
+        :param store: event_store.EventStore
+        """
+        stays = tables['icu_stays']
+        admissions = tables['admissions']
+        order = np.argsort(stays['ICUSTAY_ID'], kind='mergesort')
+        self.icu_stay_ids = np.asarray(stays['ICUSTAY_ID'], dtype=np.int64)[order]
+        self.stay_hadm_ids = np.asarray(stays['HADM_ID'], dtype=np.int64)[order]
+
+        self.items = ItemIndex(store)
+        self.care_units = CategoryIndex(stays['FIRST_CAREUNIT'], stays['ICUSTAY_ID'])
+        self.db_sources = CategoryIndex(stays['DBSOURCE'], stays['ICUSTAY_ID'])
+        self.admission_types = CategoryIndex(admissions['ADMISSION_TYPE'], admissions['HADM_ID'])
+        self.insurances = CategoryIndex(admissions['INSURANCE'], admissions['HADM_ID'])
+        self.times = TimeIndex(stays['ICUSTAY_ID'], stays['INTIME'], stays['OUTTIME'])
+
+    @staticmethod
+    def from_database(database):
+        """
+        builds the indexes from the object graph and event store of a database.
+        :param database: ICUDatabase
+        :return: CohortIndex
+        """
+        return CohortIndex(database.table_arrays(), database.event_store)
+
+    def stays_of_admissions(self, hadm_ids):
+        """
+        :param hadm_ids: sorted HADM_IDs.
+        :return: sorted ids of the icu stays of the admissions.
+        """
+        return self.icu_stay_ids[np.in1d(self.stay_hadm_ids, hadm_ids)]
+
+    def query(self):
+        """
+        :return: CohortQuery over all the icu stays.
+        """
+        return CohortQuery(self)
+
+
+class CohortQuery(object):
+    """
+    Chain of filters over the icu stays of a CohortIndex. every filter intersects the sorted ids selected so far with
+    the ids of one index, for example:
+
+        index.query().care_unit('MICU').admission_type('EMERGENCY').with_item(211, min_duration=24 * 3600).stay_ids()
+    """
+    def __init__(self, index, icu_stay_ids=None):
+        self._index = index
+        self._icu_stay_ids = index.icu_stay_ids if icu_stay_ids is None else icu_stay_ids
+
+    def _filter(self, icu_stay_ids):
+        return CohortQuery(self._index, np.intersect1d(self._icu_stay_ids, icu_stay_ids, assume_unique=True))
+
+    def care_unit(self, *care_units):
+        """
+        keeps the stays whose FIRST_CAREUNIT is any of care_units.
+        """
+        return self._filter(self._index.care_units.lookup(*care_units))
+
+    def db_source(self, *db_sources):
+        """
+        keeps the stays whose DBSOURCE is any of db_sources.
+        """
+        return self._filter(self._index.db_sources.lookup(*db_sources))
+
+    def admission_type(self, *admission_types):
+        """
+        keeps the stays of admissions whose ADMISSION_TYPE is any of admission_types.
+        """
+        return self._filter(self._index.stays_of_admissions(self._index.admission_types.lookup(*admission_types)))
+
+    def insurance(self, *insurances):
+        """
+        keeps the stays of admissions whose INSURANCE is any of insurances.
+        """
+        return self._filter(self._index.stays_of_admissions(self._index.insurances.lookup(*insurances)))
+
+    def with_item(self, item_id, min_count=1, min_duration=0):
+        """
+        keeps the stays that recorded an item.
+        :param item_id: ITEMID
+        :param min_count: minimal number of events of the item in the stay.
+        :param min_duration: minimal seconds between the first and last event of the item in the stay.
+        """
+        return self._filter(self._index.items.stays(item_id, min_count, min_duration))
+
+    def between(self, start, end):
+        """
+        keeps the stays that were open at any time between start and end.
+        :param start: datetime object or seconds since epoch.
+        :param end: datetime object or seconds since epoch.
+        """
+        if not isinstance(start, numbers.Integral):
+            start = utils.date_time_to_epoch(start)
+        if not isinstance(end, numbers.Integral):
+            end = utils.date_time_to_epoch(end)
+        if end < start:
+            logging.error("end of the time range is before its start")
+            raise ValueError("end of the time range is before its start")
+        return self._filter(self._index.times.overlapping(start, end))
+
+    def stay_ids(self):
+        """
+        :return: sorted ICUSTAY_IDs of the selected stays.
+        """
+        return self._icu_stay_ids
+
+    def __len__(self):
+        return len(self._icu_stay_ids)
@@ -0,0 +1,21 @@
+# names and defaults shared by the database modules and the command line. the module imports nothing, so the parser
+# of cli.py uses them without importing the database modules (and numpy) and --help starts right away.
+
+# tables in the order they are read, every table refers to ids of the tables before it.
+TABLE_ORDER = ('PATIENTS', 'ADMISSIONS', 'ICUSTAYS', 'CHARTEVENTS', 'LABEVENTS', 'OUTPUTEVENTS')
+
+# validation levels of an ICUDatabase, see validation.py.
+STRICT = 'strict'
+SAMPLED = 'sampled'
+OFF = 'off'
+VALIDATION_LEVELS = (STRICT, SAMPLED, OFF)
+
+# aggregations of the events of an item inside a time bin, see features.py.
+AGGREGATIONS = ('last', 'mean', 'min', 'max', 'count')
+
+# file formats and tables of export.Exporter.
+EXPORT_FORMATS = ('parquet', 'npz')
+EXPORT_TABLES = ('patients', 'admissions', 'icu_stays', 'events', 'features')
+
+# bytes the out of core ingest may use to sort a partition, see external_ingest.py.
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
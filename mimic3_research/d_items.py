@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import re
+import numpy as np
+import table_reader
+
+# columns of D_ITEMS.csv kept by ItemDictionary, and of D_LABITEMS.csv for the ITEMIDs of LABEVENTS.
+D_ITEMS_COLUMNS = (('ITEMID', 'int'), ('LABEL', 'str'), ('ABBREVIATION', 'str'), ('DBSOURCE', 'str'),
+                   ('LINKSTO', 'str'), ('CATEGORY', 'str'), ('UNITNAME', 'str'), ('PARAM_TYPE', 'str'))
+D_LABITEMS_COLUMNS = (('ITEMID', 'int'), ('LABEL', 'str'), ('FLUID', 'str'), ('CATEGORY', 'str'))
+
+# spellings of units in the events tables, lower case and stripped -> the unit they are.
+UNIT_ALIASES = {'?f': 'F', '°f': 'F', 'deg. f': 'F', 'deg f': 'F', 'degf': 'F', 'f': 'F',
+                '?c': 'C', '°c': 'C', 'deg. c': 'C', 'deg c': 'C', 'degc': 'C', 'c': 'C',
+                'kg': 'kg', 'lb': 'lb', 'lbs': 'lb', 'lbs.': 'lb', 'oz': 'oz', 'cm': 'cm', 'in': 'in', 'inch': 'in',
+                'inches': 'in'}
+# (unit, unit) -> (scale, offset), a value in the first unit times scale plus offset is the value in the second.
+UNIT_CONVERSIONS = {('F', 'C'): (5 / 9.0, -32 * 5 / 9.0), ('C', 'F'): (1.8, 32.0),
+                    ('lb', 'kg'): (0.45359237, 0.0), ('kg', 'lb'): (1 / 0.45359237, 0.0),
+                    ('oz', 'kg'): (0.028349523125, 0.0),
+                    ('in', 'cm'): (2.54, 0.0), ('cm', 'in'): (1 / 2.54, 0.0)}
+
+# concept name -> the ITEMIDs it is recorded under in CareVue and Metavision, the first ITEMID is the one the others
+# are merged into.
+DEFAULT_CONCEPTS = {'heart_rate': [220045, 211],
+                    'systolic_bp': [220050, 220179, 51, 442, 455, 6701],
+                    'diastolic_bp': [220051, 220180, 8368, 8440, 8441, 8555],
+                    'mean_bp': [220052, 220181, 225312, 52, 443, 456, 6702],
+                    'respiratory_rate': [220210, 224690, 615, 618],
+                    'temperature': [223762, 676, 223761, 678],
+                    'spo2': [220277, 646],
+                    'glucose': [220621, 225664, 226537, 807, 811, 1529, 3744, 3745],
+                    'weight': [226512, 224639, 762, 763, 3580, 226531, 3581, 3582],
+                    'height': [226730, 3485, 4188, 226707, 920, 1394, 4187, 3486]}
+# concept name (or ITEMID) -> unit its values are converted to.
+DEFAULT_UNITS = {'temperature': '?C', 'weight': 'kg', 'height': 'cm'}
+# ITEMID -> unit of its events that have no VALUEUOM.
+DEFAULT_ITEM_UNITS = {223762: '?C', 676: '?C', 223761: '?F', 678: '?F',
+                      226512: 'kg', 224639: 'kg', 762: 'kg', 763: 'kg', 3580: 'kg',
+                      226531: 'lb', 3581: 'lb', 3582: 'oz',
+                      226730: 'cm', 3485: 'cm', 4188: 'cm', 226707: 'in', 920: 'in', 1394: 'in', 4187: 'in', 3486: 'in'}
+
+
+def canonical_unit(unit):
+    """
+    :param unit: VALUEUOM string, for example 'Deg. F'.
+    :return: the unit it is a spelling of from UNIT_ALIASES ('F'), the stripped string if it isn't in it.
+    """
+    unit = unit.strip()
+    return UNIT_ALIASES.get(unit.lower(), unit)
+
+
+def _lookup(table, item_ids, default):
+    """
+    :param table: array indexed by ITEMID.
+    :param item_ids: int64 array of ITEMIDs.
+    :param default: value (or array aligned with item_ids) where the ITEMID is outside of the table.
+    :return: the table entry of every ITEMID.
+    """
+    inside = (item_ids >= 0) & (item_ids < len(table))
+    if not inside.any():
+        return np.broadcast_to(default, item_ids.shape).astype(table.dtype)
+    return np.where(inside, table[np.where(inside, item_ids, 0)], default)
+
+
+class ItemDictionary(object):
+    """
+    The item metadata of D_ITEMS (and D_LABITEMS), as columns aligned by row with an array from ITEMID to row, so
+    looking up the labels of a whole column of ITEMIDs is a single take instead of a dict lookup per event.
+
+        Attributes:
+            - item_ids: ITEMID of every row.
+            - labels, abbreviations, db_sources, link_tos, categories, unit_names, param_types: the D_ITEMS column of
+            every row, '' where the table doesn't have it (the lab items have only a label and a category).
+    """
+    COLUMNS = ('labels', 'abbreviations', 'db_sources', 'link_tos', 'categories', 'unit_names', 'param_types')
+
+    def __init__(self, item_ids, columns):
+        """
+        :param item_ids: int array of distinct ITEMIDs.
+        :param columns: dict attribute name of COLUMNS -> string array aligned with item_ids.
+        """
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        for name in self.COLUMNS:
+            setattr(self, name, np.asarray(columns[name], dtype='S'))
+        if len(np.unique(self.item_ids)) != len(self.item_ids):
+            logging.error("the item dictionary has duplicate ITEMIDs")
+            raise ValueError("the item dictionary has duplicate ITEMIDs")
+        size = int(self.item_ids.max()) + 1 if len(self.item_ids) else 0
+        self._rows = np.full(size, -1, dtype=np.int32)
+        self._rows[self.item_ids] = np.arange(len(self.item_ids), dtype=np.int32)
+
+    @staticmethod
+    def load(mimic3_dir):
+        """
+        reads D_ITEMS.csv (or .csv.gz) of mimic3_dir, and D_LABITEMS.csv when it exists.
+        :param mimic3_dir: dir of the mimic csv files.
+        :return: ItemDictionary
+        """
+        path = table_reader.table_path(mimic3_dir, 'D_ITEMS')
+        if not os.path.exists(path):
+            logging.error("no D_ITEMS table in %s", mimic3_dir)
+            raise ValueError("no D_ITEMS table in %s" % mimic3_dir)
+        item_ids = []
+        columns = dict((name, []) for name in ItemDictionary.COLUMNS)
+        with table_reader.TableReader(path, D_ITEMS_COLUMNS) as reader:
+            for chunk in reader:
+                item_ids.append(chunk['ITEMID'])
+                for name, (csv_name, kind) in zip(ItemDictionary.COLUMNS, D_ITEMS_COLUMNS[1:]):
+                    columns[name].append(chunk[csv_name])
+
+        lab_path = table_reader.table_path(mimic3_dir, 'D_LABITEMS')
+        if os.path.exists(lab_path):
+            with table_reader.TableReader(lab_path, D_LABITEMS_COLUMNS) as reader:
+                for chunk in reader:
+                    lab_columns = {'labels': chunk['LABEL'], 'categories': chunk['CATEGORY'],
+                                   'link_tos': np.full(len(chunk), 'labevents', dtype='S9')}
+                    item_ids.append(chunk['ITEMID'])
+                    for name in ItemDictionary.COLUMNS:
+                        columns[name].append(lab_columns.get(name, np.zeros(len(chunk), dtype='S1')))
+
+        def concatenate(arrays, dtype):
+            return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+        items = ItemDictionary(concatenate(item_ids, np.int64),
+                               dict((name, concatenate(values, 'S1')) for name, values in columns.items()))
+        logging.info("Loaded %d items from %s", len(items), mimic3_dir)
+        return items
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def rows(self, item_ids):
+        """
+        :param item_ids: int array of ITEMIDs.
+        :return: int array, the row of every ITEMID, -1 where it isn't in the dictionary.
+        """
+        return _lookup(self._rows, np.asarray(item_ids, dtype=np.int64), -1)
+
+    def __contains__(self, item_id):
+        return self.rows([item_id])[0] >= 0
+
+    def take(self, name, item_ids):
+        """
+        :param name: one of COLUMNS.
+        :param item_ids: int array of ITEMIDs, for example the item_id column of an event store.
+        :return: string array of the column for every ITEMID, '' where the ITEMID isn't in the dictionary.
+        """
+        rows = self.rows(item_ids)
+        values = getattr(self, name)
+        return np.where(rows >= 0, values[np.maximum(rows, 0)], '')
+
+    def label(self, item_id):
+        """
+        :return: LABEL of the ITEMID, None if it isn't in the dictionary.
+        """
+        row = self.rows([item_id])[0]
+        return self.labels[row] if row >= 0 else None
+
+    def item(self, item_id):
+        """
+        :return: dict attribute name of COLUMNS -> value of the ITEMID, None if it isn't in the dictionary.
+        """
+        row = self.rows([item_id])[0]
+        if row < 0:
+            return None
+        return dict((name, getattr(self, name)[row]) for name in self.COLUMNS)
+
+    def find(self, pattern, category=None):
+        """
+        finds items by label, for example to list the ITEMIDs of a concept.
+        :param pattern: regular expression searched in the labels, case insensitive.
+        :param category: keep only the items of this CATEGORY.
+        :return: sorted int array of ITEMIDs.
+        """
+        regex = re.compile(pattern, re.IGNORECASE)
+        found = np.array([regex.search(label) is not None for label in self.labels.tolist()], dtype=bool)
+        if category is not None:
+            found &= self.categories == category
+        return np.sort(self.item_ids[found])
+
+
+class ConceptMap(object):
+    """
+    Merges the ITEMIDs a concept is recorded under (in CareVue and in Metavision) into one ITEMID, and converts the
+    values of a concept to one unit. it is applied by event_store.EventStoreBuilder to every chunk of events as it is
+    ingested, with array lookups indexed by ITEMID, so the event store holds the merged items and the feature builders
+    never map single events. events in a unit that can't be converted are kept as they are, with their unit.
+    """
+    def __init__(self, concepts=None, units=None, item_units=None):
+        """
+        :param concepts: dict concept name -> list of ITEMIDs, the first ITEMID is the one the others are merged into.
+        :param units: dict concept name or ITEMID -> unit its values are converted to, written as VALUEUOM of the
+        converted events.
+        :param item_units: dict ITEMID -> unit of its events that have no VALUEUOM, they are converted only if it is
+        known.
+        """
+        concepts = concepts or {}
+        self.concepts = dict((name, [int(item_id) for item_id in item_ids]) for name, item_ids in concepts.items())
+        self.units = dict(units or {})
+        self.item_units = dict((int(item_id), unit) for item_id, unit in (item_units or {}).items())
+
+        merged = [item_id for item_ids in self.concepts.values() for item_id in item_ids]
+        if len(set(merged)) != len(merged):
+            logging.error("an ITEMID belongs to more than one concept")
+            raise ValueError("an ITEMID belongs to more than one concept")
+        unknown = [key for key in self.units if not isinstance(key, (int, long)) and key not in self.concepts]
+        if unknown:
+            logging.error("units of unknown concepts %s", ', '.join(unknown))
+            raise ValueError("units of unknown concepts %s" % ', '.join(unknown))
+
+        target_units = {}
+        for key, unit in self.units.items():
+            target_units[self.concepts[key][0] if key in self.concepts else int(key)] = unit
+        size = max(merged + target_units.keys() + self.item_units.keys() + [-1]) + 1
+
+        # ITEMID -> the ITEMID it is merged into, itself if it isn't merged.
+        self._merged_ids = np.arange(size, dtype=np.int64)
+        for item_ids in self.concepts.values():
+            self._merged_ids[item_ids] = item_ids[0]
+        # ITEMID -> unit code, the unit of its values or of its events without VALUEUOM, -1 if there is none.
+        self._unit_names = sorted(set(target_units.values()) | set(self.item_units.values()))
+        self._target_units = np.full(size, -1, dtype=np.int64)
+        for item_id, unit in target_units.items():
+            self._target_units[item_id] = self._unit_names.index(unit)
+        self._item_units = np.full(size, -1, dtype=np.int64)
+        for item_id, unit in self.item_units.items():
+            self._item_units[item_id] = self._unit_names.index(unit)
+
+    @staticmethod
+    def default():
+        """
+        :return: ConceptMap of DEFAULT_CONCEPTS, DEFAULT_UNITS and DEFAULT_ITEM_UNITS.
+        """
+        return ConceptMap(DEFAULT_CONCEPTS, DEFAULT_UNITS, DEFAULT_ITEM_UNITS)
+
+    def to_dict(self):
+        """
+        :return: the configuration as a dict that can be written to json, see from_dict.
+        """
+        return {'concepts': self.concepts, 'units': dict((str(key), unit) for key, unit in self.units.items()),
+                'item_units': dict((str(item_id), unit) for item_id, unit in self.item_units.items())}
+
+    @staticmethod
+    def from_dict(config):
+        """
+        :param config: dict with 'concepts', 'units' and 'item_units' as the arguments of ConceptMap, ITEMID keys may
+        be strings (as in json).
+        :return: ConceptMap
+        """
+        def text(value):
+            # json gives unicode strings, the events are byte strings.
+            return value.encode('utf-8') if isinstance(value, unicode) else value
+        concepts = dict((text(name), item_ids) for name, item_ids in config.get('concepts', {}).items())
+        units = dict((text(key) if text(key) in concepts else int(key), text(unit))
+                     for key, unit in config.get('units', {}).items())
+        item_units = dict((int(item_id), text(unit)) for item_id, unit in config.get('item_units', {}).items())
+        return ConceptMap(concepts, units, item_units)
+
+    def concept_id(self, name):
+        """
+        :param name: concept name.
+        :return: the ITEMID the events of the concept are stored under.
+        """
+        if name not in self.concepts:
+            logging.error("unknown concept %s", name)
+            raise ValueError("unknown concept %s" % name)
+        return self.concepts[name][0]
+
+    def apply(self, item_id, value_num, value_unit):
+        """
+        maps a chunk of events.
+        :param item_id: int ITEMID array.
+        :param value_num: float VALUENUM array, nan where missing.
+        :param value_unit: VALUEUOM string array.
+        :return: (item_id, value_num, value_unit) - new arrays with the merged ITEMIDs, and the values and units of
+        the converted events.
+        """
+        item_id = np.asarray(item_id, dtype=np.int64)
+        merged_id = _lookup(self._merged_ids, item_id, item_id)
+        target = _lookup(self._target_units, merged_id, -1)
+        rows = np.flatnonzero(target >= 0)
+        if len(rows) == 0:
+            return merged_id, value_num, value_unit
+
+        # the unit of every event to convert, by its VALUEUOM or else by its original ITEMID.
+        names = self._unit_names
+        units, inverse = np.unique(value_unit[rows], return_inverse=True)
+        canonical = [canonical_unit(unit) for unit in units.tolist()]
+        unit_names = [canonical_unit(name) for name in names]
+        codes = np.array([unit_names.index(unit) if unit in unit_names else len(names) + i
+                          for i, unit in enumerate(canonical)], dtype=np.int64)
+        source = codes[inverse]
+        no_unit = units[inverse] == ''
+        source[no_unit] = _lookup(self._item_units, item_id[rows[no_unit]], -1)
+        target = target[rows]
+
+        value_num = np.array(value_num, dtype=np.float64)
+        converted = np.zeros(len(rows), dtype=bool)
+        pairs = np.unique(source * (len(names) + len(units)) + target)
+        for pair in pairs.tolist():
+            from_code, to_code = divmod(pair, len(names) + len(units))
+            if from_code < 0:
+                continue
+            from_unit = unit_names[from_code] if from_code < len(names) else canonical[from_code - len(names)]
+            if from_unit == unit_names[to_code]:
+                scale, offset = 1.0, 0.0
+            elif (from_unit, unit_names[to_code]) in UNIT_CONVERSIONS:
+                scale, offset = UNIT_CONVERSIONS[(from_unit, unit_names[to_code])]
+            else:
+                continue
+            selected = (source == from_code) & (target == to_code)
+            value_num[rows[selected]] = value_num[rows[selected]] * scale + offset
+            converted |= selected
+
+        width = max([value_unit.dtype.itemsize] + [len(name) for name in names])
+        value_unit = np.array(value_unit, dtype='S%d' % width)
+        value_unit[rows[converted]] = np.array(names, dtype='S%d' % width)[target[converted]]
+        return merged_id, value_num, value_unit
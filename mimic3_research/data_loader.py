@@ -0,0 +1,191 @@
+import logging
+import threading
+import numpy as np
+import features
+import utils
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+DEFAULT_PREFETCH = 4
+
+
+class Batch(object):
+    """
+    A mini batch of icu stays.
+
+        Attributes:
+            - values: float32 array [batch_size, max_length, n_features], max_length is the longest stay of the batch.
+            - mask: bool array of the same shape, True where the feature was observed.
+            - lengths: int32 number of bins of every stay, the bins after it are padding.
+            - icu_stay_ids: ICUSTAY_ID of every stay of the batch.
+            - labels: labels of the stays, None if the loader has no labels.
+    """
+    def __init__(self, values, mask, lengths, icu_stay_ids, labels=None):
+        self.values = values
+        self.mask = mask
+        self.lengths = lengths
+        self.icu_stay_ids = icu_stay_ids
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.icu_stay_ids)
+
+
+class StayBatchLoader(object):
+    """
+    Streams mini batches of binned icu stays straight from the event store, so the features of all the stays are
+    never materialized at once. stays are bucketed by sequence length, so a batch holds stays of similar length and
+    is padded only to its longest stay. the next batches are built on background threads while the current batch is
+    used (the numpy work of features.FeatureBuilder releases the GIL), and the order of the stays is reshuffled
+    every epoch from the seed and the epoch number, without reading the csv files again.
+    """
+    def __init__(self, database, feature_builder, icu_stay_ids=None, labels=None, batch_size=32, shuffle=True,
+                 seed=0, num_workers=1, prefetch=DEFAULT_PREFETCH):
+        """
+        :param database: ICUDatabase whose event store holds the events of the stays.
+        :param feature_builder: features.FeatureBuilder, its bins and horizon set the sequence length.
+        :param icu_stay_ids: ids of the stays to load, all the stays of the database by default.
+        :param labels: optional array of a label for every stay in icu_stay_ids.
+        :param batch_size: number of stays in a batch.
+        :param shuffle: reshuffle the batches every epoch. batches are yielded from short to long stays otherwise.
+        :param seed: seed of the shuffle.
+        :param num_workers: number of threads building batches.
+        :param prefetch: number of batches every worker builds ahead.
+        """
+        if icu_stay_ids is None:
+            icu_stay_ids = sorted(database.icu_stays)
+        self.icu_stay_ids = np.asarray(icu_stay_ids, dtype=np.int64)
+        if labels is not None and len(labels) != len(self.icu_stay_ids):
+            logging.error("got %d labels for %d icu stays", len(labels), len(self.icu_stay_ids))
+            raise ValueError("got %d labels for %d icu stays" % (len(labels), len(self.icu_stay_ids)))
+        self.labels = None if labels is None else np.asarray(labels)
+        self.store = database.event_store
+        self.feature_builder = feature_builder
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_workers = max(1, num_workers)
+        self.prefetch = max(1, prefetch)
+        self.start_times = features.stay_start_times(database, self.icu_stay_ids)
+        self.lengths = self._sequence_lengths()
+        self.epoch = 0
+
+    def _sequence_lengths(self):
+        """
+        :return: int32 number of bins from the start of every stay to its last event, at least 1 and at most the
+        number of bins of the feature builder.
+        """
+        store = self.store
+        builder = self.feature_builder
+        if len(store.stay_ids) == 0:
+            return np.ones(len(self.icu_stay_ids), dtype=np.int32)
+        position = np.minimum(np.searchsorted(store.stay_ids, self.icu_stay_ids), len(store.stay_ids) - 1)
+        found = store.stay_ids[position] == self.icu_stay_ids
+        # events of a stay are sorted by time, so the last row of the stay is its last event.
+        last_time = store.chart_time[np.maximum(store.stay_stops[position] - 1, 0)]
+        # a missing INTIME, or a stay whose events all miss CHARTTIME, would overflow the difference.
+        known = found & (last_time != utils.MISSING_TIME) & (self.start_times != utils.MISSING_TIME)
+        elapsed = np.where(known, last_time, 0) - np.where(known, self.start_times, 0)
+        lengths = np.where(known, elapsed // builder.bin_width + 1, 1)
+        return np.clip(lengths, 1, builder.n_bins).astype(np.int32)
+
+    def __len__(self):
+        return -(-len(self.icu_stay_ids) // self.batch_size)
+
+    def batch_order(self, epoch):
+        """
+        :param epoch: epoch number, the shuffle of an epoch only depends on the seed and this number.
+        :return: list of arrays of positions in icu_stay_ids, one array per batch.
+        """
+        if self.shuffle:
+            random_state = np.random.RandomState((self.seed + epoch) % (2 ** 32))
+            # stays of the same length are shuffled, then the batches themselves are shuffled.
+            order = np.lexsort((random_state.random_sample(len(self.lengths)), self.lengths))
+        else:
+            order = np.argsort(self.lengths, kind='mergesort')
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if self.shuffle:
+            random_state.shuffle(batches)
+        return batches
+
+    def make_batch(self, positions):
+        """
+        :param positions: positions in icu_stay_ids of the stays of the batch.
+        :return: Batch
+        """
+        icu_stay_ids = self.icu_stay_ids[positions]
+        lengths = self.lengths[positions]
+        matrix = self.feature_builder.build(self.store, icu_stay_ids, self.start_times[positions])
+        max_length = lengths.max() if len(lengths) else 0
+        labels = None if self.labels is None else self.labels[positions]
+        return Batch(matrix.values[:, :max_length], matrix.mask[:, :max_length], lengths, icu_stay_ids, labels)
+
+    def __iter__(self):
+        """
+        iterates over the batches of the next epoch.
+        """
+        epoch = self.epoch
+        self.epoch += 1
+        return self.iterate_epoch(epoch)
+
+    def iterate_epoch(self, epoch):
+        """
+        :param epoch: epoch number.
+        :return: generator of the Batch objects of the epoch. worker w builds batches w, w + num_workers, ... into its
+        own bounded queue, and the queues are read in turn so the batches come out in batch_order.
+        """
+        batches = self.batch_order(epoch)
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.prefetch) for _ in range(self.num_workers)]
+        workers = [threading.Thread(target=self._work, args=(batches[worker::self.num_workers], queues[worker], stop))
+                   for worker in range(self.num_workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            for i in range(len(batches)):
+                failed, batch = queues[i % self.num_workers].get()
+                if failed:
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    def _work(self, batches, output, stop):
+        for positions in batches:
+            try:
+                item = (False, self.make_batch(positions))
+            except Exception as error:
+                logging.exception("failed to build a batch")
+                item = (True, error)
+            while not stop.is_set():
+                try:
+                    output.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set() or item[0]:
+                return
+
+    def as_tf_dataset(self, epoch=None):
+        """
+        wraps the loader in a tf.data.Dataset of (values, mask, lengths) tuples. tensorflow is imported only here.
+        :param epoch: epoch to iterate, the next epoch every time the dataset is iterated by default.
+        :return: tf.data.Dataset
+        """
+        import tensorflow as tf
+
+        def generate():
+            for batch in (self if epoch is None else self.iterate_epoch(epoch)):
+                yield batch.values, batch.mask, batch.lengths
+
+        n_features = self.feature_builder.n_features
+        return tf.data.Dataset.from_generator(
+            generate, (tf.float32, tf.bool, tf.int32),
+            (tf.TensorShape([None, None, n_features]), tf.TensorShape([None, None, n_features]),
+             tf.TensorShape([None])))
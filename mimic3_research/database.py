@@ -2,11 +2,31 @@ import patient
 import hospital_visit
 import icu_stay
 import event
-import csv
+import event_store
+import event_ingest
 import os
 import logging
-import multiprocessing
-import pickle
+import contextlib
+import parallel_ingest
+import table_reader
+import snapshot
+import lazy_patients
+import utils
+import watermark
+import cohort_index
+import validation
+import ingest_metrics
+import profiling
+import labels
+import stay_summary
+import external_ingest
+import pipeline
+import d_items
+import constants
+import time
+
+# tables in the order they are read, every table refers to ids of the tables before it.
+TABLE_ORDER = constants.TABLE_ORDER
 
 
 class ICUDatabase(object):
@@ -17,236 +37,744 @@ class ICUDatabase(object):
             patients: list of all patients in the database.
             num_of_patients : Number of patients in the database.
             mimic3_dir : path to dir of all .csv files
+            icu_stays : dict of all icu stays in the database by their id.
+            event_store : event_store.EventStore with the events of all icu stays. each IcuStay.time_series is a
+            view over it.
+            watermarks : dict table name -> watermark of the last ingest of the table (see watermark.py), used by
+            update to ingest only the rows appended since.
+            index : cohort_index.CohortIndex of the database, built on first use after the tables were read.
+            validator : validation.Validator that checks the chunks of the tables that are read.
+            metrics : ingest_metrics.IngestMetrics with the anomaly counters of every table that was read and a
+            bounded sample of the bad rows.
+            profiler : profiling.Profiler that times the stages of an ingest, disabled unless inside profile().
+            concept_map : d_items.ConceptMap applied to the events as they are ingested, None keeps the ITEMIDs and
+            units of the csv files.
+            items : d_items.ItemDictionary of D_ITEMS, loaded from mimic3_dir on first use.
 
     """
-    def __init__(self, mimic3_data_files_path):
+    def __init__(self, mimic3_data_files_path, validation_level=validation.STRICT, bad_rows_path=None,
+                 concept_map=None):
         """Init Patient with all the attributes defined in the patients.csv file.
             :param mimic3_data_files_path : path to .csv files.
+            :param validation_level : one of validation.LEVELS. 'strict' checks every chunk that is read, 'sampled'
+            checks a sample of the rows of every chunk and 'off' skips the checks, for trusted extracts. the events
+            tables have no sampled mode, they are checked in full unless the level is 'off'.
+            :param bad_rows_path : file to write the sample of bad rows to as json lines, kept in memory by default.
+            :param concept_map : d_items.ConceptMap that merges equivalent ITEMIDs and converts units during ingest,
+            for example d_items.ConceptMap.default().
         """
         self.patients = {}
         self.num_of_patients = 0
         self.total_number_of_hospital_visits = 0
         self.mimic3_dir = mimic3_data_files_path
-        self.invalid_rows = []
+        self.icu_stays = {}
+        self.event_store = event_store.EventStore.empty()
+        self.watermarks = {}
+        self._index = None
+        self._snapshot = None
+        self.validator = validation.Validator(validation_level)
+        self.metrics = ingest_metrics.IngestMetrics(bad_rows_path)
+        self.profiler = profiling.Profiler(enabled=False)
+        self.concept_map = concept_map
+        self._items = None
 
         # Support for Multiprocessing :
         # self.mgr = multiprocessing.Manager()
         # self.patients = self.mgr.dict()
 
-    def read_patients_table(self):
+    def read_patients_table(self, start=None, reader=None):
         """
         reads the PATIENTS.csv file and add patients to the database.
+        :param start: byte offset of the first row to read, the whole table by default.
+        :param reader: reader of the table that was already opened, for example a pipeline.TableParser.
         :return: void
         """
         table_name = 'PATIENTS'
-        reader = csv.DictReader(open(os.path.join(self.mimic3_dir, table_name + '.csv'), 'r'))
-
-        for i, row in enumerate(reader):
-
-            if 'SUBJECT_ID' not in row:
-                logging.warning("Row %d Doesn't contain the subject id", i)
-                continue
-            if row['DOD'] == "":
-                assert row['DOD_HOSP'] == '' and row['DOD_SSN'] == '' and row['EXPIRE_FLAG'] == '0'
-
-            else:
-                assert row['EXPIRE_FLAG'] == '1'
+        for i, row in self._read_table_rows(table_name, snapshot.PATIENT_COLUMNS, optional=('DOD_HOSP', 'DOD_SSN'),
+                                            start=start, reader=reader):
             if 'DOD_HOSP' not in row:
                 row['DOD_HOSP'] = None
             if 'DOD_SSN' not in row:
                 row['DOD_SSN'] = None
 
-            if int(row['SUBJECT_ID']) in self.patients.keys():
-                logging.error("Patient %d already exists.", int(row['SUBJECT_ID']))
-                raise ValueError("Patient %d already exists.", int(row['SUBJECT_ID']))
-
-            new_patient = patient.Patient(int(row['SUBJECT_ID']), row['GENDER'], row['DOB'], row['DOD'], row['DOD_HOSP'],
-                                          row['DOD_SSN'], row['EXPIRE_FLAG'])
-            self.patients[int(row['SUBJECT_ID'])] = new_patient
-            self.num_of_patients += 1
-
-            if i % 100 == 0:
-                logging.info("Successfully read %d patients from PATIENTS.csv", self.num_of_patients)
+            with self.profiler.phase('construct'):
+                self._add_patient(row)
 
         logging.info("DONE reading PATIENTS.csv, total of %d patients are saved in the database", self.num_of_patients)
         return
 
-    def read_hospital_visits_table(self):
+    def _add_patient(self, row):
+        """
+        adds a patient given as a row of PATIENTS.csv.
+        :param row: dict csv column -> value.
+        :return:
+        """
+        if int(row['SUBJECT_ID']) in self.patients:
+            logging.error("Patient %d already exists.", int(row['SUBJECT_ID']))
+            raise ValueError("Patient %d already exists.", int(row['SUBJECT_ID']))
+
+        new_patient = patient.Patient.from_row(row)
+        self.patients[int(row['SUBJECT_ID'])] = new_patient
+        self.num_of_patients += 1
+
+    def read_hospital_visits_table(self, start=None, reader=None):
         """
         reads the ADMISSIONS.csv file and adds hospital visits details to each paitent.
+        :param start: byte offset of the first row to read, the whole table by default.
+        :param reader: reader of the table that was already opened, for example a pipeline.TableParser.
         :return:
         """
         table_name = 'ADMISSIONS'
-        reader = csv.DictReader(open(os.path.join(self.mimic3_dir, table_name + '.csv'), 'r'))
-        for i, row in enumerate(reader):
-            subject_id = int(row['SUBJECT_ID'])
+        for i, row in self._read_table_rows(table_name, snapshot.ADMISSION_COLUMNS, start=start, reader=reader):
+            with self.profiler.phase('construct'):
+                self._add_hospital_visit(row)
 
-            if subject_id not in self.patients.keys():
-                logging.error("Patient %d doen't exists.", subject_id)
-                raise ValueError("Patient %d doen't exists." % subject_id)
+        logging.info("DONE reading ADMISSIONS.csv, total of %d visits are saved in the database",
+                     self.total_number_of_hospital_visits)
+        return
 
-            new_hosp_visit = hospital_visit.HospitalVisit(row['HADM_ID'], row['ADMITTIME'], row['DISCHTIME'],
-                                                          row['DEATHTIME'], row['ADMISSION_TYPE'],
-                                                          row['ADMISSION_LOCATION'], row['INSURANCE'], row['LANGUAGE'],
-                                                          row['RELIGION'], row['MARITAL_STATUS'], row['ETHNICITY'],
-                                                          row['EDREGTIME'], row['EDOUTTIME'], row['DIAGNOSIS'])
+    def _add_hospital_visit(self, row):
+        """
+        adds a hospital visit given as a row of ADMISSIONS.csv to its patient.
+        :param row: dict csv column -> value.
+        :return:
+        """
+        subject_id = int(row['SUBJECT_ID'])
 
-            self.patients[subject_id].add_hospital_visit(new_hosp_visit)
-            self.total_number_of_hospital_visits += 1
+        if subject_id not in self.patients:
+            logging.error("Patient %d doen't exists.", subject_id)
+            raise ValueError("Patient %d doen't exists." % subject_id)
 
-            if i % 100 == 0:
-                logging.info("Successfully read %d visits from ADMISSIONS.csv", i)
+        # rows were validated a chunk at a time by the validator, or come from a snapshot of validated rows.
+        new_hosp_visit = hospital_visit.HospitalVisit.from_row(row, validate=False)
 
-        logging.info("DONE reading %d rows in ADMISSIONS.csv, total of %d visits are saved in the database", i,
-                     self.total_number_of_hospital_visits)
-        return
+        self.patients[subject_id].add_hospital_visit(new_hosp_visit)
+        self.total_number_of_hospital_visits += 1
+        self._index = None
 
-    def read_icu_stays_table(self):
+    def read_icu_stays_table(self, start=None, reader=None):
         """
 
+        :param start: byte offset of the first row to read, the whole table by default.
+        :param reader: reader of the table that was already opened, for example a pipeline.TableParser.
         :return:
         """
         table_name = 'ICUSTAYS'
-        reader = csv.DictReader(open(os.path.join(self.mimic3_dir, table_name + '.csv'), 'r'))
-        for i, row in enumerate(reader):
-            subject_id = int(row['SUBJECT_ID'])
+        for i, row in self._read_table_rows(table_name, snapshot.ICU_STAY_COLUMNS, start=start, reader=reader):
+            with self.profiler.phase('construct'):
+                self._add_icu_stay(row)
 
-            if subject_id not in self.patients.keys():
-                logging.error("Patient %d doen't exists.", subject_id)
-                raise ValueError("Patient %d doen't exists." % subject_id)
+        logging.info("DONE reading ICUSTAYS.csv, total of %d icu stays are saved in the database", len(self.icu_stays))
+        return
 
-            new_icu_stay = icu_stay.IcuStay(row['ICUSTAY_ID'], row['DBSOURCE'], row['FIRST_CAREUNIT'],
-                                            row['LAST_CAREUNIT'], row['FIRST_WARDID'], row['LAST_WARDID'],
-                                            row['INTIME'], row['OUTTIME'], row['LOS'])
+    def _add_icu_stay(self, row):
+        """
+        adds an icu stay given as a row of ICUSTAYS.csv to its hospital visit.
+        :param row: dict csv column -> value.
+        :return:
+        """
+        subject_id = int(row['SUBJECT_ID'])
 
-            self.patients[subject_id].add_icu_stay(int(row['HADM_ID']), new_icu_stay)
+        if subject_id not in self.patients:
+            logging.error("Patient %d doen't exists.", subject_id)
+            raise ValueError("Patient %d doen't exists." % subject_id)
 
-            if i % 100 == 0:
-                logging.info("Successfully read %d icu_stays from ICUSTAYS.csv", i)
+        new_icu_stay = icu_stay.IcuStay.from_row(row)
 
-        logging.info("DONE reading %d rows from ICUSTAYS.csv, total of visits are saved in the database" % i)
-        return
+        self.patients[subject_id].add_icu_stay(int(row['HADM_ID']), new_icu_stay)
+        self.icu_stays[new_icu_stay.icu_stay_id] = new_icu_stay
+        self._index = None
 
-    def read_events_table_by_row(self, table):
+    def _open_table(self, table_name, columns=None, optional=(), chunk_size=table_reader.DEFAULT_CHUNK_SIZE,
+                    start=None):
+        """
+        :param table_name: for example 'ADMISSIONS', read from TABLE.csv or TABLE.csv.gz in mimic3_dir.
+        :param columns: list of (column name, kind) to read, all columns as strings by default.
+        :param start: byte offset of the first row to read, the row after the header by default.
+        :return: table_reader.TableReader
         """
+        return table_reader.TableReader(table_reader.table_path(self.mimic3_dir, table_name), columns, optional,
+                                        chunk_size, start)
 
-        :param table:
-        :return:
+    def _read_table_rows(self, table_name, columns, optional=(), start=None, reader=None):
         """
-        reader = csv.DictReader(open(os.path.join(self.mimic3_dir, table + '.csv'), 'r'))
-        for i, row in enumerate(reader):
-            yield i, row
-        '''
-        for i in range(0, 330712483):
-            yield i, reader, self
-        '''
-    def read_chart_events_table(self):
+        reads the string columns of a small table in chunks and iterates over its rows. every chunk is checked by the
+        validator before its rows are returned. the watermark of the table is set once all the rows were read. the
+        whole read, including the work of the caller on the rows, is one stage of the profiler.
+        :param columns: snapshot table columns to read.
+        :param start: byte offset of the first row to read.
+        :param reader: table_reader.TableReader (or an object that reads like one) of the string columns, opened by the
+        caller. the table is opened from start by default.
+        :return: generator of (row index, dict csv column -> str)
         """
+        if reader is None:
+            reader = self._open_table(table_name, [(name, 'str') for name, attribute, kind in columns], optional,
+                                      start=start)
+        with self.profiler.stage(table_name), reader:
+            progress = self._progress(table_name, reader)
+            offset = reader.offset
+            for chunk in self.profiler.iterate('parse', reader):
+                with self.profiler.phase('validate'):
+                    self.validator.check(table_name, chunk)
+                for i, row in enumerate(self.profiler.iterate('to_rows', chunk.rows()), chunk.first_row):
+                    yield i, row
+                self.profiler.add_rows(len(chunk))
+                progress.update(len(chunk), chunk.end_offset - offset)
+                offset = chunk.end_offset
+            self._set_watermark(table_name, reader)
+        progress.finish()
+
+    def _progress(self, table_name, reader):
+        """
+        :param reader: table_reader.TableReader of the table, before its first chunk was read.
+        :return: ingest_metrics.ProgressReporter of the read.
+        """
+        total_bytes = None if reader.compressed else os.path.getsize(reader.path) - reader.offset
+        return self.metrics.progress(table_name, total_bytes)
 
+    def _set_watermark(self, table_name, reader):
+        """
+        records that a table was ingested up to the current offset of its reader.
+        :param reader: table_reader.TableReader that read the table to its end.
         :return:
         """
-        table_name = 'CHARTEVENTS'
-        for i, row in self.read_events_table_by_row(table_name):
-            subject_id = int(row['SUBJECT_ID'])
-
-            if subject_id not in self.patients.keys():
-                logging.error("Patient %d doen't exists.", subject_id)
-                raise ValueError("Patient %d doen't exists.", subject_id)
-
-            new_chart_event = event.ChartEvent(row['ITEMID'], row['CHARTTIME'], row['VALUE'], row['VALUENUM'],
-                                               row['VALUEUOM'], row['STORETIME'],row['CGID'], row['WARNING'],
-                                               row['ERROR'], row['RESULTSTATUS'], row['STOPPED'])
-
-            if row['HADM_ID'] == '' or row['ICUSTAY_ID'] == '':
-                self.invalid_rows.append(new_chart_event)
-                logging.warning("event without icu stay id or without adm id. row %d", i)
-                continue
+        offset = os.path.getsize(reader.path) if reader.compressed else reader.offset
+        self.watermarks[table_name] = watermark.take(reader.path, offset)
 
-            self.patients[subject_id].add_event(int(row['HADM_ID']), int(row['ICUSTAY_ID']), new_chart_event)
-
-            if i % 100 == 0:
-                logging.info("Successfully read %d events from CHARTEVENTS.csv", i)
+    def read_events_table_by_row(self, table):
+        """
+        iterates over all the columns of an events table, row by row.
+        :param table: for example 'CHARTEVENTS'.
+        :return: generator of (row index, dict csv column -> str)
+        """
+        with self._open_table(table) as reader:
+            for chunk in reader:
+                for i, row in enumerate(chunk.rows(), chunk.first_row):
+                    yield i, row
 
-        logging.info("DONE reading CHARTEVENTS.csv, total of events are saved in the database")
-        return
+    def read_chart_events_table(self, start=None):
+        """
+        reads the CHARTEVENTS.csv file into the event store in chunks of typed columns, and sets the time series of
+        every icu stay to a view over its events.
+        :param start: byte offset of the first row to read, the whole table by default.
+        :return:
+        """
+        self._read_events_table('CHARTEVENTS', start)
 
-    def read_chart_events_paralell(self):
+    def read_lab_events_table(self, start=None):
+        """
+        reads the LABEVENTS.csv file into the event store. lab events have no ICUSTAY_ID, each one is assigned to the
+        icu stay of its admission that was open at CHARTTIME. labs taken outside of every icu stay are counted and
+        dropped.
+        :param start: byte offset of the first row to read, the whole table by default.
+        :return:
         """
+        self._read_events_table('LABEVENTS', start)
 
+    def read_output_events_table(self, start=None):
+        """
+        reads the OUTPUTEVENTS.csv file into the event store. rows without ICUSTAY_ID are assigned to a stay by
+        HADM_ID and CHARTTIME, as lab events are.
+        :param start: byte offset of the first row to read, the whole table by default.
         :return:
         """
-        table_name = 'CHARTEVENTS'
-        # reader = csv.DictReader(open(os.path.join(self.mimic3_dir, table_name + '.csv'), 'r'))
-        pool = multiprocessing.Pool(4)
-        pool.map(add_event_wrapper, [x for x in self.read_events_table_by_row(table_name)])
+        self._read_events_table('OUTPUTEVENTS', start)
 
-    def save_db_to_pickle(self):
+    def read_table(self, table_name, start=None):
+        """
+        reads any of the tables of TABLE_ORDER.
+        :param table_name: for example 'ICUSTAYS'.
+        :param start: byte offset of the first row to read, the whole table by default.
+        :return:
         """
+        readers = {'PATIENTS': self.read_patients_table, 'ADMISSIONS': self.read_hospital_visits_table,
+                   'ICUSTAYS': self.read_icu_stays_table}
+        if table_name in readers:
+            readers[table_name](start)
+        elif table_name in event_ingest.EVENT_TABLES:
+            self._read_events_table(table_name, start)
+        else:
+            logging.error("unknown table %s", table_name)
+            raise ValueError("unknown table %s" % table_name)
+
+    @contextlib.contextmanager
+    def profile(self, profile_dir=None):
+        """
+        times every table read inside the block as a stage of a profiling.Profiler, with its phases, rows, peak RSS
+        and allocated objects, for example:
+            with db.profile() as profiler:
+                db.read_patients_table()
+            print profiler.format_report()
+        :param profile_dir: directory to write a cProfile pstats file of every stage to, None to only time them.
+        :return: context manager that returns the profiling.Profiler.
+        """
+        disabled, self.profiler = self.profiler, profiling.Profiler(True, profile_dir)
+        try:
+            yield self.profiler
+        finally:
+            self.profiler = disabled
+
+    def ingest(self, tables=TABLE_ORDER, num_workers=None, profile=False, profile_dir=None, external_dir=None,
+               memory_budget=external_ingest.DEFAULT_MEMORY_BUDGET):
+        """
+        reads tables into the database in the order of TABLE_ORDER.
+        :param tables: names of the tables to read.
+        :param num_workers: read the events tables on this many processes, on the main process by default.
+        :param profile: time every table read and log the stage timing report.
+        :param profile_dir: directory to write a cProfile pstats file of every table read to, implies profile.
+        :param external_dir: read the events tables out of core into this directory, see read_events_external.
+        :param memory_budget: bytes the external ingest may use to sort a partition.
+        :return: profiling.Profiler of the ingest, disabled unless profile or profile_dir were given.
+        """
+        unknown = [table_name for table_name in tables if table_name not in TABLE_ORDER]
+        if unknown:
+            logging.error("unknown tables %s", ', '.join(unknown))
+            raise ValueError("unknown tables %s" % ', '.join(unknown))
+        if not (profile or profile_dir):
+            self._ingest(tables, num_workers, external_dir, memory_budget)
+            return self.profiler
+        with self.profile(profile_dir) as profiler:
+            self._ingest(tables, num_workers, external_dir, memory_budget)
+        profiler.log_report()
+        return profiler
+
+    def _ingest(self, tables, num_workers, external_dir, memory_budget):
+        for table_name in TABLE_ORDER:
+            if table_name not in tables:
+                continue
+            if external_dir and table_name in event_ingest.EVENT_TABLES:
+                continue
+            if num_workers and table_name in event_ingest.EVENT_TABLES:
+                self.read_events_table_parallel(table_name, num_workers)
+            else:
+                self.read_table(table_name)
+        if external_dir:
+            event_tables = [table_name for table_name in TABLE_ORDER
+                            if table_name in tables and table_name in event_ingest.EVENT_TABLES]
+            if event_tables:
+                self.read_events_external(external_dir, event_tables, memory_budget)
+
+    def ingest_pipeline(self, tables=TABLE_ORDER, num_workers=None, queue_size=pipeline.DEFAULT_QUEUE_SIZE,
+                        chunk_size=parallel_ingest.DEFAULT_CHUNK_SIZE, compare=False):
+        """
+        reads tables into the database as a pipeline of stages that overlap, instead of one table after another:
+            - the small tables are read and parsed at once, each on its own process (pipeline.TableParser), a bounded
+            queue of chunks ahead of the thread that builds it.
+            - PATIENTS, ADMISSIONS and ICUSTAYS are built in that order (pipeline.DEPENDENCIES), every one while the
+            tables after it are still being parsed.
+            - the events tables are parsed as soon as ICUSTAYS was built and the stay keys are known, all of them on
+            one pool of worker processes, and merged into the event store at once.
+        the database ends up the same as after ingest.
+        :param tables: names of the tables to read.
+        :param num_workers: number of processes that parse the events tables, defaults to the number of cores.
+        :param queue_size: chunks a small table parser may read ahead of its builder.
+        :param chunk_size: approximate size in bytes of the range of an events table a worker parses at a time.
+        :param compare: also time ingest of the same tables into a new database, as the sequential baseline of the
+        report.
+        :return: pipeline.PipelineReport
+        """
+        unknown = [table_name for table_name in tables if table_name not in TABLE_ORDER]
+        if unknown:
+            logging.error("unknown tables %s", ', '.join(unknown))
+            raise ValueError("unknown tables %s" % ', '.join(unknown))
+        builders = [('PATIENTS', self.read_patients_table, snapshot.PATIENT_COLUMNS, ('DOD_HOSP', 'DOD_SSN')),
+                    ('ADMISSIONS', self.read_hospital_visits_table, snapshot.ADMISSION_COLUMNS, ()),
+                    ('ICUSTAYS', self.read_icu_stays_table, snapshot.ICU_STAY_COLUMNS, ())]
+        event_tables = [table_name for table_name in TABLE_ORDER
+                        if table_name in tables and table_name in event_ingest.EVENT_TABLES]
+
+        scheduler = pipeline.Scheduler()
+        parsers = {}
+        try:
+            for table_name, read_table, columns, optional in builders:
+                if table_name not in tables:
+                    continue
+                parsers[table_name] = pipeline.TableParser(
+                    table_reader.table_path(self.mimic3_dir, table_name),
+                    [(name, 'str') for name, attribute, kind in columns], optional, queue_size=queue_size)
+                scheduler.add(table_name, lambda read_table=read_table, parser=parsers[table_name]:
+                              read_table(reader=parser), pipeline.DEPENDENCIES[table_name])
+            if event_tables:
+                scheduler.add('EVENTS', lambda: self._read_events_parallel(event_tables, num_workers, chunk_size),
+                              set(sum([pipeline.DEPENDENCIES[table_name] for table_name in event_tables], ())))
+            report = scheduler.run()
+        finally:
+            for parser in parsers.values():
+                parser.close()
+
+        for table_name, parser in parsers.items():
+            report.stage(table_name).wait_seconds = parser.wait_seconds
+            report.stages.append(pipeline.StageTiming(table_name + ' parse', 0.0, parser.parse_seconds))
+        report.stages.sort(key=lambda timing: timing.start)
+        if compare:
+            baseline = ICUDatabase(self.mimic3_dir, self.validator.level, concept_map=self.concept_map)
+            start = time.time()
+            baseline.ingest(tables, num_workers)
+            report.baseline_seconds = time.time() - start
+        logging.info("Pipeline ingest of %s took %.2f seconds", ', '.join(tables), report.wall_seconds)
+        return report
+
+    def _read_events_table(self, table_name, start=None):
+        """
+        reads an events table into the event store in chunks of typed columns. the events of all tables share the
+        event store, so the time series of an icu stay is a single timeline of its chart, lab and output events.
+        :param table_name: one of event_ingest.EVENT_TABLES.
+        :param start: byte offset of the first row to read.
+        :return:
+        """
+        with self.profiler.stage(table_name):
+            self._read_events_chunks(table_name, start)
+
+    def _read_events_chunks(self, table_name, start=None):
+        columns, add_chunk = event_ingest.EVENT_TABLES[table_name]
+        store = self.event_store
+        builder = event_store.EventStoreBuilder(store.value_dictionary, store.unit_dictionary, store.cgid_dictionary,
+                                                concept_map=self.concept_map)
+        with self.profiler.phase('stay_keys'):
+            stay_keys = self._stay_keys()
+        with self._open_table(table_name, columns, start=start) as reader:
+            progress = self._progress(table_name, reader)
+            offset = reader.offset
+            for chunk in self.profiler.iterate('parse', reader):
+                with self.profiler.phase('check_and_encode'):
+                    status = add_chunk(builder, chunk, stay_keys)
+                self._check_chunk_status(status)
+                self.metrics.count(table_name, status.anomalies, status.bad_rows)
+                self.profiler.add_rows(len(chunk))
+                progress.update(len(chunk), chunk.end_offset - offset)
+                offset = chunk.end_offset
+            self._set_watermark(table_name, reader)
+
+        with self.profiler.phase('sort'):
+            events = builder.build()
+        self.metrics.count(table_name, {ingest_metrics.DUPLICATE_ITEM_AT_TIME: event_ingest.count_duplicates(events)})
+        with self.profiler.phase('merge'):
+            self.add_events(events)
+        progress.finish()
+        self.metrics.log_summary(table_name)
+        logging.info("DONE reading %s.csv, total of %d events are saved in the database", table_name,
+                     len(self.event_store))
+        return
 
+    def read_events_external(self, work_dir, tables=('CHARTEVENTS',),
+                             memory_budget=external_ingest.DEFAULT_MEMORY_BUDGET, num_partitions=None):
+        """
+        reads events tables that don't fit in memory. a first pass streams the tables in chunks and spills the valid
+        events to partition files in work_dir by range of ICUSTAY_ID. a second pass sorts every partition on its own
+        and writes it to column files in work_dir/events, the layout of the events of a snapshot. the event store is
+        then memory mapped from those files, so only one chunk or one partition is in memory at a time. events
+        already in the event store are spilled and merged with the new ones.
+        :param work_dir: directory of the partitions and of the sorted event columns. it must stay as long as the
+        database uses the events, save_snapshot copies them out of it.
+        :param tables: names of event_ingest.EVENT_TABLES to read.
+        :param memory_budget: bytes a partition may use while it is sorted, sets the number of partitions.
+        :param num_partitions: number of partitions, estimated from the size of the tables and memory_budget by
+        default.
         :return:
         """
-        file_to_store = open('store.pckl', 'wb')
-        pickle.dump(self, file_to_store)
-        f.close()
+        with self.profiler.stage('external'):
+            self._read_events_external(work_dir, tables, memory_budget, num_partitions)
+
+    def _read_events_external(self, work_dir, tables, memory_budget, num_partitions):
+        paths = [table_reader.table_path(self.mimic3_dir, table_name) for table_name in tables]
+        with self.profiler.phase('stay_keys'):
+            stay_keys = self._stay_keys()
+        if num_partitions is None:
+            num_partitions = external_ingest.num_of_partitions(paths, memory_budget, len(self.event_store))
+        logging.info("Spilling %s to %d partitions in %s", ', '.join(tables), num_partitions, work_dir)
+        store = self.event_store
+        partitions_dir = os.path.join(work_dir, 'partitions')
+        with external_ingest.PartitionWriter(partitions_dir, external_ingest.partition_boundaries(
+                stay_keys.stay_ids, num_partitions)) as writer:
+            with self.profiler.phase('spill'):
+                writer.write_store(store, table_reader.DEFAULT_CHUNK_SIZE)
+            progress_reports = []
+            for table_name in tables:
+                columns, add_chunk = event_ingest.EVENT_TABLES[table_name]
+                with self._open_table(table_name, columns) as reader:
+                    progress = self._progress(table_name, reader)
+                    offset = reader.offset
+                    for chunk in self.profiler.iterate('parse', reader):
+                        builder = event_store.EventStoreBuilder(store.value_dictionary, store.unit_dictionary,
+                                                                store.cgid_dictionary, capacity=len(chunk),
+                                                                concept_map=self.concept_map)
+                        with self.profiler.phase('check_and_encode'):
+                            status = add_chunk(builder, chunk, stay_keys)
+                        self._check_chunk_status(status)
+                        self.metrics.count(table_name, status.anomalies, status.bad_rows)
+                        with self.profiler.phase('spill'):
+                            writer.write(builder.columns())
+                        self.profiler.add_rows(len(chunk))
+                        progress.update(len(chunk), chunk.end_offset - offset)
+                        offset = chunk.end_offset
+                    self._set_watermark(table_name, reader)
+                progress_reports.append(progress)
+
+        with self.profiler.phase('sort'):
+            self.event_store, duplicates = external_ingest.sort_partitions(
+                writer, os.path.join(work_dir, 'events'), store.value_dictionary, store.unit_dictionary,
+                store.cgid_dictionary, memory_budget)
+        os.rmdir(partitions_dir)
+        self._index = None
+        self._attach_events()
+        for table_name, progress in zip(tables, progress_reports):
+            self.metrics.count(table_name, {ingest_metrics.DUPLICATE_ITEM_AT_TIME: duplicates.get(
+                external_ingest.TABLE_SOURCES[table_name], 0)})
+            progress.finish()
+            self.metrics.log_summary(table_name)
+        logging.info("DONE reading %s out of core, total of %d events are saved in the database", ', '.join(tables),
+                     len(self.event_store))
 
     @staticmethod
-    def load_db_from_pickle():
+    def _check_chunk_status(status):
         """
-
+        raises on events of patients that are not in the database. the other anomalies of the chunk are only counted.
+        :param status: event_ingest.ChunkStatus or parallel_ingest.ChunkResult
         :return:
         """
-        file_to_load = open('store.pckl', 'rb')
-        db_load = pickle.load(file_to_load)
-        f.close()
-        return db_load
-
+        if status.unknown_subjects:
+            logging.error("Patient %d doen't exists.", status.unknown_subjects[0])
+            raise ValueError("Patient %d doen't exists." % status.unknown_subjects[0])
 
-def add_event(x):
-    """
-    :param x:
-    :param database:
-    :return:
-    """
-    i, reader, database = x
-    subject_id = int(reader[i]['SUBJECT_ID'])
+    def _stay_keys(self):
+        """
+        :return: event_ingest.StayKeys of the patients and icu stays in the database.
+        """
+        stays = []
+        for subject_id, patient_info in self.patients.items():
+            for hadm_id, visit in patient_info.hospital_visits.items():
+                for icu_stay_id, stay in visit.icu_stays.items():
+                    stays.append((icu_stay_id, subject_id, hadm_id, utils.date_time_to_epoch(stay.in_time),
+                                  utils.date_time_to_epoch(stay.out_time)))
+        return event_ingest.StayKeys(self.patients.keys(), stays, self.validator.enabled)
+
+    def add_events(self, *new_stores):
+        """
+        merges new events into the event store and points the time series of every icu stay at the merged store.
+        :param new_stores: event_store.EventStore objects.
+        :return:
+        """
+        if len(self.event_store) == 0 and len(new_stores) == 1:
+            self.event_store = new_stores[0]
+        else:
+            self.event_store = event_store.EventStore.concatenate([self.event_store] + list(new_stores))
+        self._index = None
+        self._attach_events()
+
+    def _attach_events(self):
+        """
+        points the time series of every icu stay at its slice of the event store.
+        :return:
+        """
+        for icu_stay_id, stay in self.icu_stays.items():
+            stay.set_events(self.event_store.stay_events(icu_stay_id, shared=True))
 
-    if subject_id not in database.patients.keys():
-        logging.error("Patient %d doen't exists.", subject_id)
-        raise ValueError("Patient %d doen't exists.", subject_id)
+    def read_chart_events_parallel(self, num_workers=None, chunk_size=parallel_ingest.DEFAULT_CHUNK_SIZE):
+        """
+        reads the CHARTEVENTS.csv file on several processes. the file is split into line aligned byte ranges, every
+        worker parses its ranges into partial event stores grouped by icu stay, and the partial stores are merged
+        into the database.
+        :param num_workers: number of worker processes, defaults to the number of cores.
+        :param chunk_size: approximate size in bytes of the range each worker parses at a time.
+        :return:
+        """
+        self.read_events_table_parallel('CHARTEVENTS', num_workers, chunk_size)
 
-    new_chart_event = event.ChartEvent(reader[i]['ITEMID'], reader[i]['CHARTTIME'], reader[i]['VALUE'],
-                                       reader[i]['VALUENUM'],
-                                       reader[i]['VALUEUOM'], reader[i]['STORETIME'], reader[i]['CGID'], reader[i]['WARNING'],
-                                       reader[i]['ERROR'], reader[i]['RESULTSTATUS'], reader[i]['STOPPED'])
+    def read_events_table_parallel(self, table_name, num_workers=None, chunk_size=parallel_ingest.DEFAULT_CHUNK_SIZE):
+        """
+        reads an events table on several processes, see read_chart_events_parallel.
+        :param table_name: one of event_ingest.EVENT_TABLES.
+        :param num_workers: number of worker processes, defaults to the number of cores.
+        :param chunk_size: approximate size in bytes of the range each worker parses at a time.
+        :return:
+        """
+        with self.profiler.stage(table_name):
+            self._read_events_parallel([table_name], num_workers, chunk_size)
 
-    if reader[i]['HADM_ID'] == '' or reader[i]['ICUSTAY_ID'] == '':
-        # database.invalid_rows.append(new_chart_event)
-        logging.warning("event without icu stay id or without adm id. row %d", i)
+    def _read_events_parallel(self, table_names, num_workers, chunk_size):
+        """
+        parses events tables on one pool of worker processes and merges all their partial stores into the database at
+        once.
+        :param table_names: names of event_ingest.EVENT_TABLES.
+        """
+        tables = []
+        progress = {}
+        for table_name in table_names:
+            path = table_reader.table_path(self.mimic3_dir, table_name)
+            # rows appended while the table is read are left for the next update.
+            end = os.path.getsize(path)
+            tables.append((table_name, path, end))
+            progress[table_name] = self.metrics.progress(table_name, None if path.endswith('.gz') else end)
+        partial_stores = []
+        with self.profiler.phase('stay_keys'):
+            stay_keys = self._stay_keys()
+        results = parallel_ingest.read_tables_parallel(tables, stay_keys, num_workers, chunk_size,
+                                                       self.concept_map)
+        # the workers parse, check and sort the chunks, the main process only waits for them.
+        for result in self.profiler.iterate('workers', results):
+            self._check_chunk_status(result)
+            self.metrics.count(result.table_name, result.anomalies, result.bad_rows)
+            partial_stores.append(result.events)
+            self.profiler.add_rows(result.num_of_rows)
+            progress[result.table_name].update(result.num_of_rows, result.num_of_bytes)
+
+        if partial_stores:
+            with self.profiler.phase('merge'):
+                self.add_events(*partial_stores)
+        for table_name, path, end in tables:
+            self.watermarks[table_name] = watermark.take(path, end)
+            progress[table_name].finish()
+            self.metrics.log_summary(table_name)
+        logging.info("DONE reading %s, total of %d events are saved in the database",
+                     ', '.join('%s.csv' % table_name for table_name in table_names), len(self.event_store))
         return
 
-    database.patients[subject_id].add_event(int(reader[i]['HADM_ID']), int(reader[i]['ICUSTAY_ID']), new_chart_event)
-
-    if i % 100 == 0:
-        logging.info("Successfully read %d events from CHARTEVENTS.csv", i)
-
-
-def add_event_wrapper(args):
-    return add_event(*args)
+    @property
+    def invalid_rows(self):
+        """
+        :return: the sampled event rows without HADM_ID or ICUSTAY_ID, bounded by the metrics. empty when the sample
+        is written to a bad rows file.
+        """
+        rows = self.metrics.bad_rows.rows
+        return rows[ingest_metrics.MISSING_HADM_ID] + rows[ingest_metrics.MISSING_ICUSTAY_ID]
 
+    def table_arrays(self):
+        """
+        the patients, admissions and icu stays as columns, read from the snapshot the database was opened from or
+        extracted from the object graph.
+        :return: dict table name ('patients', 'admissions', 'icu_stays') -> dict csv column -> numpy array, times in
+        seconds since epoch.
+        """
+        if self._snapshot is not None:
+            return self._snapshot.tables
+        return dict((table_name, dict(columns)) for table_name, columns in snapshot.table_columns(self).items())
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._items = d_items.ItemDictionary.load(self.mimic3_dir)
+        return self._items
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = cohort_index.CohortIndex(self.table_arrays(), self.event_store)
+        return self._index
+
+    def outcome_labels(self, los_days=labels.DEFAULT_LOS_DAYS, readmission_days=labels.DEFAULT_READMISSION_DAYS,
+                       mortality_days=labels.DEFAULT_MORTALITY_DAYS):
+        """
+        computes the outcome labels (mortality, length of stay, readmission) of all the icu stays at once, see
+        labels.compute.
+        :return: labels.LabelTable keyed by ICUSTAY_ID.
+        """
+        return labels.compute(self.table_arrays(), los_days, readmission_days, mortality_days)
 
-if __name__ == "__main__":
-    logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.DEBUG)
-    data_files_dir = os.path.join('/', 'Users', 'tomer.golany', 'MIMIC_REPO', 'csv_files')
-    demo_files_dir = os.path.join('/', 'Users', 'tomer.golany', 'PycharmProjects', 'MIMIC', 'demo_files')
+    def compute_stay_summaries(self):
+        """
+        computes the summary statistics of all the icu stays in one vectorized pass over the event store (see
+        stay_summary.summarize_store) and caches them on the icu stays, instead of one pass per stay on first use.
+        the stays of an opened snapshot are built lazily, so only the returned dict holds their summaries.
+        :return: dict icu_stay_id -> stay_summary.StaySummary, stays without events get an empty summary.
+        """
+        summaries = stay_summary.summarize_store(self.event_store)
+        if self._snapshot is not None:
+            return summaries
+        for icu_stay_id, stay in self.icu_stays.items():
+            summary = summaries.get(icu_stay_id)
+            if summary is None:
+                summary = summaries[icu_stay_id] = stay_summary.StaySummary.empty()
+            stay.set_summary(summary)
+        return summaries
+
+    def cohort(self):
+        """
+        starts a cohort query over all the icu stays, for example:
+            db.cohort().care_unit('MICU').admission_type('EMERGENCY').with_item(211, min_duration=24 * 3600)
+        :return: cohort_index.CohortQuery
+        """
+        return self.index.query()
 
-    db = ICUDatabase(demo_files_dir)
-    db.read_patients_table()
-    db.read_hospital_visits_table()
-    db.read_icu_stays_table()
-    db.read_chart_events_table()
-    # db.read_chart_events_paralell()
+    def save_snapshot(self, path, overwrite=False):
+        """
+        saves the database to a versioned snapshot directory: the event store columns plus small tables of the
+        patients, admissions and icu stays. see snapshot.py for the layout.
+        :param path: snapshot directory.
+        :param overwrite: replace an existing snapshot at path.
+        :return:
+        """
+        snapshot.save(self, path, overwrite)
 
-    d1 = { k: v for k, v in db.patients.iteritems() if v.num_of_hospital_visits > 1 }
-    d2 = {k: v for k, v in db.patients.iteritems() if v.num_of_hospital_visits < v.total_num_of_icu_stays}
+    @staticmethod
+    def load_snapshot(path):
+        """
+        loads a database saved by save_snapshot. the event columns are memory mapped, so loading doesn't read the
+        events into memory.
+        :param path: snapshot directory.
+        :return: ICUDatabase
+        """
+        loaded = snapshot.load(path)
+        db = ICUDatabase(loaded.meta['mimic3_dir'], concept_map=loaded.concept_map())
+        for row in loaded.rows('patients'):
+            db._add_patient(row)
+        for row in loaded.rows('admissions'):
+            db._add_hospital_visit(row)
+        for row in loaded.rows('icu_stays'):
+            db._add_icu_stay(row)
+        db.event_store = loaded.events
+        db.watermarks = loaded.meta.get('watermarks', {})
+        db._attach_events()
+        logging.info("Loaded snapshot %s with %d patients and %d events", path, db.num_of_patients,
+                     len(db.event_store))
+        return db
 
-    print "DONE"
\ No newline at end of file
+    @staticmethod
+    def open_snapshot(path, cache_size=lazy_patients.DEFAULT_CACHE_SIZE):
+        """
+        opens a snapshot without building the object graph. patients and icu_stays become read only dicts that
+        build a patient, with its visits and stays, from the memory mapped tables only when it is accessed, and keep
+        the last cache_size patients in an LRU cache. opening only maps the snapshot files, so it takes the same
+        time for any size of dataset.
+        :param path: snapshot directory written by save_snapshot.
+        :param cache_size: number of materialized patients to keep in memory.
+        :return: ICUDatabase
+        """
+        loaded = snapshot.load(path)
+        db = ICUDatabase(loaded.meta['mimic3_dir'], concept_map=loaded.concept_map())
+        db.patients = lazy_patients.LazyPatients(loaded, cache_size)
+        db.icu_stays = lazy_patients.LazyIcuStays(db.patients, loaded)
+        db.num_of_patients = loaded.meta['tables']['patients']
+        db.total_number_of_hospital_visits = loaded.meta['tables']['admissions']
+        db.event_store = loaded.events
+        db.watermarks = loaded.meta.get('watermarks', {})
+        db._snapshot = loaded
+        return db
+
+    def update(self, snapshot_path):
+        """
+        ingests only the rows appended to the csv files since their watermarks, and writes the snapshot again. if
+        any of the ingested files was rewritten rather than appended, all of the ingested tables are read again from
+        scratch. tables that were never ingested are skipped.
+        :param snapshot_path: snapshot directory to write, usually the one the database was loaded from with
+        load_snapshot (a database opened with open_snapshot can't be updated).
+        :return: the updated ICUDatabase - this database, or a new one if it was rebuilt.
+        """
+        tables = [table_name for table_name in TABLE_ORDER if table_name in self.watermarks]
+        changes = dict((table_name, watermark.check(table_reader.table_path(self.mimic3_dir, table_name),
+                                                    self.watermarks[table_name])) for table_name in tables)
+        if watermark.REWRITTEN in changes.values():
+            rewritten = [table_name for table_name in tables if changes[table_name] == watermark.REWRITTEN]
+            logging.warning("%s were rewritten, rebuilding the database", ', '.join(rewritten))
+            rebuilt = ICUDatabase(self.mimic3_dir, self.validator.level, self.metrics.bad_rows.path, self.concept_map)
+            for table_name in tables:
+                rebuilt.read_table(table_name)
+            rebuilt.save_snapshot(snapshot_path, overwrite=True)
+            return rebuilt
+
+        appended = [table_name for table_name in tables if changes[table_name] == watermark.APPENDED]
+        for table_name in appended:
+            logging.info("Reading the rows appended to %s", table_name)
+            self.read_table(table_name, self.watermarks[table_name]['offset'])
+        if appended:
+            self.save_snapshot(snapshot_path, overwrite=True)
+        return self
@@ -1,6 +1,13 @@
 import utils
 import logging
 
+# the tables events come from, stored in the source column of the event store.
+CHART_EVENT = 0
+LAB_EVENT = 1
+OUTPUT_EVENT = 2
+
+NAN = float('nan')
+
 class Event(object):
     """
     class event is a base class which implements an object which describes a data event of a patient in the icu
@@ -23,20 +30,31 @@ class Event(object):
 
 
     """
+    __slots__ = ('item_id', 'chart_time', '_value', 'value_num', 'value_unit')
+
     def __init__(self, item_id, chart_time, value, value_num, value_unit_of_measurement):
         self.item_id = int(item_id)
         self.chart_time = utils.convert_to_date_time_object(chart_time)
-        self.value = value
+        self._value = value
+        # VALUENUM is NaN where it is null, like in the value_num column of the event store.
+        self.value_num = float(value_num) if value_num != "" else NAN
         if Event.is_number_repl_isdigit(value):
-            self.value = float(value)
             if value_num == "":
-                logging.warning("Value is numeric but valunum in empty. value: %d", value)
-                self.value_num = value_num
-            else:
-                self.value_num = float(value_num)
-                assert value_num == value
+                logging.warning("Value is numeric but valunum in empty. value: %s", value)
+            number = float(value)
+            # a numeric VALUE that equals VALUENUM ('80' and '80.00') is derived instead of stored.
+            self._value = None if number == self.value_num else number
+
+        self.value_unit = utils.intern_string(value_unit_of_measurement)
 
-        self.value_unit = value_unit_of_measurement
+    @property
+    def value(self):
+        """
+        VALUE of the event, a float if it is numeric.
+        """
+        if self._value is None:
+            return self.value_num
+        return self._value
 
     @staticmethod
     def is_number_repl_isdigit(s):
@@ -66,12 +84,60 @@ class ChartEvent(Event):
              'Automatic').
             - STOPPED: whether the measurement was stopped.
     """
+    __slots__ = ('store_time', 'cgid', 'warning', 'error', 'result_status', 'stopped')
+    event_type = CHART_EVENT
+
     def __init__(self, item_id, chart_time, value, value_num, value_unit_of_measurement, store_time, cgid, warning,
                  error, result_status, stopped):
         Event.__init__(self, item_id, chart_time, value, value_num, value_unit_of_measurement)
         self.store_time = utils.convert_to_date_time_object(store_time)
-        self.cgid = cgid
-        self.warning = warning
-        self.error = error
-        self.result_status = result_status
-        self.stopped = stopped
+        self.cgid = utils.intern_string(cgid)
+        self.warning = utils.intern_string(warning)
+        self.error = utils.intern_string(error)
+        self.result_status = utils.intern_string(result_status)
+        self.stopped = utils.intern_string(stopped)
+
+
+class LabEvent(Event):
+    """
+    class implements lab events: LABEVENTS contains all laboratory measurements for a given patient, including out
+    patient data. lab events have no ICUSTAY_ID, they are assigned to the icu stay of their admission whose
+    INTIME/OUTTIME window contains the CHARTTIME. lab items are described in D_LABITEMS.
+
+        Attributes:
+            - All event attributes are derived.
+            - FLAG: indicates whether the laboratory value is considered abnormal ('abnormal', 'delta' or empty).
+    """
+    __slots__ = ('flag',)
+    event_type = LAB_EVENT
+
+    def __init__(self, item_id, chart_time, value, value_num, value_unit_of_measurement, flag):
+        Event.__init__(self, item_id, chart_time, value, value_num, value_unit_of_measurement)
+        self.flag = utils.intern_string(flag)
+
+
+class OutputEvent(Event):
+    """
+    class implements output events: OUTPUTEVENTS contains the fluids which have either been excreted by the patient,
+    such as urine output, or extracted from the patient, for example through a drain. VALUE is always numeric, so
+    VALUENUM is taken from it.
+
+        Attributes:
+            - All event attributes are derived.
+            - STORETIME: records the time at which the observation was manually input or validated.
+            - CGID: the identifier for the caregiver who validated the given measurement.
+            - STOPPED: whether the measurement was stopped.
+            - NEWBOTTLE: indicates that a new bag of solution was hung.
+            - ISERROR: a Metavision flag marking that the observation was an error.
+    """
+    __slots__ = ('store_time', 'cgid', 'stopped', 'new_bottle', 'is_error')
+    event_type = OUTPUT_EVENT
+
+    def __init__(self, item_id, chart_time, value, value_unit_of_measurement, store_time, cgid, stopped, new_bottle,
+                 is_error):
+        Event.__init__(self, item_id, chart_time, value, value, value_unit_of_measurement)
+        self.store_time = utils.convert_to_date_time_object(store_time)
+        self.cgid = utils.intern_string(cgid)
+        self.stopped = utils.intern_string(stopped)
+        self.new_bottle = utils.intern_string(new_bottle)
+        self.is_error = utils.intern_string(is_error)
@@ -0,0 +1,200 @@
+import numpy as np
+import event
+import ingest_metrics
+import interval_index
+import table_reader
+import utils
+
+# columns of the events tables that are kept in the event store, with the kind they are converted to.
+CHART_EVENT_COLUMNS = (('SUBJECT_ID', 'int'), ('HADM_ID', 'int'), ('ICUSTAY_ID', 'int'), ('ITEMID', 'int'),
+                       ('CHARTTIME', 'time'), ('VALUE', 'str'), ('VALUENUM', 'float'), ('VALUEUOM', 'str'),
+                       ('CGID', 'str'))
+LAB_EVENT_COLUMNS = (('SUBJECT_ID', 'int'), ('HADM_ID', 'int'), ('ITEMID', 'int'), ('CHARTTIME', 'time'),
+                     ('VALUE', 'str'), ('VALUENUM', 'float'), ('VALUEUOM', 'str'))
+# VALUE of OUTPUTEVENTS is numeric, it is read as a float and stored as VALUENUM.
+OUTPUT_EVENT_COLUMNS = (('SUBJECT_ID', 'int'), ('HADM_ID', 'int'), ('ICUSTAY_ID', 'int'), ('ITEMID', 'int'),
+                        ('CHARTTIME', 'time'), ('VALUE', 'float'), ('VALUEUOM', 'str'), ('CGID', 'str'))
+
+# number of bad rows of every anomaly type a chunk returns as dicts, the rest are only counted.
+MAX_BAD_ROWS_PER_CHUNK = ingest_metrics.DEFAULT_MAX_BAD_ROWS
+
+
+class StayKeys(object):
+    """
+    The ids of the patients and icu stays of a database as sorted arrays, used to check whole chunks of event rows
+    at once instead of looking every row up in the patients dicts.
+    """
+    def __init__(self, subject_ids, stays, validate=True):
+        """
+        :param subject_ids: ids of all the patients in the database.
+        :param stays: list of (icu_stay_id, subject_id, hadm_id, in_time, out_time) of all the icu stays in the
+        database, times in seconds since epoch.
+        :param validate: check that events belong to known patients and to stays of their admission. without it every
+        event that has a stay id is kept. the check runs on every row, the 'sampled' validation level of the database
+        checks the events tables like 'strict' since the check decides which events are kept.
+        """
+        self.validate = validate
+        self.subject_ids = np.array(sorted(subject_ids), dtype=np.int64)
+        stays = sorted(stays)
+        columns = [np.array(values, dtype=np.int64) for values in zip(*stays)] or [np.empty(0, dtype=np.int64)] * 5
+        self.stay_ids, self.stay_subject_ids, self.stay_hadm_ids, in_times, out_times = columns
+        self.intervals = interval_index.StayIntervalIndex(self.stay_hadm_ids, self.stay_ids, in_times, out_times)
+
+    def known_subjects(self, subject_id):
+        """
+        :param subject_id: int64 array.
+        :return: bool array, True where the patient is in the database.
+        """
+        return np.in1d(subject_id, self.subject_ids)
+
+    def stay_matches(self, subject_id, hadm_id, icu_stay_id):
+        """
+        :return: bool array, True where the icu stay is in the database and belongs to the subject and admission.
+        """
+        if len(self.stay_ids) == 0:
+            return np.zeros(len(icu_stay_id), dtype=bool)
+        position = np.minimum(np.searchsorted(self.stay_ids, icu_stay_id), len(self.stay_ids) - 1)
+        return ((self.stay_ids[position] == icu_stay_id) & (self.stay_subject_ids[position] == subject_id) &
+                (self.stay_hadm_ids[position] == hadm_id))
+
+
+class ChunkStatus(object):
+    """
+    What happened to the rows of a chunk of events.
+
+        Attributes:
+            - anomalies: dict ingest_metrics anomaly type -> number of rows of the chunk that have it.
+            - bad_rows: dict anomaly type -> up to MAX_BAD_ROWS_PER_CHUNK of the rows that have it, as dicts.
+            - unknown_subjects: SUBJECT_IDs of the chunk that are not in the database.
+    """
+    def __init__(self, anomalies, bad_rows, unknown_subjects):
+        self.anomalies = anomalies
+        self.bad_rows = bad_rows
+        self.unknown_subjects = unknown_subjects
+
+
+def _bad_rows(chunk, rows):
+    """
+    :param rows: bool array of the bad rows of the chunk.
+    :return: list of the first MAX_BAD_ROWS_PER_CHUNK bad rows as dicts.
+    """
+    return list(chunk.rows(np.flatnonzero(rows)[:MAX_BAD_ROWS_PER_CHUNK]))
+
+
+def _numeric_without_valuenum(value, value_num):
+    """
+    :param value: str VALUE column.
+    :param value_num: float VALUENUM column.
+    :return: bool array, True where VALUE is a number but VALUENUM is empty.
+    """
+    numeric = np.isnan(value_num) & (value != '')
+    candidates = np.flatnonzero(numeric)
+    if len(candidates):
+        digits = np.char.replace(np.char.lstrip(np.char.strip(value[candidates]), '-'), '.', '', 1)
+        numeric[candidates] = np.char.isdigit(digits)
+    return numeric
+
+
+def count_duplicates(store):
+    """
+    counts the events that have the same icu stay, CHARTTIME and ITEMID as the event before them. events without
+    CHARTTIME are not counted.
+    :param store: event_store.EventStore, sorted by (icu stay, time, item).
+    :return: int
+    """
+    if len(store) < 2:
+        return 0
+    same = ((store.icu_stay_id[1:] == store.icu_stay_id[:-1]) & (store.chart_time[1:] == store.chart_time[:-1]) &
+            (store.item_id[1:] == store.item_id[:-1]) & (store.chart_time[1:] != utils.MISSING_TIME))
+    return int(np.count_nonzero(same))
+
+
+def _add_events(builder, chunk, stay_keys, icu_stay_id, value, value_num, cgid, source, missing_stay_anomaly):
+    """
+    keeps the events of a chunk whose icu stay belongs to their subject and admission, and appends them to the
+    builder. the anomalies of the chunk are counted with numpy masks, and a bounded sample of their rows is kept.
+    :param icu_stay_id: int64 ICUSTAY_ID of the rows, table_reader.MISSING_ID where the row has none.
+    :param missing_stay_anomaly: anomaly type of the rows of a known admission that have no icu stay.
+    :return: ChunkStatus
+    """
+    subject_id = chunk['SUBJECT_ID']
+    missing_hadm = chunk['HADM_ID'] == table_reader.MISSING_ID
+    missing_stay = ~missing_hadm & (icu_stay_id == table_reader.MISSING_ID)
+    numeric = _numeric_without_valuenum(value, value_num)
+    anomalies = {ingest_metrics.MISSING_HADM_ID: int(np.count_nonzero(missing_hadm)),
+                 missing_stay_anomaly: int(np.count_nonzero(missing_stay)),
+                 ingest_metrics.NUMERIC_VALUE_WITHOUT_VALUENUM: int(np.count_nonzero(numeric))}
+    bad_rows = {}
+    for anomaly, rows in ((ingest_metrics.MISSING_HADM_ID, missing_hadm), (missing_stay_anomaly, missing_stay),
+                          (ingest_metrics.NUMERIC_VALUE_WITHOUT_VALUENUM, numeric)):
+        if anomalies[anomaly]:
+            bad_rows[anomaly] = _bad_rows(chunk, rows)
+
+    if not stay_keys.validate:
+        keep = np.flatnonzero(~missing_hadm & ~missing_stay)
+        builder.extend_columns(icu_stay_id[keep], chunk['ITEMID'][keep], chunk['CHARTTIME'][keep], value[keep],
+                               value_num[keep], chunk['VALUEUOM'][keep], cgid[keep], source)
+        return ChunkStatus(anomalies, bad_rows, [])
+
+    unknown = ~stay_keys.known_subjects(subject_id)
+    valid = np.flatnonzero(~unknown & ~missing_hadm & ~missing_stay)
+    matches = stay_keys.stay_matches(subject_id[valid], chunk['HADM_ID'][valid], icu_stay_id[valid])
+    keep = valid[matches]
+    builder.extend_columns(icu_stay_id[keep], chunk['ITEMID'][keep], chunk['CHARTTIME'][keep], value[keep],
+                           value_num[keep], chunk['VALUEUOM'][keep], cgid[keep], source)
+    foreign = valid[~matches]
+    anomalies[ingest_metrics.UNKNOWN_ICU_STAY] = len(foreign)
+    if len(foreign):
+        bad_rows[ingest_metrics.UNKNOWN_ICU_STAY] = list(chunk.rows(foreign[:MAX_BAD_ROWS_PER_CHUNK]))
+    return ChunkStatus(anomalies, bad_rows, np.unique(subject_id[unknown]).tolist())
+
+
+def add_chart_event_chunk(builder, chunk, stay_keys):
+    """
+    checks a chunk of CHARTEVENTS.csv against the icu stays of the database and appends the valid events to an event
+    store builder.
+    :param builder: event_store.EventStoreBuilder
+    :param chunk: table_reader.Chunk with the CHART_EVENT_COLUMNS.
+    :param stay_keys: StayKeys of the database.
+    :return: ChunkStatus
+    """
+    return _add_events(builder, chunk, stay_keys, chunk['ICUSTAY_ID'], chunk['VALUE'], chunk['VALUENUM'],
+                       chunk['CGID'], event.CHART_EVENT, ingest_metrics.MISSING_ICUSTAY_ID)
+
+
+def add_lab_event_chunk(builder, chunk, stay_keys):
+    """
+    assigns a chunk of LABEVENTS.csv to icu stays by HADM_ID and the INTIME/OUTTIME window of the stays, and appends
+    the assigned events to an event store builder. labs outside of every icu stay are counted as OUTSIDE_ICU_STAYS.
+    :param builder: event_store.EventStoreBuilder
+    :param chunk: table_reader.Chunk with the LAB_EVENT_COLUMNS.
+    :param stay_keys: StayKeys of the database.
+    :return: ChunkStatus
+    """
+    icu_stay_id = stay_keys.intervals.assign(chunk['HADM_ID'], chunk['CHARTTIME'])
+    no_cgid = np.zeros(len(chunk), dtype='S1')
+    return _add_events(builder, chunk, stay_keys, icu_stay_id, chunk['VALUE'], chunk['VALUENUM'], no_cgid,
+                       event.LAB_EVENT, ingest_metrics.OUTSIDE_ICU_STAYS)
+
+
+def add_output_event_chunk(builder, chunk, stay_keys):
+    """
+    checks a chunk of OUTPUTEVENTS.csv against the icu stays of the database and appends the valid events to an
+    event store builder. rows without ICUSTAY_ID are assigned to a stay by HADM_ID and CHARTTIME.
+    :param builder: event_store.EventStoreBuilder
+    :param chunk: table_reader.Chunk with the OUTPUT_EVENT_COLUMNS.
+    :param stay_keys: StayKeys of the database.
+    :return: ChunkStatus
+    """
+    icu_stay_id = chunk['ICUSTAY_ID'].copy()
+    missing = icu_stay_id == table_reader.MISSING_ID
+    icu_stay_id[missing] = stay_keys.intervals.assign(chunk['HADM_ID'][missing], chunk['CHARTTIME'][missing])
+    no_value = np.zeros(len(chunk), dtype='S1')
+    return _add_events(builder, chunk, stay_keys, icu_stay_id, no_value, chunk['VALUE'], chunk['CGID'],
+                       event.OUTPUT_EVENT, ingest_metrics.OUTSIDE_ICU_STAYS)
+
+
+# table name -> (columns to read, function that adds a chunk of the table to an event store builder)
+EVENT_TABLES = {'CHARTEVENTS': (CHART_EVENT_COLUMNS, add_chart_event_chunk),
+                'LABEVENTS': (LAB_EVENT_COLUMNS, add_lab_event_chunk),
+                'OUTPUTEVENTS': (OUTPUT_EVENT_COLUMNS, add_output_event_chunk)}
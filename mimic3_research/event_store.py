@@ -0,0 +1,607 @@
+import bisect
+import collections
+import logging
+import numbers
+import numpy as np
+import event
+import utils
+
+
+EventRow = collections.namedtuple('EventRow', ['item_id', 'chart_time', 'value', 'value_num', 'value_unit', 'cgid',
+                                               'source'])
+
+
+class StringDictionary(object):
+    """
+    Dictionary encoding of a low cardinality string column (VALUE, VALUEUOM, CGID). every distinct string gets a
+    small integer code, code 0 is reserved for the empty string.
+
+        Attributes:
+            - values: list of the distinct strings, indexed by their code.
+    """
+    def __init__(self, values=None):
+        self._values = ['']
+        self._mapped = None
+        self._codes = {'': 0}
+        if values is not None:
+            for value in values:
+                self.encode(value)
+
+    @staticmethod
+    def from_values(values):
+        """
+        :param values: distinct strings ordered by code, starting with ''. either a list, or a numpy string array (for
+        example memory mapped from a snapshot) that is decoded one code at a time and turned into a list only when
+        values or encode are used. the reverse lookup used by encode is built only when it is first needed, so
+        decode-only dictionaries open fast.
+        :return: StringDictionary
+        """
+        dictionary = StringDictionary()
+        if isinstance(values, np.ndarray):
+            dictionary._values = None
+            dictionary._mapped = values
+        else:
+            dictionary._values = values
+        dictionary._codes = None
+        return dictionary
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = self._mapped.tolist()
+            self._mapped = None
+        return self._values
+
+    def encode(self, value):
+        """
+        returns the code of a string, adds it to the dictionary if it wasn't seen before.
+        :param value: string to encode.
+        :return: int code.
+        """
+        if self._codes is None:
+            self._codes = dict((string, code) for code, string in enumerate(self.values))
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def encode_array(self, strings):
+        """
+        encodes a whole column of strings.
+        :param strings: numpy array of strings.
+        :return: int32 numpy array of codes.
+        """
+        uniques, inverse = np.unique(strings, return_inverse=True)
+        codes = np.array([self.encode(value) for value in uniques.tolist()], dtype=np.int32)
+        return codes[inverse]
+
+    def decode(self, code):
+        """
+        :param code: int code.
+        :return: the string of the code.
+        """
+        if self._values is None:
+            return str(self._mapped[code])
+        return self._values[code]
+
+    def array(self):
+        """
+        :return: numpy string array of the values indexed by their code, to decode whole columns of codes at once.
+        """
+        if self._values is None:
+            return self._mapped
+        return np.array(self._values, dtype='S')
+
+    def __len__(self):
+        if self._values is None:
+            return len(self._mapped)
+        return len(self._values)
+
+
+class _Column(object):
+    """Growable contiguous numpy buffer used while events are still being appended."""
+    def __init__(self, dtype, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def _reserve(self, size):
+        if size > len(self._data):
+            data = np.empty(max(size, 2 * len(self._data)), dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def append(self, value):
+        self._reserve(self._size + 1)
+        self._data[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        self._reserve(self._size + len(values))
+        self._data[self._size:self._size + len(values)] = values
+        self._size += len(values)
+
+    def array(self):
+        return self._data[:self._size].copy()
+
+    def __len__(self):
+        return self._size
+
+
+class EventStore(object):
+    """
+    Events of many icu stays kept in contiguous numpy arrays instead of one python object per event. rows are sorted
+    by icu stay, chart time and item id so the events of a single stay are a contiguous slice of every column.
+
+        Attributes:
+            - icu_stay_id: int64 ICUSTAY_ID of every event.
+            - item_id: int32 ITEMID of every event.
+            - chart_time: int64 CHARTTIME as seconds since epoch (utils.MISSING_TIME if missing).
+            - value_num: float64 VALUENUM (nan if missing).
+            - value: int32 code of VALUE in value_dictionary. 0 when VALUE is numeric and equals VALUENUM, since it can
+            be derived from value_num.
+            - value_unit: int32 code of VALUEUOM in unit_dictionary.
+            - cgid: int32 code of CGID in cgid_dictionary.
+            - source: uint8 table the event came from, event.CHART_EVENT, event.LAB_EVENT or event.OUTPUT_EVENT.
+            - stay_ids: sorted unique icu stay ids in the store.
+            - stay_starts, stay_stops: the slice of each of stay_ids in the columns.
+            - item_order: see item_order().
+    """
+    COLUMNS = (('icu_stay_id', np.int64), ('item_id', np.int32), ('chart_time', np.int64),
+               ('value_num', np.float64), ('value', np.int32), ('value_unit', np.int32), ('cgid', np.int32),
+               ('source', np.uint8))
+
+    def __init__(self, columns, value_dictionary, unit_dictionary, cgid_dictionary, stay_ids=None, stay_starts=None,
+                 stay_stops=None, item_order=None):
+        """
+        :param columns: dict column name -> numpy array, already sorted by icu stay, chart time and item id.
+        :param value_dictionary: StringDictionary of the value column.
+        :param unit_dictionary: StringDictionary of the value_unit column.
+        :param cgid_dictionary: StringDictionary of the cgid column.
+        :param stay_ids: optional precomputed stay index, computed from the icu_stay_id column if not given.
+        :param item_order: optional precomputed item_order().
+        """
+        for name, dtype in EventStore.COLUMNS:
+            setattr(self, name, columns[name])
+        self.value_dictionary = value_dictionary
+        self.unit_dictionary = unit_dictionary
+        self.cgid_dictionary = cgid_dictionary
+
+        if stay_ids is None:
+            stay_ids, stay_starts = np.unique(self.icu_stay_id, return_index=True)
+            stay_stops = np.append(stay_starts[1:], len(self.icu_stay_id))
+        self.stay_ids = stay_ids
+        self.stay_starts = stay_starts
+        self.stay_stops = stay_stops
+        self._item_order = item_order
+
+    @staticmethod
+    def empty(value_dictionary=None, unit_dictionary=None, cgid_dictionary=None):
+        """
+        :return: an EventStore without events.
+        """
+        columns = dict((name, np.empty(0, dtype=dtype)) for name, dtype in EventStore.COLUMNS)
+        return EventStore(columns, value_dictionary or StringDictionary(), unit_dictionary or StringDictionary(),
+                          cgid_dictionary or StringDictionary())
+
+    @staticmethod
+    def from_unsorted(columns, value_dictionary, unit_dictionary, cgid_dictionary):
+        """
+        sorts event columns by icu stay, chart time and item id and builds an EventStore from them. the sort is stable
+        so events with the same stay, time and item keep their insertion order.
+        :param columns: dict column name -> numpy array.
+        :return: EventStore
+        """
+        order = np.lexsort((columns['item_id'], columns['chart_time'], columns['icu_stay_id']))
+        columns = dict((name, np.asarray(columns[name], dtype=dtype)[order]) for name, dtype in EventStore.COLUMNS)
+        return EventStore(columns, value_dictionary, unit_dictionary, cgid_dictionary)
+
+    @staticmethod
+    def concatenate(stores):
+        """
+        merges several event stores into one. codes of stores that don't share the dictionaries of the first store are
+        re-encoded.
+        :param stores: list of EventStore objects.
+        :return: EventStore
+        """
+        first = stores[0]
+        columns = dict((name, []) for name, dtype in EventStore.COLUMNS)
+        for store in stores:
+            for name, dtype in EventStore.COLUMNS:
+                column = getattr(store, name)
+                if name in ('value', 'value_unit', 'cgid'):
+                    column = _recode(column, store.dictionary(name), first.dictionary(name))
+                columns[name].append(column)
+        columns = dict((name, np.concatenate(arrays)) for name, arrays in columns.items())
+        return EventStore.from_unsorted(columns, first.value_dictionary, first.unit_dictionary, first.cgid_dictionary)
+
+    def dictionary(self, column_name):
+        """
+        :param column_name: one of 'value', 'value_unit', 'cgid'.
+        :return: the StringDictionary used to encode the column.
+        """
+        return {'value': self.value_dictionary, 'value_unit': self.unit_dictionary,
+                'cgid': self.cgid_dictionary}[column_name]
+
+    def __len__(self):
+        return len(self.icu_stay_id)
+
+    def stay_events(self, icu_stay_id, shared=False):
+        """
+        :param icu_stay_id: id of the icu stay.
+        :param shared: True if the store is the event store of a database, events can't be appended to the view then.
+        :return: StayEvents view over the events of the stay (empty if the stay has no events).
+        """
+        position = np.searchsorted(self.stay_ids, icu_stay_id)
+        if position < len(self.stay_ids) and self.stay_ids[position] == icu_stay_id:
+            return StayEvents(self, self.stay_starts[position], self.stay_stops[position], shared)
+        return StayEvents(self, 0, 0, shared)
+
+    def item_order(self):
+        """
+        the rows of every stay ordered by item id and chart time, used to search the series of one item in a stay
+        with a binary search instead of a scan. computed on first use.
+        :return: int32 array, the offsets inside the slice of every stay of its rows in (item id, chart time) order.
+        """
+        if self._item_order is None:
+            order = np.lexsort((self.chart_time, self.item_id, self.icu_stay_id))
+            starts = np.repeat(self.stay_starts, self.stay_stops - self.stay_starts)
+            self._item_order = (order - starts).astype(np.int32)
+        return self._item_order
+
+    def decode_value(self, index):
+        """
+        :param index: row index in the store.
+        :return: the original VALUE of the row, as a float if it was derived from VALUENUM.
+        """
+        code = self.value[index]
+        if code == 0 and not np.isnan(self.value_num[index]):
+            return float(self.value_num[index])
+        return self.value_dictionary.decode(code)
+
+
+def _recode(codes, source, target):
+    """translates codes of one StringDictionary to the codes of another."""
+    if source is target:
+        return codes
+    mapping = np.array([target.encode(value) for value in source.values], dtype=np.int32)
+    return mapping[codes]
+
+
+class EventStoreBuilder(object):
+    """
+    Accumulates event rows in compact typed buffers, and sorts them into an EventStore once all rows were appended.
+    chunks of columns appended with extend_columns are mapped by the concept map first, when there is one.
+    """
+    def __init__(self, value_dictionary=None, unit_dictionary=None, cgid_dictionary=None, capacity=1024,
+                 concept_map=None):
+        """
+        :param concept_map: d_items.ConceptMap that merges ITEMIDs and converts units, None to keep them.
+        """
+        self.value_dictionary = value_dictionary or StringDictionary()
+        self.unit_dictionary = unit_dictionary or StringDictionary()
+        self.cgid_dictionary = cgid_dictionary or StringDictionary()
+        self.concept_map = concept_map
+        self._columns = dict((name, _Column(dtype, capacity)) for name, dtype in EventStore.COLUMNS)
+
+    def append(self, icu_stay_id, item_id, chart_time, value_num, value_code, unit_code, cgid_code,
+               source=event.CHART_EVENT):
+        """
+        appends an already typed and encoded event row.
+        :param chart_time: seconds since epoch.
+        :param value_num: float, nan if missing.
+        :param source: table of the event, event.CHART_EVENT, event.LAB_EVENT or event.OUTPUT_EVENT.
+        """
+        columns = self._columns
+        columns['icu_stay_id'].append(icu_stay_id)
+        columns['item_id'].append(item_id)
+        columns['chart_time'].append(chart_time)
+        columns['value_num'].append(value_num)
+        columns['value'].append(value_code)
+        columns['value_unit'].append(unit_code)
+        columns['cgid'].append(cgid_code)
+        columns['source'].append(source)
+
+    def extend(self, icu_stay_id, item_id, chart_time, value_num, value_code, unit_code, cgid_code,
+               source=event.CHART_EVENT):
+        """
+        appends typed and encoded event columns, the vectorized version of append.
+        :param source: table of the events, a single value for all of them.
+        """
+        columns = self._columns
+        columns['icu_stay_id'].extend(icu_stay_id)
+        columns['item_id'].extend(item_id)
+        columns['chart_time'].extend(chart_time)
+        columns['value_num'].extend(value_num)
+        columns['value'].extend(value_code)
+        columns['value_unit'].extend(unit_code)
+        columns['cgid'].extend(cgid_code)
+        columns['source'].extend(np.full(len(icu_stay_id), source, dtype=np.uint8))
+
+    def extend_columns(self, icu_stay_id, item_id, chart_time, value, value_num, value_unit, cgid,
+                       source=event.CHART_EVENT):
+        """
+        appends a chunk of events given as typed columns, encoding the string columns in one pass per chunk.
+        :param icu_stay_id: int ICUSTAY_ID array.
+        :param item_id: int ITEMID array.
+        :param chart_time: int64 CHARTTIME array, seconds since epoch.
+        :param value: VALUE string array.
+        :param value_num: float VALUENUM array, nan where missing.
+        :param value_unit: VALUEUOM string array.
+        :param cgid: CGID string array.
+        :param source: table of the events.
+        """
+        if self.concept_map is not None:
+            item_id, value_num, value_unit = self.concept_map.apply(item_id, value_num, value_unit)
+        missing_num = np.isnan(value_num)
+
+        # numeric VALUE strings are derived from VALUENUM and only need a code when VALUENUM is missing.
+        uniques, inverse = np.unique(value, return_inverse=True)
+        unique_values = uniques.tolist()
+        is_number = np.array([event.Event.is_number_repl_isdigit(v) for v in unique_values], dtype=bool)
+        needs_code = ~is_number | (np.bincount(inverse, weights=missing_num, minlength=len(uniques)) > 0)
+        codes = np.zeros(len(uniques), dtype=np.int32)
+        for i in np.flatnonzero(needs_code):
+            codes[i] = self.value_dictionary.encode(unique_values[i])
+        value_code = codes[inverse]
+        value_code[is_number[inverse] & ~missing_num] = 0
+
+        self.extend(icu_stay_id, item_id, chart_time, value_num, value_code,
+                    self.unit_dictionary.encode_array(value_unit), self.cgid_dictionary.encode_array(cgid), source)
+
+    def append_row(self, icu_stay_id, item_id, chart_time, value, value_num, value_unit, cgid,
+                   source=event.CHART_EVENT):
+        """
+        appends an event given as the raw strings of a csv row.
+        :param icu_stay_id: ICUSTAY_ID
+        :param item_id: ITEMID
+        :param chart_time: CHARTTIME string
+        :param value: VALUE string
+        :param value_num: VALUENUM string
+        :param value_unit: VALUEUOM string
+        :param cgid: CGID string
+        :param source: table of the event.
+        """
+        value_num = float(value_num) if value_num != '' else np.nan
+        if value_num == value_num and event.Event.is_number_repl_isdigit(value):
+            value_code = 0
+        else:
+            value_code = self.value_dictionary.encode(value)
+        chart_time = utils.convert_to_epoch(chart_time)
+        self.append(int(icu_stay_id), int(item_id), chart_time, value_num, value_code,
+                    self.unit_dictionary.encode(value_unit), self.cgid_dictionary.encode(cgid), source)
+
+    def append_event(self, icu_stay_id, new_event):
+        """
+        appends an event.Event object.
+        :param icu_stay_id: id of the stay the event belongs to.
+        :param new_event: Event object.
+        """
+        value_num = new_event.value_num
+        if value_num == value_num and isinstance(new_event.value, float):
+            value_code = 0
+        else:
+            value_code = self.value_dictionary.encode(str(new_event.value))
+        self.append(icu_stay_id, new_event.item_id, utils.date_time_to_epoch(new_event.chart_time), value_num,
+                    value_code, self.unit_dictionary.encode(new_event.value_unit),
+                    self.cgid_dictionary.encode(getattr(new_event, 'cgid', '')),
+                    getattr(new_event, 'event_type', event.CHART_EVENT))
+
+    def __len__(self):
+        return len(self._columns['icu_stay_id'])
+
+    def columns(self):
+        """
+        :return: dict column name -> numpy array of the appended rows, in the order they were appended.
+        """
+        return dict((name, column.array()) for name, column in self._columns.items())
+
+    def build(self):
+        """
+        :return: EventStore with all appended rows.
+        """
+        return EventStore.from_unsorted(self.columns(), self.value_dictionary, self.unit_dictionary,
+                                        self.cgid_dictionary)
+
+
+class StayEvents(object):
+    """
+    View over the events of a single icu stay inside an EventStore. rows are ordered by chart time and item id, so
+    chart, lab and output events of the stay form one timeline. Replaces the old dict of dicts
+    (time -> item_id -> event) of IcuStay.time_series.
+    Events appended to the view are kept aside and merged into a private store on the next query. a view over the
+    event store of a database is shared: appending to it raises, the new events would be lost the next time the
+    database merges events into its store. such events are added with ICUDatabase.add_events.
+    """
+    def __init__(self, store, start, stop, shared=False):
+        self._store = store
+        self._start = start
+        self._stop = stop
+        self._pending = None
+        self.shared = shared
+
+    @property
+    def store(self):
+        self._flush()
+        return self._store
+
+    def _column(self, name):
+        self._flush()
+        return getattr(self._store, name)[self._start:self._stop]
+
+    @property
+    def item_id(self):
+        return self._column('item_id')
+
+    @property
+    def chart_time(self):
+        return self._column('chart_time')
+
+    @property
+    def value_num(self):
+        return self._column('value_num')
+
+    @property
+    def value(self):
+        return self._column('value')
+
+    @property
+    def value_unit(self):
+        return self._column('value_unit')
+
+    @property
+    def cgid(self):
+        return self._column('cgid')
+
+    @property
+    def source(self):
+        return self._column('source')
+
+    def __len__(self):
+        self._flush()
+        return self._stop - self._start
+
+    def append_event(self, icu_stay_id, new_event):
+        """
+        adds an event object to the view.
+        :param icu_stay_id: id of the stay of the view.
+        :param new_event: event.Event object.
+        """
+        if self.shared:
+            logging.error("can't add an event to icu stay %d, its events are part of the event store of a database",
+                          icu_stay_id)
+            raise ValueError("can't add an event to icu stay %d, its events are part of the event store of a "
+                             "database, add them with ICUDatabase.add_events" % icu_stay_id)
+        if self._pending is None:
+            store = self._store
+            if self._start == self._stop:
+                # a view without events may be over a store shared by many stays, like the empty store of the stays
+                # that are not part of a database, its dictionaries are left as they are.
+                self._pending = EventStoreBuilder(capacity=16)
+            else:
+                self._pending = EventStoreBuilder(store.value_dictionary, store.unit_dictionary,
+                                                  store.cgid_dictionary, capacity=16)
+        self._pending.append_event(icu_stay_id, new_event)
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        pending, self._pending = self._pending.build(), None
+        if self._start == self._stop:
+            self._store = pending
+            self._start, self._stop = 0, len(pending)
+            return
+        store = self._store
+        current = dict((name, getattr(store, name)[self._start:self._stop]) for name, dtype in EventStore.COLUMNS)
+        current = EventStore(current, store.value_dictionary, store.unit_dictionary, store.cgid_dictionary)
+        self._store = EventStore.concatenate([current, pending])
+        self._start, self._stop = 0, len(self._store)
+
+    def _row(self, index):
+        store = self._store
+        return EventRow(int(store.item_id[index]), utils.epoch_to_date_time_object(store.chart_time[index]),
+                        store.decode_value(index), float(store.value_num[index]),
+                        store.unit_dictionary.decode(store.value_unit[index]),
+                        store.cgid_dictionary.decode(store.cgid[index]), int(store.source[index]))
+
+    def __iter__(self):
+        self._flush()
+        for index in range(self._start, self._stop):
+            yield self._row(index)
+
+    def times(self):
+        """
+        :return: sorted array of the distinct chart times (seconds since epoch) of the stay.
+        """
+        return np.unique(self.chart_time)
+
+    def events_at(self, chart_time):
+        """
+        returns all the events that happened at a given time.
+        :param chart_time: datetime object or seconds since epoch.
+        :return: dict item_id -> EventRow. if an item was recorded more than once at that time the last one is kept.
+        """
+        chart_time = _to_epoch(chart_time)
+        times = self.chart_time
+        first = np.searchsorted(times, chart_time, side='left')
+        last = np.searchsorted(times, chart_time, side='right')
+        return dict((row.item_id, row) for row in (self._row(self._start + i) for i in range(first, last)))
+
+    def item_series(self, item_id):
+        """
+        returns the time series of a single item.
+        :param item_id: ITEMID
+        :return: (chart_time, value_num) numpy arrays ordered by time.
+        """
+        return self.series(item_id)
+
+    def _item_keys(self):
+        self._flush()
+        return _ItemKeys(self._store, self._start, self._stop)
+
+    def series(self, item_id, start=None, end=None):
+        """
+        returns the time series of a single item in a time range, found with a binary search.
+        :param item_id: ITEMID
+        :param start: datetime object or seconds since epoch, the series starts at the beginning of the stay if None.
+        :param end: datetime object or seconds since epoch (inclusive), the series ends at the end of the stay if None.
+        :return: (chart_time, value_num) numpy arrays ordered by time.
+        """
+        keys = self._item_keys()
+        # events without a chart time sort first, the series skips them like as_of does.
+        start = utils.MISSING_TIME + 1 if start is None else _to_epoch(start)
+        first = bisect.bisect_left(keys, (item_id, start))
+        if end is None:
+            last = bisect.bisect_left(keys, (item_id + 1,))
+        else:
+            last = bisect.bisect_right(keys, (item_id, _to_epoch(end)))
+        rows = keys.rows(first, last)
+        return self._store.chart_time[rows], self._store.value_num[rows]
+
+    def as_of(self, item_id, chart_time):
+        """
+        returns the last observation of an item at or before a time.
+        :param item_id: ITEMID
+        :param chart_time: datetime object or seconds since epoch.
+        :return: EventRow, or None if the item wasn't recorded up to that time.
+        """
+        keys = self._item_keys()
+        position = bisect.bisect_right(keys, (item_id, _to_epoch(chart_time))) - 1
+        if position < 0:
+            return None
+        found_item, found_time = keys[position]
+        if found_item != item_id or found_time == utils.MISSING_TIME:
+            return None
+        return self._row(keys.rows(position, position + 1)[0])
+
+
+class _ItemKeys(object):
+    """
+    The (item id, chart time) of the events of a stay in item order, as a sequence for the bisect module.
+    """
+    def __init__(self, store, start, stop):
+        self._item_id = store.item_id
+        self._chart_time = store.chart_time
+        self._order = store.item_order()
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, position):
+        row = self._start + self._order[self._start + position]
+        return self._item_id[row], self._chart_time[row]
+
+    def rows(self, first, last):
+        """
+        :return: rows in the store of the positions [first, last).
+        """
+        return self._start + self._order[self._start + first:self._start + last]
+
+
+def _to_epoch(chart_time):
+    if isinstance(chart_time, numbers.Integral):
+        return chart_time
+    return utils.date_time_to_epoch(chart_time)
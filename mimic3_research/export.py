@@ -0,0 +1,275 @@
+import logging
+import os
+import numpy as np
+import features
+import snapshot
+import constants
+
+FORMATS = constants.EXPORT_FORMATS
+# tables the Exporter writes, 'features' needs a features.FeatureBuilder.
+TABLES = constants.EXPORT_TABLES
+# number of icu stays (or rows of the small tables) written to one file.
+DEFAULT_BATCH_SIZE = 256
+
+# csv column -> event_store.EventStore column of the events table.
+EVENT_COLUMNS = (('ICUSTAY_ID', 'icu_stay_id'), ('ITEMID', 'item_id'), ('CHARTTIME', 'chart_time'),
+                 ('VALUE', 'value'), ('VALUENUM', 'value_num'), ('VALUEUOM', 'value_unit'), ('CGID', 'cgid'),
+                 ('SOURCE', 'source'))
+# SOURCE column value of every event.CHART_EVENT, event.LAB_EVENT and event.OUTPUT_EVENT.
+SOURCE_TABLES = np.array(['CHARTEVENTS', 'LABEVENTS', 'OUTPUTEVENTS'], dtype='S')
+
+
+def has_pyarrow():
+    """
+    :return: True if pyarrow can be imported.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def parquet_module():
+    """
+    :return: the pyarrow.parquet module, imported on first use since pyarrow is optional.
+    """
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        logging.error("parquet export needs pyarrow, use the npz format without it")
+        raise ValueError("parquet export needs pyarrow, use the npz format without it")
+    return pyarrow.parquet
+
+
+def write_parquet(path, columns):
+    """
+    writes columns to a parquet file as one row group. nan floats and NaT times are written as nulls.
+    :param path: file to write.
+    :param columns: list of (name, numpy array).
+    :return:
+    """
+    parquet = parquet_module()
+    import pyarrow
+    arrays = []
+    for name, values in columns:
+        if values.dtype.kind == 'S':
+            arrays.append(pyarrow.array(values.tolist(), type=pyarrow.string()))
+        else:
+            arrays.append(pyarrow.array(values, from_pandas=True))
+    table = pyarrow.Table.from_arrays(arrays, [name for name, values in columns])
+    parquet.write_table(table, path, row_group_size=max(len(table), 1))
+
+
+def feature_rows(matrix):
+    """
+    flattens a feature matrix to a row per stay and bin.
+    :param matrix: features.FeatureMatrix
+    :return: list of (name, numpy array) - ICUSTAY_ID, BIN and a float column per feature, nan where it wasn't
+    observed.
+    """
+    n_stays, n_bins, n_features = matrix.values.shape
+    values = np.where(matrix.mask, matrix.values, np.nan).reshape(n_stays * n_bins, n_features)
+    columns = [('ICUSTAY_ID', np.repeat(matrix.icu_stay_ids, n_bins)), ('BIN', np.tile(np.arange(n_bins), n_stays))]
+    return columns + [(name, values[:, i]) for i, name in enumerate(matrix.feature_names)]
+
+
+def _time_column(epochs):
+    """seconds since epoch to datetime64, utils.MISSING_TIME becomes NaT."""
+    return np.asarray(epochs, dtype=np.int64).astype('datetime64[s]')
+
+
+def stay_in_times(database, icu_stay_ids):
+    """
+    INTIME of the stays from the icu stays table, so the stays of an opened snapshot are not materialized the way
+    features.stay_start_times does.
+    :param database: ICUDatabase
+    :param icu_stay_ids: ids of icu stays of the database.
+    :return: int64 array of the INTIME of the stays, seconds since epoch.
+    """
+    stays = database.table_arrays()['icu_stays']
+    order = np.argsort(stays['ICUSTAY_ID'], kind='mergesort')
+    positions = order[np.searchsorted(np.asarray(stays['ICUSTAY_ID'])[order], icu_stay_ids)]
+    return np.asarray(stays['INTIME'], dtype=np.int64)[positions]
+
+
+class Exporter(object):
+    """
+    Streams the tables of a database to files other tools read: a parquet file per batch when pyarrow is installed,
+    npz shards otherwise. every table is written to its own directory, output_dir/<table>/part-00000.<format>, one
+    batch at a time, so memory stays flat however large the export is. the cohort and the columns are applied before
+    anything is read, so the events of other stays and unused columns are never touched (with a snapshot opened by
+    ICUDatabase.open_snapshot they are never even read from disk).
+    """
+    def __init__(self, database, output_dir, file_format=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param database: ICUDatabase, usually opened from a snapshot.
+        :param output_dir: directory to write the table directories to.
+        :param file_format: one of FORMATS, parquet when pyarrow can be imported and npz otherwise by default.
+        :param batch_size: icu stays (or rows of the small tables) per file.
+        """
+        if file_format is None:
+            file_format = 'parquet' if has_pyarrow() else 'npz'
+        if file_format not in FORMATS:
+            logging.error("unknown export format %s", file_format)
+            raise ValueError("unknown export format %s" % file_format)
+        if file_format == 'parquet':
+            parquet_module()
+        self.database = database
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.batch_size = batch_size
+
+    def export(self, tables=TABLES[:4], icu_stay_ids=None, columns=None, feature_builder=None):
+        """
+        :param tables: names from TABLES.
+        :param icu_stay_ids: the cohort to export, for example db.cohort().care_unit('MICU').stay_ids(). the small
+        tables are cut to the patients and admissions of the cohort. all the stays by default.
+        :param columns: dict table name -> csv columns to write, all the columns of the tables missing from it.
+        :param feature_builder: features.FeatureBuilder of the 'features' table.
+        :return: dict table name -> list of the files written.
+        """
+        unknown = [table_name for table_name in tables if table_name not in TABLES]
+        if unknown:
+            logging.error("unknown tables %s", ', '.join(unknown))
+            raise ValueError("unknown tables %s" % ', '.join(unknown))
+        columns = columns or {}
+        written = {}
+        for table_name in tables:
+            if table_name == 'events':
+                written[table_name] = self.export_events(icu_stay_ids, columns.get(table_name))
+            elif table_name == 'features':
+                if feature_builder is None:
+                    logging.error("the features table needs a feature builder")
+                    raise ValueError("the features table needs a feature builder")
+                written[table_name] = self.export_features(feature_builder, icu_stay_ids)
+            else:
+                written[table_name] = self.export_table(table_name, icu_stay_ids, columns.get(table_name))
+        return written
+
+    def _stay_ids(self, icu_stay_ids):
+        if icu_stay_ids is None:
+            return np.array(sorted(self.database.icu_stays), dtype=np.int64)
+        return np.unique(np.asarray(icu_stay_ids, dtype=np.int64))
+
+    @staticmethod
+    def _select(names, selected, table_name):
+        if selected is None:
+            return list(names)
+        unknown = [name for name in selected if name not in names]
+        if unknown:
+            logging.error("unknown columns of %s: %s", table_name, ', '.join(unknown))
+            raise ValueError("unknown columns of %s: %s" % (table_name, ', '.join(unknown)))
+        return list(selected)
+
+    def _path(self, table_name, shard):
+        directory = os.path.join(self.output_dir, table_name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return os.path.join(directory, 'part-%05d.%s' % (shard, self.file_format))
+
+    def _write(self, table_name, shard, columns):
+        path = self._path(table_name, shard)
+        if self.file_format == 'parquet':
+            write_parquet(path, columns)
+        else:
+            np.savez(path, **dict(columns))
+        return path
+
+    def export_table(self, table_name, icu_stay_ids=None, columns=None):
+        """
+        writes one of the small tables ('patients', 'admissions', 'icu_stays'), batch_size rows per file.
+        :param icu_stay_ids: keep the rows of these stays and of their admissions and patients, all by default.
+        :param columns: csv columns to write, all by default. times are written as datetime64.
+        :return: list of the files written.
+        """
+        kinds = dict((name, kind) for name, attribute, kind in dict(snapshot.TABLES)[table_name])
+        names = self._select([name for name, attribute, kind in dict(snapshot.TABLES)[table_name]], columns,
+                             table_name)
+        tables = self.database.table_arrays()
+        table = tables[table_name]
+        if icu_stay_ids is None:
+            rows = np.arange(len(table['SUBJECT_ID']))
+        else:
+            stays = tables['icu_stays']
+            cohort = np.in1d(stays['ICUSTAY_ID'], self._stay_ids(icu_stay_ids))
+            key = {'patients': 'SUBJECT_ID', 'admissions': 'HADM_ID', 'icu_stays': 'ICUSTAY_ID'}[table_name]
+            rows = np.flatnonzero(np.in1d(table[key], np.asarray(stays[key])[cohort]))
+
+        written = []
+        for shard, first in enumerate(range(0, len(rows), self.batch_size)):
+            batch = rows[first:first + self.batch_size]
+            batch_columns = []
+            for name in names:
+                values = np.asarray(table[name])[batch]
+                batch_columns.append((name, _time_column(values) if kinds[name] == 'time' else values))
+            written.append(self._write(table_name, shard, batch_columns))
+        logging.info("Exported %d rows of %s to %d files", len(rows), table_name, len(written))
+        return written
+
+    def _event_columns(self, store, rows, names):
+        """
+        :return: list of (csv column, numpy array) of some rows of the event store, only the columns in names are
+        read and decoded.
+        """
+        attributes = dict(EVENT_COLUMNS)
+        columns = []
+        for name in names:
+            values = getattr(store, attributes[name])[rows]
+            if name == 'CHARTTIME':
+                values = _time_column(values)
+            elif name == 'VALUE':
+                # numeric VALUEs are stored as code 0 and derived from VALUENUM.
+                value_num = store.value_num[rows]
+                derived = (values == 0) & ~np.isnan(value_num)
+                values = np.where(derived, np.char.mod('%.15g', value_num),
+                                  store.value_dictionary.array()[values])
+            elif name in ('VALUEUOM', 'CGID'):
+                values = store.dictionary(attributes[name]).array()[values]
+            elif name == 'SOURCE':
+                values = SOURCE_TABLES[values]
+            columns.append((name, values))
+        return columns
+
+    def export_events(self, icu_stay_ids=None, columns=None):
+        """
+        writes the events of the stays, the events of batch_size stays per file, ordered by stay, chart time and item.
+        :param icu_stay_ids: the stays to write, all by default.
+        :param columns: csv columns from EVENT_COLUMNS, all by default.
+        :return: list of the files written.
+        """
+        names = self._select([name for name, attribute in EVENT_COLUMNS], columns, 'events')
+        store = self.database.event_store
+        icu_stay_ids = self._stay_ids(icu_stay_ids)
+        written = []
+        num_of_events = 0
+        for shard, first in enumerate(range(0, len(icu_stay_ids), self.batch_size)):
+            rows, stay_index = features.stay_rows(store, icu_stay_ids[first:first + self.batch_size])
+            written.append(self._write('events', shard, self._event_columns(store, rows, names)))
+            num_of_events += len(rows)
+        logging.info("Exported %d events of %d icu stays to %d files", num_of_events, len(icu_stay_ids), len(written))
+        return written
+
+    def export_features(self, builder, icu_stay_ids=None):
+        """
+        writes the binned features of the stays, batch_size stays per file. npz files hold the tensors of
+        features.FeatureMatrix (values, mask, icu_stay_ids, feature_names), parquet files a row per stay and bin.
+        :param builder: features.FeatureBuilder
+        :param icu_stay_ids: the stays to write, all by default.
+        :return: list of the files written.
+        """
+        icu_stay_ids = self._stay_ids(icu_stay_ids)
+        start_times = stay_in_times(self.database, icu_stay_ids)
+        written = []
+        for shard, first in enumerate(range(0, len(icu_stay_ids), self.batch_size)):
+            last = first + self.batch_size
+            matrix = builder.build(self.database.event_store, icu_stay_ids[first:last], start_times[first:last])
+            if self.file_format == 'parquet':
+                written.append(self._write('features', shard, feature_rows(matrix)))
+            else:
+                path = self._path('features', shard)
+                np.savez_compressed(path, values=matrix.values, mask=matrix.mask, icu_stay_ids=matrix.icu_stay_ids,
+                                    feature_names=np.array(matrix.feature_names))
+                written.append(path)
+        logging.info("Exported the features of %d icu stays to %d files", len(icu_stay_ids), len(written))
+        return written
@@ -0,0 +1,179 @@
+import logging
+import math
+import os
+import numpy as np
+import event
+import event_ingest
+import event_store
+import snapshot
+import constants
+
+DEFAULT_MEMORY_BUDGET = constants.DEFAULT_MEMORY_BUDGET
+# one event row as a packed record of the event store columns, the layout of the partition files.
+RECORD = np.dtype([(name, dtype) for name, dtype in event_store.EventStore.COLUMNS])
+# memory used to sort one row of a partition: the records, the sorted column being written, the sort order and the
+# item order.
+SORT_BYTES_PER_ROW = 2 * RECORD.itemsize + 3 * 8
+# the shortest csv lines of the events tables, used to estimate the rows of a table from its size. under-estimating
+# the line length only makes more, smaller partitions.
+MIN_BYTES_PER_CSV_ROW = 40
+GZIP_RATIO = 8
+# source of the events of every events table.
+TABLE_SOURCES = {'CHARTEVENTS': event.CHART_EVENT, 'LABEVENTS': event.LAB_EVENT, 'OUTPUTEVENTS': event.OUTPUT_EVENT}
+
+
+def num_of_partitions(paths, memory_budget=DEFAULT_MEMORY_BUDGET, num_of_events=0):
+    """
+    estimates how many partitions make every partition fit in the memory budget when it is sorted.
+    :param paths: csv (or csv.gz) files that are spilled.
+    :param memory_budget: bytes a partition may use while it is sorted.
+    :param num_of_events: events that are already in memory and are spilled too.
+    :return: int
+    """
+    num_of_bytes = sum(os.path.getsize(path) * (GZIP_RATIO if path.endswith('.gz') else 1) for path in paths)
+    num_of_rows = num_of_bytes / MIN_BYTES_PER_CSV_ROW + num_of_events
+    return max(1, int(math.ceil(num_of_rows * SORT_BYTES_PER_ROW / float(memory_budget))))
+
+
+def partition_boundaries(stay_ids, num_partitions):
+    """
+    splits the icu stays into ranges of ICUSTAY_ID with the same number of stays. partition i holds the stays
+    boundaries[i - 1] <= ICUSTAY_ID < boundaries[i], so sorting every partition on its own and concatenating them in
+    order sorts all the events.
+    :param stay_ids: sorted ICUSTAY_IDs of the database.
+    :param num_partitions: number of partitions.
+    :return: int64 array of num_partitions - 1 boundaries (fewer if there are less stays).
+    """
+    if len(stay_ids) == 0:
+        return np.empty(0, dtype=np.int64)
+    positions = np.linspace(0, len(stay_ids), num_partitions + 1)[1:-1].astype(np.int64)
+    return np.unique(np.asarray(stay_ids, dtype=np.int64)[positions])
+
+
+class PartitionWriter(object):
+    """
+    First pass of the external ingest: appends event columns to partition files on disk by range of ICUSTAY_ID, as
+    packed RECORD rows. only the chunk being written is in memory.
+
+        Attributes:
+            - directory: directory of the partition files.
+            - boundaries: see partition_boundaries.
+            - sizes: number of rows written to every partition.
+    """
+    def __init__(self, directory, boundaries):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.boundaries = boundaries
+        self.sizes = np.zeros(len(boundaries) + 1, dtype=np.int64)
+        self._files = [open(self.path(i), 'wb') for i in range(len(self.sizes))]
+
+    def path(self, partition):
+        return os.path.join(self.directory, 'partition_%04d.bin' % partition)
+
+    def write(self, columns):
+        """
+        :param columns: dict event store column name -> numpy array, in any order.
+        :return:
+        """
+        num_of_rows = len(columns['icu_stay_id'])
+        if num_of_rows == 0:
+            return
+        records = np.empty(num_of_rows, dtype=RECORD)
+        for name, dtype in event_store.EventStore.COLUMNS:
+            records[name] = columns[name]
+        partitions = np.searchsorted(self.boundaries, records['icu_stay_id'], side='right')
+        counts = np.bincount(partitions, minlength=len(self.sizes))
+        records = records[np.argsort(partitions, kind='mergesort')]
+        stops = np.cumsum(counts)
+        for i in np.flatnonzero(counts):
+            records[stops[i] - counts[i]:stops[i]].tofile(self._files[i])
+        self.sizes += counts
+
+    def write_store(self, store, chunk_size):
+        """
+        spills the events of an event store, chunk_size rows at a time.
+        :param store: event_store.EventStore
+        """
+        for start in range(0, len(store), chunk_size):
+            self.write(dict((name, getattr(store, name)[start:start + chunk_size])
+                            for name, dtype in event_store.EventStore.COLUMNS))
+
+    def close(self):
+        for partition_file in self._files:
+            partition_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _open_column(directory, name, dtype, length):
+    return np.lib.format.open_memmap(os.path.join(directory, name + '.npy'), mode='w+', dtype=dtype, shape=(length,))
+
+
+def sort_partitions(writer, events_dir, value_dictionary, unit_dictionary, cgid_dictionary, memory_budget=None):
+    """
+    second pass of the external ingest: sorts every partition by (icu stay, chart time, item id) and writes it after
+    the partitions before it to the column files of events_dir, in the layout of the events of a snapshot. a
+    partition file is deleted once it was written.
+    :param writer: closed PartitionWriter of the first pass.
+    :param events_dir: directory of the sorted column files.
+    :param memory_budget: bytes a partition may use, larger partitions are sorted anyway with a warning.
+    :return: (event_store.EventStore memory mapped from events_dir, dict source -> number of events of the source
+    with the same icu stay, chart time and item id as the event before them).
+    """
+    if not os.path.isdir(events_dir):
+        os.makedirs(events_dir)
+    total = int(writer.sizes.sum())
+    columns = dict((name, _open_column(events_dir, name, dtype, total))
+                   for name, dtype in event_store.EventStore.COLUMNS)
+    item_order = _open_column(events_dir, snapshot.ITEM_ORDER, np.int32, total)
+    stay_ids, stay_starts, stay_stops = [], [], []
+    duplicates = {}
+    offset = 0
+    for i, size in enumerate(writer.sizes.tolist()):
+        if size == 0:
+            os.remove(writer.path(i))
+            continue
+        if memory_budget and size * SORT_BYTES_PER_ROW > memory_budget:
+            logging.warning("partition %d of %d events needs about %.1f MB to sort, over the budget of %.1f MB", i,
+                            size, size * SORT_BYTES_PER_ROW / 2.0 ** 20, memory_budget / 2.0 ** 20)
+        records = np.fromfile(writer.path(i), dtype=RECORD)
+        records = records[np.lexsort((records['item_id'], records['chart_time'], records['icu_stay_id']))]
+        for name, dtype in event_store.EventStore.COLUMNS:
+            columns[name][offset:offset + size] = records[name]
+
+        ids, starts = np.unique(records['icu_stay_id'], return_index=True)
+        stops = np.append(starts[1:], size)
+        order = np.lexsort((records['chart_time'], records['item_id'], records['icu_stay_id']))
+        item_order[offset:offset + size] = order - np.repeat(starts, stops - starts)
+        stay_ids.append(ids)
+        stay_starts.append(starts + offset)
+        stay_stops.append(stops + offset)
+        del order
+
+        for source in np.unique(records['source']).tolist():
+            same_source = records[records['source'] == source].view(np.recarray)
+            duplicates[source] = duplicates.get(source, 0) + event_ingest.count_duplicates(same_source)
+        offset += size
+        del records
+        os.remove(writer.path(i))
+
+    index = [np.concatenate(arrays or [np.empty(0)]).astype(np.int64) for arrays in (stay_ids, stay_starts, stay_stops)]
+    for name, values in zip(snapshot.EVENT_INDEX_COLUMNS, index):
+        np.save(os.path.join(events_dir, name + '.npy'), values)
+    for column in columns.values() + [item_order]:
+        column.flush()
+    del columns, item_order
+
+    def load(name):
+        return np.load(os.path.join(events_dir, name + '.npy'), mmap_mode='r')
+    store = event_store.EventStore(dict((name, load(name)) for name, dtype in event_store.EventStore.COLUMNS),
+                                   value_dictionary, unit_dictionary, cgid_dictionary,
+                                   *[load(name) for name in snapshot.EVENT_INDEX_COLUMNS],
+                                   item_order=load(snapshot.ITEM_ORDER))
+    return store, duplicates
+
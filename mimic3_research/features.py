@@ -0,0 +1,215 @@
+import logging
+import numpy as np
+import utils
+import constants
+
+# aggregations of the events of an item inside a time bin.
+#   'last' - value_num of the last event in the bin.
+#   'mean', 'min', 'max' - of the numeric values in the bin.
+#   'count' - number of events of the item in the bin, numeric or not.
+AGGREGATIONS = constants.AGGREGATIONS
+
+DEFAULT_BATCH_SIZE = 4096
+
+
+class FeatureMatrix(object):
+    """
+    Binned features of a list of icu stays, ready to be fed to a model.
+
+        Attributes:
+            - values: float32 array [n_stays, n_bins, n_features], 0 where the feature wasn't observed.
+            - mask: bool array of the same shape, True where the feature was observed.
+            - icu_stay_ids: ICUSTAY_ID of every row of values.
+            - feature_names: name of every feature, '<item_id>_<aggregation>'.
+    """
+    def __init__(self, values, mask, icu_stay_ids, feature_names):
+        self.values = values
+        self.mask = mask
+        self.icu_stay_ids = icu_stay_ids
+        self.feature_names = feature_names
+
+    def __len__(self):
+        return len(self.icu_stay_ids)
+
+
+class FeatureBuilder(object):
+    """
+    Turns the time series of icu stays into dense [n_stays, n_bins, n_features] matrices. the first horizon seconds
+    of every stay are split into bins of bin_width seconds, and every (item, aggregation) pair is a feature. the
+    events of a whole batch of stays are grouped by (stay, bin, item) with a single sort and aggregated with numpy
+    reduceat, so there is no python loop over events.
+    """
+    def __init__(self, item_ids, bin_width=3600, horizon=48 * 3600, aggregations=('mean',),
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param item_ids: ITEMIDs to build features from.
+        :param bin_width: width of a time bin in seconds.
+        :param horizon: seconds from the start of the stay that are covered by the bins.
+        :param aggregations: names from AGGREGATIONS.
+        :param batch_size: number of stays whose events are grouped at once, bounds the size of the intermediate
+        arrays.
+        """
+        unknown = [name for name in aggregations if name not in AGGREGATIONS]
+        if unknown:
+            logging.error("unknown aggregations %s", unknown)
+            raise ValueError("unknown aggregations %s" % unknown)
+        if bin_width <= 0 or horizon <= 0:
+            logging.error("bin width and horizon must be positive")
+            raise ValueError("bin width and horizon must be positive")
+
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.bin_width = int(bin_width)
+        self.horizon = int(horizon)
+        self.aggregations = tuple(aggregations)
+        self.batch_size = batch_size
+        self.n_bins = -(-self.horizon // self.bin_width)
+
+        self._item_order = np.argsort(self.item_ids, kind='mergesort')
+        self._sorted_items = self.item_ids[self._item_order]
+
+    @property
+    def n_features(self):
+        return len(self.item_ids) * len(self.aggregations)
+
+    @property
+    def feature_names(self):
+        return ['%d_%s' % (item_id, name) for item_id in self.item_ids for name in self.aggregations]
+
+    def build(self, store, icu_stay_ids, start_times):
+        """
+        :param store: event_store.EventStore with the events of the stays.
+        :param icu_stay_ids: ICUSTAY_ID of the stays, in the order of the rows of the result.
+        :param start_times: time of the first bin of every stay, seconds since epoch (usually INTIME).
+        :return: FeatureMatrix
+        """
+        icu_stay_ids = np.asarray(icu_stay_ids, dtype=np.int64)
+        start_times = np.asarray(start_times, dtype=np.int64)
+        shape = (len(icu_stay_ids), self.n_bins, len(self.item_ids), len(self.aggregations))
+        values = np.zeros(shape, dtype=np.float32)
+        mask = np.zeros(shape, dtype=bool)
+        for first in range(0, len(icu_stay_ids), self.batch_size):
+            last = first + self.batch_size
+            self._build_batch(store, icu_stay_ids[first:last], start_times[first:last], values[first:last],
+                              mask[first:last])
+
+        shape = (len(icu_stay_ids), self.n_bins, self.n_features)
+        return FeatureMatrix(values.reshape(shape), mask.reshape(shape), icu_stay_ids, self.feature_names)
+
+    def build_for_database(self, database, icu_stay_ids=None):
+        """
+        builds the features of icu stays of a database, binned from their INTIME.
+        :param database: ICUDatabase
+        :param icu_stay_ids: ids of the stays, all the stays of the database by default.
+        :return: FeatureMatrix
+        """
+        if icu_stay_ids is None:
+            icu_stay_ids = sorted(database.icu_stays)
+        return self.build(database.event_store, icu_stay_ids, stay_start_times(database, icu_stay_ids))
+
+    def _build_batch(self, store, icu_stay_ids, start_times, values, mask):
+        """
+        fills values and mask [n_stays, n_bins, n_items, n_aggregations] of a batch of stays.
+        """
+        rows, stay_index = stay_rows(store, icu_stay_ids)
+        rows, stay_index, item_index = self._select_items(store, rows, stay_index)
+
+        chart_time = store.chart_time[rows]
+        delta = chart_time - start_times[stay_index]
+        inside = ((chart_time != utils.MISSING_TIME) & (start_times[stay_index] != utils.MISSING_TIME) &
+                  (delta >= 0) & (delta < self.horizon))
+        rows, stay_index, item_index = rows[inside], stay_index[inside], item_index[inside]
+        time_bin = delta[inside] // self.bin_width
+
+        # flat index of the (stay, bin, item) cell of every event. the events of a stay are sorted by time in the
+        # store, so a stable sort by cell keeps every cell sorted by time.
+        cell = (stay_index * self.n_bins + time_bin) * len(self.item_ids) + item_index
+        order = np.argsort(cell, kind='mergesort')
+        cell, rows = cell[order], rows[order]
+
+        flat_values = values.reshape(-1, len(self.aggregations))
+        flat_mask = mask.reshape(-1, len(self.aggregations))
+        if 'count' in self.aggregations:
+            column = self.aggregations.index('count')
+            cells, starts = group(cell)
+            flat_values[cells, column] = np.diff(np.append(starts, len(cell)))
+            flat_mask[cells, column] = True
+
+        numeric = ~np.isnan(store.value_num[rows])
+        cell = cell[numeric]
+        numbers = store.value_num[rows[numeric]]
+        if len(cell) == 0:
+            return
+        cells, starts = group(cell)
+        stops = np.append(starts[1:], len(cell))
+        aggregated = {'last': lambda: numbers[stops - 1],
+                      'mean': lambda: np.add.reduceat(numbers, starts) / (stops - starts),
+                      'min': lambda: np.minimum.reduceat(numbers, starts),
+                      'max': lambda: np.maximum.reduceat(numbers, starts)}
+        for column, name in enumerate(self.aggregations):
+            if name != 'count':
+                flat_values[cells, column] = aggregated[name]()
+                flat_mask[cells, column] = True
+
+    def _select_items(self, store, rows, stay_index):
+        """
+        keeps the rows of the requested items.
+        :return: (rows, stay_index, item_index) where item_index is the position of the item in item_ids.
+        """
+        return select_items(store, rows, stay_index, self._sorted_items, self._item_order)
+
+
+def stay_start_times(database, icu_stay_ids):
+    """
+    :param database: ICUDatabase
+    :param icu_stay_ids: ids of icu stays of the database.
+    :return: int64 array of the INTIME of the stays, seconds since epoch.
+    """
+    return np.array([utils.date_time_to_epoch(database.icu_stays[icu_stay_id].in_time)
+                     for icu_stay_id in icu_stay_ids], dtype=np.int64)
+
+
+def stay_rows(store, icu_stay_ids):
+    """
+    :return: (rows, stay_index) - the row indexes in the store of the events of all the stays, and the position in
+    icu_stay_ids of the stay of every row.
+    """
+    if len(store.stay_ids) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    position = np.minimum(np.searchsorted(store.stay_ids, icu_stay_ids), len(store.stay_ids) - 1)
+    found = store.stay_ids[position] == icu_stay_ids
+    starts = np.where(found, store.stay_starts[position], 0).astype(np.int64)
+    lengths = np.where(found, store.stay_stops[position] - store.stay_starts[position], 0).astype(np.int64)
+
+    stay_index = np.repeat(np.arange(len(icu_stay_ids)), lengths)
+    # offset of every row inside its own stay, then shifted to the start of the stay in the store.
+    first_output = np.cumsum(lengths) - lengths
+    rows = np.arange(lengths.sum()) - np.repeat(first_output, lengths) + np.repeat(starts, lengths)
+    return rows, stay_index
+
+
+def select_items(store, rows, stay_index, sorted_items, item_order):
+    """
+    keeps the rows of some items.
+    :param rows: row indexes in the store.
+    :param stay_index: see stay_rows.
+    :param sorted_items: the ITEMIDs to keep, sorted.
+    :param item_order: the position of every one of sorted_items in the original list of ITEMIDs.
+    :return: (rows, stay_index, item_index) where item_index is the position of the item in the original list.
+    """
+    if len(sorted_items) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    item_id = store.item_id[rows]
+    position = np.minimum(np.searchsorted(sorted_items, item_id), len(sorted_items) - 1)
+    wanted = sorted_items[position] == item_id
+    return rows[wanted], stay_index[wanted], item_order[position[wanted]]
+
+
+def group(sorted_keys):
+    """
+    :return: (unique keys, index of the first occurrence of every key) of a sorted array.
+    """
+    if len(sorted_keys) == 0:
+        return sorted_keys, np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.append(True, sorted_keys[1:] != sorted_keys[:-1]))
+    return sorted_keys[starts], starts
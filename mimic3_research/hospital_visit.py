@@ -1,8 +1,15 @@
 import logging
 import utils
+import stay_summary
 
+ADMISSION_TYPES = frozenset(['ELECTIVE', 'URGENT', 'NEWBORN', 'EMERGENCY'])
+ADMISSION_LOCATIONS = frozenset(['EMERGENCY ROOM ADMIT', 'TRANSFER FROM HOSP/EXTRAM', 'TRANSFER FROM OTHER HEALT',
+                                 'CLINIC REFERRAL/PREMATURE', '** INFO NOT AVAILABLE **', 'TRANSFER FROM SKILLED NUR',
+                                 'TRSF WITHIN THIS FACILITY', 'HMO REFERRAL/SICK', 'PHYS REFERRAL/NORMAL DELI'])
+INSURANCES = frozenset(['Private', 'Medicare', 'Medicaid', 'Government', 'Self Pay'])
 
-class HospitalVisit:
+
+class HospitalVisit(object):
     """Info of a single hospital visit is saved in this object. a patient object might have multiple visits in the
     hospital
 
@@ -49,10 +56,16 @@ class HospitalVisit:
             -icu_stays : dict of all icu stays during patients admission.
 
     """
+    __slots__ = ('hadm_id', 'admittime', 'dischtime', 'death_time', 'admission_type', 'admission_location',
+                 'insurance', 'language', 'religion', 'martial_status', 'etnhicity', 'ed_reg_time', 'ed_out_time',
+                 'diagnosis', 'icu_stays')
 
     def __init__(self, hadm_id, admittime, dischtime, death_time, admission_type, admission_location, insurance,
-                 language, religion, martial_status, etnhicity, ed_reg_time, ed_out_time, diagnosis):
-        """Init hospital_visit with all the attributes defined in the admissions.csv file."""
+                 language, religion, martial_status, etnhicity, ed_reg_time, ed_out_time, diagnosis, validate=True):
+        """Init hospital_visit with all the attributes defined in the admissions.csv file.
+            :param validate: check the categorical fields. the database validates whole chunks of ADMISSIONS.csv
+            instead (see validation.py) and skips the per row checks.
+        """
         '''
         if int(hadm_id) < 1000000 or int(hadm_id) > 1999999:
             logging.error('hadm_id %d not in range.', hadm_id)
@@ -63,39 +76,59 @@ class HospitalVisit:
         self.dischtime = utils.convert_to_date_time_object(dischtime)
         self.death_time = utils.convert_to_date_time_object(death_time)
 
-        if death_time != '' and death_time != dischtime:
-            logging.warning("Death time and disch time are not the same for hadm_id: %d", self.hadm_id)
-
-        if admission_type not in ['ELECTIVE', 'URGENT', 'NEWBORN', 'EMERGENCY']:
-            logging.error('admission_type invalid value %s', admission_type)
-            raise ValueError('admission_type invalid value %s', admission_type)
-
-        self.admission_type = admission_type
-
-        if admission_location not in ['EMERGENCY ROOM ADMIT', 'TRANSFER FROM HOSP/EXTRAM', 'TRANSFER FROM OTHER HEALT',
-                                      'CLINIC REFERRAL/PREMATURE', '** INFO NOT AVAILABLE **',
-                                      'TRANSFER FROM SKILLED NUR', 'TRSF WITHIN THIS FACILITY', 'HMO REFERRAL/SICK',
-                                      'PHYS REFERRAL/NORMAL DELI']:
-            logging.error('admission_location invalid value %s', admission_location)
-            raise ValueError('admission_location invalid value %s', admission_location)
-
-        self.admission_location = admission_location
-
-        if insurance not in ['Private', 'Medicare', 'Medicaid', 'Government', 'Self Pay'] :
-            logging.error('insurance %s invalid.', insurance)
-            raise ValueError('insurance invalid value %s', insurance)
-
-        self.insurance = insurance
-        self.language = language
-        self.religion = religion
-        self.martial_status = martial_status
-        self.etnhicity = etnhicity
+        if validate:
+            if death_time != '' and death_time != dischtime:
+                logging.warning("Death time and disch time are not the same for hadm_id: %d", self.hadm_id)
+
+            if admission_type not in ADMISSION_TYPES:
+                logging.error('admission_type invalid value %s', admission_type)
+                raise ValueError('admission_type invalid value %s', admission_type)
+
+            if admission_location not in ADMISSION_LOCATIONS:
+                logging.error('admission_location invalid value %s', admission_location)
+                raise ValueError('admission_location invalid value %s', admission_location)
+
+            if insurance not in INSURANCES:
+                logging.error('insurance %s invalid.', insurance)
+                raise ValueError('insurance invalid value %s', insurance)
+
+        self.admission_type = utils.intern_string(admission_type)
+        self.admission_location = utils.intern_string(admission_location)
+        self.insurance = utils.intern_string(insurance)
+        self.language = utils.intern_string(language)
+        self.religion = utils.intern_string(religion)
+        self.martial_status = utils.intern_string(martial_status)
+        self.etnhicity = utils.intern_string(etnhicity)
         self.ed_reg_time = utils.convert_to_date_time_object(ed_reg_time)
         self.ed_out_time = utils.convert_to_date_time_object(ed_out_time)
+        # free text, interning it would keep every distinct diagnosis alive for the lifetime of the process.
         self.diagnosis = diagnosis
 
         self.icu_stays = {}
-        self.num_of_icu_stays = 0
+
+    @property
+    def num_of_icu_stays(self):
+        return len(self.icu_stays)
+
+    @property
+    def summary(self):
+        """
+        :return: stay_summary.StaySummary of the events of all the icu stays of the admission, rolled up from the
+        cached summaries of the stays.
+        """
+        return stay_summary.combine([stay.summary for stay in self.icu_stays.values()])
+
+    @staticmethod
+    def from_row(row, validate=True):
+        """
+        :param row: dict of an ADMISSIONS.csv row.
+        :param validate: check the categorical fields of the row.
+        :return: HospitalVisit
+        """
+        return HospitalVisit(row['HADM_ID'], row['ADMITTIME'], row['DISCHTIME'], row['DEATHTIME'],
+                             row['ADMISSION_TYPE'], row['ADMISSION_LOCATION'], row['INSURANCE'], row['LANGUAGE'],
+                             row['RELIGION'], row['MARITAL_STATUS'], row['ETHNICITY'], row['EDREGTIME'],
+                             row['EDOUTTIME'], row['DIAGNOSIS'], validate)
 
     def add_icu_stay(self, icu_stay):
         """
@@ -103,7 +136,7 @@ class HospitalVisit:
         :param icu_stay:
         :return:
         """
-        if icu_stay.icu_stay_id in self.icu_stays.keys():
+        if icu_stay.icu_stay_id in self.icu_stays:
             logging.error('icu_stay_id already exists in this admission. adm %d, icu_stay %d', self.hadm_id,
                           icu_stay.icu_stay_id)
             raise ValueError('icu_stay_id already exists in this admission. adm %d, icu_stay %d', self.hadm_id,
@@ -118,7 +151,7 @@ class HospitalVisit:
         :param icu_stay_id : id of the icu stay
         :return:
         """
-        if icu_stay_id not in self.icu_stays.keys():
+        if icu_stay_id not in self.icu_stays:
             logging.warning("event from icu stay id %d  doesn't belong to any of the icu stays in this admission %d",
                             icu_stay_id, self.hadm_id)
             return
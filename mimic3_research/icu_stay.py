@@ -1,5 +1,12 @@
 import logging
 import utils
+import event_store
+import stay_summary
+
+# the store of the stays that have no events yet, shared by all of them. appending to a stay copies its events into
+# a private store, so the shared store stays empty.
+_NO_EVENTS = event_store.EventStore.empty()
+
 
 class IcuStay(object):
     """
@@ -23,46 +30,97 @@ class IcuStay(object):
             - LOS: is the length of stay for the patient for the given ICU stay, which may include one or more ICU units
             - was_tranferd : boolean indecating if the patient was transfered during his icu stay.
 
-            - time_series : dictionary that each key is a time and the value is a doctionay of events that happend at
-            that time.
+            - time_series : event_store.StayEvents view over the events of the stay, ordered by chart time and
+            item id. answers events_at(time) and item_series(item_id) queries.
+            - summary : stay_summary.StaySummary of time_series (counts per item, first and last chart time,
+            min/max/mean of VALUENUM). computed on first use and kept until the events of the stay change.
 
     """
+    __slots__ = ('icu_stay_id', 'db_source', 'first_care_u', 'last_care_u', 'first_ward_id', 'last_ward_id', 'in_time',
+                 'out_time', 'len_of_stay', 'time_series', '_summary')
+
     def __init__(self, icu_stay_id, db_source, first_care_u, last_care_u, first_ward_id, last_ward_id, in_time,
                  out_time, len_of_stay):
         """Init Patient with all the attributes defined in the patients.csv file."""
         self.icu_stay_id = int(icu_stay_id)
-        self.db_source = db_source
-        self.first_care_u = first_care_u
-        self.last_care_u = last_care_u
-        self.first_ward_id = first_ward_id
-        self.last_ward_id = last_ward_id
+        self.db_source = utils.intern_string(db_source)
+        self.first_care_u = utils.intern_string(first_care_u)
+        self.last_care_u = utils.intern_string(last_care_u)
+        self.first_ward_id = utils.intern_string(first_ward_id)
+        self.last_ward_id = utils.intern_string(last_ward_id)
         self.in_time = utils.convert_to_date_time_object(in_time)
         self.out_time = utils.convert_to_date_time_object(out_time)
         self.len_of_stay = len_of_stay
         if self.len_of_stay != '':
             self.len_of_stay = float(len_of_stay)
 
-        self.was_tranferd = ((self.first_ward_id != self.last_ward_id) or (self.first_care_u != self.last_care_u))
+        self.time_series = _NO_EVENTS.stay_events(self.icu_stay_id)
+        self._summary = None
+
+    @property
+    def was_tranferd(self):
+        return (self.first_ward_id != self.last_ward_id) or (self.first_care_u != self.last_care_u)
+
+    @property
+    def summary(self):
+        if self._summary is None:
+            self._summary = stay_summary.summarize(self.time_series)
+        return self._summary
 
-        self.time_series = {}
+    @staticmethod
+    def from_row(row):
+        """
+        :param row: dict of an ICUSTAYS.csv row.
+        :return: IcuStay
+        """
+        return IcuStay(row['ICUSTAY_ID'], row['DBSOURCE'], row['FIRST_CAREUNIT'], row['LAST_CAREUNIT'],
+                       row['FIRST_WARDID'], row['LAST_WARDID'], row['INTIME'], row['OUTTIME'], row['LOS'])
 
     def add_event(self, event):
         """
-        adds an event object to a patient.
+        adds an event object to a patient. an item that is inserted twice at the same time is kept twice, and
+        time_series.events_at returns the last one. raises ValueError once the stay is part of a database, whose
+        events are added with ICUDatabase.add_events.
         :param event:
         :return:
         """
-        event_time = event.chart_time
-        if event_time in self.time_series.keys():
-            if event.item_id in self.time_series[event_time].keys():
-                logging.warning("item_id %d was already inserted in the current time %s", event.item_id, str(event_time))
-                # raise ValueError("item_id %d was already inserted in the current time %s", event.item_id,
-                #                 str(event_time))
+        self.time_series.append_event(self.icu_stay_id, event)
+        self._summary = None
+        return
+
+    def series(self, item_id, start=None, end=None):
+        """
+        returns the time series of a single item, optionally in a time range. costs a binary search in the events of
+        the stay, not a scan.
+        :param item_id: ITEMID
+        :param start: datetime object or seconds since epoch, None for the beginning of the stay.
+        :param end: datetime object or seconds since epoch (inclusive), None for the end of the stay.
+        :return: (chart_time, value_num) numpy arrays ordered by time, times in seconds since epoch.
+        """
+        return self.time_series.series(item_id, start, end)
 
-            self.time_series[event_time][event.item_id] = event
+    def as_of(self, item_id, chart_time):
+        """
+        :param item_id: ITEMID
+        :param chart_time: datetime object or seconds since epoch.
+        :return: the last event_store.EventRow of the item at or before chart_time, None if there is none.
+        """
+        return self.time_series.as_of(item_id, chart_time)
 
-        else:
-            self.time_series[event_time] = {}
-            self.time_series[event_time][event.item_id] = event
+    def set_events(self, events):
+        """
+        replaces the events of the stay with a view over an event store.
+        :param events: event_store.StayEvents of this stay.
+        :return:
+        """
+        self.time_series = events
+        self._summary = None
 
-        return
+    def set_summary(self, summary):
+        """
+        sets the cached summary of the stay, used by ICUDatabase.compute_stay_summaries that computes the summaries of
+        all the stays at once.
+        :param summary: stay_summary.StaySummary of the current events of the stay.
+        :return:
+        """
+        self._summary = summary
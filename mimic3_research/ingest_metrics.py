@@ -0,0 +1,174 @@
+import collections
+import json
+import logging
+import time
+
+# anomaly types counted while events are read.
+MISSING_HADM_ID = 'missing_hadm_id'
+MISSING_ICUSTAY_ID = 'missing_icustay_id'
+UNKNOWN_ICU_STAY = 'unknown_icu_stay'
+OUTSIDE_ICU_STAYS = 'outside_icu_stays'
+DUPLICATE_ITEM_AT_TIME = 'duplicate_item_at_time'
+NUMERIC_VALUE_WITHOUT_VALUENUM = 'numeric_value_without_valuenum'
+
+DEFAULT_REPORT_INTERVAL = 10.0
+DEFAULT_MAX_BAD_ROWS = 1000
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+class ProgressReporter(object):
+    """
+    Logs the progress of reading a table at most once every interval seconds, with rows/sec, MB/sec and the ETA when
+    the size of the table is known. replaces logging every few rows.
+    """
+    def __init__(self, table_name, total_bytes=None, interval=DEFAULT_REPORT_INTERVAL, clock=time.time):
+        """
+        :param table_name: name of the table, for the log lines.
+        :param total_bytes: size of the file, None if unknown (for example a compressed file).
+        :param interval: minimal seconds between two log lines.
+        :param clock: function that returns the current time in seconds.
+        """
+        self.table_name = table_name
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self._clock = clock
+        self.start_time = clock()
+        self._last_report = self.start_time
+        self.num_of_rows = 0
+        self.num_of_bytes = 0
+
+    def update(self, num_of_rows, num_of_bytes=0):
+        """
+        adds the rows and bytes that were read since the last update and logs the progress if it is time to.
+        :param num_of_rows: number of rows read.
+        :param num_of_bytes: number of bytes of the file read.
+        :return:
+        """
+        self.num_of_rows += num_of_rows
+        self.num_of_bytes += num_of_bytes
+        now = self._clock()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            logging.info("%s", self.status(now))
+
+    def status(self, now=None, eta=True):
+        """
+        :param eta: add the percent of the table that was read and the estimated time to read the rest.
+        :return: a line describing the progress of the read.
+        """
+        elapsed = max((now or self._clock()) - self.start_time, 1e-9)
+        line = "%s: %d rows, %.0f rows/s, %.1f MB/s" % (self.table_name, self.num_of_rows, self.num_of_rows / elapsed,
+                                                       self.num_of_bytes / elapsed / 1e6)
+        if eta and self.total_bytes and self.num_of_bytes:
+            remaining = (self.total_bytes - self.num_of_bytes) * elapsed / self.num_of_bytes
+            line += ", %d%% ETA %s" % (100 * self.num_of_bytes // self.total_bytes, _format_duration(remaining))
+        return line
+
+    def finish(self):
+        """
+        logs the summary of the read.
+        :return: seconds the read took.
+        """
+        elapsed = self._clock() - self.start_time
+        logging.info("DONE %s in %s", self.status(eta=False), _format_duration(elapsed))
+        return elapsed
+
+
+class BadRowSampler(object):
+    """
+    Keeps a bounded sample of the bad rows of every anomaly type: the first max_rows of each type. with a path the
+    rows are written to that side file as json lines instead of being kept in memory.
+
+        Attributes:
+            - rows: dict anomaly type -> list of the sampled rows, when there is no path.
+    """
+    def __init__(self, path=None, max_rows=DEFAULT_MAX_BAD_ROWS):
+        """
+        :param path: file to write the sampled rows to, None keeps them in memory.
+        :param max_rows: number of rows sampled of every anomaly type.
+        """
+        self.path = path
+        self.max_rows = max_rows
+        self.rows = collections.defaultdict(list)
+        self._counts = collections.Counter()
+        self._file = None
+
+    def add(self, table_name, anomaly, rows):
+        """
+        :param table_name: table the rows came from.
+        :param anomaly: anomaly type of the rows.
+        :param rows: list of dicts.
+        :return:
+        """
+        taken = rows[:max(0, self.max_rows - self._counts[anomaly])]
+        self._counts[anomaly] += len(taken)
+        if not taken:
+            return
+        if self.path is None:
+            self.rows[anomaly].extend(taken)
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        for row in taken:
+            self._file.write(json.dumps({'table': table_name, 'anomaly': anomaly, 'row': row}) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class IngestMetrics(object):
+    """
+    Counters of anomalies per table and type, and the bad rows sample of an ingest.
+
+        Attributes:
+            - anomalies: dict table name -> collections.Counter anomaly type -> number of rows.
+            - bad_rows: BadRowSampler
+            - report_interval: seconds between progress log lines.
+            - reads: list of the ProgressReporter of every table read, with its number of rows and bytes.
+    """
+    def __init__(self, bad_rows_path=None, max_bad_rows=DEFAULT_MAX_BAD_ROWS, report_interval=DEFAULT_REPORT_INTERVAL):
+        self.anomalies = collections.defaultdict(collections.Counter)
+        self.bad_rows = BadRowSampler(bad_rows_path, max_bad_rows)
+        self.report_interval = report_interval
+        self.reads = []
+
+    def progress(self, table_name, total_bytes=None):
+        """
+        :return: ProgressReporter for a read of a table.
+        """
+        progress = ProgressReporter(table_name, total_bytes, self.report_interval)
+        self.reads.append(progress)
+        return progress
+
+    def count(self, table_name, anomalies, bad_rows=None):
+        """
+        adds the anomalies of a chunk of a table.
+        :param anomalies: dict anomaly type -> number of rows.
+        :param bad_rows: dict anomaly type -> list of rows that have it, as dicts, to sample from.
+        :return:
+        """
+        self.anomalies[table_name].update(dict((name, count) for name, count in anomalies.items() if count))
+        for anomaly, rows in (bad_rows or {}).items():
+            self.bad_rows.add(table_name, anomaly, rows)
+
+    def log_summary(self, table_name):
+        """
+        logs one warning with the anomaly counters of a table.
+        """
+        counters = self.anomalies.get(table_name)
+        if counters:
+            logging.warning("%s anomalies: %s", table_name,
+                            ', '.join('%s=%d' % (name, count) for name, count in sorted(counters.items())))
+
+    def report(self):
+        """
+        :return: dict table name -> dict anomaly type -> number of rows.
+        """
+        return dict((table_name, dict(counters)) for table_name, counters in self.anomalies.items())
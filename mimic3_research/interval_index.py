@@ -0,0 +1,90 @@
+import numpy as np
+import table_reader
+import utils
+
+
+class StayIntervalIndex(object):
+    """
+    Sorted index of the [INTIME, OUTTIME] window of every icu stay, grouped by admission. assigns events that only
+    carry a HADM_ID (LABEVENTS, some OUTPUTEVENTS) to the icu stay of their admission that was open at the time of
+    the event, with one binary search per event instead of scanning all the stays.
+    """
+    def __init__(self, hadm_ids, icu_stay_ids, in_times, out_times):
+        """
+        :param hadm_ids: HADM_ID of every icu stay.
+        :param icu_stay_ids: ICUSTAY_ID of every icu stay.
+        :param in_times: INTIME of every icu stay, seconds since epoch.
+        :param out_times: OUTTIME of every icu stay, seconds since epoch.
+        """
+        hadm_ids = np.asarray(hadm_ids, dtype=np.int64)
+        in_times = np.asarray(in_times, dtype=np.int64)
+        out_times = np.asarray(out_times, dtype=np.int64)
+        known = (in_times != utils.MISSING_TIME) & (out_times != utils.MISSING_TIME)
+
+        order = np.lexsort((in_times[known], hadm_ids[known]))
+        self.hadm_ids = hadm_ids[known][order]
+        self.icu_stay_ids = np.asarray(icu_stay_ids, dtype=np.int64)[known][order]
+        self.in_times = in_times[known][order]
+        self.out_times = out_times[known][order]
+
+        # every admission gets its own band of (admission rank, time) keys, so a single sorted int64 key orders the
+        # stays by admission and then by in time.
+        self._admissions = np.unique(self.hadm_ids)
+        self._min_time = self.in_times.min() if len(self.in_times) else 0
+        self._span = (self.out_times.max() - self._min_time + 1) if len(self.in_times) else 1
+        ranks = np.searchsorted(self._admissions, self.hadm_ids)
+        self._keys = self._key(ranks, self.in_times)
+        # the latest OUTTIME of the stays of the admission up to every stay. stays of an admission may overlap, an
+        # event after the OUTTIME of the last stay that started before it can still be inside an earlier stay.
+        self._max_out_times = self._running_max(ranks, self.out_times)
+
+    def __len__(self):
+        return len(self.icu_stay_ids)
+
+    def _key(self, admission_rank, times):
+        clipped = np.clip(times - self._min_time, -1, self._span)
+        return admission_rank * (self._span + 2) + clipped + 1
+
+    def _running_max(self, admission_rank, times):
+        """
+        :return: the maximum of the times up to every stay, restarting at the first stay of every admission.
+        """
+        if len(times) == 0:
+            return times
+        # the keys of an admission are all larger than the keys of the admissions before it.
+        keys = np.maximum.accumulate(self._key(admission_rank, times))
+        return keys - admission_rank * (self._span + 2) - 1 + self._min_time
+
+    def assign(self, hadm_ids, times):
+        """
+        finds the icu stay of each event.
+        :param hadm_ids: int64 HADM_ID of the events, table_reader.MISSING_ID if missing.
+        :param times: int64 time of the events, seconds since epoch.
+        :return: int64 ICUSTAY_ID of the events, table_reader.MISSING_ID where the admission has no icu stay that was
+        open at that time. an event inside several overlapping stays goes to the one that started last.
+        """
+        hadm_ids = np.asarray(hadm_ids, dtype=np.int64)
+        times = np.asarray(times, dtype=np.int64)
+        assigned = np.full(len(hadm_ids), table_reader.MISSING_ID, dtype=np.int64)
+        if len(self._keys) == 0:
+            return assigned
+
+        rank = np.minimum(np.searchsorted(self._admissions, hadm_ids), len(self._admissions) - 1)
+        known = (self._admissions[rank] == hadm_ids) & (times != utils.MISSING_TIME)
+        # the last stay of the admission that started at or before the event.
+        position = np.searchsorted(self._keys, self._key(rank, times), side='right') - 1
+        position = np.maximum(position, 0)
+        started = known & (self.hadm_ids[position] == hadm_ids) & (self.in_times[position] <= times)
+        inside = started & (times <= self.out_times[position])
+        assigned[inside] = self.icu_stay_ids[position[inside]]
+
+        # events after the OUTTIME of that stay that are inside an earlier stay of the admission step back one stay at
+        # a time, as many steps as the deepest overlap.
+        pending = np.flatnonzero(started & ~inside & (times <= self._max_out_times[position]))
+        while len(pending):
+            position[pending] -= 1
+            inside = times[pending] <= self.out_times[position[pending]]
+            assigned[pending[inside]] = self.icu_stay_ids[position[pending[inside]]]
+            pending = pending[~inside]
+            pending = pending[times[pending] <= self._max_out_times[position[pending]]]
+        return assigned
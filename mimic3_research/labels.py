@@ -0,0 +1,174 @@
+import logging
+import numpy as np
+import utils
+
+DAY = 24 * 3600
+DEFAULT_LOS_DAYS = 3
+DEFAULT_READMISSION_DAYS = 30
+DEFAULT_MORTALITY_DAYS = 30
+
+# labels compute returns for every icu stay.
+LABELS = ('los_days', 'long_stay', 'icu_mortality', 'in_hospital_mortality', 'mortality_after_discharge',
+          'readmission', 'icu_readmission')
+
+
+class LabelTable(object):
+    """
+    Labels of icu stays as columns aligned by ICUSTAY_ID, sorted by it, so joining them with features is a binary
+    search instead of a dict lookup per stay.
+
+        Attributes:
+            - icu_stay_ids: sorted ICUSTAY_IDs.
+            - hadm_ids: HADM_ID of every stay.
+            - subject_ids: SUBJECT_ID of every stay.
+            - columns: dict label name -> array aligned with icu_stay_ids.
+    """
+    def __init__(self, icu_stay_ids, hadm_ids, subject_ids, columns):
+        self.icu_stay_ids = icu_stay_ids
+        self.hadm_ids = hadm_ids
+        self.subject_ids = subject_ids
+        self.columns = columns
+
+    @property
+    def names(self):
+        return sorted(self.columns)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self.icu_stay_ids)
+
+    def positions(self, icu_stay_ids):
+        """
+        :param icu_stay_ids: ICUSTAY_IDs in any order.
+        :return: the row of every stay in the table.
+        """
+        icu_stay_ids = np.asarray(icu_stay_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.icu_stay_ids, icu_stay_ids), max(len(self.icu_stay_ids) - 1, 0))
+        if len(icu_stay_ids) and (len(self.icu_stay_ids) == 0 or
+                                  not np.array_equal(self.icu_stay_ids[positions], icu_stay_ids)):
+            unknown = np.setdiff1d(icu_stay_ids, self.icu_stay_ids)
+            logging.error("no labels of icu stays %s", unknown[:10].tolist())
+            raise ValueError("no labels of icu stays %s" % unknown[:10].tolist())
+        return positions
+
+    def take(self, name, icu_stay_ids):
+        """
+        :param name: one of LABELS.
+        :param icu_stay_ids: ICUSTAY_IDs in any order, for example FeatureMatrix.icu_stay_ids.
+        :return: the label of every stay, aligned with icu_stay_ids.
+        """
+        return self.columns[name][self.positions(icu_stay_ids)]
+
+
+def _died_between(death_times, dods, starts, ends):
+    """
+    :param death_times: exact times of death, MISSING_TIME when unknown.
+    :param dods: dates of death (midnight), MISSING_TIME when the patient didn't die.
+    :param starts: start of every window.
+    :param ends: end of every window.
+    :return: bool array, True where the patient died in [start, end]. without an exact time a death on the day of the
+    start or end counts.
+    """
+    exact = death_times != utils.MISSING_TIME
+    by_time = exact & (death_times >= starts) & (death_times <= ends)
+    # the midnight of a missing start only excluded the window because it wrapped around int64.
+    known_dod = ~exact & (dods != utils.MISSING_TIME) & (starts != utils.MISSING_TIME)
+    by_date = known_dod & (dods >= starts - starts % DAY) & (dods <= ends)
+    return by_time | by_date
+
+
+def _next_in_group(groups, times):
+    """
+    :param groups: group of every row, for example SUBJECT_ID.
+    :param times: time of every row.
+    :return: (next_rows, has_next) - the row that follows every row in its group by time, and whether there is one.
+    """
+    order = np.lexsort((times, groups))
+    next_rows = np.zeros(len(groups), dtype=np.int64)
+    has_next = np.zeros(len(groups), dtype=bool)
+    if len(order) > 1:
+        same = groups[order[1:]] == groups[order[:-1]]
+        next_rows[order[:-1]] = order[1:]
+        has_next[order[:-1]] = same
+    return next_rows, has_next
+
+
+def _lookup(keys, sorted_keys, order):
+    """
+    :param keys: keys to look up, all present in sorted_keys.
+    :param sorted_keys: the keys of a table sorted, sorted_keys = table_keys[order].
+    :param order: argsort of the table keys.
+    :return: the row in the table of every key.
+    """
+    return order[np.searchsorted(sorted_keys, keys)]
+
+
+def compute(tables, los_days=DEFAULT_LOS_DAYS, readmission_days=DEFAULT_READMISSION_DAYS,
+            mortality_days=DEFAULT_MORTALITY_DAYS):
+    """
+    computes the outcome labels of all the icu stays at once from the columns of the patients, admissions and icu
+    stays:
+        - los_days: length of the stay in days, LOS or OUTTIME - INTIME when LOS is empty, nan if unknown.
+        - long_stay: the stay is longer than los_days days.
+        - icu_mortality: the patient died during the icu stay.
+        - in_hospital_mortality: the patient died during the admission of the stay (DEATHTIME, or DOD between
+        ADMITTIME and DISCHTIME).
+        - mortality_after_discharge: the patient died within mortality_days of DISCHTIME.
+        - readmission: the patient was admitted again within readmission_days of DISCHTIME. admissions that ended in
+        death are never readmitted.
+        - icu_readmission: a later icu stay of the same admission exists (bounce back to the icu).
+    readmissions are found by sorting the admissions by patient and ADMITTIME and comparing every admission with the
+    next one, not by comparing pairs of admissions.
+    :param tables: dict table name -> dict csv column -> numpy array, as ICUDatabase.table_arrays.
+    :param los_days: days of a long stay.
+    :param readmission_days: days after discharge a new admission counts as a readmission.
+    :param mortality_days: days after discharge a death counts in mortality_after_discharge.
+    :return: LabelTable
+    """
+    patients, admissions, stays = tables['patients'], tables['admissions'], tables['icu_stays']
+
+    patient_order = np.argsort(patients['SUBJECT_ID'], kind='mergesort')
+    sorted_subject_ids = np.asarray(patients['SUBJECT_ID'])[patient_order]
+    admission_dods = np.asarray(patients['DOD'])[_lookup(admissions['SUBJECT_ID'], sorted_subject_ids,
+                                                         patient_order)]
+    admit_times = np.asarray(admissions['ADMITTIME'])
+    discharge_times = np.asarray(admissions['DISCHTIME'])
+    death_times = np.asarray(admissions['DEATHTIME'])
+
+    # admission labels.
+    hospital_death = _died_between(death_times, admission_dods, admit_times, discharge_times)
+    after_discharge = ~hospital_death & (admission_dods != utils.MISSING_TIME) & \
+        (admission_dods >= discharge_times - discharge_times % DAY) & \
+        (admission_dods <= discharge_times + mortality_days * DAY)
+    next_admission, has_next = _next_in_group(np.asarray(admissions['SUBJECT_ID']), admit_times)
+    readmitted = has_next & ~hospital_death & (discharge_times != utils.MISSING_TIME) & \
+        (admit_times[next_admission] != utils.MISSING_TIME) & \
+        (admit_times[next_admission] - discharge_times <= readmission_days * DAY)
+
+    # stay labels, stays sorted by ICUSTAY_ID.
+    stay_order = np.argsort(stays['ICUSTAY_ID'], kind='mergesort')
+    icu_stay_ids = np.asarray(stays['ICUSTAY_ID'], dtype=np.int64)[stay_order]
+    hadm_ids = np.asarray(stays['HADM_ID'], dtype=np.int64)[stay_order]
+    subject_ids = np.asarray(stays['SUBJECT_ID'], dtype=np.int64)[stay_order]
+    in_times = np.asarray(stays['INTIME'])[stay_order]
+    out_times = np.asarray(stays['OUTTIME'])[stay_order]
+    admission_order = np.argsort(admissions['HADM_ID'], kind='mergesort')
+    admission = _lookup(hadm_ids, np.asarray(admissions['HADM_ID'])[admission_order], admission_order)
+
+    los = np.asarray(stays['LOS'], dtype=np.float64)[stay_order]
+    known_times = (in_times != utils.MISSING_TIME) & (out_times != utils.MISSING_TIME)
+    los = np.where(np.isnan(los) & known_times, (out_times - in_times) / float(DAY), los)
+
+    has_next_stay = _next_in_group(hadm_ids, in_times)[1]
+
+    columns = {'los_days': los,
+               'long_stay': los > los_days,
+               'icu_mortality': _died_between(death_times[admission], admission_dods[admission], in_times, out_times)
+               & known_times,
+               'in_hospital_mortality': hospital_death[admission],
+               'mortality_after_discharge': after_discharge[admission],
+               'readmission': readmitted[admission],
+               'icu_readmission': has_next_stay}
+    return LabelTable(icu_stay_ids, hadm_ids, subject_ids, columns)
@@ -0,0 +1,132 @@
+import collections
+import numpy as np
+import hospital_visit
+import icu_stay
+import patient
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class LazyPatients(Mapping):
+    """
+    Read only dict of SUBJECT_ID -> Patient over the memory mapped tables of a snapshot. a patient is built, with its
+    hospital visits and icu stays, only when it is accessed, and the time series of its stays are views over the
+    memory mapped event store, so only the pages of that patient are read from disk. the most recently used patients
+    are kept in a bounded LRU cache.
+    """
+    def __init__(self, loaded_snapshot, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param loaded_snapshot: snapshot.Snapshot
+        :param cache_size: number of materialized patients to keep.
+        """
+        self._snapshot = loaded_snapshot
+        self._subject_ids = loaded_snapshot.tables['patients']['SUBJECT_ID']
+        self._admission_subject_ids = loaded_snapshot.tables['admissions']['SUBJECT_ID']
+        self._stay_subject_ids = loaded_snapshot.tables['icu_stays']['SUBJECT_ID']
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._subject_ids)
+
+    def __iter__(self):
+        for subject_id in self._subject_ids:
+            yield int(subject_id)
+
+    def __contains__(self, subject_id):
+        return self._position(subject_id) is not None
+
+    def _position(self, subject_id):
+        position = np.searchsorted(self._subject_ids, subject_id)
+        if position < len(self._subject_ids) and self._subject_ids[position] == subject_id:
+            return position
+        return None
+
+    def __getitem__(self, subject_id):
+        cached = self._cache.pop(subject_id, None)
+        if cached is None:
+            position = self._position(subject_id)
+            if position is None:
+                raise KeyError(subject_id)
+            cached = self._materialize(subject_id, position)
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+        self._cache[subject_id] = cached
+        return cached
+
+    def _materialize(self, subject_id, position):
+        """
+        builds a patient with its hospital visits and icu stays from the rows that belong to it.
+        """
+        rows = self._snapshot.rows
+        new_patient = patient.Patient.from_row(next(rows('patients', position, position + 1)))
+
+        start, stop = _id_range(self._admission_subject_ids, subject_id)
+        for row in rows('admissions', start, stop):
+            # the rows of a snapshot passed the validation level of the database that saved it, or were not checked
+            # on purpose with validation 'off'.
+            new_patient.add_hospital_visit(hospital_visit.HospitalVisit.from_row(row, validate=False))
+
+        start, stop = _id_range(self._stay_subject_ids, subject_id)
+        for row in rows('icu_stays', start, stop):
+            new_icu_stay = icu_stay.IcuStay.from_row(row)
+            new_icu_stay.set_events(self._snapshot.events.stay_events(new_icu_stay.icu_stay_id, shared=True))
+            new_patient.add_icu_stay(int(row['HADM_ID']), new_icu_stay)
+        return new_patient
+
+    def clear_cache(self):
+        self._cache.clear()
+
+
+class LazyIcuStays(Mapping):
+    """
+    Read only dict of ICUSTAY_ID -> IcuStay that resolves a stay through the patient it belongs to, so the stay is
+    taken from the patients cache.
+    """
+    def __init__(self, patients, loaded_snapshot):
+        """
+        :param patients: LazyPatients of the same snapshot.
+        :param loaded_snapshot: snapshot.Snapshot
+        """
+        self._patients = patients
+        self._table = loaded_snapshot.tables['icu_stays']
+        self._order = None
+
+    def _position(self, icu_stay_id):
+        # the icu stays table is sorted by SUBJECT_ID, the ICUSTAY_ID order is computed on first use.
+        if self._order is None:
+            self._order = np.argsort(self._table['ICUSTAY_ID'], kind='mergesort')
+        stay_ids = self._table['ICUSTAY_ID']
+        position = np.searchsorted(stay_ids, icu_stay_id, sorter=self._order)
+        if position < len(stay_ids) and stay_ids[self._order[position]] == icu_stay_id:
+            return self._order[position]
+        return None
+
+    def __len__(self):
+        return len(self._table['ICUSTAY_ID'])
+
+    def __iter__(self):
+        for icu_stay_id in self._table['ICUSTAY_ID']:
+            yield int(icu_stay_id)
+
+    def __contains__(self, icu_stay_id):
+        return self._position(icu_stay_id) is not None
+
+    def __getitem__(self, icu_stay_id):
+        position = self._position(icu_stay_id)
+        if position is None:
+            raise KeyError(icu_stay_id)
+        owner = self._patients[int(self._table['SUBJECT_ID'][position])]
+        return owner.hospital_visits[int(self._table['HADM_ID'][position])].icu_stays[icu_stay_id]
+
+
+def _id_range(sorted_ids, key):
+    """
+    :return: (start, stop) of the rows of a sorted id column that equal key.
+    """
+    return np.searchsorted(sorted_ids, key, side='left'), np.searchsorted(sorted_ids, key, side='right')
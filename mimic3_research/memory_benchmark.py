@@ -0,0 +1,88 @@
+import logging
+import sys
+import database
+import event
+
+DEFAULT_NUM_OF_EVENTS = 100000
+
+
+def deep_size(obj, seen):
+    """
+    size in bytes of an object and of everything it refers to, counting every shared object (interned strings,
+    small ints, None) once. event store views are skipped, the event store is measured separately.
+    :param obj: any object.
+    :param seen: set of the ids of the objects that were already counted.
+    :return: int
+    """
+    if id(obj) in seen or type(obj).__name__ in ('StayEvents', 'EventStore'):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+            if hasattr(obj, slot):
+                size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def event_objects(db, num_of_events):
+    """
+    builds ChartEvent objects from the first rows of CHARTEVENTS.csv.
+    :return: list of event.ChartEvent
+    """
+    events = []
+    for i, row in db.read_events_table_by_row('CHARTEVENTS'):
+        if i >= num_of_events:
+            break
+        events.append(event.ChartEvent(row['ITEMID'], row['CHARTTIME'], row['VALUE'], row['VALUENUM'],
+                                       row['VALUEUOM'], row['STORETIME'], row['CGID'], row['WARNING'], row['ERROR'],
+                                       row['RESULTSTATUS'], row['STOPPED']))
+    return events
+
+
+def run(mimic3_dir, num_of_events=DEFAULT_NUM_OF_EVENTS):
+    """
+    reports the memory of the object model on a mimic dataset: bytes per patient, per icu stay and per event object,
+    and bytes per event of the columnar event store.
+    :param mimic3_dir: dir of the mimic csv files (for example the demo files).
+    :param num_of_events: number of CHARTEVENTS rows built as event objects.
+    :return: dict measure -> bytes
+    """
+    db = database.ICUDatabase(mimic3_dir)
+    db.read_patients_table()
+    db.read_hospital_visits_table()
+    db.read_icu_stays_table()
+
+    report = {}
+    seen = set()
+    patients_size = deep_size(db.patients, seen)
+    report['bytes per patient (with visits and stays)'] = patients_size / max(1, db.num_of_patients)
+    report['bytes per icu stay'] = (sum(deep_size(stay, set()) for stay in db.icu_stays.values()) /
+                                    max(1, len(db.icu_stays)))
+
+    events = event_objects(db, num_of_events)
+    report['bytes per event object'] = deep_size(events, set()) / max(1, len(events))
+
+    db.read_chart_events_table()
+    store = db.event_store
+    columns = [store.icu_stay_id, store.item_id, store.chart_time, store.value_num, store.value, store.value_unit,
+               store.cgid, store.source]
+    report['bytes per event in the event store'] = sum(column.nbytes for column in columns) / max(1, len(store))
+
+    for name in sorted(report):
+        print "%s: %d" % (name, report[name])
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.WARNING)
+    if len(sys.argv) < 2:
+        print "usage: python memory_benchmark.py MIMIC3_DIR [NUM_OF_EVENTS]"
+        sys.exit(1)
+    run(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NUM_OF_EVENTS)
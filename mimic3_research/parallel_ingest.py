@@ -0,0 +1,156 @@
+import collections
+import logging
+import multiprocessing
+import os
+import event_ingest
+import ingest_metrics
+import event_store
+import table_reader
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# state shared by all the chunks a worker parses, set once by the pool initializer.
+_worker_state = {}
+
+
+class ChunkResult(object):
+    """
+    The partial result of parsing one byte range of an events table.
+
+        Attributes:
+            - events: event_store.EventStore with the valid events of the chunk, grouped by ICUSTAY_ID.
+            - num_of_rows: number of rows in the chunk.
+            - num_of_bytes: size in bytes of the range.
+            - anomalies: dict ingest_metrics anomaly type -> number of rows of the range that have it. duplicates are
+            counted inside the range only.
+            - bad_rows: dict anomaly type -> bounded sample of the rows that have it, as dicts.
+            - unknown_subjects: SUBJECT_IDs of the chunk that are not in the database.
+            - table_name: the events table of the range.
+    """
+    def __init__(self, events, num_of_rows, num_of_bytes, anomalies, bad_rows, unknown_subjects,
+                 table_name='CHARTEVENTS'):
+        self.table_name = table_name
+        self.events = events
+        self.num_of_rows = num_of_rows
+        self.num_of_bytes = num_of_bytes
+        self.anomalies = anomalies
+        self.bad_rows = bad_rows
+        self.unknown_subjects = unknown_subjects
+
+
+def split_into_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, end=None):
+    """
+    splits a csv file into byte ranges of about chunk_size bytes. every range starts at the beginning of a line and
+    ends right after a new line, the header line is not part of any range.
+    note: a quoted field that spans several lines might be split between two chunks, CHARTEVENTS doesn't have such
+    fields.
+    :param path: path to the csv file.
+    :param chunk_size: approximate size in bytes of each range.
+    :param end: byte offset to split the file up to, must be the end of a line. defaults to the end of the file.
+    :return: list of (start, stop) byte offsets
+    """
+    file_size = os.path.getsize(path) if end is None else end
+    chunks = []
+    with open(path, 'rb') as csv_file:
+        csv_file.readline()
+        start = csv_file.tell()
+        while start < file_size:
+            stop = start + chunk_size
+            if stop >= file_size:
+                stop = file_size
+            else:
+                csv_file.seek(stop - 1)
+                csv_file.readline()
+                stop = csv_file.tell()
+            chunks.append((start, stop))
+            start = stop
+    return chunks
+
+
+def _init_worker(stay_keys, concept_map):
+    _worker_state['stay_keys'] = stay_keys
+    _worker_state['concept_map'] = concept_map
+
+
+def parse_chunk(task):
+    """
+    parses one byte range of an events table into compact columns. runs in a worker process.
+    :param task: (table name, path, start, stop), start and stop are offsets returned by split_into_chunks.
+    :return: ChunkResult
+    """
+    table_name, path, start, stop = task
+    builder = event_store.EventStoreBuilder(concept_map=_worker_state['concept_map'])
+    num_of_rows = 0
+    anomalies = collections.Counter()
+    bad_rows = collections.defaultdict(list)
+    unknown_subjects = []
+    columns, add_chunk = event_ingest.EVENT_TABLES[table_name]
+    with table_reader.TableReader(path, columns, start=start, stop=stop) as reader:
+        for chunk in reader:
+            num_of_rows += len(chunk)
+            status = add_chunk(builder, chunk, _worker_state['stay_keys'])
+            anomalies.update(status.anomalies)
+            for anomaly, rows in status.bad_rows.items():
+                bad_rows[anomaly].extend(rows[:event_ingest.MAX_BAD_ROWS_PER_CHUNK - len(bad_rows[anomaly])])
+            unknown_subjects.extend(status.unknown_subjects)
+        num_of_bytes = reader.offset - (start if start is not None else reader.header_size)
+
+    events = builder.build()
+    anomalies[ingest_metrics.DUPLICATE_ITEM_AT_TIME] += event_ingest.count_duplicates(events)
+    return ChunkResult(events, num_of_rows, num_of_bytes, dict(anomalies), dict(bad_rows), unknown_subjects,
+                       table_name)
+
+
+def read_events_parallel(path, stay_keys, table_name='CHARTEVENTS', num_workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                         end=None, concept_map=None):
+    """
+    parses an events table on several processes. the file is split into line aligned byte ranges, each worker parses
+    its ranges into a partial event store and the partial stores are merged by the caller. a compressed .csv.gz
+    file can't be split and is parsed by a single worker.
+    :param path: path to the csv file of the table.
+    :param stay_keys: event_ingest.StayKeys of the database.
+    :param table_name: one of event_ingest.EVENT_TABLES.
+    :param num_workers: number of processes, defaults to the number of cores.
+    :param chunk_size: approximate size in bytes of each range.
+    :param end: byte offset to read the file up to, the end of the file by default.
+    :param concept_map: d_items.ConceptMap the workers apply to the events, None to keep them as they are.
+    :return: generator of ChunkResult, in the order chunks finish.
+    """
+    return read_tables_parallel([(table_name, path, end)], stay_keys, num_workers, chunk_size, concept_map)
+
+
+def read_tables_parallel(tables, stay_keys, num_workers=None, chunk_size=DEFAULT_CHUNK_SIZE, concept_map=None):
+    """
+    parses several events tables on one pool of processes, the byte ranges of all the tables are queued together so
+    the workers are kept busy until the last range of the last table. see read_events_parallel.
+    :param tables: list of (table name, path, end), end is the byte offset to read the file up to or None.
+    :param stay_keys: event_ingest.StayKeys of the database.
+    :param num_workers: number of processes, defaults to the number of cores.
+    :param chunk_size: approximate size in bytes of each range.
+    :param concept_map: d_items.ConceptMap the workers apply to the events, None to keep them as they are.
+    :return: generator of ChunkResult, in the order chunks finish.
+    """
+    num_workers = num_workers or multiprocessing.cpu_count()
+    tasks = []
+    for table_name, path, end in tables:
+        if path.endswith('.gz'):
+            logging.warning("%s is compressed and can't be split into byte ranges, it is parsed by a single worker",
+                            path)
+            # the whole file is the longest task, it starts first.
+            tasks.insert(0, (table_name, path, None, None))
+        else:
+            tasks.extend((table_name, path, start, stop) for start, stop in split_into_chunks(path, chunk_size, end))
+    names = ', '.join(path for table_name, path, end in tables)
+    logging.info("Parsing %s in %d chunks on %d workers", names, len(tasks), num_workers)
+
+    pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(stay_keys, concept_map))
+    try:
+        for i, result in enumerate(pool.imap_unordered(parse_chunk, tasks)):
+            logging.info("Parsed %d of %d chunks of %s", i + 1, len(tasks), names)
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
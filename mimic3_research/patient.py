@@ -1,5 +1,6 @@
 import logging
 import utils
+import stay_summary
 
 
 class Patient(object):
@@ -23,19 +24,44 @@ class Patient(object):
              the patient to the social security master death index (DOD_SSN).
         """
 
+    __slots__ = ('id', 'gender', 'dob', 'dod', 'dod_hosp', 'dod_ssn', 'expire_flag', 'hospital_visits')
+
     def __init__(self, subject_id, gender, dob, dod, dod_hosp, dod_ssn, expire_flag):
         """Init Patient with all the attributes defined in the patients.csv file."""
         self.id = int(subject_id)
-        self.gender = gender
+        self.gender = utils.intern_string(gender)
         self.dob = utils.convert_to_date_time_object(dob)
         self.dod = utils.convert_to_date_time_object(dod)
         self.dod_hosp = utils.convert_to_date_time_object(dod_hosp)
         self.dod_ssn = utils.convert_to_date_time_object(dod_ssn)
-        self.expire_flag = expire_flag
+        self.expire_flag = utils.intern_string(expire_flag)
 
         self.hospital_visits = {}
-        self.num_of_hospital_visits = 0
-        self.total_num_of_icu_stays = 0
+
+    @property
+    def num_of_hospital_visits(self):
+        return len(self.hospital_visits)
+
+    @property
+    def total_num_of_icu_stays(self):
+        return sum(len(visit.icu_stays) for visit in self.hospital_visits.values())
+
+    @property
+    def summary(self):
+        """
+        :return: stay_summary.StaySummary of the events of all the icu stays of the patient.
+        """
+        return stay_summary.combine([stay.summary for visit in self.hospital_visits.values()
+                                     for stay in visit.icu_stays.values()])
+
+    @staticmethod
+    def from_row(row):
+        """
+        :param row: dict of a PATIENTS.csv row.
+        :return: Patient
+        """
+        return Patient(int(row['SUBJECT_ID']), row['GENDER'], row['DOB'], row['DOD'], row['DOD_HOSP'], row['DOD_SSN'],
+                       row['EXPIRE_FLAG'])
 
     def add_hospital_visit(self, hosp_visit):
         """
@@ -48,12 +74,11 @@ class Patient(object):
             logging.warning('visit info states the patient died in hospital while patient info doesnt. '
                             'patient id: %d, hadm id: %d', self.id, hosp_visit.hadm_id)
 
-        if hosp_visit.hadm_id in self.hospital_visits.keys():
+        if hosp_visit.hadm_id in self.hospital_visits:
             logging.error('hadm_id already exists in patient. patient %d, hadm_id %d', self.id, hosp_visit.hadm_id)
             raise ValueError('hadm_id already exists in patient. patient %d, hadm_id %d', self.id, hosp_visit.hadm_id)
 
         self.hospital_visits[hosp_visit.hadm_id] = hosp_visit
-        self.num_of_hospital_visits += 1
 
     def add_icu_stay(self, admission_id, icu_stay):
         """
@@ -62,12 +87,11 @@ class Patient(object):
         :param icu_stay:
         :return:
         """
-        if admission_id not in self.hospital_visits.keys():
+        if admission_id not in self.hospital_visits:
             logging.error('hadm_id does not exists in patient. patient %d, hadm_id %d', self.id, admission_id)
             raise ValueError('hadm_id does not exists in patient. patient %d, hadm_id %d' % (self.id, admission_id))
 
         self.hospital_visits[admission_id].add_icu_stay(icu_stay)
-        self.total_num_of_icu_stays += 1
 
     def add_event(self, admission_id, icu_stay_id, event):
         """
@@ -77,7 +101,7 @@ class Patient(object):
         :param event:
         :return:
         """
-        if admission_id not in self.hospital_visits.keys():
+        if admission_id not in self.hospital_visits:
             logging.error('hadm_id does not exists in patient. patient %d, hadm_id %d', self.id, admission_id)
             raise ValueError('hadm_id does not exists in patient. patient %d, hadm_id %d' % (self.id, admission_id))
 
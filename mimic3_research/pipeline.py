@@ -0,0 +1,239 @@
+import logging
+import multiprocessing
+import Queue
+import sys
+import threading
+import time
+import table_reader
+
+# chunks a parser may read ahead of the builder of its table before it blocks.
+DEFAULT_QUEUE_SIZE = 4
+POLL_SECONDS = 1.0
+
+# the tables every table refers to, they are built before it. the parsing of the small tables doesn't depend on
+# anything, the events tables are parsed against the keys of the icu stays.
+DEPENDENCIES = {'PATIENTS': (), 'ADMISSIONS': ('PATIENTS',), 'ICUSTAYS': ('ADMISSIONS',),
+                'CHARTEVENTS': ('ICUSTAYS',), 'LABEVENTS': ('ICUSTAYS',), 'OUTPUTEVENTS': ('ICUSTAYS',)}
+
+
+def _parse_table(path, columns, optional, chunk_size, start, queue):
+    """
+    reads and parses a table into the queue, runs in the process of a TableParser. the messages are ('start', offset
+    of the first row), ('chunk', table_reader.Chunk) for every chunk, then ('done', (offset, parse seconds)) or
+    ('error', message). the parse seconds don't include the time the queue was full.
+    """
+    try:
+        started = time.time()
+        blocked = 0.0
+        with table_reader.TableReader(path, columns, optional, chunk_size, start) as reader:
+            queue.put(('start', reader.offset))
+            for chunk in reader:
+                putting = time.time()
+                queue.put(('chunk', chunk))
+                blocked += time.time() - putting
+            queue.put(('done', (reader.offset, time.time() - started - blocked)))
+    except Exception as error:
+        queue.put(('error', "%s: %s" % (type(error).__name__, error)))
+
+
+class TableParser(object):
+    """
+    Reads and parses a table on its own process, ahead of the builder that consumes the chunks. the chunks are passed
+    through a bounded queue, so a parser that gets queue_size chunks ahead of its builder waits for it instead of
+    holding the whole table in memory. reads like a table_reader.TableReader: iterating gives the chunks, offset is the
+    offset after the last chunk that was consumed.
+
+        Attributes:
+            - path, compressed, offset: as in table_reader.TableReader.
+            - parse_seconds: seconds the process spent reading and parsing the table, None until it finished.
+            - wait_seconds: seconds the consumer waited for chunks.
+    """
+    def __init__(self, path, columns=None, optional=(), chunk_size=table_reader.DEFAULT_CHUNK_SIZE,
+                 queue_size=DEFAULT_QUEUE_SIZE, start=None):
+        """
+        starts the parsing process right away.
+        :param path: csv (or csv.gz) file of the table.
+        :param columns: list of (column name, kind), see table_reader.TableReader.
+        :param queue_size: chunks the parser may read ahead.
+        :param start: byte offset of the first row to read, the row after the header by default.
+        """
+        self.path = path
+        self.compressed = path.endswith('.gz')
+        self.offset = None
+        self.parse_seconds = None
+        self.wait_seconds = 0.0
+        self._queue = multiprocessing.Queue(queue_size)
+        self._process = multiprocessing.Process(target=_parse_table,
+                                                args=(path, columns, optional, chunk_size, start, self._queue))
+        self._process.daemon = True
+        self._process.start()
+
+    def _get(self):
+        waiting = time.time()
+        while True:
+            try:
+                kind, value = self._queue.get(timeout=POLL_SECONDS)
+                break
+            except Queue.Empty:
+                if not self._process.is_alive():
+                    logging.error("the parser of %s stopped", self.path)
+                    raise RuntimeError("the parser of %s stopped" % self.path)
+        self.wait_seconds += time.time() - waiting
+        if kind == 'error':
+            logging.error("failed parsing %s: %s", self.path, value)
+            raise ValueError("failed parsing %s: %s" % (self.path, value))
+        return kind, value
+
+    def __iter__(self):
+        while True:
+            kind, value = self._get()
+            if kind == 'done':
+                self.offset, self.parse_seconds = value
+                return
+            self.offset = value.end_offset
+            yield value
+
+    def close(self):
+        # a parser blocked on a full queue never finishes by itself once its builder stopped reading.
+        if self.parse_seconds is None and self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+
+    def __enter__(self):
+        kind, self.offset = self._get()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class StageTiming(object):
+    """
+    When a stage of a pipeline ran.
+
+        Attributes:
+            - name: name of the stage.
+            - start: seconds from the start of the pipeline to the start of the stage.
+            - seconds: seconds the stage ran.
+            - wait_seconds: seconds of it the stage waited for its input.
+    """
+    def __init__(self, name, start, seconds, wait_seconds=0.0):
+        self.name = name
+        self.start = start
+        self.seconds = seconds
+        self.wait_seconds = wait_seconds
+
+    @property
+    def busy_seconds(self):
+        return self.seconds - self.wait_seconds
+
+
+class PipelineReport(object):
+    """
+    Timing of a pipeline run.
+
+        Attributes:
+            - stages: list of StageTiming, in the order the stages started.
+            - wall_seconds: seconds from the start of the first stage to the end of the last.
+            - baseline_seconds: seconds of the same work run one stage after another, None if it wasn't measured.
+    """
+    def __init__(self, stages, wall_seconds, baseline_seconds=None):
+        self.stages = stages
+        self.wall_seconds = wall_seconds
+        self.baseline_seconds = baseline_seconds
+
+    @property
+    def sequential_seconds(self):
+        """
+        :return: the busy seconds of all the stages, an estimate of the sequential baseline when it wasn't measured.
+        """
+        return sum(stage.busy_seconds for stage in self.stages)
+
+    @property
+    def speedup(self):
+        baseline = self.baseline_seconds if self.baseline_seconds is not None else self.sequential_seconds
+        return baseline / self.wall_seconds if self.wall_seconds else 0.0
+
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def format_report(self):
+        lines = ['%-20s %9s %9s %9s' % ('stage', 'start', 'seconds', 'waiting')]
+        for stage in self.stages:
+            lines.append('%-20s %9.2f %9.2f %9.2f' % (stage.name, stage.start, stage.seconds, stage.wait_seconds))
+        lines.append('wall time %.2f seconds' % self.wall_seconds)
+        if self.baseline_seconds is not None:
+            lines.append('sequential baseline %.2f seconds, speedup %.2fx' % (self.baseline_seconds, self.speedup))
+        else:
+            lines.append('sequential estimate %.2f seconds, speedup %.2fx' % (self.sequential_seconds, self.speedup))
+        return '\n'.join(lines)
+
+    def log_report(self):
+        for line in self.format_report().split('\n'):
+            logging.info(line)
+
+
+class Scheduler(object):
+    """
+    Runs the stages of a pipeline, every stage on its own thread as soon as the stages it depends on finished, so
+    independent stages overlap. a stage that fails stops the stages that depend on it, and run raises its error once
+    the other stages finished.
+    """
+    def __init__(self):
+        self._stages = []
+
+    def add(self, name, function, depends_on=()):
+        """
+        :param name: unique name of the stage.
+        :param function: called with no arguments on the thread of the stage.
+        :param depends_on: names of the stages that must finish before it starts, names that were not added are
+        ignored.
+        :return:
+        """
+        if name in [stage_name for stage_name, stage_function, stage_dependencies in self._stages]:
+            logging.error("stage %s already exists", name)
+            raise ValueError("stage %s already exists" % name)
+        self._stages.append((name, function, tuple(depends_on)))
+
+    def run(self):
+        """
+        :return: PipelineReport
+        """
+        names = set(name for name, function, depends_on in self._stages)
+        finished = dict((name, threading.Event()) for name in names)
+        timings = []
+        errors = []
+        started = time.time()
+
+        def run_stage(name, function, depends_on):
+            try:
+                for dependency in depends_on:
+                    if dependency in names:
+                        finished[dependency].wait()
+                if errors:
+                    return
+                start = time.time()
+                try:
+                    function()
+                except BaseException:
+                    errors.append(sys.exc_info())
+                finally:
+                    timings.append(StageTiming(name, start - started, time.time() - start))
+            finally:
+                finished[name].set()
+
+        threads = [threading.Thread(target=run_stage, args=stage, name=stage[0]) for stage in self._stages]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            # join with a timeout so the main thread still gets KeyboardInterrupt.
+            while thread.is_alive():
+                thread.join(POLL_SECONDS)
+        if errors:
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
+        return PipelineReport(sorted(timings, key=lambda timing: timing.start), time.time() - started)
@@ -0,0 +1,162 @@
+import contextlib
+import cProfile
+import gc
+import logging
+import os
+import resource
+import time
+
+
+class StageStats(object):
+    """
+    Measures of one stage of an ingest, usually the read of one table.
+
+        Attributes:
+            - name: name of the stage, for example 'CHARTEVENTS'.
+            - seconds: wall time of the stage.
+            - rows: number of rows the stage processed.
+            - phases: dict phase name -> wall seconds spent in the phase inside the stage, for example 'parse'.
+            - peak_rss: peak resident memory of the process in KB at the end of the stage.
+            - allocated_objects: change in the number of objects tracked by the garbage collector during the stage.
+            - profile_path: path of the pstats file of the stage, None when it wasn't profiled.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = 0
+        self.phases = {}
+        self.peak_rss = 0
+        self.allocated_objects = 0
+        self.profile_path = None
+
+    def as_dict(self):
+        return {'name': self.name, 'seconds': self.seconds, 'rows': self.rows, 'phases': dict(self.phases),
+                'peak_rss': self.peak_rss, 'allocated_objects': self.allocated_objects,
+                'profile_path': self.profile_path}
+
+
+@contextlib.contextmanager
+def _nothing():
+    yield None
+
+
+class Profiler(object):
+    """
+    Opt-in instrumentation of an ingest. a stage is timed as a whole, and the phases inside it (csv parsing, object
+    construction, sorting...) are timed by the code of the stage. a disabled profiler does nothing, so the
+    instrumented code paths cost nothing when profiling is off.
+
+        Attributes:
+            - enabled: measure stages and phases.
+            - profile_dir: directory to write a cProfile pstats file of every stage to, None to skip cProfile.
+            - stages: list of StageStats, in the order the stages ran.
+    """
+    def __init__(self, enabled=True, profile_dir=None):
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.stages = []
+        self._current = None
+        if enabled and profile_dir and not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        stats = StageStats(name)
+        outer, self._current = self._current, stats
+        objects = len(gc.get_objects())
+        profile = cProfile.Profile() if self.profile_dir else None
+        start = time.time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield stats
+        finally:
+            if profile is not None:
+                profile.disable()
+                stats.profile_path = os.path.join(self.profile_dir, '%02d_%s.pstats' % (len(self.stages), name))
+                profile.dump_stats(stats.profile_path)
+            stats.seconds = time.time() - start
+            stats.allocated_objects = len(gc.get_objects()) - objects
+            stats.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.stages.append(stats)
+            self._current = outer
+
+    def stage(self, name):
+        """
+        context manager that measures a stage. a stage that starts inside another stage is measured on its own, the
+        phases inside it are not added to the outer stage.
+        :param name: name of the stage.
+        :return: context manager that returns the StageStats of the stage, or None when disabled.
+        """
+        if not self.enabled:
+            return _nothing()
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            phases = self._current.phases
+            phases[name] = phases.get(name, 0.0) + time.time() - start
+
+    def phase(self, name):
+        """
+        context manager that adds its wall time to a phase of the current stage.
+        :param name: name of the phase, for example 'construct'.
+        """
+        if not self.enabled or self._current is None:
+            return _nothing()
+        return self._phase(name)
+
+    def iterate(self, name, iterable):
+        """
+        iterates over iterable and adds the time spent getting every item to a phase of the current stage, used to
+        time a reader separately from the loop that consumes it.
+        :param name: name of the phase, for example 'parse'.
+        :return: iterator over the items of iterable.
+        """
+        if not self.enabled or self._current is None:
+            return iter(iterable)
+        return self._iterate(name, iterable)
+
+    def _iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self._phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_rows(self, num_of_rows):
+        """
+        counts rows processed by the current stage.
+        """
+        if self.enabled and self._current is not None:
+            self._current.rows += num_of_rows
+
+    def report(self):
+        """
+        :return: list of dicts, one per stage, see StageStats.
+        """
+        return [stats.as_dict() for stats in self.stages]
+
+    def format_report(self):
+        """
+        :return: the stages as a text table, with the phases of every stage under it.
+        """
+        lines = ['%-18s %10s %12s %12s %14s %12s' % ('stage', 'seconds', 'rows', 'rows/s', 'peak rss MB',
+                                                    'objects')]
+        for stats in self.stages:
+            lines.append('%-18s %10.3f %12d %12.0f %14.1f %12d' % (
+                stats.name, stats.seconds, stats.rows, stats.rows / max(stats.seconds, 1e-9), stats.peak_rss / 1024.0,
+                stats.allocated_objects))
+            for phase, seconds in sorted(stats.phases.items(), key=lambda item: -item[1]):
+                lines.append('  %-16s %10.3f %11.1f%%' % (phase, seconds, 100 * seconds / max(stats.seconds, 1e-9)))
+        return '\n'.join(lines)
+
+    def log_report(self):
+        logging.info("Ingest profile:\n%s", self.format_report())
@@ -0,0 +1,228 @@
+import logging
+import numpy as np
+import features
+import utils
+
+# how events of the same item at the same chart time are combined into one observation.
+#   'last' - the event that was inserted last.
+#   'mean', 'max' - of their values.
+CONFLICT_POLICIES = ('last', 'mean', 'max')
+
+DEFAULT_BATCH_SIZE = 1024
+
+# largest (key, time) pair packed into one int64, see Resampler._pack_times.
+MAX_PACKED_KEY = np.iinfo(np.int64).max
+
+
+class ResampledSeries(object):
+    """
+    Time series of a list of icu stays on a regular grid, with the last observation carried forward.
+
+        Attributes:
+            - values: float32 array [n_stays, n_steps, n_items], the last value of the item at or before every grid
+            time, 0 where there is none.
+            - mask: bool array of the same shape, True where values holds a carried value that isn't stale.
+            - observed: bool array of the same shape, True where the value was observed in the step ending at the
+            grid time, not carried from an earlier step.
+            - age: float32 array of the same shape, seconds between the grid time and the observation of the value,
+            nan where mask is False.
+            - icu_stay_ids: ICUSTAY_ID of every row.
+            - item_ids: ITEMID of every column.
+            - units: VALUEUOM of every item, '' where the unit isn't checked.
+            - grid: int64 seconds from the start of the stay of every grid time.
+            - unit_mismatches: number of events of every item that were dropped because of their unit.
+    """
+    def __init__(self, values, mask, observed, age, icu_stay_ids, item_ids, units, grid, unit_mismatches):
+        self.values = values
+        self.mask = mask
+        self.observed = observed
+        self.age = age
+        self.icu_stay_ids = icu_stay_ids
+        self.item_ids = item_ids
+        self.units = units
+        self.grid = grid
+        self.unit_mismatches = unit_mismatches
+
+    def __len__(self):
+        return len(self.icu_stay_ids)
+
+
+class Resampler(object):
+    """
+    Puts the irregular time series of icu stays on a regular grid of step seconds from the start of every stay.
+    events of the same item at the same time are combined first with the conflict policy, then every grid time gets
+    the last observation at or before it (observations before the start of the stay too) unless it is older than the
+    staleness limit of the item. the observations of a batch of stays are sorted once by (stay, item, time) and all
+    the grid times of the batch are looked up with a single searchsorted, so there is no python loop over stays or
+    events.
+    """
+    def __init__(self, item_ids, step=3600, horizon=48 * 3600, max_staleness=None, conflict='last', units=None,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param item_ids: ITEMIDs to resample, numeric values only.
+        :param step: seconds between grid times.
+        :param horizon: seconds from the start of the stay covered by the grid, the grid times are 0, step, ... up to
+        horizon (exclusive).
+        :param max_staleness: seconds a value is carried forward, None to carry it to the end of the grid. either one
+        limit for all the items or a dict ITEMID -> limit, items missing from the dict are not limited.
+        :param conflict: one of CONFLICT_POLICIES.
+        :param units: dict ITEMID -> VALUEUOM. events of the item in another unit are dropped and counted, events
+        without a unit are kept. the units of items missing from the dict are not checked.
+        :param batch_size: number of stays resampled at once, bounds the size of the intermediate arrays.
+        """
+        if conflict not in CONFLICT_POLICIES:
+            logging.error("unknown conflict policy %s", conflict)
+            raise ValueError("unknown conflict policy %s" % conflict)
+        if step <= 0 or horizon <= 0:
+            logging.error("step and horizon must be positive")
+            raise ValueError("step and horizon must be positive")
+
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.step = int(step)
+        self.horizon = int(horizon)
+        self.conflict = conflict
+        self.batch_size = batch_size
+        self.grid = np.arange(0, self.horizon, self.step, dtype=np.int64)
+        units = units or {}
+        self.units = [units.get(item_id, '') for item_id in self.item_ids.tolist()]
+
+        if isinstance(max_staleness, dict):
+            limits = [max_staleness.get(item_id) for item_id in self.item_ids.tolist()]
+        else:
+            limits = [max_staleness] * len(self.item_ids)
+        self.max_staleness = np.array([np.inf if limit is None else limit for limit in limits], dtype=np.float64)
+
+        self._item_order = np.argsort(self.item_ids, kind='mergesort')
+        self._sorted_items = self.item_ids[self._item_order]
+
+    @property
+    def n_steps(self):
+        return len(self.grid)
+
+    def resample(self, store, icu_stay_ids, start_times):
+        """
+        :param store: event_store.EventStore with the events of the stays.
+        :param icu_stay_ids: ICUSTAY_ID of the stays, in the order of the rows of the result.
+        :param start_times: time of the first grid time of every stay, seconds since epoch (usually INTIME).
+        :return: ResampledSeries
+        """
+        icu_stay_ids = np.asarray(icu_stay_ids, dtype=np.int64)
+        start_times = np.asarray(start_times, dtype=np.int64)
+        shape = (len(icu_stay_ids), self.n_steps, len(self.item_ids))
+        values = np.zeros(shape, dtype=np.float32)
+        mask = np.zeros(shape, dtype=bool)
+        observed = np.zeros(shape, dtype=bool)
+        age = np.full(shape, np.nan, dtype=np.float32)
+        unit_mismatches = np.zeros(len(self.item_ids), dtype=np.int64)
+        unit_codes = self._unit_codes(store)
+        for first in range(0, len(icu_stay_ids), self.batch_size):
+            last = first + self.batch_size
+            unit_mismatches += self._resample_batch(store, unit_codes, icu_stay_ids[first:last],
+                                                    start_times[first:last], values[first:last], mask[first:last],
+                                                    observed[first:last], age[first:last])
+        for item_id, unit, count in zip(self.item_ids.tolist(), self.units, unit_mismatches.tolist()):
+            if count:
+                logging.warning("dropped %d events of item %d that are not in %s", count, item_id, unit)
+        return ResampledSeries(values, mask, observed, age, icu_stay_ids, self.item_ids, self.units, self.grid,
+                               unit_mismatches)
+
+    def resample_for_database(self, database, icu_stay_ids=None):
+        """
+        resamples icu stays of a database from their INTIME.
+        :param database: ICUDatabase
+        :param icu_stay_ids: ids of the stays, all the stays of the database by default.
+        :return: ResampledSeries
+        """
+        if icu_stay_ids is None:
+            icu_stay_ids = sorted(database.icu_stays)
+        return self.resample(database.event_store, icu_stay_ids, features.stay_start_times(database, icu_stay_ids))
+
+    def resample_stay(self, stay):
+        """
+        resamples a single icu stay from its INTIME, including the events added to it with add_event.
+        :param stay: icu_stay.IcuStay
+        :return: ResampledSeries with one row.
+        """
+        return self.resample(stay.time_series.store, [stay.icu_stay_id], [utils.date_time_to_epoch(stay.in_time)])
+
+    def _unit_codes(self, store):
+        """
+        :return: int array, the code in the unit dictionary of the store of the unit of every item, -1 where the unit
+        isn't checked and -2 where no event of the store has the unit.
+        """
+        values = store.unit_dictionary.values
+        return np.array([-1 if unit == '' else (values.index(unit) if unit in values else -2) for unit in self.units],
+                        dtype=np.int64)
+
+    def _pack_times(self, num_of_keys, relative):
+        """
+        maps the observation times and the grid times to non negative ints below span, in the same order, so a
+        (key, time) pair packs into the int64 key * span + time. the times are shifted to start at 0, or replaced by
+        their rank among all the times when key * span could overflow, for events long before the start of the stay.
+        :param num_of_keys: number of (stay, item) keys of the batch.
+        :param relative: int64 time of every observation, seconds from the start of its stay.
+        :return: (span, observation times, grid times)
+        """
+        low = min(int(relative.min()), 0)
+        span = int(self.grid[-1]) - low + 1
+        if num_of_keys * span <= MAX_PACKED_KEY:
+            return span, relative - low, self.grid - low
+        times = np.unique(np.concatenate([relative, self.grid]))
+        if num_of_keys * len(times) > MAX_PACKED_KEY:
+            logging.error("can't pack %d keys and %d times into int64, use a smaller batch size", num_of_keys,
+                          len(times))
+            raise ValueError("can't pack %d keys and %d times into int64, use a smaller batch size" %
+                             (num_of_keys, len(times)))
+        return len(times), np.searchsorted(times, relative), np.searchsorted(times, self.grid)
+
+    def _resample_batch(self, store, unit_codes, icu_stay_ids, start_times, values, mask, observed, age):
+        """
+        fills values, mask, observed and age [n_stays, n_steps, n_items] of a batch of stays.
+        :return: number of events of every item dropped because of their unit.
+        """
+        n_items = len(self.item_ids)
+        rows, stay_index = features.stay_rows(store, icu_stay_ids)
+        rows, stay_index, item_index = features.select_items(store, rows, stay_index, self._sorted_items,
+                                                             self._item_order)
+
+        unit = store.value_unit[rows]
+        wrong_unit = (unit_codes[item_index] != -1) & (unit != 0) & (unit != unit_codes[item_index])
+        unit_mismatches = np.bincount(item_index[wrong_unit], minlength=n_items)
+        chart_time = store.chart_time[rows]
+        relative = chart_time - start_times[stay_index]
+        keep = (~wrong_unit & ~np.isnan(store.value_num[rows]) & (chart_time != utils.MISSING_TIME) &
+                (start_times[stay_index] != utils.MISSING_TIME) & (relative <= self.grid[-1]))
+        rows, relative = rows[keep], relative[keep]
+        key = stay_index[keep] * n_items + item_index[keep]
+        if len(key) == 0:
+            return unit_mismatches
+
+        # one observation per (stay, item, time). the sort is stable, so the events of an observation keep the order
+        # they were inserted in and 'last' is the last of them.
+        order = np.lexsort((relative, key))
+        key, relative, numbers = key[order], relative[order], store.value_num[rows[order]]
+        starts = np.flatnonzero(np.append(True, (key[1:] != key[:-1]) | (relative[1:] != relative[:-1])))
+        stops = np.append(starts[1:], len(key))
+        if self.conflict == 'last':
+            numbers = numbers[stops - 1]
+        elif self.conflict == 'mean':
+            numbers = np.add.reduceat(numbers, starts) / (stops - starts)
+        else:
+            numbers = np.maximum.reduceat(numbers, starts)
+        key, relative = key[starts], relative[starts]
+
+        # (key, time) pairs as one sorted int64, and the (stay, step, item) cells of the batch as queries on it.
+        span, observation_times, grid_times = self._pack_times(len(icu_stay_ids) * n_items, relative)
+        observations = key * span + observation_times
+        cell_keys = np.broadcast_to(np.arange(len(icu_stay_ids))[:, None, None] * n_items + np.arange(n_items),
+                                    values.shape)
+        found = np.searchsorted(observations, cell_keys * span + grid_times[:, None], side='right') - 1
+        previous = np.maximum(found, 0)
+        ages = self.grid[:, None] - relative[previous]
+        valid = (found >= 0) & (key[previous] == cell_keys) & (ages <= self.max_staleness)
+
+        values[valid] = numbers[found[valid]]
+        mask[valid] = True
+        observed[valid] = ages[valid] < self.step
+        age[valid] = ages[valid]
+        return unit_mismatches
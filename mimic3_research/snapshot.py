@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import d_items
+import event
+import event_store
+import utils
+
+SNAPSHOT_FORMAT = 'mimic3-icu-database'
+SNAPSHOT_VERSION = 2
+META_FILE = 'snapshot.json'
+
+# (csv column, attribute of the object, kind) of the small tables. kind is one of 'int', 'str', 'time', 'float'.
+# SUBJECT_ID / HADM_ID of admissions and icu stays are taken from the objects that hold them.
+PATIENT_COLUMNS = (('SUBJECT_ID', 'id', 'int'), ('GENDER', 'gender', 'str'), ('DOB', 'dob', 'time'),
+                   ('DOD', 'dod', 'time'), ('DOD_HOSP', 'dod_hosp', 'time'), ('DOD_SSN', 'dod_ssn', 'time'),
+                   ('EXPIRE_FLAG', 'expire_flag', 'str'))
+
+ADMISSION_COLUMNS = (('SUBJECT_ID', None, 'int'), ('HADM_ID', 'hadm_id', 'int'), ('ADMITTIME', 'admittime', 'time'),
+                     ('DISCHTIME', 'dischtime', 'time'), ('DEATHTIME', 'death_time', 'time'),
+                     ('ADMISSION_TYPE', 'admission_type', 'str'), ('ADMISSION_LOCATION', 'admission_location', 'str'),
+                     ('INSURANCE', 'insurance', 'str'), ('LANGUAGE', 'language', 'str'),
+                     ('RELIGION', 'religion', 'str'), ('MARITAL_STATUS', 'martial_status', 'str'),
+                     ('ETHNICITY', 'etnhicity', 'str'), ('EDREGTIME', 'ed_reg_time', 'time'),
+                     ('EDOUTTIME', 'ed_out_time', 'time'), ('DIAGNOSIS', 'diagnosis', 'str'))
+
+ICU_STAY_COLUMNS = (('SUBJECT_ID', None, 'int'), ('HADM_ID', None, 'int'), ('ICUSTAY_ID', 'icu_stay_id', 'int'),
+                    ('DBSOURCE', 'db_source', 'str'), ('FIRST_CAREUNIT', 'first_care_u', 'str'),
+                    ('LAST_CAREUNIT', 'last_care_u', 'str'), ('FIRST_WARDID', 'first_ward_id', 'str'),
+                    ('LAST_WARDID', 'last_ward_id', 'str'), ('INTIME', 'in_time', 'time'),
+                    ('OUTTIME', 'out_time', 'time'), ('LOS', 'len_of_stay', 'float'))
+
+TABLES = (('patients', PATIENT_COLUMNS), ('admissions', ADMISSION_COLUMNS), ('icu_stays', ICU_STAY_COLUMNS))
+
+EVENT_INDEX_COLUMNS = ('stay_ids', 'stay_starts', 'stay_stops')
+DICTIONARIES = ('value', 'value_unit', 'cgid')
+# optional, snapshots written before it was added compute it on first use.
+ITEM_ORDER = 'item_order'
+
+
+class Snapshot(object):
+    """
+    A loaded snapshot of an ICUDatabase.
+
+        Attributes:
+            - meta: the content of snapshot.json, with the concept map the events were ingested with (if any).
+            - tables: dict table name -> dict csv column -> numpy array. rows are sorted by SUBJECT_ID, HADM_ID and
+            ICUSTAY_ID.
+            - events: event_store.EventStore whose columns are memory mapped from the snapshot files.
+    """
+    def __init__(self, meta, tables, events):
+        self.meta = meta
+        self.tables = tables
+        self.events = events
+
+    def concept_map(self):
+        """
+        :return: d_items.ConceptMap the events of the snapshot were ingested with, so appended rows are mapped the
+        same way. None if they were ingested without one.
+        """
+        config = self.meta.get('concept_map')
+        return d_items.ConceptMap.from_dict(config) if config else None
+
+    def rows(self, table_name, start=0, stop=None):
+        """
+        iterates over the rows of a small table as dicts of csv column -> value, in the form the ICUDatabase read
+        methods expect (times as datetime objects or '', missing LOS as '').
+        :param table_name: 'patients', 'admissions' or 'icu_stays'.
+        :param start: first row.
+        :param stop: end of the rows, defaults to the end of the table.
+        :return: generator of dicts.
+        """
+        columns = dict(TABLES)[table_name]
+        table = self.tables[table_name]
+        converted = []
+        for name, attribute, kind in columns:
+            values = table[name][start:stop]
+            if kind == 'time':
+                converted.append([utils.epoch_to_date_time_object(value) for value in values])
+            elif kind == 'float':
+                converted.append(['' if np.isnan(value) else float(value) for value in values])
+            else:
+                converted.append(values.tolist())
+        names = [name for name, attribute, kind in columns]
+        for values in zip(*converted):
+            yield dict(zip(names, values))
+
+
+def table_columns(database):
+    """
+    extracts the small tables of a database from its object graph, sorted by their keys.
+    :return: dict table name -> list of (csv column, numpy array)
+    """
+    rows = dict((table_name, []) for table_name, columns in TABLES)
+    for subject_id in sorted(database.patients):
+        patient_info = database.patients[subject_id]
+        rows['patients'].append([getattr(patient_info, attribute) for name, attribute, kind in PATIENT_COLUMNS])
+        for hadm_id in sorted(patient_info.hospital_visits):
+            visit = patient_info.hospital_visits[hadm_id]
+            rows['admissions'].append([subject_id] + [getattr(visit, attribute)
+                                                      for name, attribute, kind in ADMISSION_COLUMNS[1:]])
+            for icu_stay_id in sorted(visit.icu_stays):
+                stay = visit.icu_stays[icu_stay_id]
+                rows['icu_stays'].append([subject_id, hadm_id] + [getattr(stay, attribute)
+                                                                  for name, attribute, kind in ICU_STAY_COLUMNS[2:]])
+
+    tables = {}
+    for table_name, columns in TABLES:
+        values = list(zip(*rows[table_name])) or [()] * len(columns)
+        tables[table_name] = [(name, _to_array(column_values, kind))
+                              for (name, attribute, kind), column_values in zip(columns, values)]
+    return tables
+
+
+def _to_array(values, kind):
+    if kind == 'int':
+        return np.array(values, dtype=np.int64)
+    if kind == 'time':
+        return np.array([utils.date_time_to_epoch(value) for value in values], dtype=np.int64)
+    if kind == 'float':
+        return np.array([np.nan if value == '' else value for value in values], dtype=np.float64)
+    return np.array(values, dtype='S')
+
+
+def save(database, path, overwrite=False):
+    """
+    writes a database to a snapshot directory. every column is written once, straight from the event store and the
+    object graph, into its own .npy file so it can be memory mapped on load. the snapshot is written next to path
+    and moved into place only when complete.
+    :param database: ICUDatabase
+    :param path: snapshot directory.
+    :param overwrite: replace an existing snapshot at path.
+    :return:
+    """
+    if os.path.exists(path) and not overwrite:
+        raise ValueError("snapshot path %s already exists" % path)
+
+    temp_path = path.rstrip(os.sep) + '.partial'
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+
+    meta = {'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION, 'mimic3_dir': database.mimic3_dir, 'tables': {},
+            'watermarks': database.watermarks,
+            'concept_map': database.concept_map.to_dict() if database.concept_map is not None else None}
+    for table_name, columns in table_columns(database).items():
+        os.makedirs(os.path.join(temp_path, table_name))
+        for name, values in columns:
+            np.save(os.path.join(temp_path, table_name, name + '.npy'), values)
+        meta['tables'][table_name] = len(columns[0][1])
+
+    store = database.event_store
+    os.makedirs(os.path.join(temp_path, 'events'))
+    for name, dtype in event_store.EventStore.COLUMNS:
+        np.save(os.path.join(temp_path, 'events', name + '.npy'), getattr(store, name))
+    for name in EVENT_INDEX_COLUMNS:
+        np.save(os.path.join(temp_path, 'events', name + '.npy'), getattr(store, name))
+    np.save(os.path.join(temp_path, 'events', ITEM_ORDER + '.npy'), store.item_order())
+    for name in DICTIONARIES:
+        np.save(os.path.join(temp_path, 'events', name + '_dictionary.npy'), store.dictionary(name).array())
+    meta['events'] = len(store)
+
+    with open(os.path.join(temp_path, META_FILE), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(temp_path, path)
+    logging.info("Saved snapshot of %d patients and %d events to %s", meta['tables']['patients'], meta['events'], path)
+
+
+def load(path, mmap_mode='r'):
+    """
+    opens a snapshot directory. column files are memory mapped, so only the pages that are used are read from disk.
+    :param path: snapshot directory.
+    :param mmap_mode: numpy memory map mode of the columns, None reads them into memory.
+    :return: Snapshot
+    """
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        raise ValueError("%s is not a snapshot directory" % path)
+    with open(meta_path, 'r') as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('format') != SNAPSHOT_FORMAT or meta.get('version') > SNAPSHOT_VERSION:
+        raise ValueError("unsupported snapshot format %s version %s" % (meta.get('format'), meta.get('version')))
+
+    def load_column(directory, name):
+        return np.load(os.path.join(path, directory, name + '.npy'), mmap_mode=mmap_mode)
+
+    def load_event_column(name, dtype):
+        # version 1 snapshots hold only chart events and have no source column.
+        if name == 'source' and meta['version'] < 2:
+            return np.full(meta['events'], event.CHART_EVENT, dtype=dtype)
+        return load_column('events', name)
+
+    tables = {}
+    for table_name, columns in TABLES:
+        tables[table_name] = dict((name, load_column(table_name, name)) for name, attribute, kind in columns)
+
+    dictionaries = [event_store.StringDictionary.from_values(load_column('events', name + '_dictionary'))
+                    for name in DICTIONARIES]
+    item_order = None
+    if os.path.exists(os.path.join(path, 'events', ITEM_ORDER + '.npy')):
+        item_order = load_column('events', ITEM_ORDER)
+    events = event_store.EventStore(
+        dict((name, load_event_column(name, dtype)) for name, dtype in event_store.EventStore.COLUMNS),
+        *(dictionaries + [load_column('events', name) for name in EVENT_INDEX_COLUMNS]), item_order=item_order)
+    return Snapshot(meta, tables, events)
@@ -0,0 +1,190 @@
+import numpy as np
+import utils
+
+
+class StaySummary(object):
+    """
+    Summary statistics of the events of an icu stay, or of several stays for the rollups of HospitalVisit and Patient.
+    the per item statistics are arrays aligned with item_ids, so a summary costs a few small arrays and not a dict per
+    item.
+
+        Attributes:
+            - num_of_events: number of events.
+            - item_ids: sorted distinct ITEMIDs of the events.
+            - counts: number of events of every item.
+            - num_values: number of events of every item with a VALUENUM.
+            - sums: sum of VALUENUM of every item.
+            - min_values, max_values: smallest and largest VALUENUM of every item, nan if the item has no VALUENUM.
+            - first_chart_time, last_chart_time: first and last chart time (seconds since epoch), utils.MISSING_TIME
+            if no event has a chart time.
+            - num_of_timestamps: number of distinct chart times. in a rollup it is the sum over the stays.
+    """
+    __slots__ = ('num_of_events', 'item_ids', 'counts', 'num_values', 'sums', 'min_values', 'max_values',
+                 'first_chart_time', 'last_chart_time', 'num_of_timestamps')
+
+    def __init__(self, item_ids, counts, num_values, sums, min_values, max_values, first_chart_time, last_chart_time,
+                 num_of_timestamps):
+        self.item_ids = item_ids
+        self.counts = counts
+        self.num_values = num_values
+        self.sums = sums
+        self.min_values = min_values
+        self.max_values = max_values
+        self.num_of_events = int(counts.sum())
+        self.first_chart_time = int(first_chart_time)
+        self.last_chart_time = int(last_chart_time)
+        self.num_of_timestamps = int(num_of_timestamps)
+
+    @staticmethod
+    def empty():
+        """
+        :return: StaySummary of a stay without events.
+        """
+        return StaySummary(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                           np.empty(0), np.empty(0), np.empty(0), utils.MISSING_TIME, utils.MISSING_TIME, 0)
+
+    @property
+    def mean_values(self):
+        """
+        :return: mean VALUENUM of every item, nan if the item has no VALUENUM.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.num_values > 0, self.sums / np.maximum(self.num_values, 1), np.nan)
+
+    def _position(self, item_id):
+        position = np.searchsorted(self.item_ids, item_id)
+        if position < len(self.item_ids) and self.item_ids[position] == item_id:
+            return position
+        return None
+
+    def count(self, item_id):
+        """
+        :param item_id: ITEMID
+        :return: number of events of the item.
+        """
+        position = self._position(item_id)
+        return 0 if position is None else int(self.counts[position])
+
+    def item_stats(self, item_id):
+        """
+        :param item_id: ITEMID
+        :return: (count, min, max, mean) of the VALUENUM of the item, the values are nan if it has no VALUENUM.
+        """
+        position = self._position(item_id)
+        if position is None:
+            return 0, np.nan, np.nan, np.nan
+        return (int(self.counts[position]), float(self.min_values[position]), float(self.max_values[position]),
+                float(self.mean_values[position]))
+
+    def item_counts(self):
+        """
+        :return: dict ITEMID -> number of events.
+        """
+        return dict(zip(self.item_ids.tolist(), self.counts.tolist()))
+
+
+def _first_timed(chart_times):
+    """
+    :param chart_times: sorted chart times of a stay.
+    :return: the first chart time that isn't missing, utils.MISSING_TIME if all are missing.
+    """
+    position = np.searchsorted(chart_times, utils.MISSING_TIME, side='right')
+    return chart_times[position] if position < len(chart_times) else utils.MISSING_TIME
+
+
+def summarize(events):
+    """
+    computes the summary of the events of one stay.
+    :param events: event_store.StayEvents of the stay.
+    :return: StaySummary
+    """
+    if len(events) == 0:
+        return StaySummary.empty()
+    item_ids, inverse = np.unique(events.item_id, return_inverse=True)
+    value_num = events.value_num
+    chart_time = events.chart_time
+    has_value = ~np.isnan(value_num)
+    min_values = np.full(len(item_ids), np.nan)
+    max_values = np.full(len(item_ids), np.nan)
+    np.fmin.at(min_values, inverse, value_num)
+    np.fmax.at(max_values, inverse, value_num)
+    timed = chart_time[chart_time != utils.MISSING_TIME]
+    return StaySummary(item_ids, np.bincount(inverse, minlength=len(item_ids)),
+                       np.bincount(inverse[has_value], minlength=len(item_ids)),
+                       np.bincount(inverse[has_value], weights=value_num[has_value], minlength=len(item_ids)),
+                       min_values, max_values, _first_timed(chart_time), chart_time[-1],
+                       len(np.unique(timed)))
+
+
+def summarize_store(store):
+    """
+    computes the summaries of all the stays of an event store in one pass over its columns: the rows are grouped by
+    stay and item with the store item_order and every statistic is a reduceat over the groups.
+    :param store: event_store.EventStore
+    :return: dict icu_stay_id -> StaySummary, for the stays that have events.
+    """
+    if len(store) == 0:
+        return {}
+    stay_ids, stay_starts, stay_stops = store.stay_ids, store.stay_starts, store.stay_stops
+    lengths = stay_stops - stay_starts
+
+    # rows of the store ordered by stay, item and chart time.
+    rows = store.item_order() + np.repeat(stay_starts, lengths)
+    item_id = store.item_id[rows]
+    value_num = store.value_num[rows]
+    new_stay = np.zeros(len(rows), dtype=bool)
+    new_stay[stay_starts] = True
+    group_starts = np.flatnonzero(new_stay | np.append(True, item_id[1:] != item_id[:-1]))
+    group_items = item_id[group_starts]
+    counts = np.diff(np.append(group_starts, len(rows)))
+    has_value = ~np.isnan(value_num)
+    num_values = np.add.reduceat(has_value.astype(np.int64), group_starts)
+    sums = np.add.reduceat(np.where(has_value, value_num, 0.0), group_starts)
+    min_values = np.fmin.reduceat(value_num, group_starts)
+    max_values = np.fmax.reduceat(value_num, group_starts)
+    # every stay starts a group, so the groups of stay i are group_offsets[i]:group_offsets[i + 1].
+    group_offsets = np.append(np.searchsorted(group_starts, stay_starts), len(group_starts))
+
+    # the store itself is ordered by chart time inside every stay.
+    chart_time = store.chart_time
+    timed = chart_time != utils.MISSING_TIME
+    new_time = timed & np.append(True, chart_time[1:] != chart_time[:-1])
+    new_time[stay_starts] = timed[stay_starts]
+    num_of_timestamps = np.add.reduceat(new_time.astype(np.int64), stay_starts)
+    first_timed = np.minimum.reduceat(np.where(timed, chart_time, np.iinfo(np.int64).max), stay_starts)
+    first_timed[first_timed == np.iinfo(np.int64).max] = utils.MISSING_TIME
+    last_times = chart_time[stay_stops - 1]
+
+    summaries = {}
+    for i, icu_stay_id in enumerate(stay_ids.tolist()):
+        start, stop = group_offsets[i], group_offsets[i + 1]
+        summaries[icu_stay_id] = StaySummary(group_items[start:stop], counts[start:stop], num_values[start:stop],
+                                             sums[start:stop], min_values[start:stop], max_values[start:stop],
+                                             first_timed[i], last_times[i], num_of_timestamps[i])
+    return summaries
+
+
+def combine(summaries):
+    """
+    rolls up the summaries of several stays, used by HospitalVisit.summary and Patient.summary.
+    :param summaries: list of StaySummary objects.
+    :return: StaySummary, num_of_timestamps is the sum over the stays.
+    """
+    summaries = [summary for summary in summaries if summary.num_of_events]
+    if not summaries:
+        return StaySummary.empty()
+    if len(summaries) == 1:
+        return summaries[0]
+    item_ids, inverse = np.unique(np.concatenate([summary.item_ids for summary in summaries]), return_inverse=True)
+
+    def merged(name, reduce_function, initial):
+        values = np.full(len(item_ids), initial)
+        reduce_function.at(values, inverse, np.concatenate([getattr(summary, name) for summary in summaries]))
+        return values
+
+    first_times = [summary.first_chart_time for summary in summaries if summary.first_chart_time != utils.MISSING_TIME]
+    return StaySummary(item_ids, merged('counts', np.add, 0), merged('num_values', np.add, 0),
+                       merged('sums', np.add, 0.0), merged('min_values', np.fmin, np.nan),
+                       merged('max_values', np.fmax, np.nan), min(first_times) if first_times else utils.MISSING_TIME,
+                       max(summary.last_chart_time for summary in summaries),
+                       sum(summary.num_of_timestamps for summary in summaries))
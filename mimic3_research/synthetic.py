@@ -0,0 +1,276 @@
+import csv
+import datetime
+import logging
+import os
+import random
+import sys
+import hospital_visit
+
+DEFAULT_NUM_OF_EVENTS = 100000
+DEFAULT_EVENTS_PER_STAY = 500
+
+PATIENT_HEADER = ['ROW_ID', 'SUBJECT_ID', 'GENDER', 'DOB', 'DOD', 'DOD_HOSP', 'DOD_SSN', 'EXPIRE_FLAG']
+ADMISSION_HEADER = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ADMITTIME', 'DISCHTIME', 'DEATHTIME', 'ADMISSION_TYPE',
+                    'ADMISSION_LOCATION', 'DISCHARGE_LOCATION', 'INSURANCE', 'LANGUAGE', 'RELIGION', 'MARITAL_STATUS',
+                    'ETHNICITY', 'EDREGTIME', 'EDOUTTIME', 'DIAGNOSIS', 'HOSPITAL_EXPIRE_FLAG',
+                    'HAS_CHARTEVENTS_DATA']
+ICU_STAY_HEADER = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'DBSOURCE', 'FIRST_CAREUNIT', 'LAST_CAREUNIT',
+                   'FIRST_WARDID', 'LAST_WARDID', 'INTIME', 'OUTTIME', 'LOS']
+CHART_EVENT_HEADER = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'ITEMID', 'CHARTTIME', 'STORETIME', 'CGID',
+                      'VALUE', 'VALUENUM', 'VALUEUOM', 'WARNING', 'ERROR', 'RESULTSTATUS', 'STOPPED']
+LAB_EVENT_HEADER = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ITEMID', 'CHARTTIME', 'VALUE', 'VALUENUM', 'VALUEUOM', 'FLAG']
+OUTPUT_EVENT_HEADER = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'CHARTTIME', 'ITEMID', 'VALUE', 'VALUEUOM',
+                       'STORETIME', 'CGID', 'STOPPED', 'NEWBOTTLE', 'ISERROR']
+
+# ITEMID -> (unit, low, high) of numeric chart items, or (None, text values) of text items.
+CHART_ITEMS = {211: ('bpm', 50, 130),            # heart rate
+               618: ('insp/min', 10, 30),        # respiratory rate
+               646: ('%', 88, 100),              # SpO2
+               51: ('mmHg', 90, 160),            # arterial BP systolic
+               8368: ('mmHg', 40, 90),           # arterial BP diastolic
+               678: ('Deg. F', 96, 103),         # temperature F
+               676: ('Deg. C', 35.5, 39.5),      # temperature C
+               212: (None, ('Sinus Rhythm', 'Sinus Tachycardia', 'Atrial Fib', 'Sinus Bradycardia'))}
+LAB_ITEMS = {50912: ('mg/dL', 0.5, 3.0),         # creatinine
+             50971: ('mEq/L', 3.0, 5.5),         # potassium
+             51301: ('K/uL', 3.0, 18.0)}         # white blood cells
+OUTPUT_ITEMS = {40055: ('ml', 20, 400),          # urine out foley
+                226559: ('ml', 20, 400)}         # foley
+
+_CHART_ITEM_IDS = sorted(CHART_ITEMS)
+_LAB_ITEM_IDS = sorted(LAB_ITEMS)
+_OUTPUT_ITEM_IDS = sorted(OUTPUT_ITEMS)
+
+CARE_UNITS = ('MICU', 'SICU', 'CCU', 'CSRU', 'TSICU')
+DB_SOURCES = ('carevue', 'metavision')
+DISCHARGE_LOCATIONS = ('HOME', 'HOME HEALTH CARE', 'SNF', 'REHAB/DISTINCT PART HOSP')
+DIAGNOSES = ('SEPSIS', 'PNEUMONIA', 'CONGESTIVE HEART FAILURE', 'CORONARY ARTERY DISEASE', 'GI BLEED')
+
+# first and last admission of the generated patients, shifted into the future as MIMIC dates are.
+FIRST_ADMISSION = datetime.datetime(2100, 1, 1)
+LAST_ADMISSION = datetime.datetime(2200, 1, 1)
+
+
+class Writer(object):
+    """
+    csv writer of one table that numbers its rows.
+    """
+    def __init__(self, path, header):
+        self._file = open(path, 'wb')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(header)
+        self.num_of_rows = 0
+
+    def write(self, row):
+        """
+        :param row: list of the values of the row without ROW_ID.
+        """
+        self.num_of_rows += 1
+        self._writer.writerow([self.num_of_rows] + row)
+
+    def close(self):
+        self._file.close()
+
+
+class SyntheticMimic(object):
+    """
+    Deterministic generator of a MIMIC-III like dataset. the same seed and sizes always write the same files.
+
+    the tables keep the referential integrity the database relies on: every admission belongs to a patient, every
+    icu stay is inside its admission, every chart and output event is inside its icu stay and most lab events are
+    inside an icu stay of their admission (the rest happen before the first stay, as real labs often do). time
+    fields mix the two formats utils supports, optional fields are often empty, and a small fraction of the chart
+    events have no HADM_ID or ICUSTAY_ID.
+    """
+    def __init__(self, num_of_events=DEFAULT_NUM_OF_EVENTS, events_per_stay=DEFAULT_EVENTS_PER_STAY, seed=0,
+                 lab_fraction=0.1, output_fraction=0.05, invalid_fraction=0.001):
+        """
+        :param num_of_events: approximate number of rows of CHARTEVENTS.csv.
+        :param events_per_stay: average number of chart events of an icu stay.
+        :param seed: seed of the generator.
+        :param lab_fraction: number of lab events per chart event.
+        :param output_fraction: number of output events per chart event.
+        :param invalid_fraction: fraction of the chart events without HADM_ID or ICUSTAY_ID.
+        """
+        if num_of_events < 1 or events_per_stay < 1:
+            logging.error("num_of_events and events_per_stay must be positive")
+            raise ValueError("num_of_events and events_per_stay must be positive")
+        self.num_of_events = num_of_events
+        self.events_per_stay = events_per_stay
+        self.seed = seed
+        self.lab_fraction = lab_fraction
+        self.output_fraction = output_fraction
+        self.invalid_fraction = invalid_fraction
+        self._random = random.Random(seed)
+
+    def _time(self, date_time):
+        """
+        formats a time in one of the two formats of utils.convert_to_date_time_object, chosen at random. the day
+        first format has an unpadded hour, as in the MIMIC demo files ('13/03/2075  0:00:00').
+        """
+        if self._random.random() < 0.5:
+            return date_time.strftime('%Y-%m-%d %H:%M:%S')
+        return '%s %2d:%02d:%02d' % (date_time.strftime('%d/%m/%Y'), date_time.hour, date_time.minute,
+                                     date_time.second)
+
+    def _value(self, items, item_id):
+        """
+        :return: (VALUE, VALUENUM, VALUEUOM) of a random measurement of an item.
+        """
+        if items[item_id][0] is None:
+            return self._random.choice(items[item_id][1]), '', ''
+        unit, low, high = items[item_id]
+        value = round(self._random.uniform(low, high), 1)
+        return repr(value), repr(value), unit
+
+    def generate(self, output_dir):
+        """
+        writes PATIENTS, ADMISSIONS, ICUSTAYS, CHARTEVENTS, LABEVENTS and OUTPUTEVENTS csv files.
+        :param output_dir: directory to write the files to, created if needed.
+        :return: dict table name -> number of rows written.
+        """
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        self._random = random.Random(self.seed)
+        writers = dict((table_name, Writer(os.path.join(output_dir, '%s.csv' % table_name), header))
+                       for table_name, header in (('PATIENTS', PATIENT_HEADER), ('ADMISSIONS', ADMISSION_HEADER),
+                                                  ('ICUSTAYS', ICU_STAY_HEADER),
+                                                  ('CHARTEVENTS', CHART_EVENT_HEADER),
+                                                  ('LABEVENTS', LAB_EVENT_HEADER),
+                                                  ('OUTPUTEVENTS', OUTPUT_EVENT_HEADER)))
+        try:
+            subject_id = 0
+            hadm_id = 100000
+            icu_stay_id = 200000
+            while writers['CHARTEVENTS'].num_of_rows < self.num_of_events:
+                subject_id += 1
+                admissions = []
+                for _ in range(self._random.choice((1, 1, 1, 2, 3))):
+                    hadm_id += 1
+                    stays = []
+                    for _ in range(self._random.choice((1, 1, 2))):
+                        icu_stay_id += 1
+                        stays.append(icu_stay_id)
+                    admissions.append((hadm_id, stays))
+                self._write_patient(writers, subject_id, admissions)
+                logging.debug("Wrote patient %d, %d chart events so far", subject_id,
+                              writers['CHARTEVENTS'].num_of_rows)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return dict((table_name, writer.num_of_rows) for table_name, writer in writers.items())
+
+    def _write_patient(self, writers, subject_id, admissions):
+        rand = self._random
+        admit_time = FIRST_ADMISSION + datetime.timedelta(seconds=rand.randint(
+            0, int((LAST_ADMISSION - FIRST_ADMISSION).total_seconds())))
+        dob = admit_time - datetime.timedelta(days=rand.randint(18 * 365, 90 * 365))
+        dies = rand.random() < 0.1
+        discharges = []
+        for hadm_id, stays in admissions:
+            discharge_time = self._write_admission(writers, subject_id, hadm_id, stays, admit_time)
+            discharges.append(discharge_time)
+            admit_time = discharge_time + datetime.timedelta(days=rand.randint(10, 700))
+        dob_date = datetime.datetime(dob.year, dob.month, dob.day)
+        if dies:
+            dod = datetime.datetime(discharges[-1].year, discharges[-1].month, discharges[-1].day)
+            dod_hosp = self._time(dod) if rand.random() < 0.5 else ''
+            writers['PATIENTS'].write([subject_id, rand.choice('MF'), self._time(dob_date), self._time(dod),
+                                       dod_hosp, self._time(dod), '1'])
+        else:
+            writers['PATIENTS'].write([subject_id, rand.choice('MF'), self._time(dob_date), '', '', '', '0'])
+
+    def _write_admission(self, writers, subject_id, hadm_id, stays, admit_time):
+        """
+        :return: DISCHTIME of the admission.
+        """
+        rand = self._random
+        in_time = admit_time + datetime.timedelta(hours=rand.randint(1, 24))
+        first_in_time = in_time
+        windows = []
+        num_of_chart_events = 0
+        for icu_stay_id in stays:
+            num_of_events = max(1, int(rand.expovariate(1.0 / self.events_per_stay)))
+            # chart events every 15 minutes to 2 hours, a stay lasts as long as its events need.
+            interval = rand.choice((900, 1800, 3600, 7200))
+            out_time = in_time + datetime.timedelta(seconds=interval * (num_of_events // len(CHART_ITEMS) + 1))
+            care_unit = rand.choice(CARE_UNITS)
+            ward_id = str(rand.randint(1, 60))
+            writers['ICUSTAYS'].write([subject_id, hadm_id, icu_stay_id, rand.choice(DB_SOURCES), care_unit,
+                                       care_unit, ward_id, ward_id, self._time(in_time), self._time(out_time),
+                                       '%.4f' % ((out_time - in_time).total_seconds() / 86400.0)])
+            self._write_stay_events(writers, subject_id, hadm_id, icu_stay_id, in_time, interval, num_of_events)
+            num_of_chart_events += num_of_events
+            windows.append((in_time, out_time))
+            in_time = out_time + datetime.timedelta(hours=rand.randint(2, 72))
+        discharge_time = in_time + datetime.timedelta(hours=rand.randint(6, 240))
+
+        # most labs are taken during an icu stay, the rest in the hours before the first one.
+        num_of_labs = int(round(self.lab_fraction * num_of_chart_events))
+        for _ in range(num_of_labs):
+            item_id = rand.choice(_LAB_ITEM_IDS)
+            value, value_num, unit = self._value(LAB_ITEMS, item_id)
+            start, end = rand.choice(windows) if rand.random() < 0.9 else (admit_time, first_in_time)
+            chart_time = start + datetime.timedelta(seconds=rand.randint(0, int((end - start).total_seconds()) - 1))
+            writers['LABEVENTS'].write([subject_id, hadm_id, item_id, self._time(chart_time), value, value_num, unit,
+                                        'abnormal' if rand.random() < 0.2 else ''])
+
+        admission_type = rand.choice(sorted(hospital_visit.ADMISSION_TYPES))
+        ed_reg_time = self._time(admit_time - datetime.timedelta(hours=2)) if admission_type == 'EMERGENCY' else ''
+        ed_out_time = self._time(admit_time) if ed_reg_time else ''
+        writers['ADMISSIONS'].write([subject_id, hadm_id, self._time(admit_time), self._time(discharge_time), '',
+                                     admission_type, rand.choice(sorted(hospital_visit.ADMISSION_LOCATIONS)),
+                                     rand.choice(DISCHARGE_LOCATIONS), rand.choice(sorted(hospital_visit.INSURANCES)),
+                                     rand.choice(('ENGL', 'SPAN', '')), rand.choice(('CATHOLIC', 'JEWISH', '')),
+                                     rand.choice(('MARRIED', 'SINGLE', '')), rand.choice(('WHITE', 'BLACK', 'ASIAN')),
+                                     ed_reg_time, ed_out_time, rand.choice(DIAGNOSES), '0', '1'])
+        return discharge_time
+
+    def _write_stay_events(self, writers, subject_id, hadm_id, icu_stay_id, in_time, interval, num_of_events):
+        rand = self._random
+        item_ids = _CHART_ITEM_IDS
+        cgid = str(rand.randint(14000, 21000))
+        for i in range(num_of_events):
+            chart_time = in_time + datetime.timedelta(seconds=interval * (i // len(item_ids)) + 60)
+            item_id = item_ids[i % len(item_ids)]
+            value, value_num, unit = self._value(CHART_ITEMS, item_id)
+            row_hadm_id, row_icu_stay_id = hadm_id, icu_stay_id
+            if rand.random() < self.invalid_fraction:
+                if rand.random() < 0.5:
+                    row_hadm_id = ''
+                else:
+                    row_icu_stay_id = ''
+            store_time = self._time(chart_time + datetime.timedelta(minutes=5)) if rand.random() < 0.9 else ''
+            writers['CHARTEVENTS'].write([subject_id, row_hadm_id, row_icu_stay_id, item_id, self._time(chart_time),
+                                          store_time, cgid if store_time else '', value, value_num, unit, '', '',
+                                          'Manual' if rand.random() < 0.5 else '', ''])
+            if rand.random() < self.output_fraction:
+                item_id = rand.choice(_OUTPUT_ITEM_IDS)
+                value, value_num, unit = self._value(OUTPUT_ITEMS, item_id)
+                # about half of the output events have no ICUSTAY_ID, the database assigns them by time.
+                output_time = chart_time + datetime.timedelta(minutes=i % len(item_ids) + 1)
+                writers['OUTPUTEVENTS'].write([subject_id, hadm_id, icu_stay_id if rand.random() < 0.5 else '',
+                                               self._time(output_time), item_id, value, unit, '', cgid, '', '', ''])
+
+
+def generate(output_dir, num_of_events=DEFAULT_NUM_OF_EVENTS, events_per_stay=DEFAULT_EVENTS_PER_STAY, seed=0):
+    """
+    writes a synthetic MIMIC-III dataset, see SyntheticMimic.
+    :param output_dir: directory to write the csv files to.
+    :param num_of_events: approximate number of rows of CHARTEVENTS.csv, from 1k to tens of millions.
+    :param events_per_stay: average number of chart events of an icu stay.
+    :param seed: seed of the generator.
+    :return: dict table name -> number of rows written.
+    """
+    return SyntheticMimic(num_of_events, events_per_stay, seed).generate(output_dir)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.INFO)
+    if len(sys.argv) < 2:
+        print "usage: python synthetic.py OUTPUT_DIR [NUM_OF_EVENTS] [SEED]"
+        sys.exit(1)
+    counts = generate(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NUM_OF_EVENTS,
+                      seed=int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    for name in sorted(counts):
+        print "%s: %d rows" % (name, counts[name])
@@ -0,0 +1,207 @@
+import csv
+import gzip
+import itertools
+import operator
+import os
+import numpy as np
+import utils
+
+DEFAULT_CHUNK_SIZE = 100000
+
+# value of 'int' columns where the csv field is empty (e.g. events without HADM_ID or ICUSTAY_ID).
+MISSING_ID = -1
+
+# column kinds a TableReader converts to:
+#   'str' - numpy string array, as in the csv.
+#   'int' - int64, MISSING_ID where empty.
+#   'float' - float64, nan where empty.
+#   'time' - int64 seconds since epoch, utils.MISSING_TIME where empty.
+COLUMN_KINDS = ('str', 'int', 'float', 'time')
+
+
+def table_path(directory, table_name):
+    """
+    :param directory: dir of the mimic csv files.
+    :param table_name: for example 'CHARTEVENTS'.
+    :return: path of TABLE.csv, or of TABLE.csv.gz if only the compressed file exists.
+    """
+    path = os.path.join(directory, table_name + '.csv')
+    if not os.path.exists(path) and os.path.exists(path + '.gz'):
+        return path + '.gz'
+    return path
+
+
+def _parse_numbers(strings, dtype):
+    """
+    parses a list of non empty numeric strings. numpy's text parser is much faster than astype on string arrays, it
+    stops early on a malformed string, and then astype is used to raise the proper error.
+    """
+    numbers = np.fromstring(' '.join(strings), dtype=dtype, sep=' ')
+    if len(numbers) != len(strings):
+        numbers = np.asarray(strings, dtype='S').astype(dtype)
+    return numbers
+
+
+def _parse_column(values, dtype, missing):
+    """
+    :param values: sequence of numeric strings, '' for missing values.
+    :return: numpy array of dtype, missing where the string is empty.
+    """
+    if '' not in values:
+        return _parse_numbers(values, dtype)
+    strings = np.asarray(values, dtype='S')
+    numbers = np.full(len(strings), missing, dtype=dtype)
+    present = strings != ''
+    numbers[present] = _parse_numbers(strings[present].tolist(), dtype)
+    return numbers
+
+
+def string_column_to_float(strings):
+    """
+    :param strings: sequence of numeric strings, '' for missing values.
+    :return: float64 numpy array, nan where the string is empty.
+    """
+    return _parse_column(list(strings), np.float64, np.nan)
+
+
+def string_column_to_int(strings):
+    """
+    :param strings: sequence of integer strings, '' for missing values.
+    :return: int64 numpy array, MISSING_ID where the string is empty.
+    """
+    return _parse_column(list(strings), np.int64, MISSING_ID)
+
+
+def convert_column(values, kind):
+    """
+    converts the string values of a csv column to a typed numpy array.
+    :param values: sequence of strings.
+    :param kind: one of COLUMN_KINDS.
+    :return: numpy array
+    """
+    if kind == 'int':
+        return string_column_to_int(values)
+    if kind == 'float':
+        return string_column_to_float(values)
+    strings = np.asarray(values, dtype='S') if len(values) else np.empty(0, dtype='S1')
+    if kind == 'str':
+        return strings
+    if kind == 'time':
+        return utils.parse_time_column(strings)
+    raise ValueError("unknown column kind %s" % kind)
+
+
+class Chunk(object):
+    """
+    A chunk of consecutive rows of a table, as typed numpy columns.
+
+        Attributes:
+            - columns: dict column name -> numpy array.
+            - first_row: index in the table of the first row of the chunk.
+            - end_offset: byte offset in the file right after the last row of the chunk.
+    """
+    def __init__(self, columns, first_row, num_of_rows, end_offset):
+        self.columns = columns
+        self.first_row = first_row
+        self.num_of_rows = num_of_rows
+        self.end_offset = end_offset
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        return self.num_of_rows
+
+    def rows(self, positions=None):
+        """
+        iterates over rows of the chunk as dicts of column name -> python value.
+        :param positions: optional indexes of the rows to return, all rows by default.
+        :return: generator of dicts.
+        """
+        names = list(self.columns)
+        if positions is None:
+            values = [self.columns[name].tolist() for name in names]
+        else:
+            values = [self.columns[name][positions].tolist() for name in names]
+        for row_values in zip(*values):
+            yield dict(zip(names, row_values))
+
+
+class TableReader(object):
+    """
+    Streams a MIMIC csv table (plain or gzip compressed) as chunks of typed columns. only the requested columns are
+    kept and converted, one chunk at a time, so memory is bounded by the chunk size. can read only a byte range of a
+    plain csv file, used to split a table between processes and to read rows appended since a previous read.
+    """
+    def __init__(self, path, columns=None, optional=(), chunk_size=DEFAULT_CHUNK_SIZE, start=None, stop=None):
+        """
+        :param path: path to a .csv or .csv.gz file.
+        :param columns: list of (column name, kind) to read, kind is one of COLUMN_KINDS. None reads all the columns
+        of the header as 'str'.
+        :param optional: names of requested columns that may be missing from the file. they are left out of the
+        chunks instead of raising an error.
+        :param chunk_size: number of rows in a chunk.
+        :param start: byte offset of the first row to read, must be the start of a line. defaults to the row after the
+        header.
+        :param stop: byte offset to stop at, rows that start at or after it are not read. defaults to the end of file.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compressed = path.endswith('.gz')
+        if self.compressed and (start is not None or stop is not None):
+            raise ValueError("byte ranges are not supported for compressed file %s" % path)
+
+        self._file = gzip.open(path, 'rb') if self.compressed else open(path, 'rb')
+        header_line = self._file.readline()
+        self.header = next(csv.reader([header_line]))
+        self.header_size = len(header_line)
+        if start is not None:
+            self._file.seek(start)
+        self.offset = start if start is not None else self.header_size
+        self._stop = stop
+
+        if columns is None:
+            columns = [(name, 'str') for name in self.header]
+        missing = [name for name, kind in columns if name not in self.header and name not in optional]
+        if missing:
+            self.close()
+            raise ValueError("columns %s are missing from %s" % (', '.join(missing), path))
+        self.columns = [(name, kind) for name, kind in columns if name in self.header]
+        indexes = [self.header.index(name) for name, kind in self.columns]
+        # itemgetter of a single index returns a value instead of a tuple.
+        getter = operator.itemgetter(*indexes)
+        self._project = getter if len(indexes) > 1 else (lambda row: (getter(row),))
+
+    def _lines(self):
+        for line in self._file:
+            if self._stop is not None and self.offset >= self._stop:
+                return
+            self.offset += len(line)
+            yield line
+
+    def __iter__(self):
+        reader = csv.reader(self._lines())
+        first_row = 0
+        while True:
+            rows = list(itertools.islice(reader, self.chunk_size))
+            if not rows:
+                return
+            rows = [self._project(row) for row in rows if row]
+            if not rows:
+                continue
+            values = list(zip(*rows))
+            columns = dict((name, convert_column(values[i], kind)) for i, (name, kind) in enumerate(self.columns))
+            yield Chunk(columns, first_row, len(rows), self.offset)
+            first_row += len(rows)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+import cli
+import database
+import features
+import test_database
+
+
+def run(argv):
+    """
+    :return: what the command printed.
+    """
+    output, sys.stdout = sys.stdout, StringIO.StringIO()
+    try:
+        cli.main(argv)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = output
+
+
+class CliTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.mimic3_dir = os.path.join(cls.work_dir, 'csv')
+        test_database.write_tables(cls.mimic3_dir)
+        cls.snapshot_dir = os.path.join(cls.work_dir, 'snapshot')
+        cls.output = run(['ingest', cls.mimic3_dir, '--snapshot', cls.snapshot_dir, '--profile'])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def test_ingest(self):
+        self.assertIn('patients: 3\nadmissions: 4\nicu stays: 5\n', self.output)
+        self.assertIn('CHARTEVENTS missing_icustay_id: 1\n', self.output)
+        self.assertIn('LABEVENTS outside_icu_stays: 4\n', self.output)
+        self.assertIn('OUTPUTEVENTS', self.output)
+        self.assertTrue(os.path.isdir(self.snapshot_dir))
+
+    def test_snapshot_load_and_stats(self):
+        self.assertEqual(run(['snapshot', 'load', self.snapshot_dir]).splitlines()[:3],
+                         ['patients: 3', 'admissions: 4', 'icu stays: 5'])
+        output = run(['stats', self.snapshot_dir, '--top', '1'])
+        self.assertIn('LABEVENTS events: 40\n', output)
+        self.assertIn('OUTPUTEVENTS events: 60\n', output)
+        self.assertIn('distinct items: 5\n', output)
+        self.assertEqual(output.splitlines()[-1], 'item 40055: 60 events')
+
+    def test_export(self):
+        path = os.path.join(self.work_dir, 'features.npz')
+        opened = []
+        open_snapshot = database.ICUDatabase.__dict__['open_snapshot']
+        database.ICUDatabase.open_snapshot = classmethod(
+            lambda cls, *args, **kwargs: opened.append(open_snapshot.__get__(None, cls)(*args, **kwargs)) or opened[0])
+        try:
+            output = run(['export', self.snapshot_dir, path, '--items', '211', '50971', '--with-item', '50971',
+                          '--aggregations', 'mean', 'count', '--horizon', str(24 * 3600)])
+        finally:
+            database.ICUDatabase.open_snapshot = open_snapshot
+        # the INTIME of the stays came from the icu stays table, no patient was materialized.
+        self.assertEqual(len(opened[0].patients._cache), 0)
+        self.assertEqual(output, 'exported 5 icu stays with 4 features to %s\n' % path)
+        exported = np.load(path)
+        db = database.ICUDatabase.load_snapshot(self.snapshot_dir)
+        expected = features.FeatureBuilder([211, 50971], horizon=24 * 3600, aggregations=('mean', 'count'))\
+            .build_for_database(db)
+        np.testing.assert_array_equal(exported['values'], expected.values)
+        np.testing.assert_array_equal(exported['mask'], expected.mask)
+        self.assertEqual(exported['feature_names'].tolist(), expected.feature_names)
+
+    def test_dump(self):
+        output_dir = os.path.join(self.work_dir, 'dump')
+        output = run(['dump', self.snapshot_dir, output_dir, '--format', 'npz', '--tables', 'icu_stays', 'events',
+                      '--batch-size', '2', '--event-columns', 'ITEMID', 'VALUENUM', '--with-item', '211'])
+        self.assertEqual(output, 'icu_stays: 3 files\nevents: 3 files\n')
+        self.assertEqual(sorted(np.load(os.path.join(output_dir, 'events', 'part-00000.npz')).files),
+                         ['ITEMID', 'VALUENUM'])
+
+    def test_parser_does_not_import_numpy(self):
+        script = "import sys, cli; cli.make_parser(); print sorted(set(['numpy', 'database']) & set(sys.modules))"
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=os.path.dirname(cli.__file__) or '.')
+        self.assertEqual(output.strip(), '[]')
+
+    def test_unknown_command(self):
+        error, sys.stderr = sys.stderr, StringIO.StringIO()
+        try:
+            self.assertRaises(SystemExit, cli.main, ['drop', self.snapshot_dir])
+        finally:
+            sys.stderr = error
+
+
+if __name__ == '__main__':
+    unittest.main()
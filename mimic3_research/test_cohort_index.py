@@ -0,0 +1,83 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import cohort_index
+import database
+import test_database
+import utils
+
+
+class CategoryIndexTest(unittest.TestCase):
+    def test_lookup(self):
+        index = cohort_index.CategoryIndex(['MICU', 'SICU', 'MICU', 'CCU'], [30, 20, 10, 40])
+        self.assertEqual(index.categories(), ['CCU', 'MICU', 'SICU'])
+        self.assertEqual(index.lookup('MICU').tolist(), [10, 30])
+        self.assertEqual(index.lookup('MICU', 'CCU', 'NICU').tolist(), [10, 30, 40])
+        self.assertEqual(index.lookup('NICU').tolist(), [])
+        self.assertEqual(cohort_index.CategoryIndex([], []).categories(), [])
+
+
+class TimeIndexTest(unittest.TestCase):
+    def test_overlapping(self):
+        index = cohort_index.TimeIndex([1, 2, 3, 4], [300, 100, utils.MISSING_TIME, 500],
+                                       [400, 200, 600, utils.MISSING_TIME])
+        self.assertEqual(index.overlapping(150, 350).tolist(), [1, 2])
+        self.assertEqual(index.overlapping(201, 299).tolist(), [])
+        # a stay without OUTTIME is still open.
+        self.assertEqual(index.overlapping(10 ** 6, 10 ** 6).tolist(), [4])
+
+
+class CohortQueryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        mimic3_dir = os.path.join(cls.work_dir, 'csv')
+        test_database.write_tables(mimic3_dir)
+        cls.db = database.ICUDatabase(mimic3_dir)
+        test_database.read_tables(cls.db)
+        cls.snapshot_dir = os.path.join(cls.work_dir, 'snapshot')
+        cls.db.save_snapshot(cls.snapshot_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def test_filters(self):
+        for db in (self.db, database.ICUDatabase.load_snapshot(self.snapshot_dir)):
+            self.assertEqual(db.cohort().stay_ids().tolist(), [1001, 1002, 1003, 2001, 3001])
+            self.assertEqual(db.cohort().care_unit('MICU').db_source('carevue').admission_type('EMERGENCY')
+                             .insurance('Medicare').stay_ids().tolist(), [1001, 1002, 1003, 2001, 3001])
+            self.assertEqual(len(db.cohort().care_unit('SICU')), 0)
+            self.assertEqual(len(db.cohort().insurance('Medicaid')), 0)
+            # the last chart event of 3001 has no ICUSTAY_ID, so the stay has one event of 618 less.
+            self.assertEqual(db.cohort().with_item(618, min_count=10).stay_ids().tolist(), [1001, 1002, 1003, 2001])
+            self.assertEqual(db.cohort().with_item(50971, min_duration=42 * 3600).stay_ids().tolist(),
+                             [1001, 1002, 1003, 2001, 3001])
+            self.assertEqual(len(db.cohort().with_item(50971, min_duration=42 * 3600 + 1)), 0)
+            self.assertEqual(db.cohort().between(datetime.datetime(2150, 1, 3, 2), datetime.datetime(2150, 3, 2))
+                             .stay_ids().tolist(), [1001, 1002, 1003])
+            self.assertRaises(ValueError, db.cohort().between, datetime.datetime(2150, 1, 3),
+                              datetime.datetime(2150, 1, 2))
+
+    def test_item_counts(self):
+        counts = self.db.index.items.counts_of(211)
+        self.assertEqual(counts, dict((icu_stay_id, 10) for icu_stay_id in self.db.icu_stays))
+        self.assertEqual(self.db.index.items.counts_of(1), {})
+
+    def test_index_is_rebuilt_after_ingest(self):
+        db = database.ICUDatabase(self.db.mimic3_dir)
+        for table_name in ('PATIENTS', 'ADMISSIONS', 'ICUSTAYS'):
+            db.read_table(table_name)
+        self.assertEqual(len(db.cohort().with_item(211)), 0)
+        self.assertEqual(len(db.cohort().care_unit('MICU')), 5)
+        db.read_table('CHARTEVENTS')
+        self.assertEqual(len(db.cohort().with_item(211)), 5)
+        self.assertEqual(len(db.cohort().with_item(50971)), 0)
+        db.read_table('LABEVENTS')
+        self.assertEqual(len(db.cohort().with_item(50971)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
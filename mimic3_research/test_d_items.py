@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import d_items
+import database
+import synthetic
+
+
+class ConceptMapTest(unittest.TestCase):
+    def setUp(self):
+        self.concept_map = d_items.ConceptMap.default()
+
+    def apply(self, item_ids, values, units):
+        return self.concept_map.apply(np.array(item_ids), np.array(values, dtype=np.float64), np.array(units))
+
+    def test_items_are_merged(self):
+        item_ids, values, units = self.apply([211, 220045, 618, 999999], [80, 90, 20, 1], ['bpm', 'bpm', '', 'x'])
+        self.assertEqual(item_ids.tolist(), [220045, 220045, 220210, 999999])
+        self.assertEqual(values.tolist(), [80, 90, 20, 1])
+        self.assertEqual(units.tolist(), ['bpm', 'bpm', '', 'x'])
+        self.assertEqual(self.concept_map.concept_id('heart_rate'), 220045)
+        self.assertRaises(ValueError, self.concept_map.concept_id, 'pain')
+
+    def test_temperature_is_converted_to_celsius(self):
+        item_ids, values, units = self.apply([678, 678, 678, 676, 223762], [212, 32, 98.6, 37, 38],
+                                             ['Deg. F', '?F', '', 'Deg. C', '?C'])
+        self.assertEqual(item_ids.tolist(), [223762] * 5)
+        np.testing.assert_allclose(values, [100, 0, 37, 37, 38])
+        self.assertEqual(units.tolist(), ['?C'] * 5)
+
+    def test_weight_is_converted_to_kilograms(self):
+        item_ids, values, units = self.apply([3581, 226512, 762], [100, 70, 80], ['', 'kg', 'lbs'])
+        self.assertEqual(item_ids.tolist(), [226512] * 3)
+        np.testing.assert_allclose(values, [45.359237, 70, 80 * 0.45359237])
+        self.assertEqual(units.tolist(), ['kg'] * 3)
+
+    def test_unknown_units_are_kept(self):
+        item_ids, values, units = self.apply([226512, 678], [5, 40], ['stone', 'K'])
+        self.assertEqual(item_ids.tolist(), [226512, 223762])
+        self.assertEqual(values.tolist(), [5, 40])
+        self.assertEqual(units.tolist(), ['stone', 'K'])
+
+    def test_configuration_round_trip(self):
+        config = json.loads(json.dumps(self.concept_map.to_dict()))
+        loaded = d_items.ConceptMap.from_dict(config)
+        self.assertEqual(loaded.concepts, self.concept_map.concepts)
+        self.assertEqual(loaded.units, self.concept_map.units)
+        self.assertEqual(loaded.item_units, self.concept_map.item_units)
+
+    def test_invalid_configuration(self):
+        self.assertRaises(ValueError, d_items.ConceptMap, {'a': [1, 2], 'b': [2, 3]})
+        self.assertRaises(ValueError, d_items.ConceptMap, {'a': [1, 2]}, {'b': 'kg'})
+
+
+class ConceptMapIngestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mimic3_dir = tempfile.mkdtemp()
+        synthetic.generate(cls.mimic3_dir, num_of_events=3000, events_per_stay=100, seed=8)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.mimic3_dir)
+
+    def test_ingest_merges_and_converts(self):
+        raw = database.ICUDatabase(self.mimic3_dir)
+        raw.ingest()
+        db = database.ICUDatabase(self.mimic3_dir, concept_map=d_items.ConceptMap.default())
+        db.ingest()
+        store = db.event_store
+        self.assertEqual(len(store), len(raw.event_store))
+        self.assertFalse(np.in1d(store.item_id, [678, 676, 211, 618, 646]).any())
+        temperature = store.item_id == 223762
+        self.assertEqual(np.count_nonzero(temperature), np.count_nonzero(np.in1d(raw.event_store.item_id, [678, 676])))
+        values = store.value_num[temperature]
+        values = values[~np.isnan(values)]
+        self.assertGreater(len(values), 0)
+        self.assertTrue(((values > 35) & (values < 40)).all())
+        self.assertEqual(set(store.unit_dictionary.decode(code) for code in store.value_unit[temperature]), {'?C'})
+
+
+class ItemDictionaryTest(unittest.TestCase):
+    def setUp(self):
+        self.mimic3_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.mimic3_dir, 'D_ITEMS.csv'), 'wb') as table_file:
+            table_file.write('"ROW_ID","ITEMID","LABEL","ABBREVIATION","DBSOURCE","LINKSTO","CATEGORY","UNITNAME",'
+                             '"CONCEPTID","PARAM_TYPE","LOWNORMALVALUE","HIGHNORMALVALUE"\n'
+                             '1,211,"Heart Rate",,"carevue","chartevents",,,,,,\n'
+                             '2,220045,"Heart Rate","HR","metavision","chartevents","Routine Vital Signs","bpm",,'
+                             '"Numeric",,\n'
+                             '3,678,"Temperature F",,"carevue","chartevents",,,,,,\n')
+        with open(os.path.join(self.mimic3_dir, 'D_LABITEMS.csv'), 'wb') as table_file:
+            table_file.write('"ROW_ID","ITEMID","LABEL","FLUID","CATEGORY","LOINC_CODE"\n'
+                             '1,50912,"Creatinine","Blood","Chemistry","2160-0"\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.mimic3_dir)
+
+    def test_load(self):
+        items = d_items.ItemDictionary.load(self.mimic3_dir)
+        self.assertEqual(len(items), 4)
+        self.assertIn(220045, items)
+        self.assertNotIn(212, items)
+        self.assertEqual(items.label(678), 'Temperature F')
+        self.assertIsNone(items.label(212))
+        item = items.item(220045)
+        self.assertEqual((item['abbreviations'], item['unit_names'], item['param_types']), ('HR', 'bpm', 'Numeric'))
+        self.assertIsNone(items.item(212))
+        self.assertEqual(items.label(50912), 'Creatinine')
+        self.assertEqual(items.find('heart rate').tolist(), [211, 220045])
+        self.assertEqual(items.find('heart', category='Routine Vital Signs').tolist(), [220045])
+        self.assertEqual(items.take('labels', [211, 5]).tolist(), ['Heart Rate', ''])
+
+    def test_missing_table(self):
+        os.remove(os.path.join(self.mimic3_dir, 'D_ITEMS.csv'))
+        self.assertRaises(ValueError, d_items.ItemDictionary.load, self.mimic3_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import data_loader
+import database
+import features
+import test_database
+import utils
+
+
+class StayBatchLoaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        mimic3_dir = os.path.join(cls.work_dir, 'csv')
+        test_database.write_tables(mimic3_dir)
+        cls.db = database.ICUDatabase(mimic3_dir)
+        test_database.read_tables(cls.db)
+        cls.builder = features.FeatureBuilder([211, 618, 50971, 40055], bin_width=4 * 3600, horizon=72 * 3600)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def loader(self, **arguments):
+        return data_loader.StayBatchLoader(self.db, self.builder, **arguments)
+
+    def test_sequence_lengths(self):
+        expected = []
+        for icu_stay_id in (1001, 3001):
+            last_time = self.db.icu_stays[icu_stay_id].time_series.chart_time.max()
+            start = utils.date_time_to_epoch(self.db.icu_stays[icu_stay_id].in_time)
+            expected.append(min((last_time - start) // self.builder.bin_width + 1, self.builder.n_bins))
+        # a stay without events is one bin long.
+        self.db.icu_stays[9999] = self.db.icu_stays[1001]
+        try:
+            self.assertEqual(self.loader(icu_stay_ids=[1001, 3001, 9999]).lengths.tolist(), expected + [1])
+        finally:
+            del self.db.icu_stays[9999]
+
+    def test_sequence_lengths_of_stays_with_missing_times(self):
+        loader = self.loader(icu_stay_ids=[1001, 3001])
+        store = self.db.event_store
+        rows = store.icu_stay_id == 3001
+        chart_time = store.chart_time[rows]
+        loader.start_times[0] = utils.MISSING_TIME
+        store.chart_time[rows] = utils.MISSING_TIME
+        try:
+            self.assertEqual(loader._sequence_lengths().tolist(), [1, 1])
+        finally:
+            store.chart_time[rows] = chart_time
+
+    def test_batches_match_the_feature_builder(self):
+        labels = np.arange(len(self.db.icu_stays))
+        loader = self.loader(labels=labels, batch_size=2, num_workers=2, prefetch=1)
+        ids = sorted(self.db.icu_stays)
+        matrix = self.builder.build(self.db.event_store, ids, features.stay_start_times(self.db, ids))
+        seen = []
+        for batch in loader:
+            self.assertLessEqual(len(batch), 2)
+            self.assertEqual(batch.values.shape[1], batch.lengths.max())
+            for row, icu_stay_id in enumerate(batch.icu_stay_ids):
+                position = ids.index(icu_stay_id)
+                self.assertEqual(batch.labels[row], labels[position])
+                np.testing.assert_array_equal(batch.values[row], matrix.values[position, :batch.values.shape[1]])
+                np.testing.assert_array_equal(batch.mask[row], matrix.mask[position, :batch.values.shape[1]])
+            seen.extend(batch.icu_stay_ids.tolist())
+        self.assertEqual(sorted(seen), ids)
+        self.assertEqual(loader.epoch, 1)
+
+    def test_epochs_are_reproducible(self):
+        loader = self.loader(batch_size=2, seed=3)
+        orders = [[positions.tolist() for positions in loader.batch_order(epoch)] for epoch in (0, 1, 0)]
+        self.assertEqual(orders[0], orders[2])
+        self.assertEqual(sorted(sum(orders[1], [])), range(len(self.db.icu_stays)))
+        unshuffled = self.loader(batch_size=2, shuffle=False)
+        lengths = [unshuffled.lengths[positions].max() for positions in unshuffled.batch_order(0)]
+        self.assertEqual(lengths, sorted(lengths))
+
+    def test_labels_must_match_the_stays(self):
+        self.assertRaises(ValueError, self.loader, labels=[0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
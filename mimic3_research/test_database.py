@@ -0,0 +1,386 @@
+import csv
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import database
+import event
+import utils
+import watermark
+
+# (SUBJECT_ID, HADM_ID, ICUSTAY_ID, INTIME) of the icu stays written by write_tables, every stay lasts two days.
+STAY_LENGTH = datetime.timedelta(days=2)
+STAYS = ((1, 101, 1001, datetime.datetime(2150, 1, 1, 2)), (1, 101, 1002, datetime.datetime(2150, 1, 5)),
+         (1, 102, 1003, datetime.datetime(2150, 3, 2)), (2, 201, 2001, datetime.datetime(2151, 6, 2)),
+         (3, 301, 3001, datetime.datetime(2152, 9, 1)))
+# ITEMID -> (VALUEUOM, VALUE of the i-th event) of the chart events written by write_tables.
+CHART_ITEMS = {211: ('bpm', lambda i: str(60 + i % 50)),
+               618: ('insp/min', lambda i: '%.1f' % (12 + i % 10 / 4.0)),
+               212: ('', lambda i: ('Sinus Rhythm', 'Atrial Fib')[i % 2])}
+
+
+def _time(date_time, day_first=False):
+    # both time formats of the MIMIC files.
+    if day_first:
+        return '%s %2d:%02d:%02d' % (date_time.strftime('%d/%m/%Y'), date_time.hour, date_time.minute,
+                                     date_time.second)
+    return date_time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _write(path, header, rows):
+    with open(path, 'wb') as table_file:
+        writer = csv.writer(table_file, lineterminator='\n')
+        writer.writerow(['ROW_ID'] + header)
+        for i, row in enumerate(rows):
+            writer.writerow([i + 1] + row)
+
+
+def write_tables(mimic3_dir, events_per_stay=30):
+    """
+    writes a small MIMIC-III like dataset of STAYS: patient 1 has two admissions and three icu stays, patient 2 dies
+    at the discharge of their admission. the chart events of a stay are every half an hour, and alternate the time
+    formats. the last stay has an event without ICUSTAY_ID. every stay has a lab every 6 hours, and every admission a
+    lab before its first stay. every stay has an output event every 4 hours, every second one without ICUSTAY_ID.
+    :param mimic3_dir: directory to write the csv files to, created if needed.
+    :param events_per_stay: number of chart events of every stay.
+    """
+    if not os.path.isdir(mimic3_dir):
+        os.makedirs(mimic3_dir)
+    _write(os.path.join(mimic3_dir, 'PATIENTS.csv'),
+           ['SUBJECT_ID', 'GENDER', 'DOB', 'DOD', 'DOD_HOSP', 'DOD_SSN', 'EXPIRE_FLAG'],
+           [[1, 'F', '2100-02-03 00:00:00', '', '', '', '0'],
+            [2, 'M', '2090-07-01 00:00:00', '2151-06-09 00:00:00', '2151-06-09 00:00:00', '', '1'],
+            [3, 'M', '2080-01-01 00:00:00', '', '', '', '0']])
+
+    admissions = []
+    for subject_id, hadm_id in sorted(set((subject_id, hadm_id) for subject_id, hadm_id, _, _ in STAYS)):
+        admit_time = min(in_time for _, stay_hadm_id, _, in_time in STAYS if stay_hadm_id == hadm_id)
+        admit_time -= datetime.timedelta(hours=2)
+        disch_time = max(in_time for _, stay_hadm_id, _, in_time in STAYS if stay_hadm_id == hadm_id)
+        disch_time += datetime.timedelta(days=4)
+        death_time = _time(disch_time) if subject_id == 2 else ''
+        admissions.append([subject_id, hadm_id, _time(admit_time), _time(disch_time), death_time, 'EMERGENCY',
+                           'EMERGENCY ROOM ADMIT', 'HOME', 'Medicare', 'ENGL', 'CATHOLIC', 'MARRIED', 'WHITE', '', '',
+                           'SEPSIS', '1' if death_time else '0', '1'])
+    _write(os.path.join(mimic3_dir, 'ADMISSIONS.csv'),
+           ['SUBJECT_ID', 'HADM_ID', 'ADMITTIME', 'DISCHTIME', 'DEATHTIME', 'ADMISSION_TYPE', 'ADMISSION_LOCATION',
+            'DISCHARGE_LOCATION', 'INSURANCE', 'LANGUAGE', 'RELIGION', 'MARITAL_STATUS', 'ETHNICITY', 'EDREGTIME',
+            'EDOUTTIME', 'DIAGNOSIS', 'HOSPITAL_EXPIRE_FLAG', 'HAS_CHARTEVENTS_DATA'], admissions)
+
+    _write(os.path.join(mimic3_dir, 'ICUSTAYS.csv'),
+           ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'DBSOURCE', 'FIRST_CAREUNIT', 'LAST_CAREUNIT', 'FIRST_WARDID',
+            'LAST_WARDID', 'INTIME', 'OUTTIME', 'LOS'],
+           [[subject_id, hadm_id, icu_stay_id, 'carevue', 'MICU', 'MICU' if icu_stay_id % 2 else 'SICU', '12', '12',
+             _time(in_time), _time(in_time + STAY_LENGTH), '2.0000']
+            for subject_id, hadm_id, icu_stay_id, in_time in STAYS])
+
+    chart_events = []
+    item_ids = sorted(CHART_ITEMS)
+    for subject_id, hadm_id, icu_stay_id, in_time in STAYS:
+        for i in range(events_per_stay):
+            item_id = item_ids[i % len(item_ids)]
+            unit, value = CHART_ITEMS[item_id]
+            value = value(i)
+            chart_time = in_time + datetime.timedelta(minutes=30 * (i // len(item_ids)) + 1)
+            value_num = value if unit else ''
+            chart_events.append([subject_id, hadm_id, icu_stay_id, item_id, _time(chart_time, i % 2 == 1), '',
+                                 '14%03d' % (i % 3), value, value_num, unit, '', '', '', ''])
+    chart_events[-1][2] = ''
+    _write(os.path.join(mimic3_dir, 'CHARTEVENTS.csv'),
+           ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'ITEMID', 'CHARTTIME', 'STORETIME', 'CGID', 'VALUE', 'VALUENUM',
+            'VALUEUOM', 'WARNING', 'ERROR', 'RESULTSTATUS', 'STOPPED'], chart_events)
+
+    lab_events = []
+    output_events = []
+    for subject_id, hadm_id, icu_stay_id, in_time in STAYS:
+        if icu_stay_id == min(stay[2] for stay in STAYS if stay[1] == hadm_id):
+            lab_events.append([subject_id, hadm_id, 50912, _time(in_time - datetime.timedelta(hours=1)), '1.1', '1.1',
+                               'mg/dL', ''])
+        for i in range(8):
+            lab_events.append([subject_id, hadm_id, 50971, _time(in_time + datetime.timedelta(hours=6 * i + 3)),
+                               '%.1f' % (3.5 + i / 10.0), '%.1f' % (3.5 + i / 10.0), 'mEq/L', 'abnormal' if i else ''])
+        for i in range(12):
+            output_events.append([subject_id, hadm_id, icu_stay_id if i % 2 else '',
+                                  _time(in_time + datetime.timedelta(hours=4 * i + 2), True), 40055, str(100 + i),
+                                  'ml', '', '14000', '', '', ''])
+    _write(os.path.join(mimic3_dir, 'LABEVENTS.csv'),
+           ['SUBJECT_ID', 'HADM_ID', 'ITEMID', 'CHARTTIME', 'VALUE', 'VALUENUM', 'VALUEUOM', 'FLAG'], lab_events)
+    _write(os.path.join(mimic3_dir, 'OUTPUTEVENTS.csv'),
+           ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'CHARTTIME', 'ITEMID', 'VALUE', 'VALUEUOM', 'STORETIME', 'CGID',
+            'STOPPED', 'NEWBOTTLE', 'ISERROR'], output_events)
+
+
+def read_tables(db):
+    """
+    reads all the tables of write_tables into db.
+    """
+    db.ingest()
+
+
+def table_rows(mimic3_dir):
+    """
+    :return: the rows of the events tables of write_tables that belong to an icu stay, as sorted (ICUSTAY_ID, ITEMID,
+    CHARTTIME, VALUENUM, source) tuples. rows without ICUSTAY_ID get the stay of their admission that was open at
+    CHARTTIME. VALUENUM is None when missing.
+    """
+    windows = [(hadm_id, icu_stay_id, utils.date_time_to_epoch(in_time),
+                utils.date_time_to_epoch(in_time + STAY_LENGTH)) for _, hadm_id, icu_stay_id, in_time in STAYS]
+    rows = []
+    for table_name, source, value_column in (('CHARTEVENTS', event.CHART_EVENT, 'VALUENUM'),
+                                             ('LABEVENTS', event.LAB_EVENT, 'VALUENUM'),
+                                             ('OUTPUTEVENTS', event.OUTPUT_EVENT, 'VALUE')):
+        with open(os.path.join(mimic3_dir, table_name + '.csv'), 'rb') as table_file:
+            for row in csv.DictReader(table_file):
+                chart_time = utils.convert_to_epoch(row['CHARTTIME'])
+                if row.get('ICUSTAY_ID'):
+                    icu_stay_id = int(row['ICUSTAY_ID'])
+                elif table_name == 'CHARTEVENTS':
+                    continue
+                else:
+                    inside = [icu_stay_id for hadm_id, icu_stay_id, in_time, out_time in windows
+                              if hadm_id == int(row['HADM_ID']) and in_time <= chart_time <= out_time]
+                    if not inside:
+                        continue
+                    icu_stay_id = inside[0]
+                rows.append((icu_stay_id, int(row['ITEMID']), chart_time,
+                             float(row[value_column]) if row[value_column] else None, source))
+    return sorted(rows)
+
+
+def event_rows(store):
+    """
+    :return: the events of a store as sorted (icu_stay_id, item_id, chart_time, value_num, source) tuples, value_num
+    is None when missing.
+    """
+    return sorted(zip(store.icu_stay_id.tolist(), store.item_id.tolist(), store.chart_time.tolist(),
+                      [None if np.isnan(value) else value for value in store.value_num.tolist()],
+                      store.source.tolist()))
+
+
+def time_series_rows(time_series):
+    """
+    :return: the EventRows of an icu stay time series, value_num is None when missing so the rows compare equal.
+    """
+    return [row._replace(value_num=None) if np.isnan(row.value_num) else row for row in time_series]
+
+
+class IngestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mimic3_dir = tempfile.mkdtemp()
+        write_tables(cls.mimic3_dir)
+        cls.db = database.ICUDatabase(cls.mimic3_dir)
+        read_tables(cls.db)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.mimic3_dir)
+
+    def test_patients_and_stays(self):
+        self.assertEqual(self.db.num_of_patients, 3)
+        self.assertEqual(self.db.total_number_of_hospital_visits, 4)
+        self.assertEqual(sorted(self.db.icu_stays), [icu_stay_id for _, _, icu_stay_id, _ in STAYS])
+        self.assertIs(self.db.patients[1].hospital_visits[101].icu_stays[1002], self.db.icu_stays[1002])
+
+    def test_store_holds_the_events_of_all_tables(self):
+        self.assertEqual(event_rows(self.db.event_store), table_rows(self.mimic3_dir))
+        self.assertEqual(len(self.db.invalid_rows), 1)
+        self.assertEqual(sorted(set(self.db.event_store.source.tolist())),
+                         [event.CHART_EVENT, event.LAB_EVENT, event.OUTPUT_EVENT])
+        # 8 labs and 12 outputs of every stay, the labs before the first stay of every admission are dropped.
+        self.assertEqual(np.count_nonzero(self.db.event_store.source == event.LAB_EVENT), 8 * len(STAYS))
+        self.assertEqual(np.count_nonzero(self.db.event_store.source == event.OUTPUT_EVENT), 12 * len(STAYS))
+
+    def test_store_is_grouped_by_stay_and_time(self):
+        store = self.db.event_store
+        self.assertEqual(store.stay_ids.tolist(), sorted(self.db.icu_stays))
+        for icu_stay_id, start, stop in zip(store.stay_ids, store.stay_starts, store.stay_stops):
+            self.assertTrue((store.icu_stay_id[start:stop] == icu_stay_id).all())
+            self.assertTrue((np.diff(store.chart_time[start:stop]) >= 0).all())
+
+    def test_time_series_are_views_of_the_store(self):
+        for icu_stay_id, stay in self.db.icu_stays.items():
+            self.assertIs(stay.time_series.store, self.db.event_store)
+            np.testing.assert_array_equal(stay.time_series.item_id,
+                                          self.db.event_store.item_id[self.db.event_store.icu_stay_id == icu_stay_id])
+        rows = list(self.db.icu_stays[1001].time_series)
+        self.assertEqual([row.value for row in rows[:3]], [60.0, 'Atrial Fib', 12.5])
+        self.assertEqual([row.value_unit for row in rows[:3]], ['bpm', '', 'insp/min'])
+        self.assertEqual(rows[0].chart_time, datetime.datetime(2150, 1, 1, 2, 1))
+
+
+class IngestModesTest(unittest.TestCase):
+    """
+    the sequential and the parallel ingest of the same tables, plain or compressed, build the same database.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.mimic3_dir = os.path.join(cls.work_dir, 'csv')
+        write_tables(cls.mimic3_dir, events_per_stay=60)
+        cls.sequential = database.ICUDatabase(cls.mimic3_dir)
+        read_tables(cls.sequential)
+        cls.expected = event_rows(cls.sequential.event_store)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def assert_same_database(self, db):
+        self.assertEqual(db.num_of_patients, self.sequential.num_of_patients)
+        self.assertEqual(sorted(db.icu_stays), sorted(self.sequential.icu_stays))
+        self.assertEqual(event_rows(db.event_store), self.expected)
+        self.assertEqual(db.metrics.report(), self.sequential.metrics.report())
+        for icu_stay_id, stay in self.sequential.icu_stays.items():
+            self.assertEqual(time_series_rows(db.icu_stays[icu_stay_id].time_series),
+                             time_series_rows(stay.time_series))
+
+    def test_parallel_ingest(self):
+        db = database.ICUDatabase(self.mimic3_dir)
+        db.read_patients_table()
+        db.read_hospital_visits_table()
+        db.read_icu_stays_table()
+        for table_name in ('CHARTEVENTS', 'LABEVENTS', 'OUTPUTEVENTS'):
+            # small ranges, so every table is split between several chunks.
+            db.read_events_table_parallel(table_name, num_workers=2, chunk_size=1024)
+        self.assert_same_database(db)
+
+    def test_external_ingest(self):
+        db = database.ICUDatabase(self.mimic3_dir)
+        external_dir = os.path.join(self.work_dir, 'external')
+        db.ingest(external_dir=external_dir, memory_budget=16 * 1024)
+        self.assert_same_database(db)
+        self.assertIsInstance(db.event_store.chart_time, np.memmap)
+        snapshot_dir = os.path.join(self.work_dir, 'external_snapshot')
+        db.save_snapshot(snapshot_dir)
+        self.assertEqual(event_rows(database.ICUDatabase.load_snapshot(snapshot_dir).event_store), self.expected)
+
+    def test_external_ingest_merges_the_events_in_the_store(self):
+        db = database.ICUDatabase(self.mimic3_dir)
+        db.ingest(database.TABLE_ORDER[:4])
+        db.read_events_external(os.path.join(self.work_dir, 'merged'), ('LABEVENTS', 'OUTPUTEVENTS'),
+                                num_partitions=3)
+        self.assert_same_database(db)
+
+    def test_pipeline_ingest(self):
+        db = database.ICUDatabase(self.mimic3_dir)
+        report = db.ingest_pipeline(num_workers=2, queue_size=2, chunk_size=1024, compare=True)
+        self.assert_same_database(db)
+        self.assertEqual(db.watermarks, self.sequential.watermarks)
+        self.assertIsNotNone(report.stage('EVENTS'))
+        self.assertIsNotNone(report.baseline_seconds)
+        self.assertIn('speedup', report.format_report())
+
+    def test_pipeline_rejects_unknown_tables(self):
+        self.assertRaises(ValueError, database.ICUDatabase(self.mimic3_dir).ingest_pipeline, ['NOTEEVENTS'])
+
+    def test_compressed_tables(self):
+        compressed_dir = os.path.join(self.work_dir, 'gz')
+        os.makedirs(compressed_dir)
+        for name in os.listdir(self.mimic3_dir):
+            with open(os.path.join(self.mimic3_dir, name), 'rb') as table_file:
+                with gzip.open(os.path.join(compressed_dir, name + '.gz'), 'wb') as compressed_file:
+                    compressed_file.write(table_file.read())
+        db = database.ICUDatabase(compressed_dir)
+        read_tables(db)
+        self.assert_same_database(db)
+        db = database.ICUDatabase(compressed_dir)
+        db.read_patients_table()
+        db.read_hospital_visits_table()
+        db.read_icu_stays_table()
+        for table_name in ('CHARTEVENTS', 'LABEVENTS', 'OUTPUTEVENTS'):
+            db.read_events_table_parallel(table_name, num_workers=2, chunk_size=1024)
+        self.assert_same_database(db)
+
+
+class UpdateTest(unittest.TestCase):
+    """
+    update of a snapshot after rows were appended to a table, or after a table was rewritten.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.full_dir = os.path.join(cls.work_dir, 'full')
+        write_tables(cls.full_dir, events_per_stay=60)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def _ingest_prefix(self, name):
+        """
+        ingests a copy of the tables whose CHARTEVENTS.csv holds only its first half of rows, and saves a snapshot.
+        :return: (csv directory, snapshot directory, the rows of CHARTEVENTS.csv that were left out)
+        """
+        mimic3_dir = os.path.join(self.work_dir, name)
+        shutil.copytree(self.full_dir, mimic3_dir)
+        path = os.path.join(mimic3_dir, 'CHARTEVENTS.csv')
+        with open(path, 'rb') as table_file:
+            lines = table_file.readlines()
+        half = len(lines) // 2
+        with open(path, 'wb') as table_file:
+            table_file.writelines(lines[:half])
+        db = database.ICUDatabase(mimic3_dir)
+        read_tables(db)
+        snapshot_dir = os.path.join(self.work_dir, name + '_snapshot')
+        db.save_snapshot(snapshot_dir)
+        return mimic3_dir, snapshot_dir, lines[half:]
+
+    def test_watermarks_of_every_table(self):
+        mimic3_dir, snapshot_dir, rest = self._ingest_prefix('watermarks')
+        db = database.ICUDatabase.load_snapshot(snapshot_dir)
+        self.assertEqual(sorted(db.watermarks), sorted(database.TABLE_ORDER))
+        self.assertEqual(db.watermarks['CHARTEVENTS']['offset'],
+                         os.path.getsize(os.path.join(mimic3_dir, 'CHARTEVENTS.csv')))
+
+    def test_unchanged_tables(self):
+        mimic3_dir, snapshot_dir, rest = self._ingest_prefix('unchanged')
+        db = database.ICUDatabase.load_snapshot(snapshot_dir)
+        events = event_rows(db.event_store)
+        self.assertIs(db.update(snapshot_dir), db)
+        self.assertEqual(event_rows(db.event_store), events)
+
+    def test_appended_rows(self):
+        mimic3_dir, snapshot_dir, rest = self._ingest_prefix('appended')
+        path = os.path.join(mimic3_dir, 'CHARTEVENTS.csv')
+        with open(path, 'ab') as table_file:
+            table_file.writelines(rest)
+        self.assertEqual(watermark.check(path, database.ICUDatabase.load_snapshot(snapshot_dir)
+                                         .watermarks['CHARTEVENTS']), watermark.APPENDED)
+
+        db = database.ICUDatabase.load_snapshot(snapshot_dir)
+        self.assertIs(db.update(snapshot_dir), db)
+        full = database.ICUDatabase(self.full_dir)
+        read_tables(full)
+        self.assertEqual(event_rows(db.event_store), event_rows(full.event_store))
+        self.assertEqual(db.watermarks['CHARTEVENTS']['offset'], os.path.getsize(path))
+        # the snapshot was written again with the appended rows.
+        saved = database.ICUDatabase.load_snapshot(snapshot_dir)
+        self.assertEqual(event_rows(saved.event_store), event_rows(full.event_store))
+        self.assertEqual(saved.watermarks, db.watermarks)
+
+    def test_rewritten_table(self):
+        mimic3_dir, snapshot_dir, rest = self._ingest_prefix('rewritten')
+        path = os.path.join(mimic3_dir, 'CHARTEVENTS.csv')
+        with open(path, 'rb') as table_file:
+            lines = table_file.readlines()
+        with open(path, 'wb') as table_file:
+            # the first rows are dropped, the ingested part of the file is different.
+            table_file.writelines(lines[:1] + lines[len(lines) // 2:] + rest)
+
+        db = database.ICUDatabase.load_snapshot(snapshot_dir)
+        rebuilt = db.update(snapshot_dir)
+        self.assertIsNot(rebuilt, db)
+        expected = database.ICUDatabase(mimic3_dir)
+        read_tables(expected)
+        self.assertEqual(event_rows(rebuilt.event_store), event_rows(expected.event_store))
+        self.assertEqual(rebuilt.watermarks, expected.watermarks)
+        saved = database.ICUDatabase.load_snapshot(snapshot_dir)
+        self.assertEqual(event_rows(saved.event_store), event_rows(expected.event_store))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import math
+import unittest
+import event
+import hospital_visit
+
+
+class EventTest(unittest.TestCase):
+    def test_numeric_value_is_derived_from_valuenum(self):
+        new_event = event.Event('211', '2150-01-01 00:00:00', '80', '80', 'bpm')
+        self.assertEqual(new_event.value_num, 80.0)
+        self.assertEqual(new_event.value, 80.0)
+        self.assertEqual(new_event.item_id, 211)
+
+    def test_text_value_without_valuenum(self):
+        new_event = event.Event('212', '2150-01-01 00:00:00', 'Sinus Rhythm', '', '')
+        self.assertTrue(math.isnan(new_event.value_num))
+        self.assertEqual(new_event.value, 'Sinus Rhythm')
+
+    def test_text_value_with_valuenum(self):
+        new_event = event.Event('198', '2150-01-01 00:00:00', '4 Confused', '4', '')
+        self.assertEqual(new_event.value_num, 4.0)
+        self.assertEqual(new_event.value, '4 Confused')
+
+    def test_numeric_value_that_differs_from_valuenum(self):
+        new_event = event.Event('211', '2150-01-01 00:00:00', '80.0', '80', 'bpm')
+        self.assertEqual(new_event.value_num, 80.0)
+        self.assertEqual(new_event.value, 80.0)
+        self.assertIs(type(new_event.value), float)
+        self.assertIsNone(new_event._value)
+        new_event = event.Event('211', '2150-01-01 00:00:00', '81', '80', 'bpm')
+        self.assertEqual((new_event.value, new_event.value_num), (81.0, 80.0))
+
+    def test_numeric_value_without_valuenum(self):
+        new_event = event.Event('211', '2150-01-01 00:00:00', '80', '', 'bpm')
+        self.assertTrue(math.isnan(new_event.value_num))
+        self.assertEqual(new_event.value, 80.0)
+
+    def test_events_have_no_instance_dict(self):
+        new_events = [event.ChartEvent('211', '2150-01-01 00:00:00', '80', '80', 'bpm', '', ''.join(['14', '001']),
+                                       '', '', '', ''),
+                      event.LabEvent('50912', '2150-01-01 00:00:00', '1.1', '1.1', 'mg/dL', ''),
+                      event.OutputEvent('40055', '2150-01-01 00:00:00', '100', 'ml', '', '14001', '', '', '')]
+        for new_event in new_events:
+            self.assertFalse(hasattr(new_event, '__dict__'))
+            self.assertRaises(AttributeError, setattr, new_event, 'comment', '')
+        # repeated strings of the events share one interned copy.
+        self.assertIs(new_events[0].cgid, new_events[2].cgid)
+        self.assertIs(new_events[0].value_unit, event.Event('211', '2150-01-01 00:00:00', '81', '81',
+                                                            ''.join(['b', 'pm'])).value_unit)
+
+
+class HospitalVisitTest(unittest.TestCase):
+    def _visit(self, hadm_id, diagnosis):
+        return hospital_visit.HospitalVisit(hadm_id, '2150-01-01 00:00:00', '2150-01-05 00:00:00', '', 'EMERGENCY',
+                                            'EMERGENCY ROOM ADMIT', ''.join(['Medi', 'care']), 'ENGL', 'CATHOLIC',
+                                            'MARRIED', 'WHITE', '', '', diagnosis)
+
+    def test_only_categorical_fields_are_interned(self):
+        first, second = self._visit(101, ''.join(['SEP', 'SIS'])), self._visit(102, ''.join(['SEPS', 'IS']))
+        self.assertIs(first.insurance, second.insurance)
+        self.assertEqual(first.diagnosis, second.diagnosis)
+        self.assertIsNot(first.diagnosis, second.diagnosis)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import event
+import event_store
+import database
+import icu_stay
+import test_database
+import utils
+
+
+def _builder():
+    builder = event_store.EventStoreBuilder()
+    builder.append_row('2', '211', '2150-01-01 01:00:00', '90', '90', 'bpm', '14001')
+    builder.append_row('1', '212', '2150-01-01 00:00:00', 'Sinus Rhythm', '', '', '')
+    builder.append_row('1', '211', '01/01/2150  0:00:00', '80', '80', 'bpm', '14002')
+    builder.append_row('1', '198', '2150-01-01 00:30:00', '4 Confused', '4', '', '14002')
+    return builder
+
+
+class StringDictionaryTest(unittest.TestCase):
+    def test_encode_decode(self):
+        dictionary = event_store.StringDictionary()
+        codes = [dictionary.encode(value) for value in ['b', '', 'a', 'b']]
+        self.assertEqual(codes, [1, 0, 2, 1])
+        self.assertEqual([dictionary.decode(code) for code in codes], ['b', '', 'a', 'b'])
+        self.assertEqual(len(dictionary), 3)
+
+    def test_array_backed_dictionary(self):
+        dictionary = event_store.StringDictionary.from_values(np.array(['', 'a', 'bb'], dtype='S'))
+        self.assertEqual(len(dictionary), 3)
+        self.assertEqual(dictionary.decode(2), 'bb')
+        self.assertIs(type(dictionary.decode(2)), str)
+        self.assertEqual(dictionary.encode('a'), 1)
+        self.assertEqual(dictionary.encode('c'), 3)
+        self.assertEqual(dictionary.values, ['', 'a', 'bb', 'c'])
+        np.testing.assert_array_equal(dictionary.array(), np.array(['', 'a', 'bb', 'c'], dtype='S'))
+
+
+class EventStoreTest(unittest.TestCase):
+    def test_rows_are_sorted_by_stay_time_and_item(self):
+        store = _builder().build()
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.icu_stay_id.tolist(), [1, 1, 1, 2])
+        self.assertEqual(store.item_id.tolist(), [211, 212, 198, 211])
+        self.assertEqual(store.stay_ids.tolist(), [1, 2])
+        self.assertEqual(store.stay_starts.tolist(), [0, 3])
+        self.assertEqual(store.stay_stops.tolist(), [3, 4])
+
+    def test_values(self):
+        store = _builder().build()
+        # numeric VALUEs are derived from VALUENUM, the others are kept in the dictionary.
+        self.assertEqual([store.decode_value(i) for i in range(len(store))], [80.0, 'Sinus Rhythm', '4 Confused', 90.0])
+        self.assertEqual(store.value[0], 0)
+        self.assertTrue(np.isnan(store.value_num[1]))
+        self.assertEqual(store.value_num[2], 4.0)
+        self.assertEqual([store.unit_dictionary.decode(code) for code in store.value_unit], ['bpm', '', '', 'bpm'])
+
+    def test_concatenate_recodes_strings(self):
+        other = event_store.EventStoreBuilder()
+        other.append_row('3', '212', '2150-01-02 00:00:00', 'Atrial Fib', '', '', '14003')
+        other.append_row('1', '212', '2150-01-01 02:00:00', 'Sinus Rhythm', '', '', '')
+        store = event_store.EventStore.concatenate([_builder().build(), other.build()])
+        self.assertEqual(store.icu_stay_id.tolist(), [1, 1, 1, 1, 2, 3])
+        self.assertEqual([store.decode_value(i) for i in range(len(store))],
+                         [80.0, 'Sinus Rhythm', '4 Confused', 'Sinus Rhythm', 90.0, 'Atrial Fib'])
+        self.assertEqual([store.cgid_dictionary.decode(code) for code in store.cgid],
+                         ['14002', '', '14002', '', '14001', '14003'])
+
+
+class StayEventsTest(unittest.TestCase):
+    def setUp(self):
+        self.store = _builder().build()
+        self.events = self.store.stay_events(1)
+
+    def test_view_of_a_stay(self):
+        self.assertEqual(len(self.events), 3)
+        self.assertIs(self.events.store, self.store)
+        self.assertEqual(self.events.item_id.tolist(), [211, 212, 198])
+        self.assertEqual(len(self.store.stay_events(3)), 0)
+        rows = list(self.events)
+        self.assertEqual(rows[0], event_store.EventRow(211, datetime.datetime(2150, 1, 1), 80.0, 80.0, 'bpm', '14002',
+                                                       event.CHART_EVENT))
+        self.assertEqual(rows[1].value, 'Sinus Rhythm')
+
+    def test_events_at(self):
+        start = utils.date_time_to_epoch(datetime.datetime(2150, 1, 1))
+        found = self.events.events_at(datetime.datetime(2150, 1, 1))
+        self.assertEqual(sorted(found), [211, 212])
+        self.assertEqual(found[211].value, 80.0)
+        self.assertEqual(self.events.events_at(start + 1800).keys(), [198])
+        self.assertEqual(self.events.events_at(0), {})
+        self.assertEqual(self.events.times().tolist(), [start, start + 1800])
+
+    def test_item_series(self):
+        times, values = self.events.item_series(211)
+        self.assertEqual(times.tolist(), [utils.date_time_to_epoch(datetime.datetime(2150, 1, 1))])
+        self.assertEqual(values.tolist(), [80.0])
+
+
+class ItemSeriesTest(unittest.TestCase):
+    """
+    series and as_of lookups of a stay, checked against a scan of its events.
+    """
+    def setUp(self):
+        builder = event_store.EventStoreBuilder()
+        for i in range(40):
+            chart_time = '2150-01-01 %02d:%02d:00' % (i // 4, 15 * (i % 4))
+            builder.append_row('1', str(211 + i % 3), chart_time, str(60 + i), str(60 + i), 'bpm', '')
+        builder.append_row('2', '211', '2150-01-01 00:00:00', '50', '50', 'bpm', '')
+        self.start = utils.convert_to_epoch('2150-01-01 00:00:00')
+        self.events = builder.build().stay_events(1)
+
+    def test_series_matches_a_scan_of_the_stay(self):
+        for item_id in (211, 212, 213, 214):
+            selected = self.events.item_id == item_id
+            times, values = self.events.series(item_id)
+            np.testing.assert_array_equal(times, self.events.chart_time[selected])
+            np.testing.assert_array_equal(values, self.events.value_num[selected])
+
+    def test_series_in_a_time_range(self):
+        all_times = self.events.chart_time[self.events.item_id == 212]
+        start, end = all_times[3], all_times[8]
+        times, values = self.events.series(212, start, end)
+        np.testing.assert_array_equal(times, all_times[3:9])
+        times, values = self.events.series(212, utils.epoch_to_date_time_object(start))
+        np.testing.assert_array_equal(times, all_times[3:])
+        self.assertEqual(len(self.events.series(212, end + 1, start)[0]), 0)
+
+    def test_as_of_returns_the_last_observation_at_or_before(self):
+        times = self.events.chart_time[self.events.item_id == 211]
+        self.assertIsNone(self.events.as_of(211, times[0] - 1))
+        for i in range(len(times)):
+            row = self.events.as_of(211, times[i] + 60)
+            self.assertEqual(utils.date_time_to_epoch(row.chart_time), times[i])
+            self.assertEqual(row.value_num, self.events.value_num[self.events.item_id == 211][i])
+        self.assertIsNone(self.events.as_of(214, times[-1]))
+        self.assertEqual(self.events.as_of(213, datetime.datetime(2150, 1, 1, 0, 30)).value, 62.0)
+
+    def test_events_without_a_chart_time_are_skipped(self):
+        builder = event_store.EventStoreBuilder()
+        builder.append_row('1', '211', '', '70', '70', 'bpm', '')
+        builder.append_row('1', '211', '2150-01-01 00:00:00', '80', '80', 'bpm', '')
+        events = builder.build().stay_events(1)
+        times, values = events.series(211)
+        self.assertEqual((times.tolist(), values.tolist()), ([self.start], [80.0]))
+        self.assertIsNone(events.as_of(211, self.start - 1))
+
+
+class DatabaseStayTest(unittest.TestCase):
+    """
+    the events of the stays of a database are views over its event store.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.mimic3_dir = os.path.join(cls.work_dir, 'csv')
+        test_database.write_tables(cls.mimic3_dir)
+        cls.db = database.ICUDatabase(cls.mimic3_dir)
+        cls.db.ingest()
+        cls.snapshot_dir = os.path.join(cls.work_dir, 'snapshot')
+        cls.db.save_snapshot(cls.snapshot_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def test_database_stays_refuse_appended_events(self):
+        opened = database.ICUDatabase.open_snapshot(self.snapshot_dir)
+        for db in (self.db, opened):
+            stay = db.icu_stays[1001]
+            new_event = event.Event(211, stay.in_time, '80', '80', 'bpm')
+            self.assertRaises(ValueError, stay.add_event, new_event)
+            self.assertEqual(len(stay.time_series), np.count_nonzero(db.event_store.icu_stay_id == 1001))
+
+
+class StandaloneStayTest(unittest.TestCase):
+    """
+    events appended to an icu stay that is not part of a database.
+    """
+    def _stay(self, icu_stay_id):
+        return icu_stay.IcuStay(icu_stay_id, 'carevue', 'MICU', 'MICU', '12', '12', '2150-01-01 00:00:00',
+                                '2150-01-03 00:00:00', '2')
+
+    def test_appended_events_are_queried_in_time_order(self):
+        stay = self._stay(1)
+        stay.add_event(event.Event(211, '2150-01-01 02:00:00', '90', '90', 'bpm'))
+        stay.add_event(event.Event(211, '2150-01-01 01:00:00', '80', '80', 'bpm'))
+        stay.add_event(event.Event(212, '2150-01-01 01:00:00', 'Sinus Rhythm', '', ''))
+        self.assertEqual(len(stay.time_series), 3)
+        times, values = stay.time_series.item_series(211)
+        self.assertEqual(values.tolist(), [80.0, 90.0])
+        self.assertEqual(stay.time_series.events_at(datetime.datetime(2150, 1, 1, 1))[212].value, 'Sinus Rhythm')
+        stay.add_event(event.Event(211, '2150-01-01 01:00:00', '85', '85', 'bpm'))
+        self.assertEqual(len(stay.time_series), 4)
+        self.assertEqual(stay.time_series.events_at(datetime.datetime(2150, 1, 1, 1))[211].value, 85.0)
+
+    def test_events_of_all_tables_share_the_timeline(self):
+        stay = self._stay(1)
+        stay.add_event(event.LabEvent(50912, '2150-01-01 03:00:00', '1.1', '1.1', 'mg/dL', ''))
+        stay.add_event(event.OutputEvent(40055, '2150-01-01 02:00:00', '100', 'ml', '', '14000', '', '', ''))
+        stay.add_event(event.Event(211, '2150-01-01 01:00:00', '80', '80', 'bpm'))
+        self.assertEqual(stay.time_series.item_id.tolist(), [211, 40055, 50912])
+        self.assertEqual([row.source for row in stay.time_series],
+                         [event.CHART_EVENT, event.OUTPUT_EVENT, event.LAB_EVENT])
+        self.assertEqual([row.value for row in stay.time_series], [80.0, 100.0, 1.1])
+
+    def test_stays_without_events_share_an_empty_store(self):
+        first, second = self._stay(1), self._stay(2)
+        self.assertIs(first.time_series.store, second.time_series.store)
+        first.add_event(event.Event(211, first.in_time, '80', '80', 'bpm'))
+        self.assertEqual(len(first.time_series), 1)
+        self.assertEqual(len(second.time_series), 0)
+        self.assertEqual(len(second.time_series.store), 0)
+        self.assertEqual(len(second.time_series.store.value_dictionary), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import database
+import export
+import features
+import test_database
+import utils
+
+
+class ExporterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        mimic3_dir = os.path.join(cls.work_dir, 'csv')
+        test_database.write_tables(mimic3_dir)
+        db = database.ICUDatabase(mimic3_dir)
+        db.ingest()
+        cls.snapshot_dir = os.path.join(cls.work_dir, 'snapshot')
+        db.save_snapshot(cls.snapshot_dir)
+        cls.db = database.ICUDatabase.load_snapshot(cls.snapshot_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(dir=self.work_dir)
+
+    def exporter(self, db=None, **arguments):
+        return export.Exporter(db or self.db, self.output_dir, 'npz', **arguments)
+
+    def test_small_tables_of_a_cohort(self):
+        written = self.exporter(batch_size=2).export(icu_stay_ids=[1003, 2001], tables=('patients', 'icu_stays'),
+                                                     columns={'icu_stays': ['ICUSTAY_ID', 'INTIME']})
+        self.assertEqual([os.path.basename(path) for path in written['icu_stays']], ['part-00000.npz'])
+        stays = np.load(written['icu_stays'][0])
+        self.assertEqual(sorted(stays.files), ['ICUSTAY_ID', 'INTIME'])
+        self.assertEqual(stays['ICUSTAY_ID'].tolist(), [1003, 2001])
+        self.assertEqual(stays['INTIME'].astype(np.int64).tolist(),
+                         [utils.date_time_to_epoch(self.db.icu_stays[icu_stay_id].in_time)
+                          for icu_stay_id in (1003, 2001)])
+        patients = np.load(written['patients'][0])
+        self.assertEqual(patients['SUBJECT_ID'].tolist(), [1, 2])
+
+    def test_events(self):
+        written = self.exporter(batch_size=2).export_events()
+        self.assertEqual(len(written), 3)
+        rows = []
+        for path in written:
+            shard = np.load(path)
+            values = shard['VALUENUM'].tolist()
+            rows.extend(zip(shard['ICUSTAY_ID'].tolist(), shard['ITEMID'].tolist(),
+                            shard['CHARTTIME'].astype(np.int64).tolist(),
+                            [None if np.isnan(value) else value for value in values], shard['SOURCE'].tolist()))
+        sources = {'CHARTEVENTS': 0, 'LABEVENTS': 1, 'OUTPUTEVENTS': 2}
+        self.assertEqual(sorted((row[:4] + (sources[row[4]],)) for row in rows),
+                         test_database.table_rows(self.db.mimic3_dir))
+        shard = np.load(written[0])
+        self.assertEqual(shard['VALUE'][:3].tolist(), ['60', 'Atrial Fib', '12.5'])
+        self.assertRaises(ValueError, self.exporter().export_events, columns=['ITEMID', 'WARNING'])
+
+    def test_features_of_an_opened_snapshot(self):
+        builder = features.FeatureBuilder([211, 50971], horizon=24 * 3600)
+        opened = database.ICUDatabase.open_snapshot(self.snapshot_dir)
+        written = self.exporter(opened, batch_size=3).export(('features',), feature_builder=builder)['features']
+        expected = builder.build_for_database(self.db)
+        values = np.concatenate([np.load(path)['values'] for path in written])
+        np.testing.assert_array_equal(values, expected.values)
+        # the stays were never materialized.
+        self.assertEqual(len(opened.patients._cache), 0)
+        self.assertRaises(ValueError, self.exporter().export, ('features',))
+
+    def test_unknown_format_and_tables(self):
+        self.assertRaises(ValueError, export.Exporter, self.db, self.output_dir, 'csv')
+        self.assertRaises(ValueError, self.exporter().export, ('notes',))
+
+
+if __name__ == '__main__':
+    unittest.main()
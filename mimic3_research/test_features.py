@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+import event_store
+import features
+import utils
+
+START = utils.convert_to_epoch('2150-01-01 00:00:00')
+
+
+def _store():
+    builder = event_store.EventStoreBuilder()
+    builder.append_row('1', '211', '2150-01-01 00:10:00', '80', '80', 'bpm', '')
+    builder.append_row('1', '211', '2150-01-01 00:50:00', '90', '90', 'bpm', '')
+    builder.append_row('1', '212', '2150-01-01 00:20:00', 'Sinus Rhythm', '', '', '')
+    builder.append_row('1', '211', '2150-01-01 02:30:00', '70', '70', 'bpm', '')
+    builder.append_row('1', '211', '2150-01-01 05:00:00', '60', '60', 'bpm', '')
+    builder.append_row('1', '211', '2149-12-31 23:00:00', '50', '50', 'bpm', '')
+    builder.append_row('2', '618', '2150-01-01 01:30:00', '12', '12', 'insp/min', '')
+    builder.append_row('2', '211', '', '100', '100', 'bpm', '')
+    return builder.build()
+
+
+class FeatureBuilderTest(unittest.TestCase):
+    def test_aggregations(self):
+        builder = features.FeatureBuilder([212, 211], bin_width=3600, horizon=3 * 3600,
+                                          aggregations=('last', 'mean', 'min', 'max', 'count'))
+        matrix = builder.build(_store(), [1, 2, 3], [START, START, START])
+        self.assertEqual(matrix.values.shape, (3, 3, 10))
+        self.assertEqual(matrix.feature_names[:6], ['212_last', '212_mean', '212_min', '212_max', '212_count',
+                                                    '211_last'])
+        self.assertEqual(matrix.icu_stay_ids.tolist(), [1, 2, 3])
+        # the text events of 212 are only counted.
+        self.assertEqual(matrix.values[0, 0, :5].tolist(), [0, 0, 0, 0, 1])
+        self.assertEqual(matrix.mask[0, 0, :5].tolist(), [False, False, False, False, True])
+        self.assertEqual(matrix.values[0, 0, 5:].tolist(), [90, 85, 80, 90, 2])
+        self.assertFalse(matrix.mask[0, 1].any())
+        # events before the start or after the horizon are dropped.
+        self.assertEqual(matrix.values[0, 2, 5:].tolist(), [70, 70, 70, 70, 1])
+        # stay 2 only has 211 without a time, and no stay 3 in the store.
+        self.assertFalse(matrix.mask[1:].any())
+
+    def test_missing_start_times(self):
+        builder = features.FeatureBuilder([211], horizon=3600)
+        matrix = builder.build(_store(), [1, 1], [utils.MISSING_TIME, START])
+        self.assertFalse(matrix.mask[0].any())
+        self.assertEqual(matrix.values[1, 0].tolist(), [85])
+
+    def test_batches_give_the_same_matrix(self):
+        store = _store()
+        ids, starts = [2, 1, 1], [START - 3600, START, START + 1800]
+        expected = features.FeatureBuilder([211, 618], horizon=6 * 3600).build(store, ids, starts)
+        batched = features.FeatureBuilder([211, 618], horizon=6 * 3600, batch_size=1).build(store, ids, starts)
+        np.testing.assert_array_equal(batched.values, expected.values)
+        np.testing.assert_array_equal(batched.mask, expected.mask)
+        self.assertEqual(expected.values[0, 2, 1], 12)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, features.FeatureBuilder, [211], aggregations=('median',))
+        self.assertRaises(ValueError, features.FeatureBuilder, [211], bin_width=0)
+        self.assertEqual(features.FeatureBuilder([211], bin_width=7, horizon=20).n_bins, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import database
+import ingest_metrics
+import test_database
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ProgressReporterTest(unittest.TestCase):
+    def test_status(self):
+        clock = _Clock()
+        progress = ingest_metrics.ProgressReporter('CHARTEVENTS', total_bytes=4 * 10 ** 6, interval=10, clock=clock)
+        clock.now += 2
+        progress.update(1000, 10 ** 6)
+        self.assertEqual(progress.status(), 'CHARTEVENTS: 1000 rows, 500 rows/s, 0.5 MB/s, 25% ETA 0:00:06')
+        self.assertEqual(progress.status(eta=False), 'CHARTEVENTS: 1000 rows, 500 rows/s, 0.5 MB/s')
+        clock.now += 8
+        self.assertEqual(progress.finish(), 10)
+
+
+class BadRowSamplerTest(unittest.TestCase):
+    def test_rows_are_bounded_per_anomaly(self):
+        sampler = ingest_metrics.BadRowSampler(max_rows=3)
+        sampler.add('CHARTEVENTS', 'a', [{'ROW': i} for i in range(2)])
+        sampler.add('LABEVENTS', 'a', [{'ROW': i} for i in range(2, 5)])
+        sampler.add('LABEVENTS', 'b', [{'ROW': 5}])
+        self.assertEqual(sampler.rows['a'], [{'ROW': 0}, {'ROW': 1}, {'ROW': 2}])
+        self.assertEqual(sampler.rows['b'], [{'ROW': 5}])
+
+    def test_rows_written_to_a_file(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(work_dir, 'bad_rows.jsonl')
+            sampler = ingest_metrics.BadRowSampler(path, max_rows=1)
+            sampler.add('CHARTEVENTS', 'a', [{'ROW': 0}, {'ROW': 1}])
+            sampler.close()
+            with open(path) as rows_file:
+                self.assertEqual([json.loads(line) for line in rows_file],
+                                 [{'table': 'CHARTEVENTS', 'anomaly': 'a', 'row': {'ROW': 0}}])
+            self.assertEqual(dict(sampler.rows), {})
+        finally:
+            shutil.rmtree(work_dir)
+
+
+class IngestMetricsTest(unittest.TestCase):
+    def test_anomalies_of_an_ingest(self):
+        mimic3_dir = tempfile.mkdtemp()
+        try:
+            test_database.write_tables(mimic3_dir)
+            db = database.ICUDatabase(mimic3_dir)
+            test_database.read_tables(db)
+        finally:
+            shutil.rmtree(mimic3_dir)
+        report = db.metrics.report()
+        self.assertEqual(report['CHARTEVENTS'], {ingest_metrics.MISSING_ICUSTAY_ID: 1})
+        # the lab of every admission before its first stay.
+        self.assertEqual(report['LABEVENTS'], {ingest_metrics.OUTSIDE_ICU_STAYS: 4})
+        self.assertEqual(report['OUTPUTEVENTS'], {})
+        self.assertEqual([row['ITEMID'] for row in db.metrics.bad_rows.rows[ingest_metrics.OUTSIDE_ICU_STAYS]],
+                         [50912] * 4)
+        self.assertEqual(len(db.invalid_rows), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+import interval_index
+import table_reader
+import utils
+
+
+class StayIntervalIndexTest(unittest.TestCase):
+    def test_events_inside_and_outside_stays(self):
+        index = interval_index.StayIntervalIndex([10, 10, 20], [1, 2, 3], [100, 300, 100], [200, 400, 200])
+        assigned = index.assign([10, 10, 10, 10, 20, 30, table_reader.MISSING_ID, 10],
+                                [100, 200, 250, 300, 150, 150, 150, utils.MISSING_TIME])
+        self.assertEqual(assigned.tolist(), [1, 1, -1, 2, 3, -1, -1, -1])
+
+    def test_overlapping_stays(self):
+        # stay 2 starts inside stay 1 and ends before it, stay 3 starts inside stay 1 after stay 2 ended.
+        index = interval_index.StayIntervalIndex([10, 10, 10], [1, 2, 3], [0, 100, 300], [1000, 200, 400])
+        assigned = index.assign([10] * 7, [50, 150, 250, 350, 500, 1000, 1001])
+        self.assertEqual(assigned.tolist(), [1, 2, 1, 3, 1, 1, -1])
+
+    def test_matches_a_scan_of_random_stays(self):
+        random_state = np.random.RandomState(0)
+        for trial in range(100):
+            num_of_stays = random_state.randint(0, 12)
+            hadm_ids = random_state.randint(1, 4, num_of_stays)
+            in_times = random_state.randint(0, 100, num_of_stays)
+            out_times = in_times + random_state.randint(0, 60, num_of_stays)
+            index = interval_index.StayIntervalIndex(hadm_ids, np.arange(num_of_stays), in_times, out_times)
+            event_hadm_ids = random_state.randint(0, 5, 200)
+            event_times = random_state.randint(-10, 180, 200)
+            assigned = index.assign(event_hadm_ids, event_times)
+            for hadm_id, chart_time, icu_stay_id in zip(event_hadm_ids, event_times, assigned):
+                inside = [(in_times[i], i) for i in range(num_of_stays)
+                          if hadm_ids[i] == hadm_id and in_times[i] <= chart_time <= out_times[i]]
+                if not inside:
+                    self.assertEqual(icu_stay_id, table_reader.MISSING_ID)
+                else:
+                    # the stay that started last, stays that started together are equally good.
+                    latest = max(start for start, i in inside)
+                    self.assertIn(icu_stay_id, [i for start, i in inside if start == latest])
+
+    def test_stays_without_times_are_skipped(self):
+        index = interval_index.StayIntervalIndex([10, 10], [1, 2], [0, utils.MISSING_TIME], [100, 100])
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.assign([10], [50]).tolist(), [1])
+        empty = interval_index.StayIntervalIndex([], [], [], [])
+        self.assertEqual(empty.assign([10], [50]).tolist(), [table_reader.MISSING_ID])
+
+
+if __name__ == '__main__':
+    unittest.main()
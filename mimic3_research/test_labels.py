@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import database
+import labels
+import test_database
+import utils
+
+DAY = labels.DAY
+MISSING = utils.MISSING_TIME
+
+
+def _tables():
+    """
+    patient 1 is readmitted 15 days after the first of their two admissions, and goes back to the icu during it.
+    patient 2 dies at discharge, in the icu. patient 3 dies 20 days after discharge.
+    """
+    patients = {'SUBJECT_ID': np.array([3, 1, 2]), 'DOD': np.array([100 * DAY, MISSING, 10 * DAY])}
+    admissions = {'SUBJECT_ID': np.array([1, 1, 2, 3]), 'HADM_ID': np.array([102, 101, 201, 301]),
+                  'ADMITTIME': np.array([20 * DAY, 0, 0, 0]),
+                  'DISCHTIME': np.array([25 * DAY, 5 * DAY, 10 * DAY, 80 * DAY]),
+                  'DEATHTIME': np.array([MISSING, MISSING, 10 * DAY, MISSING])}
+    icu_stays = {'ICUSTAY_ID': np.array([1003, 1002, 2001, 1001, 3001]),
+                 'HADM_ID': np.array([102, 101, 201, 101, 301]),
+                 'SUBJECT_ID': np.array([1, 1, 2, 1, 3]),
+                 'INTIME': np.array([21 * DAY, 3 * DAY, 8 * DAY, 1 * DAY, 1 * DAY]),
+                 'OUTTIME': np.array([25 * DAY, 4 * DAY + DAY // 2, 10 * DAY, 2 * DAY, 2 * DAY]),
+                 'LOS': np.array([4.0, np.nan, 2.0, 1.0, 1.0])}
+    return {'patients': patients, 'admissions': admissions, 'icu_stays': icu_stays}
+
+
+class ComputeTest(unittest.TestCase):
+    def setUp(self):
+        self.labels = labels.compute(_tables())
+
+    def label(self, name):
+        return dict(zip(self.labels.icu_stay_ids.tolist(), self.labels[name].tolist()))
+
+    def test_stays_are_sorted_by_id(self):
+        self.assertEqual(self.labels.icu_stay_ids.tolist(), [1001, 1002, 1003, 2001, 3001])
+        self.assertEqual(self.labels.hadm_ids.tolist(), [101, 101, 102, 201, 301])
+        self.assertEqual(self.labels.subject_ids.tolist(), [1, 1, 1, 2, 3])
+        self.assertEqual(self.labels.names, sorted(labels.LABELS))
+
+    def test_length_of_stay(self):
+        self.assertEqual(self.label('los_days'), {1001: 1.0, 1002: 1.5, 1003: 4.0, 2001: 2.0, 3001: 1.0})
+        self.assertEqual(self.label('long_stay'), {1001: False, 1002: False, 1003: True, 2001: False, 3001: False})
+
+    def test_mortality(self):
+        self.assertEqual(self.label('icu_mortality'),
+                         {1001: False, 1002: False, 1003: False, 2001: True, 3001: False})
+        self.assertEqual(self.label('in_hospital_mortality'),
+                         {1001: False, 1002: False, 1003: False, 2001: True, 3001: False})
+        self.assertEqual(self.label('mortality_after_discharge'),
+                         {1001: False, 1002: False, 1003: False, 2001: False, 3001: True})
+        later = labels.compute(_tables(), mortality_days=10)
+        self.assertFalse(later['mortality_after_discharge'].any())
+
+    def test_death_date_in_a_window_without_a_start(self):
+        died = labels._died_between(np.array([MISSING, MISSING]), np.array([10 * DAY, 10 * DAY]),
+                                    np.array([MISSING, 9 * DAY]), np.array([20 * DAY, 20 * DAY]))
+        self.assertEqual(died.tolist(), [False, True])
+
+    def test_readmission(self):
+        self.assertEqual(self.label('readmission'), {1001: True, 1002: True, 1003: False, 2001: False, 3001: False})
+        self.assertEqual(self.label('icu_readmission'),
+                         {1001: True, 1002: False, 1003: False, 2001: False, 3001: False})
+        shorter = labels.compute(_tables(), readmission_days=10)
+        self.assertFalse(shorter['readmission'].any())
+
+    def test_take(self):
+        self.assertEqual(self.labels.take('los_days', [3001, 1002]).tolist(), [1.0, 1.5])
+        self.assertRaises(ValueError, self.labels.take, 'los_days', [1001, 9999])
+
+
+class DatabaseLabelsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        test_database.write_tables(cls.work_dir)
+        cls.db = database.ICUDatabase(cls.work_dir)
+        cls.db.ingest(tables=('PATIENTS', 'ADMISSIONS', 'ICUSTAYS'))
+        cls.snapshot_dir = os.path.join(cls.work_dir, 'snapshot')
+        cls.db.save_snapshot(cls.snapshot_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def test_labels_of_every_stay(self):
+        table = self.db.outcome_labels()
+        self.assertEqual(table.icu_stay_ids.tolist(), sorted(self.db.icu_stays))
+        for icu_stay_id, los, died in zip(table.icu_stay_ids.tolist(), table['los_days'].tolist(),
+                                          table['in_hospital_mortality'].tolist()):
+            stay = self.db.icu_stays[icu_stay_id]
+            self.assertAlmostEqual(los, stay.len_of_stay)
+            hadm_id = table.hadm_ids[table.positions([icu_stay_id])[0]]
+            subject_id = table.subject_ids[table.positions([icu_stay_id])[0]]
+            visit = self.db.patients[subject_id].hospital_visits[hadm_id]
+            self.assertIn(icu_stay_id, visit.icu_stays)
+            self.assertEqual(died, visit.death_time != '')
+        # patient 1 is admitted again more than 30 days after their first discharge, it is not a readmission.
+        self.assertFalse(table['readmission'].any())
+        self.assertEqual(table['icu_readmission'].tolist(), [True, False, False, False, False])
+        self.assertEqual(table['in_hospital_mortality'].tolist(), [False, False, False, True, False])
+
+    def test_opened_snapshot_has_the_same_labels(self):
+        table = self.db.outcome_labels()
+        opened = database.ICUDatabase.open_snapshot(self.snapshot_dir).outcome_labels()
+        for name in table.names:
+            np.testing.assert_array_equal(opened[name], table[name], name)
+
+
+if __name__ == '__main__':
+    unittest.main()
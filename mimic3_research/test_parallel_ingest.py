@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+import parallel_ingest
+
+
+class SplitIntoChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, 'CHARTEVENTS.csv')
+        with open(self.path, 'wb') as table_file:
+            table_file.write('ROW_ID,VALUE\n' + ''.join('%d,%s\n' % (i, 'x' * (i % 7)) for i in range(500)))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_ranges_are_line_aligned_and_cover_the_rows(self):
+        with open(self.path, 'rb') as table_file:
+            data = table_file.read()
+        for chunk_size in (1, 100, 1000, 10 ** 6):
+            chunks = parallel_ingest.split_into_chunks(self.path, chunk_size)
+            self.assertEqual(chunks[0][0], len('ROW_ID,VALUE\n'))
+            self.assertEqual(chunks[-1][1], len(data))
+            for (start, stop), (next_start, next_stop) in zip(chunks, chunks[1:]):
+                self.assertEqual(stop, next_start)
+            for start, stop in chunks:
+                self.assertEqual(data[stop - 1], '\n')
+        self.assertEqual(len(parallel_ingest.split_into_chunks(self.path, 1)), 500)
+
+    def test_table_without_rows(self):
+        with open(self.path, 'wb') as table_file:
+            table_file.write('ROW_ID,VALUE\n')
+        self.assertEqual(parallel_ingest.split_into_chunks(self.path, 100), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
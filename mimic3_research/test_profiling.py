@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+import database
+import profiling
+import test_database
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_disabled_profiler_measures_nothing(self):
+        profiler = profiling.Profiler(enabled=False)
+        with profiler.stage('PATIENTS') as stats:
+            with profiler.phase('parse'):
+                profiler.add_rows(10)
+            self.assertEqual(list(profiler.iterate('parse', [1, 2])), [1, 2])
+        self.assertIsNone(stats)
+        self.assertEqual(profiler.report(), [])
+
+    def test_stages_and_phases(self):
+        profiler = profiling.Profiler()
+        with profiler.stage('ADMISSIONS'):
+            for _ in profiler.iterate('parse', range(3)):
+                with profiler.phase('construct'):
+                    profiler.add_rows(1)
+            with profiler.stage('inner'):
+                profiler.add_rows(5)
+        outer, = [stats for stats in profiler.stages if stats.name == 'ADMISSIONS']
+        inner, = [stats for stats in profiler.stages if stats.name == 'inner']
+        self.assertEqual(outer.rows, 3)
+        self.assertEqual(sorted(outer.phases), ['construct', 'parse'])
+        self.assertEqual(inner.rows, 5)
+        self.assertEqual(inner.phases, {})
+        self.assertEqual([stats['name'] for stats in profiler.report()], ['inner', 'ADMISSIONS'])
+        self.assertIn('construct', profiler.format_report())
+
+
+class IngestProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.mimic3_dir = os.path.join(self.work_dir, 'csv')
+        test_database.write_tables(self.mimic3_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_ingest_profile(self):
+        db = database.ICUDatabase(self.mimic3_dir)
+        profile_dir = os.path.join(self.work_dir, 'profile')
+        profiler = db.ingest(profile_dir=profile_dir)
+        self.assertEqual([stats.name for stats in profiler.stages], list(database.TABLE_ORDER))
+        self.assertEqual([stats.rows for stats in profiler.stages[:3]], [3, 4, 5])
+        for stats in profiler.stages:
+            self.assertTrue(os.path.isfile(stats.profile_path))
+        # the database profiler is disabled again after the ingest.
+        self.assertFalse(db.profiler.enabled)
+
+    def test_ingest_without_profile(self):
+        db = database.ICUDatabase(self.mimic3_dir)
+        self.assertEqual(db.ingest(['PATIENTS']).stages, [])
+        self.assertEqual(db.num_of_patients, 3)
+        self.assertRaises(ValueError, db.ingest, ['PATIENTS', 'NOTEEVENTS'])
+
+
+if __name__ == '__main__':
+    unittest.main()
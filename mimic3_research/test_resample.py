@@ -0,0 +1,125 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import database
+import event
+import event_store
+import resample
+import test_database
+import utils
+
+HOUR = 3600
+START = datetime.datetime(2150, 1, 1)
+
+
+def _store(events):
+    """
+    :param events: list of (icu stay id, item id, seconds from START, value, unit).
+    :return: event_store.EventStore
+    """
+    builder = event_store.EventStoreBuilder()
+    for icu_stay_id, item_id, seconds, value, unit in events:
+        builder.append_event(icu_stay_id, event.Event(item_id, START + datetime.timedelta(seconds=seconds), value,
+                                                      value, unit))
+    return builder.build()
+
+
+class ResamplerTest(unittest.TestCase):
+    def setUp(self):
+        self.store = _store([(1, 211, 0, '80', 'bpm'), (1, 211, 0, '90', 'bpm'), (1, 211, 5400, '100', 'bpm'),
+                             (1, 618, 600, '20', 'insp/min'), (1, 211, 9000, '120', 'mmHg'),
+                             (1, 211, 4 * HOUR, '200', 'bpm'),
+                             (2, 618, -1000, '15', 'insp/min')])
+        self.start = utils.date_time_to_epoch(START)
+
+    def resample(self, **arguments):
+        resampler = resample.Resampler([211, 618], step=HOUR, horizon=4 * HOUR, **arguments)
+        return resampler.resample(self.store, [1, 2], [self.start, self.start])
+
+    def test_last_observation_is_carried_forward(self):
+        result = self.resample()
+        self.assertEqual(result.values.shape, (2, 4, 2))
+        np.testing.assert_array_equal(result.grid, [0, HOUR, 2 * HOUR, 3 * HOUR])
+        # the mmHg event has no unit check and is the last one, the event at the horizon is outside of the grid.
+        np.testing.assert_array_equal(result.values[0, :, 0], [90, 90, 100, 120])
+        np.testing.assert_array_equal(result.mask[0, :, 0], [True, True, True, True])
+        np.testing.assert_array_equal(result.observed[0, :, 0], [True, False, True, True])
+        np.testing.assert_array_equal(result.age[0, :, 0], [0, HOUR, 1800, 1800])
+        np.testing.assert_array_equal(result.mask[0, :, 1], [False, True, True, True])
+        np.testing.assert_array_equal(result.values[0, 1:, 1], [20, 20, 20])
+        # an observation before the start of the stay is carried into it.
+        np.testing.assert_array_equal(result.values[1, :, 1], [15, 15, 15, 15])
+        np.testing.assert_array_equal(result.age[1, :, 1], [1000, 1000 + HOUR, 1000 + 2 * HOUR, 1000 + 3 * HOUR])
+        self.assertFalse(result.mask[1, :, 0].any())
+
+    def test_conflict_policies(self):
+        self.assertEqual(self.resample(conflict='last').values[0, 0, 0], 90)
+        self.assertEqual(self.resample(conflict='mean').values[0, 0, 0], 85)
+        self.assertEqual(self.resample(conflict='max').values[0, 0, 0], 90)
+        self.assertRaises(ValueError, resample.Resampler, [211], conflict='first')
+
+    def test_staleness(self):
+        result = self.resample(max_staleness=HOUR)
+        np.testing.assert_array_equal(result.mask[0, :, 0], [True, True, True, True])
+        np.testing.assert_array_equal(result.mask[0, :, 1], [False, True, False, False])
+        np.testing.assert_array_equal(result.mask[1, :, 1], [True, False, False, False])
+        self.assertTrue(np.isnan(result.age[0, 2, 1]))
+        self.assertEqual(result.values[0, 2, 1], 0)
+
+        result = self.resample(max_staleness={618: 2 * HOUR})
+        np.testing.assert_array_equal(result.mask[0, :, 0], [True, True, True, True])
+        np.testing.assert_array_equal(result.mask[0, :, 1], [False, True, True, False])
+
+    def test_units(self):
+        result = self.resample(units={211: 'bpm'})
+        np.testing.assert_array_equal(result.values[0, :, 0], [90, 90, 100, 100])
+        np.testing.assert_array_equal(result.unit_mismatches, [1, 0])
+
+    def test_times_that_do_not_fit_int64_next_to_the_keys(self):
+        self.store = event_store.EventStore.concatenate([self.store, _store([(2, 211, -10 ** 10, '60', 'bpm')])])
+        packed = self.resample()
+        limit = resample.MAX_PACKED_KEY
+        resample.MAX_PACKED_KEY = 10 ** 6
+        try:
+            ranked = self.resample()
+        finally:
+            resample.MAX_PACKED_KEY = limit
+        np.testing.assert_array_equal(ranked.values, packed.values)
+        np.testing.assert_array_equal(ranked.mask, packed.mask)
+        np.testing.assert_array_equal(ranked.observed, packed.observed)
+        np.testing.assert_array_equal(ranked.age, packed.age)
+        self.assertEqual(ranked.values[1, 0, 0], 60)
+
+
+class DatabaseResampleTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mimic3_dir = tempfile.mkdtemp()
+        test_database.write_tables(cls.mimic3_dir)
+        cls.db = database.ICUDatabase(cls.mimic3_dir)
+        cls.db.ingest()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.mimic3_dir)
+
+    def test_matches_as_of(self):
+        item_ids = [211, 618, 50971, 40055]
+        resampler = resample.Resampler(item_ids, step=HOUR, horizon=48 * HOUR, batch_size=2)
+        result = resampler.resample_for_database(self.db)
+        self.assertEqual(result.icu_stay_ids.tolist(), sorted(self.db.icu_stays))
+        for row, icu_stay_id in enumerate(result.icu_stay_ids.tolist()):
+            stay = self.db.icu_stays[icu_stay_id]
+            in_time = utils.date_time_to_epoch(stay.in_time)
+            for column, item_id in enumerate(item_ids):
+                for step, grid_time in enumerate(result.grid.tolist()):
+                    found = stay.as_of(item_id, in_time + grid_time)
+                    self.assertEqual(result.mask[row, step, column], found is not None)
+                    if found is not None:
+                        self.assertAlmostEqual(result.values[row, step, column], found.value_num, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
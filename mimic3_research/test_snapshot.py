@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import database
+import event_store
+import snapshot
+import test_database
+
+
+class SnapshotTest(unittest.TestCase):
+    """
+    a database saved to a snapshot, then loaded and opened from it.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.mimic3_dir = os.path.join(cls.work_dir, 'csv')
+        test_database.write_tables(cls.mimic3_dir)
+        cls.db = database.ICUDatabase(cls.mimic3_dir)
+        test_database.read_tables(cls.db)
+        cls.snapshot_dir = os.path.join(cls.work_dir, 'snapshot')
+        cls.db.save_snapshot(cls.snapshot_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def assert_same_events(self, store, expected):
+        for name, dtype in event_store.EventStore.COLUMNS:
+            np.testing.assert_array_equal(getattr(store, name), getattr(expected, name), name)
+        for name in snapshot.DICTIONARIES:
+            self.assertEqual(list(store.dictionary(name).values), list(expected.dictionary(name).values))
+
+    def assert_same_stay(self, stay, expected):
+        for name in ('icu_stay_id', 'db_source', 'first_care_u', 'last_care_u', 'first_ward_id', 'last_ward_id',
+                     'in_time', 'out_time', 'len_of_stay'):
+            self.assertEqual(getattr(stay, name), getattr(expected, name), name)
+        self.assertEqual(test_database.time_series_rows(stay.time_series),
+                         test_database.time_series_rows(expected.time_series))
+
+    def test_save_refuses_to_overwrite(self):
+        self.assertRaises(ValueError, self.db.save_snapshot, self.snapshot_dir)
+        other_dir = os.path.join(self.work_dir, 'other')
+        self.db.save_snapshot(other_dir)
+        self.db.save_snapshot(other_dir, overwrite=True)
+        self.assertEqual(len(database.ICUDatabase.load_snapshot(other_dir).event_store), len(self.db.event_store))
+
+    def test_load_refuses_other_directories(self):
+        self.assertRaises(ValueError, database.ICUDatabase.load_snapshot, self.mimic3_dir)
+
+    def test_load_round_trip(self):
+        loaded = database.ICUDatabase.load_snapshot(self.snapshot_dir)
+        self.assertEqual(loaded.num_of_patients, self.db.num_of_patients)
+        self.assertEqual(loaded.total_number_of_hospital_visits, self.db.total_number_of_hospital_visits)
+        self.assertEqual(sorted(loaded.icu_stays), sorted(self.db.icu_stays))
+        self.assertIsInstance(loaded.event_store.chart_time, np.memmap)
+        self.assert_same_events(loaded.event_store, self.db.event_store)
+        for subject_id, patient in self.db.patients.items():
+            loaded_patient = loaded.patients[subject_id]
+            self.assertEqual((loaded_patient.gender, loaded_patient.dob, loaded_patient.dod),
+                             (patient.gender, patient.dob, patient.dod))
+            for hadm_id, visit in patient.hospital_visits.items():
+                loaded_visit = loaded_patient.hospital_visits[hadm_id]
+                self.assertEqual((loaded_visit.admittime, loaded_visit.death_time, loaded_visit.diagnosis),
+                                 (visit.admittime, visit.death_time, visit.diagnosis))
+                self.assertEqual(sorted(loaded_visit.icu_stays), sorted(visit.icu_stays))
+        for icu_stay_id, stay in self.db.icu_stays.items():
+            self.assert_same_stay(loaded.icu_stays[icu_stay_id], stay)
+
+    def test_open_round_trip(self):
+        opened = database.ICUDatabase.open_snapshot(self.snapshot_dir, cache_size=2)
+        self.assertEqual(opened.num_of_patients, self.db.num_of_patients)
+        self.assertEqual(opened.total_number_of_hospital_visits, self.db.total_number_of_hospital_visits)
+        self.assertEqual(sorted(opened.patients), sorted(self.db.patients))
+        self.assertEqual(sorted(opened.icu_stays), sorted(self.db.icu_stays))
+        self.assert_same_events(opened.event_store, self.db.event_store)
+        for subject_id, patient in sorted(self.db.patients.items()):
+            opened_patient = opened.patients[subject_id]
+            self.assertEqual(opened_patient.gender, patient.gender)
+            self.assertEqual(sorted(opened_patient.hospital_visits), sorted(patient.hospital_visits))
+        for icu_stay_id, stay in self.db.icu_stays.items():
+            self.assert_same_stay(opened.icu_stays[icu_stay_id], stay)
+        self.assertNotIn(4, opened.patients)
+        self.assertNotIn(4001, opened.icu_stays)
+        self.assertRaises(KeyError, opened.patients.__getitem__, 4)
+
+    def test_opened_dictionaries_stay_mapped(self):
+        opened = snapshot.load(self.snapshot_dir)
+        dictionary = opened.events.value_dictionary
+        self.assertIsInstance(dictionary.array(), np.memmap)
+        expected = self.db.event_store.value_dictionary
+        self.assertEqual(len(dictionary), len(expected))
+        self.assertEqual([dictionary.decode(code) for code in range(len(dictionary))], expected.values)
+
+    def test_opened_patients_are_cached(self):
+        opened = database.ICUDatabase.open_snapshot(self.snapshot_dir, cache_size=2)
+        first = opened.patients[1]
+        self.assertIs(opened.patients[1], first)
+        self.assertIs(opened.icu_stays[1002], first.hospital_visits[101].icu_stays[1002])
+        opened.patients[2]
+        opened.patients[3]
+        # patient 1 was the least recently used, it was dropped from the cache.
+        self.assertIsNot(opened.patients[1], first)
+
+    def test_table_arrays_round_trip(self):
+        opened = database.ICUDatabase.open_snapshot(self.snapshot_dir)
+        tables = opened.table_arrays()
+        expected = self.db.table_arrays()
+        self.assertEqual(sorted(tables), sorted(expected))
+        for table_name in expected:
+            for name, values in expected[table_name].items():
+                np.testing.assert_array_equal(tables[table_name][name], values, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import database
+import event_store
+import stay_summary
+import test_database
+import utils
+
+
+def assert_same_summary(test, summary, expected):
+    for name in ('num_of_events', 'first_chart_time', 'last_chart_time', 'num_of_timestamps'):
+        test.assertEqual(getattr(summary, name), getattr(expected, name), name)
+    for name in ('item_ids', 'counts', 'num_values', 'sums', 'min_values', 'max_values'):
+        np.testing.assert_array_equal(getattr(summary, name), getattr(expected, name), name)
+
+
+class SummarizeTest(unittest.TestCase):
+    def setUp(self):
+        builder = event_store.EventStoreBuilder()
+        builder.append_row('1', '211', '2150-01-01 01:00:00', '90', '90', 'bpm', '')
+        builder.append_row('1', '211', '2150-01-01 00:00:00', '80', '80', 'bpm', '')
+        builder.append_row('1', '212', '2150-01-01 00:00:00', 'Sinus Rhythm', '', '', '')
+        builder.append_row('1', '618', '', '12', '12', 'insp/min', '')
+        builder.append_row('2', '212', '', 'Atrial Fib', '', '', '')
+        self.store = builder.build()
+
+    def test_summary_of_a_stay(self):
+        summary = stay_summary.summarize(self.store.stay_events(1))
+        self.assertEqual(summary.item_counts(), {211: 2, 212: 1, 618: 1})
+        self.assertEqual(summary.item_stats(211), (2, 80.0, 90.0, 85.0))
+        count, min_value, max_value, mean = summary.item_stats(212)
+        self.assertEqual(count, 1)
+        self.assertTrue(np.isnan(min_value) and np.isnan(mean))
+        self.assertEqual(summary.item_stats(1)[0], 0)
+        self.assertEqual(summary.first_chart_time, utils.convert_to_epoch('2150-01-01 00:00:00'))
+        self.assertEqual(summary.last_chart_time, utils.convert_to_epoch('2150-01-01 01:00:00'))
+        self.assertEqual(summary.num_of_timestamps, 2)
+        untimed = stay_summary.summarize(self.store.stay_events(2))
+        self.assertEqual((untimed.first_chart_time, untimed.num_of_timestamps), (utils.MISSING_TIME, 0))
+        self.assertEqual(stay_summary.summarize(self.store.stay_events(3)).num_of_events, 0)
+
+    def test_summarize_store_matches_summarize(self):
+        summaries = stay_summary.summarize_store(self.store)
+        self.assertEqual(sorted(summaries), [1, 2])
+        for icu_stay_id, summary in summaries.items():
+            assert_same_summary(self, summary, stay_summary.summarize(self.store.stay_events(icu_stay_id)))
+
+    def test_combine(self):
+        summaries = stay_summary.summarize_store(self.store)
+        combined = stay_summary.combine([summaries[1], summaries[2], stay_summary.StaySummary.empty()])
+        self.assertEqual(combined.item_counts(), {211: 2, 212: 2, 618: 1})
+        self.assertEqual(combined.num_of_timestamps, 2)
+        self.assertEqual(combined.first_chart_time, summaries[1].first_chart_time)
+        self.assertEqual(stay_summary.combine([]).num_of_events, 0)
+
+
+class DatabaseSummariesTest(unittest.TestCase):
+    def test_bulk_summaries(self):
+        mimic3_dir = tempfile.mkdtemp()
+        try:
+            test_database.write_tables(mimic3_dir)
+            db = database.ICUDatabase(mimic3_dir)
+            db.ingest()
+        finally:
+            shutil.rmtree(mimic3_dir)
+        summaries = db.compute_stay_summaries()
+        self.assertEqual(sorted(summaries), sorted(db.icu_stays))
+        for icu_stay_id, stay in db.icu_stays.items():
+            self.assertIs(stay.summary, summaries[icu_stay_id])
+            assert_same_summary(self, summaries[icu_stay_id], stay_summary.summarize(stay.time_series))
+        visit = db.patients[1].hospital_visits[101]
+        self.assertEqual(visit.summary.count(211), 20)
+        self.assertEqual(db.patients[1].summary.count(50971), 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import filecmp
+import os
+import shutil
+import tempfile
+import unittest
+import benchmark
+import database
+import synthetic
+
+
+class SyntheticTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_same_seed_writes_the_same_files(self):
+        first, second, other = [os.path.join(self.work_dir, name) for name in ('first', 'second', 'other')]
+        synthetic.generate(first, num_of_events=1000, events_per_stay=50, seed=1)
+        synthetic.generate(second, num_of_events=1000, events_per_stay=50, seed=1)
+        synthetic.generate(other, num_of_events=1000, events_per_stay=50, seed=2)
+        names = sorted(os.listdir(first))
+        self.assertEqual(names, sorted(table_name + '.csv' for table_name in database.TABLE_ORDER))
+        self.assertEqual(filecmp.cmpfiles(first, second, names, shallow=False)[0], names)
+        self.assertFalse(filecmp.cmp(os.path.join(first, 'CHARTEVENTS.csv'), os.path.join(other, 'CHARTEVENTS.csv'),
+                                     shallow=False))
+
+    def test_strict_ingest(self):
+        mimic3_dir = os.path.join(self.work_dir, 'csv')
+        synthetic.generate(mimic3_dir, num_of_events=2000, events_per_stay=100, seed=5)
+        db = database.ICUDatabase(mimic3_dir)
+        db.ingest()
+        self.assertGreater(db.num_of_patients, 0)
+        self.assertEqual(sorted(set(db.event_store.source.tolist())), [0, 1, 2])
+        with open(os.path.join(mimic3_dir, 'CHARTEVENTS.csv')) as table_file:
+            num_of_rows = sum(1 for _ in table_file) - 1
+        self.assertGreater(len(db.event_store), num_of_rows * 0.99)
+
+    def test_invalid_sizes(self):
+        self.assertRaises(ValueError, synthetic.SyntheticMimic, num_of_events=0)
+
+
+class CompareTest(unittest.TestCase):
+    def test_regressions(self):
+        baseline = {'dataset': {'seed': 0}, 'results': {'ingest': {'seconds': 10.0, 'rows_per_sec': 100.0,
+                                                                   'events': 5}}}
+        report = {'dataset': {'seed': 0}, 'results': {'ingest': {'seconds': 11.0, 'rows_per_sec': 70.0, 'events': 5,
+                                                                 'peak_rss_mb': 50.0}}}
+        self.assertEqual(benchmark.compare(report, baseline), [('ingest', 'rows_per_sec', 100.0, 70.0)])
+        report['results']['ingest'].update(seconds=13.0, events=6)
+        self.assertEqual([metric for name, metric, base, value in benchmark.compare(report, baseline)],
+                         ['events', 'rows_per_sec', 'seconds'])
+        self.assertIn('+30.0%', benchmark.format_report(report, baseline))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import gzip
+import math
+import os
+import shutil
+import tempfile
+import unittest
+import table_reader
+import utils
+
+TABLE = ('ROW_ID,SUBJECT_ID,ICUSTAY_ID,CHARTTIME,VALUE,VALUENUM\n'
+         '1,10,100,2150-01-01 00:00:00,80,80\n'
+         '2,10,,01/01/2150  1:00:00,"Sinus, Rhythm",\n'
+         '3,11,110,,7.5,7.5\n'
+         '4,12,120,2150-01-02 00:00:00,,\n'
+         '5,12,120,2150-01-02 01:00:00,90,90\n')
+COLUMNS = [('SUBJECT_ID', 'int'), ('ICUSTAY_ID', 'int'), ('CHARTTIME', 'time'), ('VALUE', 'str'),
+           ('VALUENUM', 'float')]
+
+
+class TableReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, 'CHARTEVENTS.csv')
+        with open(self.path, 'wb') as table_file:
+            table_file.write(TABLE)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def read(self, path, columns=COLUMNS, **arguments):
+        with table_reader.TableReader(path, columns, **arguments) as reader:
+            return list(reader)
+
+    def test_typed_columns(self):
+        chunks = self.read(self.path)
+        self.assertEqual(len(chunks), 1)
+        chunk = chunks[0]
+        self.assertEqual(len(chunk), 5)
+        self.assertEqual(sorted(chunk.columns), sorted(name for name, kind in COLUMNS))
+        self.assertEqual(chunk['SUBJECT_ID'].tolist(), [10, 10, 11, 12, 12])
+        self.assertEqual(chunk['ICUSTAY_ID'].tolist(), [100, table_reader.MISSING_ID, 110, 120, 120])
+        self.assertEqual(chunk['CHARTTIME'].tolist(),
+                         [utils.convert_to_epoch('2150-01-01 00:00:00'), utils.convert_to_epoch('2150-01-01 01:00:00'),
+                          utils.MISSING_TIME, utils.convert_to_epoch('2150-01-02 00:00:00'),
+                          utils.convert_to_epoch('2150-01-02 01:00:00')])
+        self.assertEqual(chunk['VALUE'].tolist(), ['80', 'Sinus, Rhythm', '7.5', '', '90'])
+        values = chunk['VALUENUM'].tolist()
+        self.assertEqual([values[0], values[2], values[4]], [80.0, 7.5, 90.0])
+        self.assertTrue(math.isnan(values[1]) and math.isnan(values[3]))
+        self.assertEqual(chunk.end_offset, len(TABLE))
+        self.assertEqual(list(chunk.rows([2]))[0]['VALUE'], '7.5')
+
+    def test_chunks(self):
+        chunks = self.read(self.path, chunk_size=2)
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([chunk.first_row for chunk in chunks], [0, 2, 4])
+        self.assertEqual(sum((chunk['SUBJECT_ID'].tolist() for chunk in chunks), []), [10, 10, 11, 12, 12])
+
+    def test_all_columns_as_strings(self):
+        chunk = self.read(self.path, columns=None)[0]
+        self.assertEqual(chunk['ROW_ID'].tolist(), ['1', '2', '3', '4', '5'])
+
+    def test_missing_columns(self):
+        self.assertRaises(ValueError, table_reader.TableReader, self.path, [('CGID', 'str')])
+        chunk = self.read(self.path, [('SUBJECT_ID', 'int'), ('CGID', 'str')], optional=('CGID',))[0]
+        self.assertNotIn('CGID', chunk)
+        self.assertIn('SUBJECT_ID', chunk)
+
+    def test_byte_ranges(self):
+        header_size = TABLE.index('\n') + 1
+        second_row = TABLE.index('\n3,') + 1
+        first = self.read(self.path, start=header_size, stop=second_row)
+        rest = self.read(self.path, start=second_row)
+        self.assertEqual(first[0]['SUBJECT_ID'].tolist(), [10, 10])
+        self.assertEqual(first[0].end_offset, second_row)
+        self.assertEqual(rest[0]['SUBJECT_ID'].tolist(), [11, 12, 12])
+
+    def test_compressed_table(self):
+        os.rename(self.path, self.path + '.tmp')
+        with gzip.open(self.path + '.gz', 'wb') as table_file:
+            table_file.write(TABLE)
+        self.assertEqual(table_reader.table_path(self.work_dir, 'CHARTEVENTS'), self.path + '.gz')
+        chunk = self.read(self.path + '.gz')[0]
+        self.assertEqual(chunk['VALUE'].tolist(), ['80', 'Sinus, Rhythm', '7.5', '', '90'])
+        self.assertRaises(ValueError, table_reader.TableReader, self.path + '.gz', COLUMNS, start=10)
+        os.rename(self.path + '.tmp', self.path)
+        self.assertEqual(table_reader.table_path(self.work_dir, 'CHARTEVENTS'), self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import datetime
+import unittest
+import numpy as np
+import utils
+
+
+class ConvertTimeTest(unittest.TestCase):
+    def test_both_formats(self):
+        expected = datetime.datetime(2188, 12, 11, 9, 25, 47)
+        self.assertEqual(utils.convert_to_date_time_object('2188-12-11 09:25:47'), expected)
+        self.assertEqual(utils.convert_to_date_time_object('11/12/2188  9:25:47'), expected)
+        self.assertEqual(utils.convert_to_date_time_object(''), '')
+        self.assertRaises(ValueError, utils.convert_to_date_time_object, '2188-12-11')
+
+    def test_epoch(self):
+        self.assertEqual(utils.convert_to_epoch('1970-01-02 00:00:01'), 86401)
+        self.assertEqual(utils.convert_to_epoch('1970-01-02 00:00:01'), 86401)
+        self.assertEqual(utils.convert_to_epoch(''), utils.MISSING_TIME)
+        self.assertEqual(utils.epoch_to_date_time_object(86401), datetime.datetime(1970, 1, 2, 0, 0, 1))
+        self.assertEqual(utils.epoch_to_date_time_object(utils.MISSING_TIME), '')
+
+
+class ParseTimeColumnTest(unittest.TestCase):
+    def test_both_formats(self):
+        strings = ['2188-12-11 09:25:47', '11/12/2188 09:25:47', '11/12/2188  9:25:47', '1864-11-16 00:00:00',
+                   '29/02/2000 23:59:59', '']
+        expected = [utils.convert_to_epoch(string) for string in strings[:5]] + [utils.MISSING_TIME]
+        self.assertEqual(utils.parse_time_column(strings).tolist(), expected)
+        self.assertEqual(expected[0], expected[1])
+        self.assertEqual(expected[0], utils.date_time_to_epoch(datetime.datetime(2188, 12, 11, 9, 25, 47)))
+
+    def test_empty_strings_are_missing(self):
+        self.assertEqual(utils.parse_time_column(['', '']).tolist(), [utils.MISSING_TIME] * 2)
+        self.assertEqual(len(utils.parse_time_column(np.array([], dtype='S'))), 0)
+
+    def test_invalid_strings_raise(self):
+        for strings in (['N/A'], ['2188-12-11 09:25:47', ' '], ['2188-12-11'], ['2188-12-11 09:25:47 1']):
+            self.assertRaises(ValueError, utils.parse_time_column, strings)
+
+
+if __name__ == '__main__':
+    unittest.main()
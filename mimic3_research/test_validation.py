@@ -0,0 +1,156 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import database
+import synthetic
+import table_reader
+import test_database
+import validation
+
+
+def _admissions(num_of_rows=4, **changes):
+    """
+    :param changes: column -> dict row -> value, the values that differ from a valid row.
+    :return: table_reader.Chunk of ADMISSIONS rows.
+    """
+    row = {'ADMISSION_TYPE': 'EMERGENCY', 'ADMISSION_LOCATION': 'EMERGENCY ROOM ADMIT', 'INSURANCE': 'Medicare',
+           'DISCHTIME': '2150-01-05 00:00:00', 'DEATHTIME': ''}
+    columns = {}
+    for name, value in row.items():
+        values = [value] * num_of_rows
+        for position, changed in changes.get(name, {}).items():
+            values[position] = changed
+        columns[name] = np.array(values, dtype='S')
+    return table_reader.Chunk(columns, 100, num_of_rows, 0)
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class ValidatorTest(unittest.TestCase):
+    def setUp(self):
+        self.records = _Records()
+        logging.getLogger().addHandler(self.records)
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.records)
+
+    def test_valid_chunk(self):
+        validation.Validator().check('ADMISSIONS', _admissions())
+        self.assertEqual(self.records.messages, [])
+
+    def test_violations_of_a_chunk_are_reported_together(self):
+        chunk = _admissions(INSURANCE={1: 'Unknown'}, ADMISSION_TYPE={1: 'X', 3: 'Y'})
+        try:
+            validation.Validator().check('ADMISSIONS', chunk)
+            self.fail("the chunk is invalid")
+        except ValueError as error:
+            self.assertIn("2 rows violate 'ADMISSION_TYPE", str(error))
+            self.assertIn('rows [101, 103]', str(error))
+            self.assertIn("1 rows violate 'INSURANCE", str(error))
+
+    def test_death_time_other_than_discharge_time_is_a_warning(self):
+        chunk = _admissions(DEATHTIME={0: '2150-01-05 00:00:00', 2: '2150-01-04 00:00:00'})
+        validation.Validator().check('ADMISSIONS', chunk)
+        self.assertEqual(len(self.records.messages), 1)
+        self.assertIn("1 rows violate 'DEATHTIME", self.records.messages[0])
+        self.assertIn('rows [102]', self.records.messages[0])
+
+    def test_levels(self):
+        chunk = _admissions(INSURANCE={2: 'Unknown'})
+        validation.Validator(validation.OFF).check('ADMISSIONS', chunk)
+        self.assertRaises(ValueError, validation.Validator(validation.SAMPLED, sample_rate=1.0).check,
+                          'ADMISSIONS', chunk)
+        self.assertRaises(ValueError, validation.Validator, 'lenient')
+
+    def test_sampled_positions(self):
+        positions = validation.Validator(validation.SAMPLED, sample_rate=0.25, seed=3)._positions(10000)
+        self.assertTrue(np.all(np.diff(positions) > 0))
+        self.assertTrue(2000 < len(positions) < 3000)
+        np.testing.assert_array_equal(validation.Validator(validation.SAMPLED, sample_rate=0.25, seed=3)
+                                      ._positions(10000), positions)
+        self.assertEqual(len(validation.Validator(validation.SAMPLED, sample_rate=1.0)._positions(100)), 100)
+
+    def test_tables_without_rules(self):
+        validation.Validator().check('CHARTEVENTS', _admissions(INSURANCE={0: 'Unknown'}))
+
+
+class DatabaseValidationTest(unittest.TestCase):
+    """
+    ingest of tables with an ADMISSIONS row out of the known sets, at every validation level.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.mimic3_dir = tempfile.mkdtemp()
+        test_database.write_tables(cls.mimic3_dir)
+        path = os.path.join(cls.mimic3_dir, 'ADMISSIONS.csv')
+        with open(path, 'rb') as table_file:
+            text = table_file.read()
+        with open(path, 'wb') as table_file:
+            table_file.write(text.replace('EMERGENCY,', 'TRANSFER,', 1))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.mimic3_dir)
+
+    def test_strict_level_rejects_the_table(self):
+        db = database.ICUDatabase(self.mimic3_dir)
+        db.read_table('PATIENTS')
+        self.assertRaises(ValueError, db.read_table, 'ADMISSIONS')
+
+    def test_off_level_reads_every_row(self):
+        db = database.ICUDatabase(self.mimic3_dir, validation.OFF)
+        test_database.read_tables(db)
+        self.assertEqual(db.total_number_of_hospital_visits, 4)
+        self.assertEqual(db.patients[1].hospital_visits[101].admission_type, 'TRANSFER')
+        self.assertEqual(test_database.event_rows(db.event_store), test_database.table_rows(self.mimic3_dir))
+
+    def test_off_level_snapshot(self):
+        db = database.ICUDatabase(self.mimic3_dir, validation.OFF)
+        db.ingest()
+        snapshot_dir = os.path.join(self.mimic3_dir, 'snapshot')
+        db.save_snapshot(snapshot_dir)
+        try:
+            for loaded in (database.ICUDatabase.load_snapshot(snapshot_dir),
+                           database.ICUDatabase.open_snapshot(snapshot_dir)):
+                self.assertEqual(loaded.patients[1].hospital_visits[101].admission_type, 'TRANSFER')
+                self.assertEqual(loaded.icu_stays[1001].icu_stay_id, 1001)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+
+
+class EventTablesValidationTest(unittest.TestCase):
+    """
+    the events tables have no sampled mode, 'sampled' keeps the same events as 'strict'.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.mimic3_dir = tempfile.mkdtemp()
+        synthetic.generate(cls.mimic3_dir, num_of_events=2000, events_per_stay=100, seed=6)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.mimic3_dir)
+
+    def test_sampled_level_checks_every_event(self):
+        strict = database.ICUDatabase(self.mimic3_dir, validation.STRICT)
+        strict.ingest()
+        sampled = database.ICUDatabase(self.mimic3_dir, validation.SAMPLED)
+        sampled.ingest()
+        self.assertEqual(len(sampled.event_store), len(strict.event_store))
+        np.testing.assert_array_equal(sampled.event_store.icu_stay_id, strict.event_store.icu_stay_id)
+        self.assertEqual(sampled.metrics.report(), strict.metrics.report())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+import watermark
+
+
+class WatermarkTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, 'CHARTEVENTS.csv')
+        with open(self.path, 'wb') as table_file:
+            table_file.write('ROW_ID,VALUE\n' + ''.join('%d,%d\n' % (i, i * 7) for i in range(1000)))
+        self.mark = watermark.take(self.path, os.path.getsize(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_unchanged(self):
+        self.assertEqual(watermark.check(self.path, self.mark), watermark.UNCHANGED)
+
+    def test_appended(self):
+        with open(self.path, 'ab') as table_file:
+            table_file.write('1000,7000\n')
+        self.assertEqual(watermark.check(self.path, self.mark), watermark.APPENDED)
+
+    def test_rewritten(self):
+        with open(self.path, 'r+b') as table_file:
+            table_file.seek(20)
+            table_file.write('9')
+        self.assertEqual(watermark.check(self.path, self.mark), watermark.REWRITTEN)
+
+    def test_truncated(self):
+        with open(self.path, 'r+b') as table_file:
+            table_file.truncate(100)
+        self.assertEqual(watermark.check(self.path, self.mark), watermark.REWRITTEN)
+
+    def test_replaced_by_another_file(self):
+        other = os.path.join(self.work_dir, 'CHARTEVENTS.csv.gz')
+        shutil.copy(self.path, other)
+        self.assertEqual(watermark.check(other, self.mark), watermark.REWRITTEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,32 +1,168 @@
+import calendar
 from datetime import datetime
+import numpy as np
+
+try:
+    _intern = intern
+except NameError:
+    from sys import intern as _intern
+
+# chart time of events without a time, stored in int64 time columns.
+MISSING_TIME = -2 ** 63
+
+
+# supported time string formats, told apart by the separator of the date part.
+DAY_FIRST_FORMAT = '%d/%m/%Y %H:%M:%S'
+YEAR_FIRST_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# times repeat heavily within a stay, so parsed strings are memoized. the caches are cleared when full to bound
+# their memory.
+_CACHE_SIZE = 1 << 16
+_date_time_cache = {}
+_epoch_cache = {}
+
+
+def intern_string(value):
+    """
+    interns a low cardinality string field, so all the objects that hold the same value share one copy.
+    :param value: str. other values ('' , None, datetime objects) are returned as they are.
+    :return:
+    """
+    return _intern(value) if type(value) is str else value
 
 
 def convert_to_date_time_object(data_string):
     """
-    converts a string to a datetime object.
+    converts a string to a datetime object. results are memoized. datetime objects are returned as they are.
     expceted string formats:
             - day/month/year 0:00:00 . for example : 13/03/2075  0:00:00
             - year-month-day 00:00:00 . for example : 1864-11-16 00:00:00
     :param data_string:
     :return:
     """
-    if data_string == '':
+    if data_string == '' or isinstance(data_string, datetime):
         return data_string
-    else:
-        try:
-            date_object = datetime.strptime(data_string, '%d/%m/%Y %H:%M:%S')
-            return date_object
-        except ValueError as e:
-            if str(e) != "time data '" + data_string + "' does not match format '%d/%m/%Y %H:%M:%S'":
-                print str(e)
-                raise e
-        date_object = datetime.strptime(data_string, '%Y-%m-%d %H:%M:%S')
+    date_object = _date_time_cache.get(data_string)
+    if date_object is None:
+        if len(_date_time_cache) >= _CACHE_SIZE:
+            _date_time_cache.clear()
+        if '-' in data_string[:5]:
+            date_object = datetime.strptime(data_string, YEAR_FIRST_FORMAT)
+        else:
+            date_object = datetime.strptime(data_string, DAY_FIRST_FORMAT)
+        _date_time_cache[data_string] = date_object
     return date_object
 
 
+def convert_to_epoch(data_string):
+    """
+    converts a time string to seconds since epoch. results are memoized.
+    :param data_string: time string in one of the formats of convert_to_date_time_object, or ''.
+    :return: int, MISSING_TIME if the string is empty.
+    """
+    epoch = _epoch_cache.get(data_string)
+    if epoch is None:
+        if len(_epoch_cache) >= _CACHE_SIZE:
+            _epoch_cache.clear()
+        epoch = date_time_to_epoch(convert_to_date_time_object(data_string))
+        _epoch_cache[data_string] = epoch
+    return epoch
+
+
+def parse_time_column(time_strings):
+    """
+    converts a whole column of time strings to seconds since epoch in one vectorized pass, instead of calling strptime
+    per row. both formats of convert_to_date_time_object are supported, the format of each string is told apart by
+    its date separator so a chunk mixing the two formats is parsed correctly. fields may be unpadded and separated by
+    more than one space ('12/11/2188  9:25:47').
+    :param time_strings: sequence or numpy array of time strings, '' for missing times.
+    :return: int64 numpy array of seconds since epoch, MISSING_TIME where the string is empty. use
+    .astype('datetime64[s]') to get datetime64 values (MISSING_TIME becomes NaT). raises ValueError if a non empty
+    string isn't a time.
+    """
+    strings = np.asarray(time_strings)
+    if strings.dtype.kind != 'S':
+        strings = strings.astype('S')
+    num_of_rows = len(strings)
+    epochs = np.full(num_of_rows, MISSING_TIME, dtype=np.int64)
+    width = strings.dtype.itemsize
+    if num_of_rows == 0 or width == 0:
+        return epochs
+
+    # a leading zero column keeps digit runs of consecutive rows apart.
+    row_width = width + 1
+    chars = np.zeros((num_of_rows, row_width), dtype=np.uint8)
+    chars[:, 1:] = np.ascontiguousarray(strings).view(np.uint8).reshape(num_of_rows, width)
+    flat_chars = chars.ravel()
+    is_digit = (flat_chars >= ord('0')) & (flat_chars <= ord('9'))
+    previous_is_digit = np.append(False, is_digit[:-1])
+    next_is_digit = np.append(is_digit[1:], False)
+    run_starts = np.flatnonzero(is_digit & ~previous_is_digit)
+    run_ends = np.flatnonzero(is_digit & ~next_is_digit)
+
+    runs_per_row = np.bincount(run_starts // row_width, minlength=num_of_rows)
+    present = runs_per_row > 0
+    # only '' is a missing time, a string without digits ('N/A') is as invalid as one with too few fields.
+    invalid = np.where(present, runs_per_row != 6, strings != '')
+    if np.any(invalid):
+        bad_row = np.flatnonzero(invalid)[0]
+        raise ValueError("time data '%s' does not match the supported formats" % strings[bad_row])
+    if len(run_starts) == 0:
+        return epochs
+
+    # every digit adds digit * 10 ** (distance from the end of its run) to the number of its run.
+    digit_positions = np.flatnonzero(is_digit)
+    run_of_digit = np.searchsorted(run_starts, digit_positions, side='right') - 1
+    place_values = 10 ** (run_ends[run_of_digit] - digit_positions)
+    numbers = np.bincount(run_of_digit, weights=(flat_chars[digit_positions] - ord('0')) * place_values)
+    fields = numbers.astype(np.int64).reshape(-1, 6)
+
+    year_first = (chars[present] == ord('-')).any(axis=1)
+    year = np.where(year_first, fields[:, 0], fields[:, 2])
+    day = np.where(year_first, fields[:, 2], fields[:, 0])
+    days = _days_from_civil(year, fields[:, 1], day)
+    epochs[present] = days * 86400 + fields[:, 3] * 3600 + fields[:, 4] * 60 + fields[:, 5]
+    return epochs
+
+
+def _days_from_civil(year, month, day):
+    """
+    number of days since 1970-01-01 of proleptic gregorian dates, vectorized over numpy arrays.
+    """
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def date_time_to_epoch(date_object):
+    """
+    converts a datetime object to seconds since epoch.
+    :param date_object: datetime object or '' if the time is missing.
+    :return: int, MISSING_TIME if the time is missing.
+    """
+    if date_object == '':
+        return MISSING_TIME
+    return calendar.timegm(date_object.timetuple())
+
+
+def epoch_to_date_time_object(epoch):
+    """
+    converts seconds since epoch back to a datetime object.
+    :param epoch: int seconds since epoch.
+    :return: datetime object, or '' if the time is MISSING_TIME.
+    """
+    if epoch == MISSING_TIME:
+        return ''
+    return datetime.utcfromtimestamp(int(epoch))
+
+
 if __name__ == "__main__":
     d1 = convert_to_date_time_object('30/08/2108  15:00:00')
     d2 = convert_to_date_time_object('12/11/2188  9:25:47')
     print d2
     d3 = convert_to_date_time_object('1879-08-01 00:00:00')
     print d3
+    print parse_time_column(['30/08/2108  15:00:00', '', '1879-08-01 00:00:00']).astype('datetime64[s]')
@@ -0,0 +1,120 @@
+import logging
+import numpy as np
+import hospital_visit
+import constants
+
+# validation levels of an ICUDatabase:
+#   'strict' - every row of every chunk is checked, violations of a chunk are reported together.
+#   'sampled' - a random sample of the rows of every chunk is checked.
+#   'off' - nothing is checked, for trusted extracts that were already validated.
+# the events tables have no sampled mode. their checks (known patient, stay of the admission of the row) also decide
+# which stay every event goes to and which events are dropped, so they run on every row unless the level is 'off'.
+STRICT = constants.STRICT
+SAMPLED = constants.SAMPLED
+OFF = constants.OFF
+LEVELS = constants.VALIDATION_LEVELS
+
+DEFAULT_SAMPLE_RATE = 0.01
+
+# severity of a rule: a chunk that violates an error rule is rejected, violations of a warning rule are logged.
+ERROR = 'error'
+WARNING = 'warning'
+
+# number of violating rows listed in the error.
+MAX_REPORTED_ROWS = 10
+
+
+def _in_set(column, values):
+    return lambda chunk: np.in1d(chunk[column], np.array(sorted(values), dtype='S'))
+
+
+def _empty(chunk, column):
+    # optional columns that are missing from the file count as empty.
+    if column not in chunk:
+        return np.ones(len(chunk['SUBJECT_ID']), dtype=bool)
+    return chunk[column] == ''
+
+
+def _death_flags(chunk):
+    alive = _empty(chunk, 'DOD')
+    return np.where(alive, _empty(chunk, 'DOD_HOSP') & _empty(chunk, 'DOD_SSN') & (chunk['EXPIRE_FLAG'] == '0'),
+                    chunk['EXPIRE_FLAG'] == '1')
+
+
+def _death_at_discharge(chunk):
+    return _empty(chunk, 'DEATHTIME') | (chunk['DEATHTIME'] == chunk['DISCHTIME'])
+
+
+# table name -> list of (description, function of a dict of string columns -> bool array, True where the row is
+# valid, severity).
+RULES = {
+    'PATIENTS': [('EXPIRE_FLAG is 1 exactly when DOD is set, and DOD_HOSP / DOD_SSN are empty without DOD',
+                  _death_flags, ERROR)],
+    'ADMISSIONS': [('ADMISSION_TYPE is one of %s' % ', '.join(sorted(hospital_visit.ADMISSION_TYPES)),
+                    _in_set('ADMISSION_TYPE', hospital_visit.ADMISSION_TYPES), ERROR),
+                   ('ADMISSION_LOCATION is a known location',
+                    _in_set('ADMISSION_LOCATION', hospital_visit.ADMISSION_LOCATIONS), ERROR),
+                   ('INSURANCE is one of %s' % ', '.join(sorted(hospital_visit.INSURANCES)),
+                    _in_set('INSURANCE', hospital_visit.INSURANCES), ERROR),
+                   ('DEATHTIME is empty or the same as DISCHTIME', _death_at_discharge, WARNING)],
+}
+
+
+class Validator(object):
+    """
+    Checks chunks of a table with set based, vectorized rules (RULES) instead of per row checks in the constructors
+    of the domain objects. all the violations of a chunk are reported in a single error.
+    """
+    def __init__(self, level=STRICT, sample_rate=DEFAULT_SAMPLE_RATE, seed=0):
+        """
+        :param level: one of LEVELS.
+        :param sample_rate: fraction of the rows checked in 'sampled' level.
+        :param seed: seed of the sample.
+        """
+        if level not in LEVELS:
+            logging.error("unknown validation level %s", level)
+            raise ValueError("unknown validation level %s" % level)
+        self.level = level
+        self.sample_rate = sample_rate
+        self._random_state = np.random.RandomState(seed)
+
+    @property
+    def enabled(self):
+        return self.level != OFF
+
+    def _positions(self, num_of_rows):
+        """
+        :return: positions of the rows of a chunk to check.
+        """
+        if self.level == STRICT:
+            return np.arange(num_of_rows)
+        # every row is kept with probability sample_rate, choice without replacement permutes the whole chunk.
+        return np.flatnonzero(self._random_state.random_sample(num_of_rows) < self.sample_rate)
+
+    def check(self, table_name, chunk):
+        """
+        checks a chunk of a table and raises a ValueError that lists every violated error rule and its rows. violated
+        warning rules are logged.
+        :param table_name: for example 'ADMISSIONS'. tables without rules are not checked.
+        :param chunk: table_reader.Chunk
+        :return:
+        """
+        rules = RULES.get(table_name)
+        if not self.enabled or not rules or len(chunk) == 0:
+            return
+        positions = self._positions(len(chunk))
+        columns = dict((name, chunk[name][positions]) for name in chunk.columns)
+        violations = []
+        for description, rule, severity in rules:
+            invalid = positions[~rule(columns)] + chunk.first_row
+            if len(invalid):
+                violation = "%d rows violate '%s', rows %s" % (len(invalid), description,
+                                                                invalid[:MAX_REPORTED_ROWS].tolist())
+                if severity == WARNING:
+                    logging.warning("%s.csv: %s", table_name, violation)
+                else:
+                    violations.append(violation)
+        if violations:
+            message = "%s.csv is invalid: %s" % (table_name, '; '.join(violations))
+            logging.error(message)
+            raise ValueError(message)
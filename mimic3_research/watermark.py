@@ -0,0 +1,53 @@
+import hashlib
+import logging
+import os
+
+# number of bytes hashed at the start of a file and right before the watermark.
+FINGERPRINT_SIZE = 1 << 16
+
+# results of check.
+UNCHANGED = 'unchanged'
+APPENDED = 'appended'
+REWRITTEN = 'rewritten'
+
+
+def _hash_range(path, start, stop):
+    with open(path, 'rb') as table_file:
+        table_file.seek(start)
+        return hashlib.sha1(table_file.read(stop - start)).hexdigest()
+
+
+def take(path, offset):
+    """
+    records how far a table file was ingested. the fingerprint is the hash of the first bytes of the file and of the
+    bytes right before offset: rows appended after offset don't change it, while a rewrite of the ingested part of
+    the file almost surely does.
+    :param path: path to the csv or csv.gz file of the table.
+    :param offset: byte offset right after the last ingested row. a compressed file can only be read as a whole, its
+    offset is the size of the file.
+    :return: dict that can be stored in json.
+    """
+    return {'file': os.path.basename(path), 'offset': offset,
+            'head': _hash_range(path, 0, min(offset, FINGERPRINT_SIZE)),
+            'tail': _hash_range(path, max(0, offset - FINGERPRINT_SIZE), offset)}
+
+
+def check(path, watermark):
+    """
+    compares a table file with the watermark of its last ingest.
+    :param path: path to the csv or csv.gz file of the table.
+    :param watermark: dict returned by take.
+    :return: UNCHANGED, APPENDED if rows were only added after the watermark, or REWRITTEN.
+    """
+    if os.path.basename(path) != watermark['file'] or not os.path.exists(path):
+        logging.info("%s was replaced by %s", watermark['file'], path)
+        return REWRITTEN
+    offset = watermark['offset']
+    size = os.path.getsize(path)
+    if (size < offset or _hash_range(path, 0, min(offset, FINGERPRINT_SIZE)) != watermark['head'] or
+            _hash_range(path, max(0, offset - FINGERPRINT_SIZE), offset) != watermark['tail']):
+        return REWRITTEN
+    if size == offset:
+        return UNCHANGED
+    # a gzip file can't be resumed from a byte offset.
+    return REWRITTEN if path.endswith('.gz') else APPENDED
@@ -0,0 +1,11 @@
+from setuptools import setup
+
+setup(
+    name='mimic3_research',
+    version='0.1.0',
+    description='MIMIC-III ICU database, cohort and feature tools',
+    packages=['mimic3_research'],
+    install_requires=['numpy'],
+    extras_require={'parquet': ['pyarrow'], 'models': ['tensorflow']},
+    entry_points={'console_scripts': ['mimic3 = mimic3_research.cli:main']},
+)